@@ -8,8 +8,19 @@ const AppState = {
     brushSize: 10,
     isDrawing: false,
     strokes: [],
+    processedObjectUrl: null, // 応答に含まれた処理済み画像のObject URL
+    thresholdHistogram: null, // 選択した色に対する閾値ごとの透明になるピクセル数
+    pickingColor: false, // EyeDropper API がない場合に、元画像のクリックで色を選択中か
+    imageSize: null, // 元画像の原寸 { width, height }（画像上の座標の変換用）
+    histogramRequestId: 0,
 };
 
+// 元画像のプレビューを表示する長辺の大きさ（サーバーで縮小した画像を取得する）
+const PREVIEW_IMAGE_SIZE = 1024;
+
+// 元画像のクリックで色を選択する際に平均をとる範囲の一辺（ピクセル）
+const COLOR_PICK_SAMPLE_SIZE = 3;
+
 // DOM要素の取得
 const elements = {
     fileInput: null,
@@ -22,6 +33,7 @@ const elements = {
     processBtn: null,
     threshold: null,
     thresholdValue: null,
+    thresholdImpact: null,
     loading: null,
     errorMessage: null,
     // ツール関連
@@ -58,6 +70,7 @@ function initElements() {
     elements.processBtn = document.getElementById('processBtn');
     elements.threshold = document.getElementById('threshold');
     elements.thresholdValue = document.getElementById('thresholdValue');
+    elements.thresholdImpact = document.getElementById('thresholdImpact');
     elements.loading = document.getElementById('loading');
     elements.errorMessage = document.getElementById('errorMessage');
     // ツール関連
@@ -85,6 +98,10 @@ function attachEventListeners() {
         elements.addColorBtn.addEventListener('click', handleAddColor);
     }
 
+    if (elements.originalImage) {
+        elements.originalImage.addEventListener('click', handleImageColorPick);
+    }
+
     if (elements.processBtn) {
         elements.processBtn.addEventListener('click', handleProcess);
     }
@@ -141,12 +158,44 @@ function attachEventListeners() {
 }
 
 // EyeDropper APIのサポート確認
+// サポートしていない場合は、元画像をクリックしてサーバーから画素値を取得する
 function checkEyeDropperSupport() {
     if (!window.EyeDropper) {
         if (elements.addColorBtn) {
-            elements.addColorBtn.disabled = true;
-            elements.addColorBtn.title = 'お使いのブラウザはEyeDropper APIをサポートしていません';
+            elements.addColorBtn.title = '元画像をクリックして色を選択します';
+        }
+    }
+}
+
+// ファイルのSHA-256を送り、サーバーに同じファイルがあればそのセッション情報を返す
+// 確認できない場合はnullを返し、通常のアップロードを行う
+async function precheckUpload(file) {
+    if (!window.crypto || !window.crypto.subtle) {
+        return null;
+    }
+
+    try {
+        const buffer = await file.arrayBuffer();
+        const digest = await window.crypto.subtle.digest('SHA-256', buffer);
+        const sha256 = Array.from(new Uint8Array(digest))
+            .map((b) => b.toString(16).padStart(2, '0'))
+            .join('');
+
+        const response = await fetch('/api/upload/precheck', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ sha256, size: file.size, filename: file.name }),
+        });
+
+        if (!response.ok) {
+            return null;
         }
+
+        const data = await response.json();
+        return data.exists ? data : null;
+    } catch (error) {
+        console.warn('Upload precheck failed:', error);
+        return null;
     }
 }
 
@@ -165,27 +214,33 @@ async function handleFileSelect(event) {
     hideError();
 
     try {
-        // FormDataを作成してアップロード
-        const formData = new FormData();
-        formData.append('file', file);
+        // 同じファイルがサーバーにあればアップロードを省略
+        let data = await precheckUpload(file);
 
-        const response = await fetch('/api/upload', {
-            method: 'POST',
-            body: formData,
-        });
+        if (!data) {
+            // FormDataを作成してアップロード
+            const formData = new FormData();
+            formData.append('file', file);
 
-        if (!response.ok) {
-            throw new Error('アップロードに失敗しました');
-        }
+            const response = await fetch('/api/upload', {
+                method: 'POST',
+                body: formData,
+            });
 
-        const data = await response.json();
+            if (!response.ok) {
+                throw new Error('アップロードに失敗しました');
+            }
+
+            data = await response.json();
+        }
 
         // 状態を更新
         AppState.sessionId = data.session_id;
         AppState.filename = data.filename;
+        AppState.imageSize = null;
 
-        // 画像をプレビュー表示
-        elements.originalImage.src = data.image_url;
+        // 画像をプレビュー表示（縮小した画像を取得し、原寸の画像はダウンロードしない）
+        elements.originalImage.src = withPreviewSize(data.image_url);
         elements.previewSection.classList.add('active');
 
         // ツールセクションを表示
@@ -209,6 +264,7 @@ async function handleFileSelect(event) {
 
         // 処理後画像をクリア
         elements.processedImage.src = '';
+        releaseProcessedObjectUrl();
 
     } catch (error) {
         console.error('Upload error:', error);
@@ -218,6 +274,13 @@ async function handleFileSelect(event) {
     }
 }
 
+// 画像URLに縮小画像のサイズを指定
+function withPreviewSize(imageUrl) {
+    const url = new URL(imageUrl, window.location.origin);
+    url.searchParams.set('size', PREVIEW_IMAGE_SIZE);
+    return url.pathname + url.search;
+}
+
 // 色追加ハンドラ
 async function handleAddColor() {
     // 最大3色まで
@@ -227,7 +290,8 @@ async function handleAddColor() {
     }
 
     if (!window.EyeDropper) {
-        showError('お使いのブラウザはEyeDropper APIをサポートしていません');
+        AppState.pickingColor = true;
+        elements.originalImage.classList.add('picking');
         return;
     }
 
@@ -251,6 +315,53 @@ async function handleAddColor() {
     }
 }
 
+// 元画像のクリック位置の色をサーバーから取得して追加（EyeDropper API がない場合）
+async function handleImageColorPick(event) {
+    if (!AppState.pickingColor) return;
+    AppState.pickingColor = false;
+    elements.originalImage.classList.remove('picking');
+
+    try {
+        // 表示しているのは縮小画像のため、原寸の座標に変換する
+        if (!AppState.imageSize) {
+            const response = await fetch(
+                `/api/images/${AppState.sessionId}/${AppState.filename}/analysis`
+            );
+            if (!response.ok) {
+                throw new Error('画像の情報の取得に失敗しました');
+            }
+            AppState.imageSize = await response.json();
+        }
+
+        const rect = elements.originalImage.getBoundingClientRect();
+        const x = Math.floor((event.clientX - rect.left) * AppState.imageSize.width / rect.width);
+        const y = Math.floor((event.clientY - rect.top) * AppState.imageSize.height / rect.height);
+
+        const response = await fetch('/api/sample', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({
+                session_id: AppState.sessionId,
+                filename: AppState.filename,
+                points: [[x, y]],
+                size: COLOR_PICK_SAMPLE_SIZE,
+            }),
+        });
+        if (!response.ok) {
+            throw new Error('色の取得に失敗しました');
+        }
+
+        const sample = (await response.json()).samples[0];
+        if (!sample) return;
+        addColorToList(sample[0], sample[1], sample[2]);
+    } catch (error) {
+        console.error('Color pick error:', error);
+        showError('スポイトツールの使用に失敗しました');
+    }
+}
+
 // リストに色を追加
 function addColorToList(r, g, b) {
     // 既に同じ色が選択されているかチェック
@@ -292,12 +403,76 @@ function updateColorListUI() {
     if (elements.addColorBtn) {
         elements.addColorBtn.disabled = AppState.selectedColors.length >= 3 || !AppState.sessionId;
     }
+
+    refreshThresholdHistogram();
+}
+
+// 選択中の色をAPIのRGB形式に変換
+function selectedColorsToRgb() {
+    // 複数色の場合は配列の配列、単一色の場合は単純な配列
+    if (AppState.selectedColors.length === 1) {
+        // 単一色の場合（後方互換性）
+        const color = AppState.selectedColors[0];
+        return [color.r, color.g, color.b];
+    }
+    // 複数色の場合
+    return AppState.selectedColors.map(color => [color.r, color.g, color.b]);
+}
+
+// 選択した色に対する閾値ごとの透明になるピクセル数を取得
+async function refreshThresholdHistogram() {
+    const requestId = ++AppState.histogramRequestId;
+    AppState.thresholdHistogram = null;
+    updateThresholdImpact();
+
+    if (!AppState.sessionId || AppState.selectedColors.length === 0) return;
+
+    try {
+        const response = await fetch('/api/process/histogram', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({
+                session_id: AppState.sessionId,
+                filename: AppState.filename,
+                rgb: selectedColorsToRgb(),
+            }),
+        });
+        if (!response.ok) return;
+
+        const data = await response.json();
+        // 取得中に色が変わった場合は古い結果を使わない
+        if (requestId !== AppState.histogramRequestId) return;
+        AppState.thresholdHistogram = data;
+        updateThresholdImpact();
+    } catch (error) {
+        console.error('Histogram error:', error);
+    }
+}
+
+// 現在の閾値で透明になるピクセルの割合を表示（画像を処理せずに閾値を選べるようにする）
+function updateThresholdImpact() {
+    if (!elements.thresholdImpact) return;
+
+    const histogram = AppState.thresholdHistogram;
+    if (!histogram || histogram.total_pixels === 0) {
+        elements.thresholdImpact.textContent = '';
+        return;
+    }
+
+    const threshold = parseInt(elements.threshold.value) || 0;
+    const cleared = histogram.cleared_pixels[threshold];
+    const percent = (cleared / histogram.total_pixels * 100).toFixed(1);
+    elements.thresholdImpact.textContent =
+        `${percent}% が透明になります（推奨: ${histogram.suggested_threshold}）`;
 }
 
 // 閾値入力ハンドラ
 function handleThresholdInput() {
     const threshold = parseInt(elements.threshold.value) || 0;
     elements.thresholdValue.textContent = threshold;
+    updateThresholdImpact();
 }
 
 // 色を削除
@@ -326,17 +501,7 @@ async function handleProcess() {
 
     try {
         const threshold = parseInt(elements.threshold.value) || 30;
-
-        // 複数色の場合は配列の配列、単一色の場合は単純な配列
-        let rgbData;
-        if (AppState.selectedColors.length === 1) {
-            // 単一色の場合（後方互換性）
-            const color = AppState.selectedColors[0];
-            rgbData = [color.r, color.g, color.b];
-        } else {
-            // 複数色の場合
-            rgbData = AppState.selectedColors.map(color => [color.r, color.g, color.b]);
-        }
+        const rgbData = selectedColorsToRgb();
 
         const response = await fetch('/api/process', {
             method: 'POST',
@@ -348,6 +513,7 @@ async function handleProcess() {
                 filename: AppState.filename,
                 rgb: rgbData,
                 threshold: threshold,
+                inline: true,
             }),
         });
 
@@ -356,13 +522,11 @@ async function handleProcess() {
             throw new Error(errorData.detail || '透過処理に失敗しました');
         }
 
-        const data = await response.json();
-
         // 処理済みファイル名を保存
-        AppState.processedFilename = data.filename;
+        AppState.processedFilename = response.headers.get('X-Filename');
 
-        // 処理済み画像を表示（キャッシュ回避のためタイムスタンプを追加）
-        elements.processedImage.src = data.processed_url + '?t=' + Date.now();
+        // 応答に含まれた処理済み画像を表示（画像を取得し直す往復が不要）
+        await showProcessedImage(response);
 
         // アクションボタンとリセットボタンを表示
         if (elements.imageActions) {
@@ -380,6 +544,23 @@ async function handleProcess() {
     }
 }
 
+// 応答に含まれた処理済み画像を表示
+async function showProcessedImage(response) {
+    const blob = await response.blob();
+    const objectUrl = URL.createObjectURL(blob);
+    elements.processedImage.src = objectUrl;
+    releaseProcessedObjectUrl();
+    AppState.processedObjectUrl = objectUrl;
+}
+
+// 前に表示していた処理済み画像のObject URLを解放
+function releaseProcessedObjectUrl() {
+    if (AppState.processedObjectUrl) {
+        URL.revokeObjectURL(AppState.processedObjectUrl);
+        AppState.processedObjectUrl = null;
+    }
+}
+
 // ローディング表示の切り替え
 function showLoading(show) {
     if (elements.loading) {
@@ -584,6 +765,43 @@ async function handleCanvasTouchEnd(event) {
     }
 }
 
+// ストロークをバイナリ形式にエンコード（サーバーの stroke_payload.py と同じ形式）
+// ヘッダー: "STRK", フラグ, 予約, セグメント数 / セグメント: ブラシサイズ, 点の数, 座標
+// 2点目以降は直前の点からの差分で、int16に収まらない場合はint32で格納する
+function encodeStrokePayload(strokes, brushSize) {
+    const FLAG_INT32 = 0x01;
+    const FLAG_DELTA = 0x02;
+
+    const deltas = [];
+    let previousX = 0;
+    let previousY = 0;
+    for (const [x, y] of strokes) {
+        deltas.push(x - previousX, y - previousY);
+        previousX = x;
+        previousY = y;
+    }
+    const int32 = deltas.some(value => value < -32768 || value > 32767);
+    const itemSize = int32 ? 4 : 2;
+
+    const buffer = new ArrayBuffer(8 + 6 + deltas.length * itemSize);
+    const view = new DataView(buffer);
+    [0x53, 0x54, 0x52, 0x4b].forEach((byte, index) => view.setUint8(index, byte));
+    view.setUint8(4, FLAG_DELTA | (int32 ? FLAG_INT32 : 0));
+    view.setUint8(5, 0);
+    view.setUint16(6, 1, true);
+    view.setUint16(8, brushSize, true);
+    view.setUint32(10, strokes.length, true);
+    deltas.forEach((value, index) => {
+        const offset = 14 + index * itemSize;
+        if (int32) {
+            view.setInt32(offset, value, true);
+        } else {
+            view.setInt16(offset, value, true);
+        }
+    });
+    return buffer;
+}
+
 // 消しゴムリクエストをバックエンドに送信
 async function sendEraseRequest() {
     if (!AppState.sessionId || !AppState.processedFilename || AppState.strokes.length === 0) {
@@ -594,17 +812,18 @@ async function sendEraseRequest() {
     hideError();
 
     try {
-        const response = await fetch('/api/erase', {
+        // ストロークはバイナリ形式で送信（JSONの解析・検証を省く）
+        const query = new URLSearchParams({
+            session_id: AppState.sessionId,
+            filename: AppState.processedFilename,
+            inline: 'true',
+        });
+        const response = await fetch(`/api/erase/binary?${query}`, {
             method: 'POST',
             headers: {
-                'Content-Type': 'application/json',
+                'Content-Type': 'application/octet-stream',
             },
-            body: JSON.stringify({
-                session_id: AppState.sessionId,
-                filename: AppState.processedFilename,
-                strokes: AppState.strokes,
-                brush_size: AppState.brushSize,
-            }),
+            body: encodeStrokePayload(AppState.strokes, AppState.brushSize),
         });
 
         if (!response.ok) {
@@ -612,10 +831,8 @@ async function sendEraseRequest() {
             throw new Error(errorData.detail || '消しゴム処理に失敗しました');
         }
 
-        const data = await response.json();
-
-        // 処理済み画像を更新
-        elements.processedImage.src = data.processed_url;
+        // 応答に含まれた処理済み画像で更新
+        await showProcessedImage(response);
 
         // Canvasをクリア
         const canvas = elements.eraserCanvas;
@@ -700,11 +917,20 @@ function handleDownload() {
 
 // リセット
 function handleReset() {
+    // サーバー側の一時ファイルを削除（失敗しても期限切れで自動削除される）
+    if (AppState.sessionId) {
+        fetch(`/api/cleanup/${AppState.sessionId}`, { method: 'DELETE' }).catch((error) => {
+            console.warn('Cleanup failed:', error);
+        });
+    }
+
     // 状態をリセット
     AppState.sessionId = null;
     AppState.filename = null;
     AppState.selectedColors = [];
     AppState.processedFilename = null;
+    AppState.pickingColor = false;
+    AppState.imageSize = null;
     AppState.currentTool = 'eyedropper';
     AppState.brushSize = 10;
     AppState.isDrawing = false;
@@ -714,6 +940,7 @@ function handleReset() {
     elements.fileInput.value = '';
     elements.originalImage.src = '';
     elements.processedImage.src = '';
+    releaseProcessedObjectUrl();
     updateColorListUI();
     updateProcessButton();
 
@@ -748,6 +975,7 @@ function handleReset() {
     if (elements.threshold) {
         elements.threshold.value = 30;
         elements.thresholdValue.textContent = '30';
+        updateThresholdImpact();
     }
 
     hideError();
@@ -0,0 +1,20 @@
+"""
+テスト共通の設定
+一時ファイルをリポジトリ内の tmp/transpalentor ではなく、テストごとの一時ディレクトリに書き出す
+"""
+
+import os
+import shutil
+import tempfile
+
+import pytest
+
+_TMP_DIR = tempfile.mkdtemp(prefix="transpalentor-tests-")
+
+# アプリケーションのモジュールは読み込み時に保存先を決めるため、テストの読み込み前に設定する
+os.environ["TRANSPALENTOR_TMP_DIR"] = _TMP_DIR
+
+
+def pytest_unconfigure(config: pytest.Config) -> None:
+    """テスト終了時に一時ディレクトリを削除"""
+    shutil.rmtree(_TMP_DIR, ignore_errors=True)
@@ -0,0 +1,141 @@
+"""
+アルファマスクの転送形式とAPIのテスト
+"""
+
+import io
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+
+def create_test_image() -> io.BytesIO:
+    """テスト用の画像を作成"""
+    image = Image.new("RGB", (40, 30), color=tuple(os.urandom(3)))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    buffer.seek(0)
+    return buffer
+
+
+def create_alpha() -> Image.Image:
+    """左半分が透明で、1画素だけ半透明のアルファチャンネルを作成"""
+    alpha = Image.new("L", (40, 30), 255)
+    alpha.paste(0, (0, 0, 20, 30))
+    alpha.putpixel((30, 10), 100)
+    return alpha
+
+
+def test_rle_round_trip() -> None:
+    """ランレングス符号化したアルファチャンネルが復元できることをテスト"""
+    from transpalentor.infrastructure.alpha_mask import decode_rle, encode_rle
+
+    alpha = create_alpha()
+    data = encode_rle(alpha)
+
+    assert data[:4] == b"ARLE"
+    assert len(data) < len(alpha.tobytes())
+    assert decode_rle(data).tobytes() == alpha.tobytes()
+
+    with pytest.raises(ValueError):
+        decode_rle(data[:-1])
+    with pytest.raises(ValueError):
+        decode_rle(b"XXXX" + data[4:])
+
+
+def test_png_masks() -> None:
+    """1ビット・8ビットのPNGマスクをテスト"""
+    from transpalentor.infrastructure.alpha_mask import (
+        MASK_FORMAT_PNG1,
+        MASK_FORMAT_PNG8,
+        encode_alpha_mask,
+    )
+
+    alpha = create_alpha()
+
+    data, media_type = encode_alpha_mask(alpha, MASK_FORMAT_PNG8)
+    assert media_type == "image/png"
+    with Image.open(io.BytesIO(data)) as mask:
+        assert mask.mode == "L"
+        assert mask.tobytes() == alpha.tobytes()
+
+    data, _ = encode_alpha_mask(alpha, MASK_FORMAT_PNG1)
+    with Image.open(io.BytesIO(data)) as mask:
+        assert mask.mode == "1"
+        assert mask.getpixel((5, 5)) == 0
+        assert mask.getpixel((35, 5)) == 255
+        # しきい値未満の半透明は透明になる
+        assert mask.getpixel((30, 10)) == 0
+
+    with pytest.raises(ValueError):
+        encode_alpha_mask(alpha, "jpeg")
+
+
+def test_get_alpha_mask_includes_pending_erase() -> None:
+    """未保存の消しゴム処理を含むアルファマスクが返り、ETagで再検証できることをテスト"""
+    from transpalentor.infrastructure.alpha_mask import decode_rle
+    from transpalentor.presentation.app import app
+
+    client = TestClient(app)
+    upload = client.post(
+        "/api/upload", files={"file": ("test.png", create_test_image(), "image/png")}
+    ).json()
+    session_id = upload["session_id"]
+    base_url = f"/api/images/{session_id}/{upload['filename']}/alpha"
+
+    response = client.get(base_url)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/png"
+    assert response.headers["x-image-width"] == "40"
+    etag = response.headers["etag"]
+    assert client.get(base_url, headers={"If-None-Match": etag}).status_code == 304
+
+    client.post(
+        "/api/erase",
+        json={
+            "session_id": session_id,
+            "filename": upload["filename"],
+            "strokes": [[10, 10]],
+            "brush_size": 4,
+        },
+    )
+
+    response = client.get(base_url, params={"format": "rle"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/octet-stream"
+    alpha = decode_rle(response.content)
+    assert alpha.size == (40, 30)
+    assert alpha.getpixel((10, 10)) == 0
+    assert alpha.getpixel((30, 20)) == 255
+
+    assert client.get(base_url, params={"format": "gif"}).status_code == 422
+
+    client.delete(f"/api/cleanup/{session_id}")
+
+
+def test_get_alpha_mask_accepts_image_url_signature() -> None:
+    """署名付きURLが有効な場合、画像のURLの署名でアルファマスクを取得できることをテスト"""
+    from transpalentor.infrastructure.image_delivery import image_delivery
+    from transpalentor.presentation.app import app
+
+    client = TestClient(app)
+    image_delivery.configure(offload_mode=None, signed_urls=True)
+    try:
+        upload = client.post(
+            "/api/upload", files={"file": ("test.png", create_test_image(), "image/png")}
+        ).json()
+        session_id = upload["session_id"]
+        path, query = upload["image_url"].split("?", 1)
+        assert "md5=" in query
+
+        response = client.get(f"{path}/alpha?{query}")
+        assert response.status_code == 200
+        assert response.headers["x-image-width"] == "40"
+
+        unsigned = client.get(f"{path}/alpha")
+        assert unsigned.status_code == 403
+        assert unsigned.json()["error_code"] == "INVALID_SIGNATURE"
+    finally:
+        image_delivery.configure(offload_mode=None, signed_urls=False)
+        client.delete(f"/api/cleanup/{session_id}")
@@ -1,10 +1,11 @@
 """
 消しゴム機能のテスト
 """
+
 import pytest
 from PIL import Image
 
-from transpalentor.domain.transparency import erase_at_coordinates
+from transpalentor.domain.transparency import erase_at_coordinates, erase_with_mask
 
 
 def test_erase_at_coordinates_basic():
@@ -225,3 +226,31 @@ def test_erase_at_coordinates_circular_brush():
     # 対角線（距離が sqrt(8^2 + 8^2) ≈ 11.3 > 10）は透明化されていないべき
     r, g, b, a = pixels[58, 58]
     assert a == 255
+
+
+def test_erase_with_mask_applies_partial_alpha():
+    """マスクの値に応じてアルファが下がり、範囲外は変わらないことをテスト"""
+    image = Image.new("RGBA", (20, 20), (10, 20, 30, 255))
+    mask = Image.new("L", (10, 10), 255)
+    mask.putpixel((0, 0), 0)
+    mask.putpixel((1, 0), 128)
+
+    result = erase_with_mask(image, mask, offset=(15, 5))
+
+    # 画像外にはみ出した部分は無視される
+    assert result.getpixel((15, 5)) == (10, 20, 30, 255)
+    assert result.getpixel((16, 5))[3] == 127
+    assert result.getpixel((19, 14)) == (10, 20, 30, 0)
+    assert result.getpixel((14, 5))[3] == 255
+    assert result.getpixel((15, 15))[3] == 255
+    # 元の画像は変更されない
+    assert image.getpixel((19, 14))[3] == 255
+
+
+def test_erase_with_mask_outside_image():
+    """画像と重ならないマスクでは何も変わらないことをテスト"""
+    image = Image.new("RGB", (10, 10), (1, 2, 3))
+    result = erase_with_mask(image, Image.new("1", (5, 5), 1), offset=(-5, 0))
+
+    assert result.mode == "RGBA"
+    assert result.getchannel("A").getextrema() == (255, 255)
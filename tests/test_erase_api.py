@@ -1,6 +1,7 @@
 """
 消しゴムAPIエンドポイントのテスト
 """
+
 import io
 import pytest
 from PIL import Image
@@ -25,9 +26,7 @@ def uploaded_image_session(client):
     img_byte_arr.seek(0)
 
     # 画像をアップロード
-    response = client.post(
-        "/api/upload", files={"file": ("test.png", img_byte_arr, "image/png")}
-    )
+    response = client.post("/api/upload", files={"file": ("test.png", img_byte_arr, "image/png")})
     assert response.status_code == 200
 
     data = response.json()
@@ -234,7 +233,7 @@ def test_erase_updates_image_file(client, uploaded_image_session):
     assert response2.status_code == 200
     url2 = response2.json()["processed_url"]
 
-    # URLにタイムスタンプが含まれているため、異なるべき
+    # URLに操作ごとのリビジョンが含まれているため、異なるべき
     assert url1 != url2
 
 
@@ -312,3 +311,161 @@ def test_erase_with_minimum_brush_size(client, uploaded_image_session):
     )
 
     assert response.status_code == 200
+
+
+def test_erase_returns_inline_image(client, uploaded_image_session):
+    """inline 指定時に消しゴム処理後の画像が応答に含まれることをテスト"""
+    session_id = uploaded_image_session["session_id"]
+    filename = uploaded_image_session["filename"]
+
+    response = client.post(
+        "/api/erase",
+        json={
+            "session_id": session_id,
+            "filename": filename,
+            "strokes": [[50, 50]],
+            "brush_size": 10,
+            "inline": True,
+        },
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/png"
+    assert response.headers["x-filename"] == filename
+    with Image.open(io.BytesIO(response.content)) as image:
+        assert image.getpixel((50, 50))[3] == 0
+
+    # 遅延保存ではエンコード済みの内容がそのまま書き込まれる
+    fetched = client.get(response.headers["x-processed-url"])
+    assert fetched.content == response.content
+
+
+def test_erase_with_mask_png_and_raw(client, uploaded_image_session):
+    """PNGとrawのマスクで消しゴム処理できることをテスト"""
+    session_id = uploaded_image_session["session_id"]
+    filename = uploaded_image_session["filename"]
+    params = {"session_id": session_id, "filename": filename, "inline": "true"}
+
+    # 消しゴムの効果が見えるよう、不透明な画像に置き換える
+    from transpalentor.infrastructure.file_storage import encode_png, get_session_directory
+    from transpalentor.infrastructure.working_images import working_images
+
+    working_images.write(
+        get_session_directory(session_id) / filename,
+        encode_png(Image.new("RGBA", (100, 100), (0, 0, 255, 255))),
+    )
+
+    # 10x10 の範囲だけを覆う1ビットPNGのマスク
+    mask = Image.new("1", (10, 10), 1)
+    buffer = io.BytesIO()
+    mask.save(buffer, format="PNG")
+    response = client.post(
+        "/api/erase/mask",
+        params={**params, "x": 20, "y": 30},
+        content=buffer.getvalue(),
+        headers={"Content-Type": "image/png"},
+    )
+    assert response.status_code == 200
+    with Image.open(io.BytesIO(response.content)) as image:
+        assert image.getpixel((25, 35))[3] == 0
+        assert image.getpixel((35, 35))[3] == 255
+
+    # 1ビットの raw (1行2バイト、先頭の1画素だけ消す)
+    raw = bytes([0x80, 0x00] * 2)
+    response = client.post(
+        "/api/erase/mask",
+        params={**params, "x": 60, "y": 60, "width": 16, "height": 2, "bits": 1},
+        content=raw,
+    )
+    assert response.status_code == 200
+    with Image.open(io.BytesIO(response.content)) as image:
+        assert image.getpixel((60, 61))[3] == 0
+        assert image.getpixel((61, 61))[3] == 255
+
+    # 寸法が合わない raw は拒否される
+    response = client.post(
+        "/api/erase/mask", params={**params, "width": 10, "height": 10}, content=b"\xff" * 99
+    )
+    assert response.status_code == 400
+    assert response.json()["error_code"] == "INVALID_PAYLOAD"
+
+
+def test_erase_mask_rejects_paths_outside_session(client, uploaded_image_session):
+    """別のセッションのファイルを指すファイル名が拒否されることをテスト"""
+    import os
+
+    from transpalentor.infrastructure.file_storage import get_session_directory
+
+    image = Image.new("RGB", (100, 100), color=(0, 255, 0))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    buffer.seek(0)
+    victim = client.post("/api/upload", files={"file": ("victim.png", buffer, "image/png")}).json()
+    victim_path = get_session_directory(victim["session_id"]) / victim["filename"]
+    original = victim_path.read_bytes()
+
+    session_id = uploaded_image_session["session_id"]
+    traversal = os.path.relpath(victim_path, get_session_directory(session_id))
+    for filename in (traversal, ".", ".manifest.json/.."):
+        response = client.post(
+            "/api/erase/mask",
+            params={"session_id": session_id, "filename": filename, "width": 1, "height": 1},
+            content=b"\xff",
+        )
+        assert response.status_code == 404
+
+    assert victim_path.read_bytes() == original
+    client.delete(f"/api/cleanup/{victim['session_id']}")
+
+
+def test_processing_uses_pending_erase(client):
+    """未保存の消しゴム処理が透過処理・閾値の分布・ライブプレビューに反映されることをテスト"""
+    from transpalentor.infrastructure.alpha_mask import decode_alpha_patch
+    from transpalentor.infrastructure.file_storage import get_session_directory
+    from transpalentor.infrastructure.working_images import working_images
+
+    image = Image.new("RGB", (100, 100), color=(0, 0, 255))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    buffer.seek(0)
+    upload = client.post("/api/upload", files={"file": ("test.png", buffer, "image/png")}).json()
+    session_id = upload["session_id"]
+    filename = upload["filename"]
+    target = {"session_id": session_id, "filename": filename}
+
+    # 処理前の結果をキャッシュさせる
+    before = client.post("/api/process/histogram", json={**target, "rgb": [0, 0, 255]})
+    assert before.json()["total_pixels"] == 10000
+    assert client.post("/api/process", json={**target, "rgb": [0, 255, 0]}).status_code == 200
+
+    response = client.post(
+        "/api/erase", json={**target, "strokes": [[50, 50]], "brush_size": 10, "inline": True}
+    )
+    assert response.status_code == 200
+    assert working_images.has_pending_changes(get_session_directory(session_id) / filename)
+
+    histogram = client.post("/api/process/histogram", json={**target, "rgb": [0, 0, 255]}).json()
+    assert 0 < histogram["total_pixels"] < 10000
+
+    processed = client.post("/api/process", json={**target, "rgb": [0, 255, 0]}).json()
+    with Image.open(io.BytesIO(client.get(processed["processed_url"]).content)) as result:
+        assert result.getpixel((50, 50))[3] == 0
+        assert result.getpixel((10, 10))[3] == 255
+
+    with client.websocket_connect(f"/api/process/live/{session_id}/{filename}?size=100") as ws:
+        ws.receive_json()
+        ws.send_json({"rgb": [0, 255, 0], "threshold": 0})
+        _, _, alpha = decode_alpha_patch(ws.receive_bytes())
+        assert alpha.getpixel((50, 50)) == 0
+        assert alpha.getpixel((10, 10)) == 255
+
+    client.delete(f"/api/cleanup/{session_id}")
+
+
+def test_processing_rejects_internal_files(client, uploaded_image_session):
+    """マニフェストなどの内部ファイルを透過処理・閾値の分布の対象にできないことをテスト"""
+    target = {"session_id": uploaded_image_session["session_id"], "filename": ".manifest.json"}
+
+    assert client.post("/api/process", json={**target, "rgb": [0, 0, 0]}).status_code == 404
+    response = client.post("/api/process/histogram", json={**target, "rgb": [0, 0, 0]})
+    assert response.status_code == 404
@@ -1,6 +1,7 @@
 """
 一時ファイルストレージの初期化テスト
 """
+
 import uuid
 from pathlib import Path
 
@@ -101,3 +102,230 @@ def test_ensure_session_directory_invalid_session_id() -> None:
 
     with pytest.raises(ValueError, match="Invalid session_id format"):
         ensure_session_directory("invalid-session-id")
+
+
+@pytest.mark.asyncio
+async def test_save_uploaded_file_deduplicates_blobs() -> None:
+    """同じ内容のアップロードが1つのブロブを共有することをテスト"""
+    import hashlib
+    import os
+
+    from transpalentor.infrastructure.file_storage import (
+        delete_session_files,
+        generate_session_id,
+        get_blob_path,
+        get_blob_refcount,
+        get_file_hash,
+        save_uploaded_file,
+    )
+
+    content = b"dedup-test-" + uuid.uuid4().bytes
+    content_hash = hashlib.sha256(content).hexdigest()
+    session_ids = [generate_session_id(), generate_session_id()]
+
+    try:
+        paths = [
+            await save_uploaded_file(session_id, "image.png", content) for session_id in session_ids
+        ]
+
+        # 両セッションのファイルが同じブロブを参照している
+        blob_path = get_blob_path(content_hash)
+        assert blob_path.exists()
+        assert all(os.path.samefile(path, blob_path) for path in paths)
+        assert get_blob_refcount(content_hash) == 2
+        assert get_file_hash(session_ids[0], "image.png") == content_hash
+
+        # 1つ削除してもブロブは残る
+        assert delete_session_files(session_ids[0]) is True
+        assert blob_path.exists()
+        assert paths[1].read_bytes() == content
+
+        # 最後の参照が消えるとブロブも削除される
+        assert delete_session_files(session_ids[1]) is True
+        assert not blob_path.exists()
+    finally:
+        for session_id in session_ids:
+            delete_session_files(session_id)
+
+
+@pytest.mark.asyncio
+async def test_atomic_write_does_not_modify_blob() -> None:
+    """セッションファイルの上書きがブロブ本体を書き換えないことをテスト"""
+    from transpalentor.infrastructure.file_storage import (
+        atomic_write_bytes,
+        collect_orphan_blobs,
+        delete_session_files,
+        generate_session_id,
+        get_blob_path,
+        get_file_hash,
+        save_uploaded_file,
+    )
+
+    content = b"blob-test-" + uuid.uuid4().bytes
+    session_id = generate_session_id()
+
+    try:
+        file_path = await save_uploaded_file(session_id, "image.png", content)
+        content_hash = get_file_hash(session_id, "image.png")
+        assert content_hash is not None
+
+        atomic_write_bytes(file_path, b"edited")
+
+        assert file_path.read_bytes() == b"edited"
+        assert get_blob_path(content_hash).read_bytes() == content
+        # 内容が変わったファイルはハッシュを返さない
+        assert get_file_hash(session_id, "image.png") is None
+
+        # 参照がなくなった直後のブロブは猶予の間は残り、その後に回収される
+        assert get_blob_path(content_hash).exists()
+        collect_orphan_blobs()
+        assert get_blob_path(content_hash).exists()
+        assert collect_orphan_blobs(min_age=0) >= 1
+        assert not get_blob_path(content_hash).exists()
+    finally:
+        delete_session_files(session_id)
+
+
+def test_atomic_write_bytes_replaces_file(tmp_path) -> None:
+    """書き込みが一時ファイルを残さず原子的に置き換えることをテスト"""
+    from transpalentor.infrastructure.file_storage import atomic_write_bytes
+
+    file_path = tmp_path / "image.png"
+    file_path.write_bytes(b"old")
+
+    atomic_write_bytes(file_path, b"new", fsync=True)
+
+    assert file_path.read_bytes() == b"new"
+    assert [p.name for p in tmp_path.iterdir()] == ["image.png"]
+
+
+def test_release_blob_waits_for_link() -> None:
+    """リンクの作成中はブロブの解放が待たされ、リンクされたブロブを削除しないことをテスト"""
+    import fcntl
+    import hashlib
+    import os
+    import threading
+
+    from transpalentor.infrastructure.file_storage import (
+        BLOB_LOCK_FILENAME,
+        get_blob_path,
+        release_blob,
+        store_blob,
+    )
+
+    content = b"release-test-" + uuid.uuid4().bytes
+    content_hash = store_blob(content)
+    blob_path = get_blob_path(content_hash)
+    link_path = blob_path.with_name(f".link-{uuid.uuid4().hex}")
+
+    # 別のワーカーのリンクの作成を、同じロックファイルの別のオープンで再現する
+    released = []
+    releaser = threading.Thread(target=lambda: released.append(release_blob(content_hash)))
+    try:
+        with (blob_path.parent / BLOB_LOCK_FILENAME).open("a") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            releaser.start()
+            releaser.join(timeout=0.2)
+            assert releaser.is_alive()
+
+            os.link(blob_path, link_path)
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+        releaser.join(timeout=5)
+        assert released == [False]
+        assert hashlib.sha256(blob_path.read_bytes()).hexdigest() == content_hash
+    finally:
+        link_path.unlink(missing_ok=True)
+        release_blob(content_hash)
+
+
+def test_save_staged_file_across_filesystems(monkeypatch) -> None:
+    """一時ファイルがブロブと別のファイルシステムにある場合もコピーして保存することをテスト"""
+    import errno
+    import hashlib
+    import os
+
+    from transpalentor.infrastructure import file_storage
+    from transpalentor.infrastructure.file_storage import (
+        create_staging_path,
+        delete_session_files,
+        generate_session_id,
+        get_blob_path,
+        save_staged_file,
+    )
+
+    content = b"staged-test-" + uuid.uuid4().bytes
+    content_hash = hashlib.sha256(content).hexdigest()
+    staged_path = create_staging_path()
+    staged_path.write_bytes(content)
+
+    replace = os.replace
+
+    def cross_device_replace(source, destination) -> None:
+        if Path(source) == staged_path:
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+        replace(source, destination)
+
+    monkeypatch.setattr(file_storage.os, "replace", cross_device_replace)
+    session_id = generate_session_id()
+    try:
+        file_path = save_staged_file(session_id, "image.png", staged_path, content_hash)
+
+        assert file_path.read_bytes() == content
+        assert os.path.samefile(file_path, get_blob_path(content_hash))
+        assert not staged_path.exists()
+        assert not [p for p in get_blob_path(content_hash).parent.iterdir() if ".tmp" in p.name]
+    finally:
+        delete_session_files(session_id)
+
+
+def test_session_directory_is_sharded() -> None:
+    """セッションディレクトリがUUIDの先頭によるシャード配下に置かれることをテスト"""
+    from transpalentor.infrastructure.file_storage import TMP_DIR, get_session_directory
+
+    session_id = "12345678-1234-4234-8234-123456789abc"
+    assert get_session_directory(session_id) == TMP_DIR / "12" / "34" / session_id
+
+
+@pytest.mark.asyncio
+async def test_flat_session_directory_is_migrated_on_access() -> None:
+    """旧形式のセッションディレクトリがアクセス時にシャード配下へ移動されることをテスト"""
+    import hashlib
+    import os
+
+    from transpalentor.infrastructure.file_storage import (
+        TMP_DIR,
+        delete_session_files,
+        generate_session_id,
+        get_file_hash,
+        get_session_directory,
+        iter_session_directories,
+        save_uploaded_file,
+    )
+
+    session_id = generate_session_id()
+    content = os.urandom(64)
+    await save_uploaded_file(session_id, "image.png", content)
+
+    # 旧形式の配置に戻す
+    flat_dir = TMP_DIR / session_id
+    os.rename(get_session_directory(session_id), flat_dir)
+    assert flat_dir in list(iter_session_directories())
+
+    try:
+        session_dir = get_session_directory(session_id)
+        assert not flat_dir.exists()
+        assert (session_dir / "image.png").read_bytes() == content
+        assert get_file_hash(session_id, "image.png") == hashlib.sha256(content).hexdigest()
+        assert session_dir in list(iter_session_directories())
+    finally:
+        delete_session_files(session_id)
+
+
+def test_tmp_dir_follows_setting() -> None:
+    """一時ファイルの保存先が TRANSPALENTOR_TMP_DIR に従うことをテスト"""
+    import os
+
+    from transpalentor.infrastructure.file_storage import TMP_DIR
+
+    assert TMP_DIR == Path(os.environ["TRANSPALENTOR_TMP_DIR"])
@@ -0,0 +1,248 @@
+"""
+アップロード時の事前計算のテスト
+"""
+
+import io
+
+from fastapi.testclient import TestClient
+from PIL import Image
+
+
+def create_test_image(size: tuple[int, int] = (1100, 500)) -> io.BytesIO:
+    """テスト用の画像を作成 (白地の中央に赤い四角)"""
+    image = Image.new("RGB", size, color=(255, 255, 255))
+    image.paste((200, 0, 0), (size[0] // 4, size[1] // 4, size[0] * 3 // 4, size[1] * 3 // 4))
+    image.paste((0, 0, 255), (0, size[1] - 2, 10, size[1]))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    buffer.seek(0)
+    return buffer
+
+
+def test_analyze_image(tmp_path) -> None:
+    """ピラミッド・サムネイル・ヒストグラム・背景色の候補が作成されることをテスト"""
+    from transpalentor.infrastructure.image_analysis import analyze_image
+
+    path = tmp_path / "image.png"
+    path.write_bytes(create_test_image().getvalue())
+
+    analysis = analyze_image(path, "hash")
+
+    assert (analysis["width"], analysis["height"], analysis["image_format"]) == (1100, 500, "PNG")
+    assert analysis["raster"].mode == "RGBA"
+    assert {size: level.size for size, level in analysis["pyramid"].items()} == {
+        1024: (550, 250),
+        512: (275, 125),
+        256: (138, 63),
+    }
+    with Image.open(io.BytesIO(analysis["thumbnail"])) as thumbnail:
+        assert thumbnail.size == (138, 63)
+    assert len(analysis["histogram"]) == 768
+    assert sorted(color for _, color in analysis["colors"]) == [
+        (0, 0, 255),
+        (200, 0, 0),
+        (255, 255, 255),
+    ]
+    assert analysis["border_colors"] == [[255, 255, 255], [0, 0, 255]]
+
+
+def test_select_level(tmp_path) -> None:
+    """要求した長辺以下の縮小画像がピラミッドから選ばれることをテスト"""
+    from transpalentor.infrastructure.image_analysis import analyze_image, select_level
+
+    path = tmp_path / "image.png"
+    path.write_bytes(create_test_image().getvalue())
+    analysis = analyze_image(path, "hash")
+
+    assert select_level(analysis, 512) is analysis["pyramid"][512]
+    assert select_level(analysis, 2048) is analysis["raster"]
+    assert max(select_level(analysis, 100).size) <= 100
+    assert max(select_level(analysis, 600).size) <= 600
+
+
+def test_pyramid_level_cache() -> None:
+    """要求した長辺に対応する段と、エンコード済みの縮小画像のLRUをテスト"""
+    from transpalentor.infrastructure.image_analysis import ImageAnalysisStore, pyramid_level_for
+
+    assert [pyramid_level_for(size) for size in (1, 256, 257, 2048, 2049)] == [
+        256,
+        256,
+        512,
+        2048,
+        None,
+    ]
+
+    store = ImageAnalysisStore(max_workers=1, level_cache_limit=10)
+    store.put_level("a", 256, b"12345")
+    store.put_level("b", 256, b"12345")
+    assert store.get_level("a", 256) == b"12345"
+    store.put_level("c", 256, b"12345")
+    assert store.get_level("b", 256) is None
+    assert store.get_level("a", 256) == b"12345"
+    store.put_level("d", 256, b"x" * 11)
+    assert store.get_level("d", 256) is None
+    assert store.stats()["level_entries"] == 2
+
+
+def test_store_deduplicates_and_evicts(tmp_path) -> None:
+    """同じ内容は1回だけ計算され、上限を超えると古い結果から削除されることをテスト"""
+    from transpalentor.infrastructure.image_analysis import ImageAnalysisStore
+
+    first = tmp_path / "first.png"
+    first.write_bytes(create_test_image((200, 100)).getvalue())
+    second = tmp_path / "second.png"
+    second.write_bytes(create_test_image((200, 100)).getvalue())
+    broken = tmp_path / "broken.png"
+    broken.write_bytes(b"not an image")
+
+    store = ImageAnalysisStore(max_workers=1, memory_limit=200 * 100 * 4)
+    assert store.get("first") is None
+
+    store.submit("first", first)
+    store.submit("first", first)
+    assert store.get("first", wait=True)["width"] == 200
+
+    store.submit("second", second)
+    assert store.get("second", wait=True) is not None
+    assert store.get("first") is None
+
+    store.submit("broken", broken)
+    assert store.get("broken", wait=True) is None
+
+    stats = store.stats()
+    assert (stats["analyses"], stats["failures"], stats["evictions"]) == (2, 1, 1)
+    assert (stats["entries"], stats["pending"]) == (1, 0)
+
+
+def test_upload_precomputes_analysis() -> None:
+    """アップロード時に事前計算され、解析結果と透過処理で使われることをテスト"""
+    from transpalentor.infrastructure.image_analysis import image_analysis
+    from transpalentor.infrastructure.result_cache import result_cache
+    from transpalentor.presentation.app import app
+
+    client = TestClient(app)
+    result_cache.clear()
+    upload = client.post(
+        "/api/upload", files={"file": ("test.png", create_test_image(), "image/png")}
+    ).json()
+    session_id = upload["session_id"]
+
+    response = client.get(f"/api/images/{session_id}/{upload['filename']}/analysis")
+    assert response.status_code == 200
+    assert response.json() == {
+        "session_id": session_id,
+        "filename": upload["filename"],
+        "width": 1100,
+        "height": 500,
+        "color_count": 3,
+        "border_colors": [[255, 255, 255], [0, 0, 255]],
+    }
+
+    hits = image_analysis.stats()["hits"]
+    response = client.post(
+        "/api/process",
+        json={
+            "session_id": session_id,
+            "filename": upload["filename"],
+            "rgb": [255, 255, 255],
+            "threshold": 0,
+        },
+    )
+    assert response.status_code == 200
+    assert image_analysis.stats()["hits"] == hits + 1
+    assert "image_analysis" in client.get("/api/metrics").json()
+
+    missing = client.get(f"/api/images/{session_id}/missing.png/analysis")
+    assert missing.status_code == 404
+
+    client.delete(f"/api/cleanup/{session_id}")
+
+
+def test_sample_pixels() -> None:
+    """画素値と、画像の内側に切り詰めた範囲の平均が取得できることをテスト"""
+    from transpalentor.infrastructure.image_analysis import sample_pixels
+
+    raster = Image.new("RGBA", (10, 10), (0, 0, 0, 255))
+    raster.paste((90, 30, 0, 255), (0, 0, 1, 3))
+
+    assert sample_pixels(raster, [(0, 0), (5, 5), (10, 0), (-1, 3)]) == [
+        [90, 30, 0, 255],
+        [0, 0, 0, 255],
+        None,
+        None,
+    ]
+    # (0, 0) を中心とする 3×3 は画像の内側の 2×2 だけを平均する
+    assert sample_pixels(raster, [(1, 1), (0, 0)], size=3) == [
+        [30, 10, 0, 255],
+        [45, 15, 0, 255],
+    ]
+
+
+def test_sample_endpoint() -> None:
+    """事前計算したラスターと、未保存の変更を含む作業中画像から画素値を取得できることをテスト"""
+    from transpalentor.presentation.app import app
+
+    client = TestClient(app)
+    upload = client.post(
+        "/api/upload", files={"file": ("test.png", create_test_image(), "image/png")}
+    ).json()
+    session_id = upload["session_id"]
+    body = {"session_id": session_id, "filename": upload["filename"]}
+
+    response = client.post(
+        "/api/sample", json={**body, "points": [[10, 10], [550, 250], [1100, 0]], "size": 5}
+    )
+    assert response.status_code == 200
+    assert response.json() == {
+        **body,
+        "width": 1100,
+        "height": 500,
+        "samples": [[255, 255, 255, 255], [200, 0, 0, 255], None],
+    }
+
+    process = client.post(
+        "/api/process", json={**body, "rgb": [255, 255, 255], "threshold": 0}
+    ).json()
+    processed = {"session_id": session_id, "filename": process["filename"]}
+    client.post("/api/erase", json={**processed, "strokes": [[550, 250]], "brush_size": 4})
+    samples = client.post(
+        "/api/sample", json={**processed, "points": [[10, 10], [550, 250], [300, 200]]}
+    ).json()["samples"]
+    assert [sample[3] for sample in samples] == [0, 0, 255]
+
+    even = client.post("/api/sample", json={**body, "points": [[1, 1]], "size": 2})
+    assert even.status_code == 422
+    assert client.post("/api/sample", json={**body, "points": [[1]]}).status_code == 422
+    missing = client.post(
+        "/api/sample", json={**body, "filename": "missing.png", "points": [[1, 1]]}
+    )
+    assert missing.status_code == 404
+
+    client.delete(f"/api/cleanup/{session_id}")
+
+
+def test_sample_endpoint_rejects_paths_outside_session() -> None:
+    """別のセッションのファイルを指すファイル名が拒否されることをテスト"""
+    import os
+
+    from transpalentor.infrastructure.file_storage import get_session_directory
+    from transpalentor.presentation.app import app
+
+    client = TestClient(app)
+    upload, victim = (
+        client.post("/api/upload", files={"file": (name, create_test_image(), "image/png")}).json()
+        for name in ("test.png", "victim.png")
+    )
+    session_id = upload["session_id"]
+    victim_path = get_session_directory(victim["session_id"]) / victim["filename"]
+    traversal = os.path.relpath(victim_path, get_session_directory(session_id))
+
+    for filename in (traversal, ".", ".manifest.json/.."):
+        response = client.post(
+            "/api/sample",
+            json={"session_id": session_id, "filename": filename, "points": [[10, 10]]},
+        )
+        assert response.status_code == 404
+
+    client.delete(f"/api/cleanup/{session_id}")
+    client.delete(f"/api/cleanup/{victim['session_id']}")
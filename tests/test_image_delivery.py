@@ -0,0 +1,218 @@
+"""
+画像配信のオフロードと署名付きURLのテスト
+"""
+
+import base64
+import hashlib
+import io
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+
+def create_test_image() -> io.BytesIO:
+    """テスト用の画像を作成"""
+    image = Image.new("RGB", (20, 20), color=tuple(os.urandom(3)))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    buffer.seek(0)
+    return buffer
+
+
+def test_sign_path_matches_nginx_secure_link() -> None:
+    """署名がnginx secure_link_md5と同じ形式で計算されることをテスト"""
+    from transpalentor.infrastructure.image_delivery import sign_path
+
+    expected = (
+        base64.urlsafe_b64encode(hashlib.md5(b"2147483647/api/images/s/a.png secret").digest())
+        .decode()
+        .rstrip("=")
+    )
+    assert sign_path("/api/images/s/a.png", 2147483647, "secret") == expected
+    assert "=" not in expected and "+" not in expected and "/" not in expected
+
+
+def test_signed_url_verification(tmp_path) -> None:
+    """署名付きURLが検証され、改ざん・期限切れは拒否されることをテスト"""
+    from urllib.parse import parse_qs, urlsplit
+
+    from transpalentor.infrastructure.image_delivery import ImageDelivery
+
+    delivery = ImageDelivery(signed_urls=True, url_ttl=60, secret_path=tmp_path / "secret")
+    url = delivery.sign_url("/api/images/s/a.png", now=1000)
+    parts = urlsplit(url)
+    query = parse_qs(parts.query)
+    signature, expires = query["md5"][0], int(query["expires"][0])
+
+    assert parts.path == "/api/images/s/a.png"
+    # 有効期限は有効期間の半分 (30秒) 単位に切り捨てられる
+    assert expires == 1050
+    assert delivery.sign_url("/api/images/s/a.png", now=1019) == url
+    assert delivery.sign_url("/api/images/s/a.png", now=1020) != url
+    assert delivery.verify(parts.path, signature, expires, now=1030)
+    assert not delivery.verify(parts.path, signature, expires, now=1051)
+    assert not delivery.verify("/api/images/s/b.png", signature, expires, now=1030)
+    assert not delivery.verify(parts.path, signature, expires + 1, now=1030)
+    assert not delivery.verify(parts.path, None, None, now=1030)
+
+    # 秘密鍵はファイルで共有され、別のインスタンスでも検証できる
+    other = ImageDelivery(signed_urls=True, secret_path=tmp_path / "secret")
+    assert other.verify(parts.path, signature, expires, now=1030)
+
+
+def test_delivery_from_settings(tmp_path) -> None:
+    """環境変数の設定から画像配信の設定が作成されることをテスト"""
+    from transpalentor.infrastructure.image_delivery import (
+        OFFLOAD_X_SENDFILE,
+        ImageDelivery,
+        delivery_from_settings,
+    )
+
+    default = delivery_from_settings({})
+    assert default.offload_mode is None
+    assert not default.signed_urls
+
+    delivery = delivery_from_settings(
+        {
+            "TRANSPALENTOR_OFFLOAD_MODE": OFFLOAD_X_SENDFILE,
+            "TRANSPALENTOR_SIGNED_URLS": "true",
+            "TRANSPALENTOR_SIGNED_URL_TTL": "600",
+            "TRANSPALENTOR_URL_SIGNING_SECRET": "secret",
+        }
+    )
+    assert delivery.offload_mode == OFFLOAD_X_SENDFILE
+    assert delivery.signed_urls
+    assert delivery.url_ttl == 600
+    assert delivery.url_bucket == 300
+    # 同じ秘密鍵を設定したワーカー同士で検証できる
+    other = ImageDelivery(signed_urls=True, secret="secret", secret_path=tmp_path / "unused")
+    url = delivery.sign_url("/api/images/s/a.png", now=1000)
+    signature, expires = url.split("md5=")[1].split("&expires=")
+    assert other.verify("/api/images/s/a.png", signature, int(expires), now=1000)
+
+    with pytest.raises(ValueError):
+        delivery_from_settings({"TRANSPALENTOR_OFFLOAD_MODE": "sendfile"})
+    with pytest.raises(ValueError):
+        delivery_from_settings({"TRANSPALENTOR_SIGNED_URL_TTL": "0"})
+
+
+def test_get_image_offloads_with_signed_url() -> None:
+    """オフロード有効時にX-Accel-Redirectヘッダーだけが返ることをテスト"""
+    from transpalentor.infrastructure.file_storage import TMP_DIR, get_session_directory
+    from transpalentor.infrastructure.image_delivery import (
+        OFFLOAD_X_ACCEL_REDIRECT,
+        OFFLOAD_X_SENDFILE,
+        image_delivery,
+    )
+    from transpalentor.presentation.app import app
+
+    client = TestClient(app)
+    image_delivery.configure(offload_mode=OFFLOAD_X_ACCEL_REDIRECT, signed_urls=True)
+    try:
+        upload = client.post(
+            "/api/upload", files={"file": ("test.png", create_test_image(), "image/png")}
+        ).json()
+        session_id = upload["session_id"]
+        file_path = get_session_directory(session_id) / upload["filename"]
+
+        assert "md5=" in upload["image_url"] and "expires=" in upload["image_url"]
+        response = client.get(upload["image_url"])
+        assert response.status_code == 200
+        assert response.content == b""
+        assert response.headers["content-type"] == "image/png"
+        relative = file_path.resolve().relative_to(TMP_DIR.resolve()).as_posix()
+        assert response.headers["x-accel-redirect"] == f"/_protected/{relative}"
+
+        # 署名のないURL・改ざんされたURLは拒否される
+        unsigned = client.get(f"/api/images/{session_id}/{upload['filename']}")
+        assert unsigned.status_code == 403
+        assert unsigned.json()["error_code"] == "INVALID_SIGNATURE"
+        tampered = client.get(upload["image_url"].replace("md5=", "md5=x"))
+        assert tampered.status_code == 403
+
+        image_delivery.configure(offload_mode=OFFLOAD_X_SENDFILE, signed_urls=True)
+        response = client.get(upload["image_url"])
+        assert response.headers["x-sendfile"] == str(file_path.resolve())
+    finally:
+        image_delivery.configure(offload_mode=None, signed_urls=False)
+        client.delete(f"/api/cleanup/{session_id}")
+
+
+def test_etag_matches() -> None:
+    """If-None-Matchの比較 (複数指定・弱いETag・*) をテスト"""
+    from transpalentor.infrastructure.image_delivery import etag_matches, make_etag
+
+    etag = make_etag("abc")
+    assert etag == '"abc"'
+    assert etag_matches('"abc"', etag)
+    assert etag_matches('"x", W/"abc"', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches('"x"', etag)
+    assert not etag_matches(None, etag)
+
+
+def test_get_image_returns_not_modified_for_matching_etag() -> None:
+    """内容のハッシュのETagが一致する場合に304が返ることをテスト"""
+    from transpalentor.infrastructure.image_delivery import IMMUTABLE_CACHE_CONTROL
+    from transpalentor.presentation.app import app
+
+    client = TestClient(app)
+    upload = client.post(
+        "/api/upload", files={"file": ("test.png", create_test_image(), "image/png")}
+    ).json()
+    session_id = upload["session_id"]
+
+    # アップロードのURLには内容のバージョンが付き、変更されないものとしてキャッシュされる
+    assert "v=" in upload["image_url"]
+    response = client.get(upload["image_url"])
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == IMMUTABLE_CACHE_CONTROL
+    etag = response.headers["etag"]
+
+    cached = client.get(upload["image_url"], headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+    assert cached.headers["etag"] == etag
+
+    # バージョンのないURLは毎回再検証させる
+    unversioned = client.get(f"/api/images/{session_id}/{upload['filename']}")
+    assert "no-cache" in unversioned.headers["cache-control"]
+    assert unversioned.headers["etag"] == etag
+
+    client.delete(f"/api/cleanup/{session_id}")
+
+
+def test_erase_changes_etag() -> None:
+    """消しゴム処理の後はETagが変わり、古いETagでは304にならないことをテスト"""
+    from transpalentor.presentation.app import app
+
+    client = TestClient(app)
+    upload = client.post(
+        "/api/upload", files={"file": ("test.png", create_test_image(), "image/png")}
+    ).json()
+    session_id = upload["session_id"]
+    processed = client.post(
+        "/api/process",
+        json={"session_id": session_id, "filename": upload["filename"], "rgb": [0, 0, 0]},
+    ).json()
+    etag = client.get(processed["processed_url"]).headers["etag"]
+
+    erased = client.post(
+        "/api/erase",
+        json={
+            "session_id": session_id,
+            "filename": processed["filename"],
+            "strokes": [[10, 10]],
+            "brush_size": 5,
+        },
+    ).json()
+    assert "t=" not in erased["processed_url"]
+
+    response = client.get(erased["processed_url"], headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    assert "no-cache" in response.headers["cache-control"]
+
+    client.delete(f"/api/cleanup/{session_id}")
@@ -1,6 +1,7 @@
 """
 画像表示機能のテスト
 """
+
 import io
 import shutil
 
@@ -69,3 +70,65 @@ def test_get_image_invalid_session_id() -> None:
     response = client.get("/api/images/invalid-session-id/test.png")
 
     assert response.status_code == 404
+
+
+def test_get_image_pyramid_level() -> None:
+    """size を指定すると縮小画像が返り、画像が変更されると別の縮小画像になることをテスト"""
+    from transpalentor.presentation.app import app
+
+    client = TestClient(app)
+    upload = client.post(
+        "/api/upload",
+        files={"file": ("test.jpg", create_test_image("JPEG", (1200, 600)), "image/jpeg")},
+    ).json()
+    session_id = upload["session_id"]
+    image_url = f"/api/images/{session_id}/{upload['filename']}"
+
+    response = client.get(image_url, params={"size": 600})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/png"
+    with Image.open(io.BytesIO(response.content)) as level:
+        assert level.size == (600, 300)
+
+    # 同じ段は同じETagで再検証できる
+    etag = response.headers["etag"]
+    assert client.get(image_url, params={"size": 1024}).headers["etag"] == etag
+    cached = client.get(image_url, params={"size": 1024}, headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+
+    # 元画像の方が小さい段・上限を超える大きさは元画像を返す
+    full = client.get(image_url, params={"size": 4096})
+    assert full.headers["content-type"] == "image/jpeg"
+    assert client.get(image_url, params={"size": 0}).status_code == 422
+
+    # 処理済み画像を消しゴムで変更すると、縮小画像も変わる
+    processed = client.post(
+        "/api/process",
+        json={
+            "session_id": session_id,
+            "filename": upload["filename"],
+            "rgb": [255, 0, 0],
+            "threshold": 0,
+        },
+    ).json()
+    processed_url = f"/api/images/{session_id}/{processed['filename']}"
+    before = client.get(processed_url, params={"size": 256})
+    with Image.open(io.BytesIO(before.content)) as level:
+        assert level.size == (240, 120)
+        assert level.getpixel((10, 10))[3] == 255
+
+    client.post(
+        "/api/erase",
+        json={
+            "session_id": session_id,
+            "filename": processed["filename"],
+            "strokes": [[50, 50]],
+            "brush_size": 100,
+        },
+    )
+    after = client.get(processed_url, params={"size": 256})
+    assert after.headers["etag"] != before.headers["etag"]
+    with Image.open(io.BytesIO(after.content)) as level:
+        assert level.getpixel((10, 10))[3] == 0
+
+    client.delete(f"/api/cleanup/{session_id}")
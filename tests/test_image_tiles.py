@@ -0,0 +1,184 @@
+"""
+画像のタイル配信のテスト
+"""
+
+import io
+
+from fastapi.testclient import TestClient
+from PIL import Image
+
+
+def create_test_image(size: tuple[int, int] = (600, 300)) -> io.BytesIO:
+    """テスト用の画像を作成"""
+    image = Image.new("RGB", size, color=(10, 200, 30))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    buffer.seek(0)
+    return buffer
+
+
+def test_tile_geometry() -> None:
+    """段・タイル数・タイルが覆う範囲の計算をテスト"""
+    from transpalentor.infrastructure.image_tiles import max_tile_level, tile_box, tile_count
+
+    assert max_tile_level(256, 100) == 0
+    assert max_tile_level(1000, 600) == 2
+    assert tile_count(1000, 600, 0) == (4, 3)
+    assert tile_count(1000, 600, 2) == (1, 1)
+    assert tile_box(1000, 600, 0, 3, 2) == (768, 512, 1000, 600)
+    assert tile_box(1000, 600, 1, 1, 0) == (512, 0, 1000, 512)
+    assert tile_box(1000, 600, 0, 4, 0) is None
+    assert tile_box(1000, 600, 3, 0, 0) is None
+    assert tile_box(1000, 600, -1, 0, 0) is None
+
+
+def test_tile_cache_invalidates_overlapping_tiles(tmp_path) -> None:
+    """変更された範囲に重なるタイルだけが全ての段で破棄されることをテスト"""
+    from transpalentor.infrastructure.image_tiles import TileCache
+
+    cache = TileCache()
+    path = tmp_path / "image.png"
+    for key in [(0, 0, 0), (0, 1, 0), (0, 0, 1), (1, 0, 0)]:
+        version = cache.begin(path, *key)
+        cache.end(path, *key, version, (b"tile", "etag"), "a" * 64)
+
+    cache.invalidate(path, (300, 10, 310, 20))
+    assert cache.get(path, 0, 0, 0) == (b"tile", "etag")
+    assert cache.get(path, 0, 1, 0) is None
+    assert cache.get(path, 0, 0, 1) == (b"tile", "etag")
+    assert cache.get(path, 1, 0, 0) is None
+
+    # 作成中に重なる範囲が変更されたタイルは保持しない (重ならないタイルは保持する)
+    stale = cache.begin(path, 0, 1, 0)
+    fresh = cache.begin(path, 0, 2, 0)
+    cache.invalidate(path, (300, 10, 310, 20))
+    cache.end(path, 0, 1, 0, stale, (b"stale", "etag"))
+    cache.end(path, 0, 2, 0, fresh, (b"fresh", "etag"))
+    assert cache.get(path, 0, 1, 0) is None
+    assert cache.get(path, 0, 2, 0) == (b"fresh", "etag")
+
+    cache.invalidate(path)
+    assert cache.stats()["entries"] == 0
+
+
+def test_tile_cache_drops_tiles_saved_by_other_workers(tmp_path) -> None:
+    """インデックスの内容のハッシュが変わった画像のタイルだけが破棄されることをテスト"""
+    from transpalentor.infrastructure.image_tiles import TileCache
+    from transpalentor.infrastructure.result_cache import compute_content_hash
+
+    cache = TileCache()
+    path = tmp_path / "image.png"
+    other = tmp_path / "other.png"
+    for file_path in (path, other):
+        version = cache.begin(file_path, 0, 0, 0)
+        cache.end(file_path, 0, 0, 0, version, (b"tile", "etag"), "a" * 64)
+
+    # このワーカーの保存は記録されるため、保存後のハッシュでも破棄しない
+    cache.record_write(path, b"saved")
+    assert cache.get(path, 0, 0, 0, compute_content_hash(b"saved")) == (b"tile", "etag")
+
+    # 記録のない変更 (別のワーカーの保存)
+    assert cache.get(path, 0, 0, 0, "b" * 64) is None
+    assert cache.get(other, 0, 0, 0, "a" * 64) == (b"tile", "etag")
+
+    # 変更前の内容から作成したタイルは保持しない
+    version = cache.begin(other, 0, 1, 0)
+    cache.end(other, 0, 1, 0, version, (b"tile", "etag"), "c" * 64)
+    assert cache.get(other, 0, 1, 0) is None
+
+
+def test_get_tiles() -> None:
+    """タイルの構成と各タイルを取得でき、消しゴムで変更したタイルだけが作り直されることをテスト"""
+    from transpalentor.infrastructure.image_tiles import tile_cache
+    from transpalentor.infrastructure.working_images import working_images
+    from transpalentor.presentation.app import app
+
+    client = TestClient(app)
+    upload = client.post(
+        "/api/upload", files={"file": ("test.png", create_test_image(), "image/png")}
+    ).json()
+    session_id = upload["session_id"]
+    base_url = f"/api/images/{session_id}/{upload['filename']}/tiles"
+
+    info = client.get(base_url).json()
+    assert (info["width"], info["height"], info["tile_size"], info["max_level"]) == (
+        600,
+        300,
+        256,
+        2,
+    )
+
+    first = client.get(f"{base_url}/0/0/0")
+    assert first.status_code == 200
+    assert first.headers["content-type"] == "image/png"
+    with Image.open(io.BytesIO(first.content)) as tile:
+        assert tile.size == (256, 256)
+    with Image.open(io.BytesIO(client.get(f"{base_url}/0/2/1").content)) as tile:
+        assert tile.size == (88, 44)
+    with Image.open(io.BytesIO(client.get(f"{base_url}/2/0/0").content)) as tile:
+        assert tile.size == (150, 75)
+
+    missing = client.get(f"{base_url}/0/3/0")
+    assert missing.status_code == 404
+    assert missing.json()["error_code"] == "TILE_NOT_FOUND"
+
+    etag = first.headers["etag"]
+    assert client.get(f"{base_url}/0/0/0", headers={"If-None-Match": etag}).status_code == 304
+
+    client.post(
+        "/api/erase",
+        json={
+            "session_id": session_id,
+            "filename": upload["filename"],
+            "strokes": [[10, 10]],
+            "brush_size": 10,
+        },
+    )
+
+    # 変更された範囲のタイルは作り直され、それ以外は保持したものが返る
+    erased = client.get(f"{base_url}/0/0/0")
+    assert erased.headers["etag"] != etag
+    with Image.open(io.BytesIO(erased.content)) as tile:
+        assert tile.getpixel((10, 10))[3] == 0
+    hits = tile_cache.stats()["hits"]
+    unchanged = client.get(f"{base_url}/0/2/1")
+    assert tile_cache.stats()["hits"] == hits + 1
+
+    # 保存後も変更されていないタイルは保持され、保持したETagで再検証できる
+    working_images.flush_all()
+    revalidated = client.get(
+        f"{base_url}/0/2/1", headers={"If-None-Match": unchanged.headers["etag"]}
+    )
+    assert revalidated.status_code == 304
+    assert tile_cache.stats()["hits"] == hits + 2
+
+    client.delete(f"/api/cleanup/{session_id}")
+
+
+def test_tiles_follow_changes_from_other_workers() -> None:
+    """別のワーカーが保存した変更が、保持しているタイルより優先されることをテスト"""
+    from transpalentor.infrastructure.file_storage import encode_png, get_session_directory
+    from transpalentor.infrastructure.storage_budget import storage_budget
+    from transpalentor.infrastructure.working_images import WorkingImageManager
+    from transpalentor.presentation.app import app
+
+    client = TestClient(app)
+    upload = client.post(
+        "/api/upload", files={"file": ("test.png", create_test_image(), "image/png")}
+    ).json()
+    session_id = upload["session_id"]
+    tile_url = f"/api/images/{session_id}/{upload['filename']}/tiles/0/0/0"
+
+    with Image.open(io.BytesIO(client.get(tile_url).content)) as tile:
+        assert tile.getpixel((0, 0)) == (10, 200, 30, 255)
+
+    # 別のワーカーに相当する、このプロセスのキャッシュを共有しないマネージャーで書き換える
+    other_worker = WorkingImageManager()
+    other_worker.add_write_listener(storage_budget.record_path)
+    file_path = get_session_directory(session_id) / upload["filename"]
+    other_worker.write(file_path, encode_png(Image.new("RGBA", (600, 300), (0, 0, 255, 255))))
+
+    with Image.open(io.BytesIO(client.get(tile_url).content)) as tile:
+        assert tile.getpixel((0, 0)) == (0, 0, 255, 255)
+
+    client.delete(f"/api/cleanup/{session_id}")
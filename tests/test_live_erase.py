@@ -0,0 +1,138 @@
+"""
+消しゴムのWebSocketのテスト
+"""
+
+import io
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+from starlette.websockets import WebSocketDisconnect
+
+
+def create_test_image() -> io.BytesIO:
+    """テスト用の画像を作成"""
+    image = Image.new("RGB", (100, 80), color=(10, 200, 30))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    buffer.seek(0)
+    return buffer
+
+
+def test_erase_strokes_in_place_returns_dirty_box() -> None:
+    """その場で消した範囲が画像の範囲内に切り詰めて返ることをテスト"""
+    from transpalentor.domain.transparency import erase_strokes_in_place
+
+    image = Image.new("RGBA", (50, 50), (1, 2, 3, 255))
+
+    assert erase_strokes_in_place(image, [[2, 10], [20, 12]], brush_size=6) == (0, 7, 24, 16)
+    assert image.getpixel((2, 10))[3] == 0
+    assert image.getpixel((30, 10))[3] == 255
+    assert erase_strokes_in_place(image, [[200, 200]], brush_size=6) is None
+    assert erase_strokes_in_place(image, [], brush_size=6) is None
+
+
+def test_alpha_patch_round_trip() -> None:
+    """アルファパッチのエンコードと復元をテスト"""
+    from transpalentor.infrastructure.alpha_mask import decode_alpha_patch, encode_alpha_patch
+
+    alpha = Image.new("L", (3, 2), 7)
+    sequence, origin, decoded = decode_alpha_patch(encode_alpha_patch(5, (10, 20, 13, 22), alpha))
+    assert (sequence, origin) == (5, (10, 20))
+    assert decoded.tobytes() == alpha.tobytes()
+
+    assert decode_alpha_patch(encode_alpha_patch(6, None, None)) == (6, (0, 0), None)
+    with pytest.raises(ValueError):
+        decode_alpha_patch(b"APCH")
+
+
+def test_live_erase_streams_patches_and_commits(monkeypatch) -> None:
+    """ストロークごとにパッチが返り、保存は操作の区切りでまとめて行われることをテスト"""
+    from transpalentor.application.stroke_payload import encode_stroke_payload
+    from transpalentor.infrastructure.alpha_mask import decode_alpha_patch
+    from transpalentor.infrastructure.file_storage import get_session_directory
+    from transpalentor.infrastructure.working_images import working_images
+    from transpalentor.presentation import app as app_module
+
+    monkeypatch.setattr(app_module, "LIVE_ERASE_IDLE_SECONDS", 60)
+    client = TestClient(app_module.app)
+    upload = client.post(
+        "/api/upload", files={"file": ("test.png", create_test_image(), "image/png")}
+    ).json()
+    session_id = upload["session_id"]
+    file_path = get_session_directory(session_id) / upload["filename"]
+    original = file_path.read_bytes()
+    flushes = working_images.stats()["flushes"]
+
+    with client.websocket_connect(f"/api/erase/live/{session_id}/{upload['filename']}") as ws:
+        ws.send_bytes(encode_stroke_payload([(4, [(10, 10), (12, 10)])]))
+        sequence, origin, alpha = decode_alpha_patch(ws.receive_bytes())
+        assert (sequence, origin, alpha.size) == (1, (8, 8), (7, 5))
+        assert alpha.getpixel((2, 2)) == 0
+
+        ws.send_bytes(encode_stroke_payload([(10, [(50, 40)])]))
+        sequence, origin, alpha = decode_alpha_patch(ws.receive_bytes())
+        assert (sequence, origin) == (2, (45, 35))
+
+        # ストロークごとには保存しない
+        assert working_images.has_pending_changes(file_path)
+        assert file_path.read_bytes() == original
+
+        ws.send_bytes(b"bad")
+        assert ws.receive_json()["error_code"] == "INVALID_PAYLOAD"
+
+        ws.send_json({"action": "flush"})
+        flushed = ws.receive_json()
+        assert flushed["type"] == "flushed"
+        assert flushed["sequence"] == 2
+        assert "v=" in flushed["processed_url"]
+
+    assert working_images.stats()["flushes"] == flushes + 1
+    with Image.open(file_path) as saved:
+        assert saved.getpixel((10, 10))[3] == 0
+        assert saved.getpixel((50, 40))[3] == 0
+        assert saved.getpixel((90, 10))[3] == 255
+
+    client.delete(f"/api/cleanup/{session_id}")
+
+
+def test_live_erase_commits_when_idle_or_disconnected(monkeypatch) -> None:
+    """操作がない時間が続くと保存され、切断時にも保存されることをテスト"""
+    from transpalentor.application.stroke_payload import encode_stroke_payload
+    from transpalentor.infrastructure.file_storage import get_session_directory
+    from transpalentor.infrastructure.working_images import working_images
+    from transpalentor.presentation import app as app_module
+
+    monkeypatch.setattr(app_module, "LIVE_ERASE_IDLE_SECONDS", 0.05)
+    client = TestClient(app_module.app)
+    upload = client.post(
+        "/api/upload", files={"file": ("test.png", create_test_image(), "image/png")}
+    ).json()
+    session_id = upload["session_id"]
+    file_path = get_session_directory(session_id) / upload["filename"]
+
+    with client.websocket_connect(f"/api/erase/live/{session_id}/{upload['filename']}") as ws:
+        ws.send_bytes(encode_stroke_payload([(4, [(10, 10)])]))
+        ws.receive_bytes()
+
+        deadline = time.time() + 5
+        while working_images.has_pending_changes(file_path) and time.time() < deadline:
+            time.sleep(0.01)
+        assert not working_images.has_pending_changes(file_path)
+
+        monkeypatch.setattr(app_module, "LIVE_ERASE_IDLE_SECONDS", 60)
+        ws.send_bytes(encode_stroke_payload([(4, [(30, 30)])]))
+        ws.receive_bytes()
+
+    deadline = time.time() + 5
+    while working_images.has_pending_changes(file_path) and time.time() < deadline:
+        time.sleep(0.01)
+    with Image.open(file_path) as saved:
+        assert saved.getpixel((30, 30))[3] == 0
+
+    with pytest.raises(WebSocketDisconnect):
+        with client.websocket_connect(f"/api/erase/live/{session_id}/missing.png") as ws:
+            ws.receive_bytes()
+
+    client.delete(f"/api/cleanup/{session_id}")
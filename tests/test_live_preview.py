@@ -0,0 +1,161 @@
+"""
+透過処理のライブプレビューのテスト
+"""
+
+import io
+import random
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+from starlette.websockets import WebSocketDisconnect
+
+
+def create_test_image() -> io.BytesIO:
+    """テスト用の画像を作成 (左半分が緑、右半分が白)"""
+    image = Image.new("RGB", (400, 200), color=(10, 200, 30))
+    image.paste((255, 255, 255), (200, 0, 400, 200))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    buffer.seek(0)
+    return buffer
+
+
+def test_compute_transparent_alpha_matches_make_transparent() -> None:
+    """チャンネル単位の計算が make_transparent と同じアルファになることをテスト"""
+    from transpalentor.domain.transparency import compute_transparent_alpha, make_transparent
+
+    random.seed(0)
+    image = Image.new("RGBA", (30, 20))
+    image.putdata([tuple(random.randrange(256) for _ in range(4)) for _ in range(600)])
+
+    for mode in ("RGBA", "RGB", "P"):
+        source = image.convert(mode)
+        for rgb, threshold in [
+            ((10, 200, 30), 0),
+            ([(100, 100, 100), (0, 0, 0)], 120),
+            ([(255, 255, 255), (1, 2, 3), (90, 9, 200)], 255),
+        ]:
+            expected = make_transparent(source, rgb, threshold).getchannel("A")
+            assert compute_transparent_alpha(source, rgb, threshold).tobytes() == (
+                expected.tobytes()
+            )
+
+
+def test_compute_transparent_alpha_without_lambda_eval(monkeypatch) -> None:
+    """lambda_eval のない Pillow でも文字列の式で同じアルファになることをテスト"""
+    from PIL import ImageMath
+
+    from transpalentor.domain.transparency import compute_transparent_alpha, make_transparent
+
+    # Pillow 10 相当: lambda_eval がなく、文字列の式を eval で評価する
+    monkeypatch.delattr(ImageMath, "lambda_eval")
+    monkeypatch.setattr(
+        ImageMath,
+        "eval",
+        getattr(ImageMath, "unsafe_eval", None) or getattr(ImageMath, "eval"),
+        raising=False,
+    )
+
+    random.seed(1)
+    image = Image.new("RGBA", (30, 20))
+    image.putdata([tuple(random.randrange(256) for _ in range(4)) for _ in range(600)])
+
+    for rgb, threshold in [
+        ((10, 200, 30), 0),
+        ([(255, 255, 255), (1, 2, 3), (90, 9, 200)], 255),
+    ]:
+        expected = make_transparent(image, rgb, threshold).getchannel("A")
+        assert compute_transparent_alpha(image, rgb, threshold).tobytes() == expected.tobytes()
+
+
+def test_load_preview_raster_reduces_to_max_size(tmp_path) -> None:
+    """長辺が上限以下になるよう縮小されることをテスト"""
+    from transpalentor.infrastructure.file_storage import load_preview_raster
+
+    path = tmp_path / "image.jpg"
+    Image.new("RGB", (1000, 400), (10, 20, 30)).save(path, format="JPEG")
+
+    raster = load_preview_raster(path, 256)
+    assert raster.mode == "RGBA"
+    assert max(raster.size) <= 256
+    assert raster.width / raster.height == pytest.approx(2.5, rel=0.05)
+
+    assert load_preview_raster(path, 2048).size == (1000, 400)
+
+
+def test_live_preview_streams_alpha_previews() -> None:
+    """パラメータごとに縮小画像のアルファが返ることをテスト"""
+    from transpalentor.infrastructure.alpha_mask import decode_alpha_patch
+    from transpalentor.presentation.app import app
+
+    client = TestClient(app)
+    upload = client.post(
+        "/api/upload", files={"file": ("test.png", create_test_image(), "image/png")}
+    ).json()
+    session_id = upload["session_id"]
+    url = f"/api/process/live/{session_id}/{upload['filename']}?size=100"
+
+    with client.websocket_connect(url) as ws:
+        ready = ws.receive_json()
+        assert ready == {
+            "type": "ready",
+            "width": 400,
+            "height": 200,
+            "preview_width": 100,
+            "preview_height": 50,
+        }
+
+        ws.send_json({"rgb": [10, 200, 30], "threshold": 10})
+        sequence, origin, alpha = decode_alpha_patch(ws.receive_bytes())
+        assert (sequence, origin, alpha.size) == (1, (0, 0), (100, 50))
+        assert alpha.getpixel((10, 10)) == 0
+        assert alpha.getpixel((90, 10)) == 255
+
+        ws.send_json({"rgb": [[255, 255, 255]], "threshold": 0, "sequence": 42})
+        sequence, _, alpha = decode_alpha_patch(ws.receive_bytes())
+        assert sequence == 42
+        assert alpha.getpixel((10, 10)) == 255
+        assert alpha.getpixel((90, 10)) == 0
+
+        ws.send_json({"rgb": [300, 0, 0]})
+        assert ws.receive_json()["error_code"] == "INVALID_PAYLOAD"
+
+    with pytest.raises(WebSocketDisconnect):
+        with client.websocket_connect(f"/api/process/live/{session_id}/missing.png") as ws:
+            ws.receive_json()
+
+    client.delete(f"/api/cleanup/{session_id}")
+
+
+def test_live_preview_skips_stale_parameters(monkeypatch) -> None:
+    """計算中に届いたパラメータは最新のものだけが計算されることをテスト"""
+    from transpalentor.domain import transparency
+    from transpalentor.infrastructure.alpha_mask import decode_alpha_patch
+    from transpalentor.presentation.app import app
+
+    compute = transparency.compute_transparent_alpha
+
+    def slow_compute(*args, **kwargs):
+        time.sleep(0.2)
+        return compute(*args, **kwargs)
+
+    monkeypatch.setattr(transparency, "compute_transparent_alpha", slow_compute)
+    client = TestClient(app)
+    upload = client.post(
+        "/api/upload", files={"file": ("test.png", create_test_image(), "image/png")}
+    ).json()
+    session_id = upload["session_id"]
+
+    with client.websocket_connect(f"/api/process/live/{session_id}/{upload['filename']}") as ws:
+        ws.receive_json()
+        for threshold in (10, 20, 30):
+            ws.send_json({"rgb": [10, 200, 30], "threshold": threshold})
+
+        sequences = []
+        while not sequences or sequences[-1] != 3:
+            sequences.append(decode_alpha_patch(ws.receive_bytes())[0])
+        assert len(sequences) < 3
+
+    client.delete(f"/api/cleanup/{session_id}")
@@ -0,0 +1,136 @@
+"""
+透過処理結果キャッシュのテスト
+"""
+
+import io
+import shutil
+
+from fastapi.testclient import TestClient
+from PIL import Image
+
+
+def create_test_image(color: tuple = (255, 0, 0)) -> io.BytesIO:
+    """テスト用の画像を作成"""
+    image = Image.new("RGB", (40, 40), color=color)
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    buffer.seek(0)
+    return buffer
+
+
+def test_make_cache_key_normalizes_colors() -> None:
+    """色の順序や重複がキャッシュキーに影響しないことをテスト"""
+    from transpalentor.infrastructure.result_cache import make_cache_key
+
+    key1 = make_cache_key("abc", [(255, 0, 0), (0, 0, 255)], 30)
+    key2 = make_cache_key("abc", [[0, 0, 255], [255, 0, 0], [255, 0, 0]], 30)
+
+    assert key1 == key2
+    assert key1 != make_cache_key("abc", [(255, 0, 0)], 30)
+    assert key1 != make_cache_key("abc", [(255, 0, 0), (0, 0, 255)], 31)
+    assert key1 != make_cache_key("def", [(255, 0, 0), (0, 0, 255)], 30)
+
+
+def test_result_cache_memory_and_disk_tiers(tmp_path) -> None:
+    """メモリ層から外れたエントリがディスク層から取得できることをテスト"""
+    from transpalentor.infrastructure.result_cache import ResultCache
+
+    cache = ResultCache(tmp_path, memory_limit=10, disk_limit=1024)
+
+    assert cache.get("aa01") is None
+
+    cache.put("aa01", b"12345678")
+    assert cache.get("aa01") == b"12345678"
+
+    # メモリ上限を超えると古いエントリはメモリ層から追い出される
+    cache.put("bb02", b"abcdefgh")
+    assert "aa01" not in cache._memory
+
+    assert cache.get("aa01") == b"12345678"
+
+    stats = cache.stats()
+    assert stats["memory_hits"] == 1
+    assert stats["disk_hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["hit_ratio"] == 2 / 3
+
+
+def test_result_cache_disk_lru_eviction(tmp_path) -> None:
+    """ディスク層が上限を超えると最終アクセスが古いエントリから削除されることをテスト"""
+    import os
+
+    from transpalentor.infrastructure.result_cache import ResultCache
+
+    cache = ResultCache(tmp_path, memory_limit=0, disk_limit=20)
+
+    cache.put("aa01", b"x" * 8)
+    cache.put("bb02", b"y" * 8)
+    os.utime(cache._entry_path("aa01"), (1, 1))
+    os.utime(cache._entry_path("bb02"), (2, 2))
+
+    cache.put("cc03", b"z" * 8)
+
+    assert cache.get("aa01") is None
+    assert cache.get("bb02") == b"y" * 8
+    assert cache.get("cc03") == b"z" * 8
+    assert cache.disk_usage() <= 20
+
+
+def test_result_cache_concurrent_puts_and_stats(tmp_path, monkeypatch) -> None:
+    """同じキーを同時に書き込んでも一時ファイルが衝突せず、statsがディスクを走査しないことをテスト"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    from transpalentor.infrastructure.result_cache import ResultCache
+
+    cache = ResultCache(tmp_path, memory_limit=0, disk_limit=1024)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda _: cache.put("aa01", b"x" * 8), range(32)))
+
+    assert [path.name for path in tmp_path.glob("*/*")] == ["aa01.png"]
+    assert cache.get("aa01") == b"x" * 8
+
+    def fail_scan():
+        raise AssertionError("stats must not scan the disk tier")
+
+    monkeypatch.setattr(cache, "_scan_disk", fail_scan)
+    assert cache.stats()["disk_bytes"] == 8
+
+
+def test_process_uses_result_cache() -> None:
+    """同じ画像・パラメータの再処理がキャッシュから返されることをテスト"""
+    from transpalentor.infrastructure.file_storage import get_session_directory
+    from transpalentor.infrastructure.result_cache import result_cache
+    from transpalentor.presentation.app import app
+
+    client = TestClient(app)
+    session_ids = []
+
+    try:
+        for _ in range(2):
+            upload_response = client.post(
+                "/api/upload",
+                files={"file": ("cache.png", create_test_image((1, 2, 3)), "image/png")},
+            )
+            session_ids.append(upload_response.json()["session_id"])
+
+        before = result_cache.stats()
+        responses = []
+        for session_id, rgb in zip(session_ids, ([1, 2, 3], [[1, 2, 3], [1, 2, 3]])):
+            response = client.post(
+                "/api/process",
+                json={"session_id": session_id, "filename": "cache.png", "rgb": rgb},
+            )
+            assert response.status_code == 200
+            responses.append(client.get(response.json()["processed_url"]).content)
+        after = result_cache.stats()
+
+        # 2回目は別セッションでもキャッシュにヒットし、同じPNGが返る
+        hits_before = before["memory_hits"] + before["disk_hits"]
+        assert after["memory_hits"] + after["disk_hits"] >= hits_before + 1
+        assert responses[0] == responses[1]
+
+        metrics = client.get("/api/metrics").json()
+        assert "hit_ratio" in metrics["result_cache"]
+    finally:
+        for session_id in session_ids:
+            shutil.rmtree(get_session_directory(session_id), ignore_errors=True)
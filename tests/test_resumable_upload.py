@@ -0,0 +1,169 @@
+"""
+再開可能な分割アップロードのテスト
+"""
+
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+
+def create_test_image_bytes(size: tuple = (64, 48)) -> bytes:
+    """テスト用の画像を作成 (他のテストと内容が重ならないようランダムな色を使う)"""
+    image = Image.new("RGB", size, color=tuple(os.urandom(3)))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """テストクライアントのフィクスチャ (未完了のアップロードはテストごとの保存先に作る)"""
+    from transpalentor.infrastructure import resumable_upload
+    from transpalentor.presentation.app import app
+
+    monkeypatch.setattr(resumable_upload, "UPLOADS_DIR", tmp_path / "_uploads")
+    return TestClient(app)
+
+
+def test_merge_range() -> None:
+    """受信済み範囲が結合されることをテスト"""
+    from transpalentor.infrastructure.resumable_upload import _merge_range
+
+    ranges = _merge_range([], 10, 20)
+    ranges = _merge_range(ranges, 0, 5)
+    assert ranges == [[0, 5], [10, 20]]
+
+    ranges = _merge_range(ranges, 5, 10)
+    assert ranges == [[0, 20]]
+
+
+def test_resumable_upload_parallel_chunks(client) -> None:
+    """順不同・並列に送ったチャンクから画像が復元されることをテスト"""
+    from transpalentor.infrastructure.file_storage import delete_session_files
+
+    content = create_test_image_bytes()
+    chunk_size = max(1, len(content) // 4)
+
+    response = client.post("/api/uploads", json={"filename": "big.png", "size": len(content)})
+    assert response.status_code == 201
+    status = response.json()
+    upload_url = status["upload_url"]
+    assert status["offset"] == 0
+    assert status["complete"] is False
+
+    offsets = list(range(0, len(content), chunk_size))
+
+    def send_chunk(offset: int) -> int:
+        chunk = content[offset : offset + chunk_size]
+        chunk_response = client.patch(
+            upload_url, content=chunk, headers={"Upload-Offset": str(offset)}
+        )
+        return chunk_response.status_code
+
+    # 先頭チャンクを最後に送り、残りは並列に送る
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        assert all(code == 200 for code in executor.map(send_chunk, offsets[1:]))
+
+    # 先頭が欠けている間は連続オフセットが進まない
+    status = client.get(upload_url).json()
+    assert status["offset"] == 0
+    assert status["received"] == len(content) - chunk_size
+
+    # 未完了の状態では完了できない
+    assert client.post(f"{upload_url}/finalize").status_code == 409
+
+    assert send_chunk(0) == 200
+    head_response = client.head(upload_url)
+    assert head_response.status_code == 200
+    assert head_response.headers["Upload-Offset"] == str(len(content))
+
+    response = client.post(f"{upload_url}/finalize")
+    assert response.status_code == 200
+    data = response.json()
+
+    try:
+        assert data["filename"] == "big.png"
+        assert data["size"] == len(content)
+        assert client.get(data["image_url"]).content == content
+
+        # 完了後のアップロードは残らない
+        assert client.get(upload_url).status_code == 404
+    finally:
+        delete_session_files(data["session_id"])
+
+
+def test_resumable_upload_rejects_out_of_range_chunk(client) -> None:
+    """宣言したサイズを超えるチャンクが拒否されることをテスト"""
+    response = client.post("/api/uploads", json={"filename": "a.png", "size": 10})
+    upload_url = response.json()["upload_url"]
+
+    response = client.patch(upload_url, content=b"x" * 8, headers={"Upload-Offset": "5"})
+    assert response.status_code == 409
+    assert response.json()["error_code"] == "UPLOAD_CONFLICT"
+
+    response = client.patch(upload_url, content=b"x", headers={"Upload-Offset": "-1"})
+    assert response.status_code == 409
+
+
+def test_resumable_upload_validates_on_finalize(client) -> None:
+    """完了時に画像形式がバリデーションされることをテスト"""
+    content = b"This is not a valid image file"
+
+    upload_url = client.post(
+        "/api/uploads", json={"filename": "bad.png", "size": len(content)}
+    ).json()["upload_url"]
+    client.patch(upload_url, content=content, headers={"Upload-Offset": "0"})
+
+    response = client.post(f"{upload_url}/finalize")
+    assert response.status_code == 422
+    assert "UNSUPPORTED_FORMAT" in str(response.json())
+
+
+def test_resumable_upload_rejects_large_size(client) -> None:
+    """作成時にサイズ上限が検証されることをテスト"""
+    from transpalentor.application.validation import MAX_FILE_SIZE
+
+    response = client.post("/api/uploads", json={"filename": "a.png", "size": MAX_FILE_SIZE + 1})
+    assert response.status_code == 413
+
+
+def test_resumable_upload_not_found(client) -> None:
+    """存在しないアップロードIDが404になることをテスト"""
+    response = client.patch(
+        "/api/uploads/12345678-1234-4234-8234-123456789abc",
+        content=b"x",
+        headers={"Upload-Offset": "0"},
+    )
+    assert response.status_code == 404
+    assert response.json()["error_code"] == "UPLOAD_NOT_FOUND"
+
+    assert client.get("/api/uploads/not-a-uuid").status_code == 404
+
+
+def test_resumable_upload_limits_pending_uploads(client, monkeypatch) -> None:
+    """未完了のアップロードの件数が制限され、確保したサイズが使用量に含まれることをテスト"""
+    from transpalentor.infrastructure import resumable_upload
+    from transpalentor.infrastructure.storage_budget import storage_budget
+
+    monkeypatch.setattr(resumable_upload, "MAX_PENDING_UPLOADS", 2)
+    usage = storage_budget.usage()
+
+    first = client.post("/api/uploads", json={"filename": "a.png", "size": 1000})
+    assert first.status_code == 201
+    assert client.post("/api/uploads", json={"filename": "b.png", "size": 500}).status_code == 201
+
+    response = client.post("/api/uploads", json={"filename": "c.png", "size": 10})
+    assert response.status_code == 429
+    assert response.json()["error_code"] == "TOO_MANY_UPLOADS"
+
+    assert resumable_upload.pending_upload_bytes() == 1500
+    assert storage_budget.usage() == usage + 1500
+    assert storage_budget.stats()["uploads_bytes"] == 1500
+
+    # 破棄すると再び作成できる
+    resumable_upload.delete_upload(first.json()["upload_id"])
+    assert client.post("/api/uploads", json={"filename": "c.png", "size": 10}).status_code == 201
@@ -0,0 +1,124 @@
+"""
+セッションのクリーンアップのテスト
+"""
+
+import io
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+
+def create_test_image() -> io.BytesIO:
+    """テスト用の画像を作成"""
+    image = Image.new("RGB", (20, 20), color=tuple(os.urandom(3)))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    buffer.seek(0)
+    return buffer
+
+
+def test_session_index_orders_by_last_access(tmp_path) -> None:
+    """期限切れセッションが最終アクセスの古い順に取り出されることをテスト"""
+    from transpalentor.infrastructure.session_index import SessionIndex
+
+    index = SessionIndex(tmp_path / "sessions.db")
+    index.touch("session-a", now=100)
+    index.touch("session-b", now=50)
+    index.touch("session-c", now=300)
+
+    assert index.expired_sessions(cutoff=200, limit=10) == ["session-b", "session-a"]
+    assert index.expired_sessions(cutoff=200, limit=1) == ["session-b"]
+
+    # 再アクセスで期限が延びる
+    index.touch("session-b", now=250, force=True)
+    assert index.expired_sessions(cutoff=200, limit=10) == ["session-a"]
+
+    index.remove("session-a")
+    assert index.count() == 2
+
+
+def test_session_index_throttles_touch(tmp_path) -> None:
+    """TOUCH_INTERVAL内の再アクセスは記録されないことをテスト"""
+    from transpalentor.infrastructure.session_index import SessionIndex
+
+    index = SessionIndex(tmp_path / "sessions.db", touch_interval=60)
+    index.touch("session-a", now=100)
+    index.touch("session-a", now=130)
+    assert index.get_last_access("session-a") == 100
+
+    index.touch("session-a", now=170)
+    assert index.get_last_access("session-a") == 170
+
+
+@pytest.mark.asyncio
+async def test_sweep_expired_sessions(tmp_path) -> None:
+    """期限切れのセッションだけが削除されることをテスト"""
+    import time
+
+    from transpalentor.infrastructure.file_storage import (
+        generate_session_id,
+        get_session_directory,
+        save_uploaded_file,
+    )
+    from transpalentor.infrastructure.session_cleanup import (
+        delete_session,
+        sweep_expired_sessions,
+    )
+    from transpalentor.infrastructure.session_index import SessionIndex
+
+    index = SessionIndex(tmp_path / "sessions.db")
+    now = time.time()
+    old_session, new_session = generate_session_id(), generate_session_id()
+
+    try:
+        for session_id, last_access in ((old_session, now - 25 * 3600), (new_session, now)):
+            await save_uploaded_file(session_id, "image.png", create_test_image().getvalue())
+            index.touch(session_id, now=last_access)
+
+        assert sweep_expired_sessions(now=now, ttl_hours=24, index=index) == 1
+
+        assert not get_session_directory(old_session).exists()
+        assert get_session_directory(new_session).exists()
+        assert index.get_last_access(old_session) is None
+    finally:
+        delete_session(old_session, index)
+        delete_session(new_session, index)
+
+
+def test_cleanup_endpoint() -> None:
+    """DELETE /api/cleanup/{session_id} でセッションが削除されることをテスト"""
+    from transpalentor.infrastructure.file_storage import get_session_directory
+    from transpalentor.presentation.app import app
+
+    client = TestClient(app)
+
+    upload_response = client.post(
+        "/api/upload", files={"file": ("test.png", create_test_image(), "image/png")}
+    )
+    session_id = upload_response.json()["session_id"]
+
+    response = client.delete(f"/api/cleanup/{session_id}")
+    assert response.status_code == 200
+    assert response.json() == {"session_id": session_id, "status": "deleted"}
+    assert not get_session_directory(session_id).exists()
+
+    # 削除済み・無効なセッションは404
+    assert client.delete(f"/api/cleanup/{session_id}").status_code == 404
+    assert client.delete("/api/cleanup/invalid-session-id").status_code == 404
+
+
+def test_cleanup_scheduler_start_and_shutdown() -> None:
+    """スケジューラーが起動・停止できることをテスト"""
+    from transpalentor.infrastructure.session_cleanup import CleanupScheduler
+
+    scheduler = CleanupScheduler(interval_minutes=60)
+    scheduler.start()
+    try:
+        assert scheduler._scheduler is not None
+        assert scheduler._scheduler.get_job("sweep_expired_sessions") is not None
+        assert scheduler._scheduler.get_job("sweep_orphan_blobs") is not None
+    finally:
+        scheduler.shutdown()
+    assert scheduler._scheduler is None
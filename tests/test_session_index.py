@@ -0,0 +1,132 @@
+"""
+セッションインデックスのメタデータのテスト
+"""
+
+import io
+import os
+import sqlite3
+
+from fastapi.testclient import TestClient
+from PIL import Image
+
+
+def create_test_image(size: tuple = (20, 10)) -> io.BytesIO:
+    """テスト用の画像を作成"""
+    image = Image.new("RGB", size, color=tuple(os.urandom(3)))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    buffer.seek(0)
+    return buffer
+
+
+def test_record_artifact_metadata(tmp_path) -> None:
+    """成果物のハッシュ・形式・寸法が記録・更新されることをテスト"""
+    from transpalentor.infrastructure.session_index import SessionIndex
+
+    index = SessionIndex(tmp_path / "sessions.db")
+    index.record_artifact(
+        "session-a",
+        "image.png",
+        "original",
+        100,
+        now=10,
+        content_hash="a" * 64,
+        image_format="PNG",
+        width=20,
+        height=10,
+    )
+
+    artifact = index.get_artifact("session-a", "image.png")
+    assert artifact == {
+        "name": "image.png",
+        "kind": "original",
+        "size": 100,
+        "updated_at": 10,
+        "content_hash": "a" * 64,
+        "format": "PNG",
+        "width": 20,
+        "height": 10,
+    }
+    assert index.get_artifact("session-a", "missing.png") is None
+    assert [a["name"] for a in index.list_artifacts("session-a")] == ["image.png"]
+
+
+def test_existing_index_is_migrated(tmp_path) -> None:
+    """メタデータ列のない既存のインデックスに列が追加されることをテスト"""
+    from transpalentor.infrastructure.session_index import SessionIndex
+
+    db_path = tmp_path / "sessions.db"
+    connection = sqlite3.connect(str(db_path))
+    connection.execute(
+        "CREATE TABLE artifacts (session_id TEXT NOT NULL, name TEXT NOT NULL, "
+        "kind TEXT NOT NULL, size INTEGER NOT NULL, updated_at REAL NOT NULL, "
+        "PRIMARY KEY (session_id, name))"
+    )
+    connection.execute("INSERT INTO artifacts VALUES ('session-a', 'image.png', 'original', 5, 1)")
+    connection.commit()
+    connection.close()
+
+    index = SessionIndex(db_path)
+    artifact = index.get_artifact("session-a", "image.png")
+    assert artifact["size"] == 5
+    assert artifact["content_hash"] is None
+
+
+def test_session_info_reports_uploaded_and_processed_files() -> None:
+    """アップロード・透過処理したファイルのメタデータが取得できることをテスト"""
+    from transpalentor.presentation.app import app
+
+    client = TestClient(app)
+    upload = client.post(
+        "/api/upload", files={"file": ("test.png", create_test_image(), "image/png")}
+    )
+    upload_data = upload.json()
+    session_id = upload_data["session_id"]
+
+    client.post(
+        "/api/process",
+        json={"session_id": session_id, "filename": upload_data["filename"], "rgb": [0, 0, 0]},
+    )
+
+    response = client.get(f"/api/sessions/{session_id}")
+    assert response.status_code == 200
+    files = {f["filename"]: f for f in response.json()["files"]}
+
+    original = files[upload_data["filename"]]
+    assert original["kind"] == "original"
+    assert original["size"] == upload_data["size"]
+    assert (original["format"], original["width"], original["height"]) == ("PNG", 20, 10)
+    assert len(original["content_hash"]) == 64
+
+    processed = files["test_processed.png"]
+    assert processed["kind"] == "processed"
+    assert (processed["width"], processed["height"]) == (20, 10)
+
+    client.delete(f"/api/cleanup/{session_id}")
+    assert client.get(f"/api/sessions/{session_id}").status_code == 404
+
+
+def test_indexed_image_is_served_without_probing(monkeypatch) -> None:
+    """インデックスに記録されたファイルはディレクトリを確認せずに返されることをテスト"""
+    from transpalentor.presentation import app as app_module
+
+    client = TestClient(app_module.app)
+    upload_data = client.post(
+        "/api/upload", files={"file": ("test.png", create_test_image(), "image/png")}
+    ).json()
+
+    calls = []
+    original_get_session_directory = app_module.get_session_directory
+
+    def spy(session_id: str, migrate: bool = True):
+        calls.append(migrate)
+        return original_get_session_directory(session_id, migrate=migrate)
+
+    monkeypatch.setattr(app_module, "get_session_directory", spy)
+    try:
+        response = client.get(upload_data["image_url"])
+        assert response.status_code == 200
+        assert calls == [False]
+    finally:
+        monkeypatch.undo()
+        client.delete(f"/api/cleanup/{upload_data['session_id']}")
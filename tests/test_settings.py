@@ -0,0 +1,32 @@
+"""
+環境変数による設定のテスト
+"""
+
+import pytest
+
+
+def test_get_setting() -> None:
+    """接頭辞付きの環境変数から設定値が読み込まれることをテスト"""
+    from transpalentor.infrastructure.settings import get_setting
+
+    environ = {"TRANSPALENTOR_NAME": " value ", "TRANSPALENTOR_EMPTY": "", "NAME": "other"}
+    assert get_setting("NAME", environ=environ) == "value"
+    assert get_setting("EMPTY", "default", environ=environ) == "default"
+    assert get_setting("MISSING", environ=environ) is None
+
+
+def test_get_bool_and_int_setting() -> None:
+    """真偽値・整数の設定値の解釈をテスト"""
+    from transpalentor.infrastructure.settings import get_bool_setting, get_int_setting
+
+    environ = {"TRANSPALENTOR_ON": "Yes", "TRANSPALENTOR_OFF": "0", "TRANSPALENTOR_TTL": "60"}
+    assert get_bool_setting("ON", False, environ=environ) is True
+    assert get_bool_setting("OFF", True, environ=environ) is False
+    assert get_bool_setting("MISSING", True, environ=environ) is True
+    assert get_int_setting("TTL", 10, environ=environ) == 60
+    assert get_int_setting("MISSING", 10, environ=environ) == 10
+
+    with pytest.raises(ValueError):
+        get_bool_setting("TTL", False, environ=environ)
+    with pytest.raises(ValueError):
+        get_int_setting("ON", 0, environ=environ)
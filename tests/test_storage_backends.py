@@ -0,0 +1,428 @@
+"""
+ストレージバックエンドとセッションの退避のテスト
+"""
+
+import io
+import os
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+
+def create_test_image() -> io.BytesIO:
+    """テスト用の画像を作成"""
+    image = Image.new("RGB", (20, 20), color=tuple(os.urandom(3)))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    buffer.seek(0)
+    return buffer
+
+
+class FakeS3Error(Exception):
+    """botocoreのClientErrorと同じ形のエラー"""
+
+    def __init__(self, code: str) -> None:
+        super().__init__(code)
+        self.response = {"Error": {"Code": code}}
+
+
+class FakeS3Client:
+    """S3クライアントのローカルの代替 (テスト用)"""
+
+    def __init__(self, page_size: int = 1000) -> None:
+        self.objects = {}
+        self.page_size = page_size
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes) -> dict:
+        self.objects[(Bucket, Key)] = bytes(Body)
+        return {}
+
+    def get_object(self, Bucket: str, Key: str) -> dict:
+        if (Bucket, Key) not in self.objects:
+            raise FakeS3Error("NoSuchKey")
+        return {"Body": io.BytesIO(self.objects[(Bucket, Key)])}
+
+    def head_object(self, Bucket: str, Key: str) -> dict:
+        if (Bucket, Key) not in self.objects:
+            raise FakeS3Error("404")
+        return {"ContentLength": len(self.objects[(Bucket, Key)])}
+
+    def delete_object(self, Bucket: str, Key: str) -> dict:
+        self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def list_objects_v2(self, Bucket: str, Prefix: str = "", ContinuationToken: str = "0") -> dict:
+        keys = sorted(k for b, k in self.objects if b == Bucket and k.startswith(Prefix))
+        start = int(ContinuationToken)
+        page = keys[start : start + self.page_size]
+        truncated = start + self.page_size < len(keys)
+        response = {"Contents": [{"Key": k} for k in page], "IsTruncated": truncated}
+        if truncated:
+            response["NextContinuationToken"] = str(start + self.page_size)
+        return response
+
+
+def test_local_disk_backend(tmp_path) -> None:
+    """ローカルディスクへの保存・取得・列挙・削除をテスト"""
+    from transpalentor.infrastructure.storage_backends import LocalDiskBackend
+
+    backend = LocalDiskBackend(tmp_path)
+    backend.put("session/a.png", b"a")
+    backend.put("session/b.png", b"b")
+    backend.put("other/c.png", b"c")
+
+    assert backend.get("session/a.png") == b"a"
+    assert backend.get("session/missing.png") is None
+    assert backend.list_keys("session/") == ["session/a.png", "session/b.png"]
+
+    backend.delete("session/a.png")
+    assert not backend.exists("session/a.png")
+
+    with pytest.raises(ValueError):
+        backend.put("../escape.png", b"x")
+
+
+def test_memory_backend_spills_least_recently_used(tmp_path) -> None:
+    """上限を超えたエントリが古い順に退避され、読み込み時にメモリへ戻ることをテスト"""
+    from transpalentor.infrastructure.storage_backends import LocalDiskBackend, MemoryBackend
+
+    spill = LocalDiskBackend(tmp_path)
+    backend = MemoryBackend(limit_bytes=10, spill=spill)
+
+    backend.put("a", b"aaaa")
+    backend.put("b", b"bbbb")
+    backend.get("a")
+    backend.put("c", b"cccc")
+
+    # 最も使われていない b だけが退避される
+    assert spill.list_keys() == ["b"]
+    assert backend.stats()["bytes"] == 8
+
+    assert backend.get("b") == b"bbbb"
+    assert backend.list_keys() == ["a", "b", "c"]
+
+    # 上限より大きい内容は直接退避する
+    backend.put("large", b"x" * 20)
+    assert spill.get("large") == b"x" * 20
+
+    backend.delete("b")
+    assert not backend.exists("b")
+
+
+def test_memory_backend_get_during_spill(tmp_path) -> None:
+    """退避の書き込み中に読み込んでも、退避中のエントリが見つかることをテスト"""
+    import threading
+
+    from transpalentor.infrastructure.storage_backends import LocalDiskBackend, MemoryBackend
+
+    putting = threading.Event()
+    release = threading.Event()
+
+    class SlowSpill(LocalDiskBackend):
+        def put(self, key: str, data: bytes) -> None:
+            putting.set()
+            release.wait(timeout=5)
+            super().put(key, data)
+
+    backend = MemoryBackend(limit_bytes=4, spill=SlowSpill(tmp_path))
+    backend.put("a", b"aaaa")
+
+    results = []
+    writer = threading.Thread(target=backend.put, args=("b", b"bbbb"))
+    reader = threading.Thread(target=lambda: results.append(backend.get("a")))
+    try:
+        writer.start()
+        assert putting.wait(timeout=5)
+        reader.start()
+        release.set()
+        writer.join(timeout=5)
+        reader.join(timeout=5)
+    finally:
+        release.set()
+
+    assert results == [b"aaaa"]
+
+
+def test_s3_backend_with_fake_client() -> None:
+    """S3互換バックエンドの保存・取得・ページングされた列挙をテスト"""
+    from transpalentor.infrastructure.storage_backends import S3Backend
+
+    client = FakeS3Client(page_size=2)
+    backend = S3Backend("bucket", prefix="sessions", client=client)
+
+    for name in ("a", "b", "c"):
+        backend.put(f"s1/{name}.png", name.encode())
+
+    assert ("bucket", "sessions/s1/a.png") in client.objects
+    assert backend.get("s1/b.png") == b"b"
+    assert backend.get("s1/missing.png") is None
+    assert backend.exists("s1/c.png")
+    assert not backend.exists("s1/missing.png")
+    assert backend.list_keys("s1/") == ["s1/a.png", "s1/b.png", "s1/c.png"]
+
+    backend.delete("s1/a.png")
+    assert backend.list_keys() == ["s1/b.png", "s1/c.png"]
+
+
+def test_s3_backend_requires_boto3(monkeypatch) -> None:
+    """boto3がない環境でクライアント未指定の場合はエラーになることをテスト"""
+    from transpalentor.infrastructure.storage_backends import S3Backend
+
+    monkeypatch.setitem(sys.modules, "boto3", None)
+    with pytest.raises(RuntimeError):
+        S3Backend("bucket")
+
+
+def test_idle_session_is_archived_and_restored_on_access() -> None:
+    """退避したセッションが次のアクセスで復元されることをテスト"""
+    from transpalentor.infrastructure.file_storage import get_session_directory
+    from transpalentor.infrastructure.session_archive import session_archive
+    from transpalentor.infrastructure.session_index import session_index
+    from transpalentor.infrastructure.storage_backends import S3Backend
+    from transpalentor.presentation.app import app
+
+    client = TestClient(app)
+    upload = client.post(
+        "/api/upload", files={"file": ("test.png", create_test_image(), "image/png")}
+    ).json()
+    session_id = upload["session_id"]
+    original = client.get(upload["image_url"]).content
+
+    cold = FakeS3Client()
+    session_archive.configure(S3Backend("bucket", client=cold))
+    try:
+        assert session_archive.archive_session(session_id)
+        assert not get_session_directory(session_id).exists()
+        assert session_index.is_archived(session_id)
+        assert session_index.session_bytes(session_id) == 0
+
+        # アクセス時に復元される
+        response = client.get(upload["image_url"])
+        assert response.status_code == 200
+        assert response.content == original
+        assert not session_index.is_archived(session_id)
+        assert session_index.get_artifact(session_id, upload["filename"])["size"] == upload["size"]
+        assert cold.objects == {}
+
+        # 退避中のセッションも削除できる
+        assert session_archive.archive_session(session_id)
+        assert client.delete(f"/api/cleanup/{session_id}").status_code == 200
+        assert cold.objects == {}
+    finally:
+        session_archive.configure(None)
+        client.delete(f"/api/cleanup/{session_id}")
+
+
+def test_processed_image_is_served_from_memory() -> None:
+    """透過処理の結果がメモリ層から返されることをテスト"""
+    from transpalentor.infrastructure.session_archive import hot_files
+    from transpalentor.presentation.app import app
+
+    client = TestClient(app)
+    upload = client.post(
+        "/api/upload", files={"file": ("test.png", create_test_image(), "image/png")}
+    ).json()
+    processed = client.post(
+        "/api/process",
+        json={"session_id": upload["session_id"], "filename": upload["filename"], "rgb": [0, 0, 0]},
+    ).json()
+
+    hits = hot_files.stats()["hits"]
+    response = client.get(processed["processed_url"])
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/png"
+    assert hot_files.stats()["hits"] == hits + 1
+
+    client.delete(f"/api/cleanup/{upload['session_id']}")
+
+
+def test_archive_idle_sessions(tmp_path) -> None:
+    """最終アクセスが古いセッションだけが退避されることをテスト"""
+    from transpalentor.infrastructure.file_storage import (
+        delete_session_files,
+        ensure_session_directory,
+        generate_session_id,
+    )
+    from transpalentor.infrastructure.session_archive import SessionArchive
+    from transpalentor.infrastructure.session_index import SessionIndex
+    from transpalentor.infrastructure.storage_backends import MemoryBackend
+
+    index = SessionIndex(tmp_path / "sessions.db")
+    archive = SessionArchive(index, MemoryBackend(1024 * 1024), archive_after_minutes=30)
+
+    idle_session = generate_session_id()
+    active_session = generate_session_id()
+    for session_id, last_access in ((idle_session, 1000), (active_session, 4000)):
+        (ensure_session_directory(session_id) / "image.png").write_bytes(b"image")
+        index.touch(session_id, now=last_access, force=True)
+        index.record_artifact(session_id, "image.png", "processed", 5, now=last_access)
+
+    try:
+        assert archive.archive_idle_sessions(now=4000) == 1
+        assert index.is_archived(idle_session)
+        assert not index.is_archived(active_session)
+        assert archive.backend.get(f"{idle_session}/image.png") == b"image"
+        assert index.total_bytes() == 5
+
+        # 退避済みのセッションは再び対象にならない
+        assert archive.archive_idle_sessions(now=4000) == 0
+    finally:
+        delete_session_files(idle_session)
+        delete_session_files(active_session)
+
+
+def test_archive_backend_from_settings(tmp_path) -> None:
+    """環境変数の設定から退避先のバックエンドが作成されることをテスト"""
+    from transpalentor.infrastructure.session_archive import backend_from_settings
+    from transpalentor.infrastructure.storage_backends import LocalDiskBackend, S3Backend
+
+    assert backend_from_settings({}) is None
+
+    backend = backend_from_settings(
+        {"TRANSPALENTOR_ARCHIVE_BACKEND": "local", "TRANSPALENTOR_ARCHIVE_DIR": str(tmp_path)}
+    )
+    assert isinstance(backend, LocalDiskBackend)
+    assert backend.root == tmp_path
+
+    with pytest.raises(ValueError):
+        backend_from_settings({"TRANSPALENTOR_ARCHIVE_BACKEND": "local"})
+    with pytest.raises(ValueError):
+        backend_from_settings({"TRANSPALENTOR_ARCHIVE_BACKEND": "s3"})
+    with pytest.raises(ValueError):
+        backend_from_settings({"TRANSPALENTOR_ARCHIVE_BACKEND": "ftp"})
+
+    if _has_boto3():
+        backend = backend_from_settings(
+            {
+                "TRANSPALENTOR_ARCHIVE_BACKEND": "s3",
+                "TRANSPALENTOR_ARCHIVE_S3_BUCKET": "bucket",
+                "TRANSPALENTOR_ARCHIVE_S3_PREFIX": "archive",
+            }
+        )
+        assert isinstance(backend, S3Backend)
+        assert backend.prefix == "archive/"
+
+
+def _has_boto3() -> bool:
+    """boto3がインストールされているか"""
+    import importlib.util
+
+    return importlib.util.find_spec("boto3") is not None
+
+
+def test_archive_holds_session_lock(tmp_path) -> None:
+    """退避中はセッションの変更が待たされ、退避後の変更が失われないことをテスト"""
+    import threading
+
+    from transpalentor.infrastructure.file_storage import (
+        delete_session_files,
+        ensure_session_directory,
+        generate_session_id,
+    )
+    from transpalentor.infrastructure.session_archive import SessionArchive
+    from transpalentor.infrastructure.session_index import SessionIndex
+    from transpalentor.infrastructure.storage_backends import MemoryBackend
+    from transpalentor.infrastructure.working_images import working_images
+
+    putting = threading.Event()
+    release = threading.Event()
+
+    class SlowBackend(MemoryBackend):
+        def put(self, key: str, data: bytes) -> None:
+            putting.set()
+            release.wait(timeout=5)
+            super().put(key, data)
+
+    index = SessionIndex(tmp_path / "sessions.db")
+    archive = SessionArchive(index, SlowBackend(1024 * 1024))
+
+    session_id = generate_session_id()
+    image_path = ensure_session_directory(session_id) / "image.png"
+    Image.new("RGBA", (10, 10), (255, 0, 0, 255)).save(image_path, format="PNG")
+    index.touch(session_id, now=1000, force=True)
+
+    # 未保存の変更は退避の前に書き込まれる
+    working_images.apply(image_path, lambda image: image.crop((0, 0, 5, 5)))
+
+    errors = []
+
+    def edit() -> None:
+        try:
+            working_images.apply(image_path, lambda image: image)
+        except FileNotFoundError as e:
+            errors.append(e)
+
+    archiver = threading.Thread(target=archive.archive_session, args=(session_id,))
+    try:
+        archiver.start()
+        assert putting.wait(timeout=5)
+        editor = threading.Thread(target=edit)
+        editor.start()
+        release.set()
+        archiver.join(timeout=5)
+        editor.join(timeout=5)
+
+        # 変更は退避の完了を待ってから行われ、削除済みのファイルには適用されない
+        assert len(errors) == 1
+        assert not working_images.has_pending_changes(image_path)
+        with Image.open(io.BytesIO(archive.backend.get(f"{session_id}/image.png"))) as saved:
+            assert saved.size == (5, 5)
+    finally:
+        release.set()
+        delete_session_files(session_id)
+
+
+def test_restore_waits_for_other_workers(tmp_path) -> None:
+    """他のワーカーが退避・削除中のセッションは、その完了を待ってから復元することをテスト"""
+    import fcntl
+    import threading
+    import zlib
+
+    from transpalentor.infrastructure.file_storage import (
+        delete_session_files,
+        ensure_session_directory,
+        generate_session_id,
+        get_session_directory,
+    )
+    from transpalentor.infrastructure.session_archive import (
+        ARCHIVE_LOCK_DIR,
+        ARCHIVE_LOCK_STRIPES,
+        SessionArchive,
+    )
+    from transpalentor.infrastructure.session_index import SessionIndex
+    from transpalentor.infrastructure.storage_backends import MemoryBackend
+
+    index = SessionIndex(tmp_path / "sessions.db")
+    archive = SessionArchive(index, MemoryBackend(1024 * 1024))
+
+    session_id = generate_session_id()
+    image_path = ensure_session_directory(session_id) / "image.png"
+    Image.new("RGBA", (10, 10), (255, 0, 0, 255)).save(image_path, format="PNG")
+    index.touch(session_id, now=1000, force=True)
+    assert archive.archive_session(session_id)
+
+    # 別のワーカーのロックを同じロックファイルの別のオープンで再現する
+    stripe = zlib.crc32(session_id.encode("utf-8")) % ARCHIVE_LOCK_STRIPES
+    restored = []
+    restorer = threading.Thread(target=lambda: restored.append(archive.restore_session(session_id)))
+    try:
+        with (ARCHIVE_LOCK_DIR / f"{stripe:02d}.lock").open("a") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            restorer.start()
+            restorer.join(timeout=0.2)
+            assert restorer.is_alive()
+            assert not get_session_directory(session_id).exists()
+
+            # ロックの間に他のワーカーが削除した
+            archive.discard(session_id)
+            index.remove(session_id)
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+        restorer.join(timeout=5)
+        assert restored == [False]
+        assert not get_session_directory(session_id).exists()
+    finally:
+        delete_session_files(session_id)
@@ -0,0 +1,207 @@
+"""
+一時ディレクトリの容量管理のテスト
+"""
+
+import io
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+
+def create_test_image() -> io.BytesIO:
+    """テスト用の画像を作成"""
+    image = Image.new("RGB", (20, 20), color=tuple(os.urandom(3)))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    buffer.seek(0)
+    return buffer
+
+
+@pytest.fixture(autouse=True)
+def isolated_uploads(tmp_path, monkeypatch):
+    """他のテストが残した未完了の分割アップロードと一時ファイルを使用量に含めない"""
+    from transpalentor.infrastructure import file_storage, resumable_upload
+
+    monkeypatch.setattr(resumable_upload, "UPLOADS_DIR", tmp_path / "_uploads")
+    monkeypatch.setattr(file_storage, "STAGING_DIR", tmp_path / "_staging")
+
+
+def _create_session_file(session_id: str, name: str, size: int):
+    """セッションディレクトリに指定サイズのファイルを作成"""
+    from transpalentor.infrastructure.file_storage import ensure_session_directory
+
+    path = ensure_session_directory(session_id) / name
+    path.write_bytes(b"\0" * size)
+    return path
+
+
+def test_session_index_tracks_artifact_totals(tmp_path) -> None:
+    """成果物のサイズが差分で合計に反映されることをテスト"""
+    from transpalentor.infrastructure.session_index import SessionIndex
+
+    index = SessionIndex(tmp_path / "sessions.db")
+    index.record_artifact("session-a", "image.png", "original", 100, now=10)
+    index.record_artifact("session-a", "processed_image.png", "processed", 50, now=10)
+    index.record_artifact("session-b", "image.png", "original", 30, now=10)
+    assert index.total_bytes() == 180
+
+    # 上書きは差分だけ加算され、種類は変わらない
+    index.record_artifact("session-a", "image.png", "processed", 120, now=20)
+    assert index.total_bytes() == 200
+    assert index.session_bytes("session-a") == 170
+    assert index.lru_derived_artifacts(30, 10) == [("session-a", "processed_image.png", 50)]
+    # 指定時刻以降にアクセスされたセッションの成果物は対象外
+    index.touch("session-a", now=40, force=True)
+    assert index.lru_derived_artifacts(30, 10) == []
+
+    index.remove_artifact("session-a", "processed_image.png")
+    assert index.total_bytes() == 150
+
+    index.remove("session-a")
+    assert index.total_bytes() == 30
+    assert index.count() == 1
+
+
+def test_enforce_evicts_derived_before_sessions(tmp_path) -> None:
+    """派生成果物がセッション全体より先に、古いセッションから削除されることをテスト"""
+    from transpalentor.infrastructure.file_storage import generate_session_id
+    from transpalentor.infrastructure.result_cache import ResultCache
+    from transpalentor.infrastructure.session_index import SessionIndex
+    from transpalentor.infrastructure.storage_budget import StorageBudget
+    from transpalentor.infrastructure.working_images import WorkingImageManager
+
+    index = SessionIndex(tmp_path / "sessions.db")
+    budget = StorageBudget(
+        index,
+        ResultCache(tmp_path / "cache"),
+        WorkingImageManager(),
+        budget_bytes=1000,
+        high_watermark=0.9,
+        low_watermark=0.3,
+        idle_seconds=60,
+    )
+
+    old_session = generate_session_id()
+    new_session = generate_session_id()
+    index.touch(old_session, now=100, force=True)
+    index.touch(new_session, now=900, force=True)
+
+    old_processed = _create_session_file(old_session, "processed_a.png", 300)
+    new_processed = _create_session_file(new_session, "processed_b.png", 300)
+    old_original = _create_session_file(old_session, "a.png", 200)
+    _create_session_file(new_session, "b.png", 200)
+    index.record_artifact(old_session, "processed_a.png", "processed", 300, now=100)
+    index.record_artifact(new_session, "processed_b.png", "processed", 300, now=900)
+    index.record_artifact(old_session, "a.png", "original", 200, now=100)
+    index.record_artifact(new_session, "b.png", "original", 200, now=900)
+
+    # 1000 bytes → 300 bytes 以下まで削除
+    freed = budget.enforce(now=1000)
+
+    assert freed == 800
+    assert not old_processed.exists()
+    assert not new_processed.exists()
+    # 派生成果物だけで足りない分は、アクセスのない古いセッションから削除
+    assert not old_original.exists()
+    assert index.get_last_access(old_session) is None
+    assert index.get_last_access(new_session) == 900
+    assert index.total_bytes() == 200
+    assert budget.stats()["evicted_sessions"] == 1
+
+
+def test_enforce_keeps_active_sessions_and_pending_edits(tmp_path) -> None:
+    """アクセス中のセッションの成果物と未保存の作業中画像を削除しないことをテスト"""
+    from transpalentor.infrastructure.file_storage import (
+        create_staging_path,
+        generate_session_id,
+    )
+    from transpalentor.infrastructure.result_cache import ResultCache
+    from transpalentor.infrastructure.session_index import SessionIndex
+    from transpalentor.infrastructure.storage_budget import StorageBudget
+    from transpalentor.infrastructure.working_images import WorkingImageManager
+
+    index = SessionIndex(tmp_path / "sessions.db")
+    images = WorkingImageManager(flush_delay=60)
+    budget = StorageBudget(
+        index,
+        ResultCache(tmp_path / "cache"),
+        images,
+        budget_bytes=1000,
+        high_watermark=0.5,
+        low_watermark=0.45,
+        idle_seconds=60,
+    )
+
+    idle_session = generate_session_id()
+    active_session = generate_session_id()
+    index.touch(idle_session, now=100, force=True)
+    index.touch(active_session, now=990, force=True)
+
+    active_processed = _create_session_file(active_session, "processed_a.png", 100)
+    edited = _create_session_file(idle_session, "processed_b.png", 0)
+    Image.new("RGBA", (4, 4), (255, 0, 0, 255)).save(edited, format="PNG")
+    idle_processed = _create_session_file(idle_session, "processed_c.png", 100)
+    index.record_artifact(active_session, "processed_a.png", "processed", 100, now=990)
+    index.record_artifact(idle_session, "processed_b.png", "processed", 100, now=100)
+    index.record_artifact(idle_session, "processed_c.png", "processed", 100, now=200)
+    images.apply(edited, lambda image: image)
+
+    # 取り込み前のアップロードの一時ファイルも使用量に含める
+    create_staging_path().write_bytes(b"\0" * 250)
+    assert budget.usage() == 550
+    assert budget.stats()["staging_bytes"] == 250
+
+    # 550 bytes → 450 bytes 以下まで削除
+    freed = budget.enforce(now=1000)
+
+    assert freed == 100
+    assert not idle_processed.exists()
+    # 未保存の変更がある作業中画像と、アクセス中のセッションの成果物は残す
+    assert edited.exists()
+    assert images.has_pending_changes(edited)
+    assert active_processed.exists()
+
+
+def test_enforce_does_nothing_below_high_watermark(tmp_path) -> None:
+    """使用量がHIGH_WATERMARK以下なら何も削除しないことをテスト"""
+    from transpalentor.infrastructure.result_cache import ResultCache
+    from transpalentor.infrastructure.session_index import SessionIndex
+    from transpalentor.infrastructure.storage_budget import StorageBudget
+    from transpalentor.infrastructure.working_images import WorkingImageManager
+
+    index = SessionIndex(tmp_path / "sessions.db")
+    budget = StorageBudget(
+        index, ResultCache(tmp_path / "cache"), WorkingImageManager(), budget_bytes=1000
+    )
+    index.record_artifact("session-a", "processed_a.png", "processed", 800)
+
+    assert budget.enforce() == 0
+    assert index.total_bytes() == 800
+
+
+def test_upload_and_process_are_recorded() -> None:
+    """アップロードと透過処理の結果が使用量として記録されることをテスト"""
+    from transpalentor.infrastructure.session_index import session_index
+    from transpalentor.presentation.app import app
+
+    client = TestClient(app)
+    upload = client.post(
+        "/api/upload", files={"file": ("test.png", create_test_image(), "image/png")}
+    )
+    session_id = upload.json()["session_id"]
+    assert session_index.session_bytes(session_id) == upload.json()["size"]
+
+    process = client.post(
+        "/api/process",
+        json={"session_id": session_id, "filename": upload.json()["filename"], "rgb": [255, 0, 0]},
+    )
+    assert process.status_code == 200
+    assert session_index.session_bytes(session_id) > upload.json()["size"]
+
+    metrics = client.get("/api/metrics").json()
+    assert metrics["storage"]["sessions_bytes"] >= session_index.session_bytes(session_id)
+
+    client.delete(f"/api/cleanup/{session_id}")
+    assert session_index.session_bytes(session_id) == 0
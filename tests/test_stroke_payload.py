@@ -0,0 +1,136 @@
+"""
+消しゴムのストロークのバイナリ形式のテスト
+"""
+
+import io
+import struct
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+
+def create_test_image() -> io.BytesIO:
+    """テスト用の画像を作成"""
+    image = Image.new("RGB", (100, 100), color=(10, 200, 30))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    buffer.seek(0)
+    return buffer
+
+
+@pytest.mark.parametrize("int32", [False, True])
+@pytest.mark.parametrize("delta", [False, True])
+def test_round_trip(int32: bool, delta: bool) -> None:
+    """エンコードしたストロークが同じ座標に復元されることをテスト"""
+    from transpalentor.application.stroke_payload import (
+        decode_stroke_payload,
+        encode_stroke_payload,
+    )
+
+    segments = [(5, [(10, 20), (12, 25), (8, 3)]), (40, [(300, 400)]), (1, [])]
+    payload = encode_stroke_payload(segments, int32=int32, delta=delta)
+
+    assert decode_stroke_payload(payload) == segments
+
+
+def test_delta_keeps_int16_payload_small() -> None:
+    """差分で格納すると大きな座標でも int16 に収まることをテスト"""
+    from transpalentor.application.stroke_payload import encode_stroke_payload
+
+    points = [(30000 + i, 30000 + i) for i in range(100)]
+
+    assert len(encode_stroke_payload([(10, points)])) == 8 + 6 + 100 * 4
+    with pytest.raises(OverflowError):
+        encode_stroke_payload([(10, [(40000, 0)])], delta=False)
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        b"STR",
+        b"XXXX" + bytes(4),
+        struct.pack("<4sBBH", b"STRK", 0x80, 0, 0),
+        struct.pack("<4sBBH", b"STRK", 0, 0, 1),
+        struct.pack("<4sBBHHI", b"STRK", 0, 0, 1, 0, 0),
+        struct.pack("<4sBBHHI", b"STRK", 0, 0, 1, 101, 0),
+        struct.pack("<4sBBHHIhh", b"STRK", 0, 0, 1, 10, 2, 1, 1),
+        struct.pack("<4sBBHHIhh", b"STRK", 0, 0, 1, 10, 1, -1, 5),
+        struct.pack("<4sBBHHIhhhh", b"STRK", 0x02, 0, 1, 10, 2, 5, 5, -6, 0),
+        struct.pack("<4sBBHHIhh", b"STRK", 0, 0, 1, 10, 1, 1, 1) + b"\x00",
+    ],
+)
+def test_invalid_payloads_are_rejected(payload: bytes) -> None:
+    """形式の不正・範囲外の値が拒否されることをテスト"""
+    from transpalentor.application.stroke_payload import decode_stroke_payload
+    from transpalentor.presentation.exceptions import InvalidPayloadError
+
+    with pytest.raises(InvalidPayloadError):
+        decode_stroke_payload(payload)
+
+
+def test_erase_binary_endpoint() -> None:
+    """ブラシサイズの異なる複数のセグメントで消しゴム処理できることをテスト"""
+    from transpalentor.application.stroke_payload import encode_stroke_payload
+    from transpalentor.presentation.app import app
+
+    client = TestClient(app)
+    upload = client.post(
+        "/api/upload", files={"file": ("test.png", create_test_image(), "image/png")}
+    ).json()
+    session_id = upload["session_id"]
+    params = {"session_id": session_id, "filename": upload["filename"], "inline": "true"}
+
+    payload = encode_stroke_payload([(2, [(10, 10), (11, 10)]), (20, [(70, 70)])])
+    response = client.post(
+        "/api/erase/binary",
+        params=params,
+        content=payload,
+        headers={"Content-Type": "application/octet-stream"},
+    )
+
+    assert response.status_code == 200
+    with Image.open(io.BytesIO(response.content)) as image:
+        assert image.getpixel((10, 10))[3] == 0
+        assert image.getpixel((15, 10))[3] == 255
+        assert image.getpixel((78, 70))[3] == 0
+
+    invalid = client.post("/api/erase/binary", params=params, content=b"STRK")
+    assert invalid.status_code == 400
+    assert invalid.json()["error_code"] == "INVALID_PAYLOAD"
+
+    client.delete(f"/api/cleanup/{session_id}")
+
+
+def test_erase_binary_rejects_paths_outside_session() -> None:
+    """別のセッションのファイルを指すファイル名が拒否されることをテスト"""
+    import os
+
+    from transpalentor.application.stroke_payload import encode_stroke_payload
+    from transpalentor.infrastructure.file_storage import get_session_directory
+    from transpalentor.presentation.app import app
+
+    client = TestClient(app)
+    uploads = [
+        client.post(
+            "/api/upload", files={"file": ("test.png", create_test_image(), "image/png")}
+        ).json()
+        for _ in range(2)
+    ]
+    attacker, victim = uploads
+    victim_path = get_session_directory(victim["session_id"]) / victim["filename"]
+    original = victim_path.read_bytes()
+    traversal = os.path.relpath(victim_path, get_session_directory(attacker["session_id"]))
+
+    response = client.post(
+        "/api/erase/binary",
+        params={"session_id": attacker["session_id"], "filename": traversal},
+        content=encode_stroke_payload([(20, [(10, 10)])]),
+        headers={"Content-Type": "application/octet-stream"},
+    )
+
+    assert response.status_code == 404
+    assert victim_path.read_bytes() == original
+
+    for upload in uploads:
+        client.delete(f"/api/cleanup/{upload['session_id']}")
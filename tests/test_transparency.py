@@ -1,6 +1,7 @@
 """
 透過処理機能のテスト
 """
+
 import io
 from pathlib import Path
 
@@ -205,9 +206,9 @@ def test_make_transparent_multiple_colors() -> None:
 
     # 赤、緑、青、黄色のピクセルを持つ画像を作成
     colors = [
-        (255, 0, 0),    # 赤
-        (0, 255, 0),    # 緑
-        (0, 0, 255),    # 青
+        (255, 0, 0),  # 赤
+        (0, 255, 0),  # 緑
+        (0, 0, 255),  # 青
         (255, 255, 0),  # 黄色
     ]
     image = create_test_image_with_colors(colors)
@@ -248,9 +249,9 @@ def test_make_transparent_three_colors() -> None:
 
     # 5色のピクセルを持つ画像を作成
     colors = [
-        (255, 0, 0),    # 赤
-        (0, 255, 0),    # 緑
-        (0, 0, 255),    # 青
+        (255, 0, 0),  # 赤
+        (0, 255, 0),  # 緑
+        (0, 0, 255),  # 青
         (255, 255, 0),  # 黄色
         (255, 0, 255),  # マゼンタ
     ]
@@ -309,10 +310,10 @@ def test_make_transparent_multiple_colors_with_threshold() -> None:
 
     # 赤と少し異なる赤のピクセルを持つ画像
     colors = [
-        (255, 0, 0),    # 純粋な赤
-        (250, 5, 5),    # 少し異なる赤
-        (0, 255, 0),    # 緑
-        (0, 250, 5),    # 少し異なる緑
+        (255, 0, 0),  # 純粋な赤
+        (250, 5, 5),  # 少し異なる赤
+        (0, 255, 0),  # 緑
+        (0, 250, 5),  # 少し異なる緑
     ]
     image = create_test_image_with_colors(colors)
 
@@ -336,3 +337,47 @@ def test_make_transparent_multiple_colors_with_threshold() -> None:
     # 少し異なる緑も透過（閾値内）
     r, g, b, a = pixels[3, 0]
     assert a == 0
+
+
+def test_distance_histogram_matches_make_transparent() -> None:
+    """最小距離の分布の累積が、各閾値で透明になるピクセル数と一致することをテスト"""
+    import random
+    from itertools import accumulate
+
+    from transpalentor.domain.transparency import (
+        MAX_COLOR_DISTANCE,
+        distance_histogram,
+        make_transparent,
+    )
+
+    random.seed(0)
+    colors = [tuple(random.randrange(256) for _ in range(3)) for _ in range(50)]
+    image = create_test_image_with_colors(colors, size=(20, 15))
+    targets = [(0, 0, 0), (200, 100, 50)]
+
+    histogram = distance_histogram(image.getcolors(), targets)
+    cleared = list(accumulate(histogram))
+
+    assert len(histogram) == MAX_COLOR_DISTANCE + 1
+    assert cleared[-1] == 300
+    for threshold in (0, 1, 37, 100, 255):
+        result = make_transparent(image, targets, threshold)
+        assert cleared[threshold] == result.getchannel("A").histogram()[0]
+
+    # 最も遠い色 (白と黒の距離 441.67...) は 442 で初めて透明になる
+    assert distance_histogram([(1, (255, 255, 255))], (0, 0, 0))[442] == 1
+
+
+def test_otsu_threshold_separates_two_groups() -> None:
+    """大津の方法で2つの山の間の閾値が選ばれることをテスト"""
+    from transpalentor.domain.transparency import otsu_threshold
+
+    histogram = [0] * 443
+    histogram[3] = 500
+    histogram[5] = 300
+    histogram[180] = 400
+    histogram[200] = 600
+
+    assert 5 <= otsu_threshold(histogram) < 180
+    assert otsu_threshold([0] * 10) == 0
+    assert otsu_threshold([0, 10, 0]) == 0
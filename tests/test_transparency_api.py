@@ -1,6 +1,7 @@
 """
 透過処理APIエンドポイントのテスト
 """
+
 import io
 import shutil
 from pathlib import Path
@@ -368,3 +369,114 @@ def test_process_transparency_backwards_compatible() -> None:
     session_dir = get_session_directory(session_id)
     if session_dir.exists():
         shutil.rmtree(session_dir)
+
+
+def test_process_returns_inline_image() -> None:
+    """inline 指定時に処理済み画像が応答に含まれ、保存が遅延されることをテスト"""
+    from transpalentor.infrastructure.file_storage import get_session_directory
+    from transpalentor.infrastructure.working_images import working_images
+    from transpalentor.presentation.app import app
+
+    client = TestClient(app)
+    upload = client.post(
+        "/api/upload", files={"file": ("test.png", create_test_image(), "image/png")}
+    ).json()
+    session_id = upload["session_id"]
+
+    response = client.post(
+        "/api/process",
+        json={
+            "session_id": session_id,
+            "filename": upload["filename"],
+            "rgb": [0, 0, 0],
+            "inline": True,
+        },
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/png"
+    assert response.headers["x-session-id"] == session_id
+    filename = response.headers["x-filename"]
+    processed_path = get_session_directory(session_id) / filename
+    assert working_images.has_pending_changes(processed_path)
+    with Image.open(io.BytesIO(response.content)) as image:
+        assert image.mode == "RGBA"
+
+    # 画像のURLから取得しても同じ内容 (未保存の場合はここで保存される)
+    fetched = client.get(response.headers["x-processed-url"])
+    assert fetched.content == response.content
+    assert fetched.headers["etag"] == response.headers["etag"]
+    assert processed_path.read_bytes() == response.content
+
+    client.delete(f"/api/cleanup/{session_id}")
+
+
+def test_threshold_histogram() -> None:
+    """閾値ごとの透明になるピクセル数と閾値の候補を取得できることをテスト"""
+    from transpalentor.presentation.app import app
+
+    client = TestClient(app)
+    image = Image.new("RGB", (100, 100), color=(250, 250, 250))
+    image.paste((240, 245, 250), (0, 0, 100, 20))
+    image.paste((20, 60, 200), (30, 30, 70, 70))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    buffer.seek(0)
+    upload = client.post("/api/upload", files={"file": ("test.png", buffer, "image/png")}).json()
+    session_id = upload["session_id"]
+
+    response = client.post(
+        "/api/process/histogram",
+        json={"session_id": session_id, "filename": upload["filename"], "rgb": [250, 250, 250]},
+    )
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["total_pixels"] == 10000
+    assert len(data["cleared_pixels"]) == 443
+    # 同じ色・近い色 (距離 sqrt(125) ≒ 11.2)・遠い色の順に透明になる
+    assert data["cleared_pixels"][0] == 6400
+    assert data["cleared_pixels"][11] == 6400
+    assert data["cleared_pixels"][12] == 8400
+    assert data["cleared_pixels"][442] == 10000
+    assert 12 <= data["suggested_threshold"] <= 255
+
+    invalid = client.post(
+        "/api/process/histogram",
+        json={"session_id": session_id, "filename": upload["filename"], "rgb": [300, 0, 0]},
+    )
+    assert invalid.status_code == 422
+
+    client.delete(f"/api/cleanup/{session_id}")
+
+
+def test_threshold_histogram_rejects_paths_outside_session() -> None:
+    """別のセッションのファイルを指すファイル名が拒否されることをテスト"""
+    import os
+
+    from transpalentor.infrastructure.file_storage import get_session_directory
+    from transpalentor.presentation.app import app
+
+    client = TestClient(app)
+    uploads = []
+    for name in ("test.png", "victim.png"):
+        buffer = io.BytesIO()
+        Image.new("RGB", (10, 10), color=(250, 250, 250)).save(buffer, format="PNG")
+        buffer.seek(0)
+        uploads.append(
+            client.post("/api/upload", files={"file": (name, buffer, "image/png")}).json()
+        )
+    upload, victim = uploads
+    session_id = upload["session_id"]
+    victim_path = get_session_directory(victim["session_id"]) / victim["filename"]
+    traversal = os.path.relpath(victim_path, get_session_directory(session_id))
+
+    for filename in (traversal, ".", ".manifest.json/.."):
+        response = client.post(
+            "/api/process/histogram",
+            json={"session_id": session_id, "filename": filename, "rgb": [250, 250, 250]},
+        )
+        assert response.status_code == 404
+
+    client.delete(f"/api/cleanup/{session_id}")
+    client.delete(f"/api/cleanup/{victim['session_id']}")
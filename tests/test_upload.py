@@ -1,6 +1,7 @@
 """
 画像アップロード機能のテスト
 """
+
 import io
 from pathlib import Path
 
@@ -60,9 +61,7 @@ def test_upload_image_validation_format() -> None:
     image.save(buffer, format="GIF")
     buffer.seek(0)
 
-    response = client.post(
-        "/api/upload", files={"file": ("test_image.gif", buffer, "image/gif")}
-    )
+    response = client.post("/api/upload", files={"file": ("test_image.gif", buffer, "image/gif")})
 
     assert response.status_code == 422
     data = response.json()
@@ -150,9 +149,7 @@ def test_upload_without_filename() -> None:
     image_data = create_test_image("PNG")
 
     # ファイル名なし（Noneになる）
-    response = client.post(
-        "/api/upload", files={"file": (None, image_data, "image/png")}
-    )
+    response = client.post("/api/upload", files={"file": (None, image_data, "image/png")})
 
     # FastAPIはファイル名がない場合、バリデーションエラーになる可能性がある
     # ここでは実際の動作を確認し、適切に処理されることを確認
@@ -177,3 +174,217 @@ def test_upload_corrupted_image() -> None:
     assert response.status_code == 422
     data = response.json()
     assert "UNSUPPORTED_FORMAT" in str(data)
+
+
+def test_upload_precheck_skips_known_file() -> None:
+    """既存のファイルはハッシュの事前確認だけでセッションが作成されることをテスト"""
+    import hashlib
+    import os
+
+    from transpalentor.infrastructure.file_storage import delete_session_files
+    from transpalentor.presentation.app import app
+
+    client = TestClient(app)
+    # 他のテストと内容が重ならないよう、ランダムな色の画像を使う
+    buffer = io.BytesIO()
+    Image.new("RGB", (31, 17), color=tuple(os.urandom(3))).save(buffer, format="PNG")
+    content = buffer.getvalue()
+    sha256 = hashlib.sha256(content).hexdigest()
+    session_ids = []
+
+    try:
+        # 未知のファイルは存在しない扱い
+        response = client.post(
+            "/api/upload/precheck",
+            json={"sha256": sha256, "size": len(content), "filename": "brand.png"},
+        )
+        assert response.status_code == 200
+        assert response.json()["exists"] is False
+
+        upload_response = client.post(
+            "/api/upload", files={"file": ("brand.png", content, "image/png")}
+        )
+        session_ids.append(upload_response.json()["session_id"])
+
+        # サイズが一致しない場合は存在しない扱い
+        response = client.post(
+            "/api/upload/precheck",
+            json={"sha256": sha256, "size": len(content) + 1, "filename": "brand.png"},
+        )
+        assert response.json()["exists"] is False
+
+        response = client.post(
+            "/api/upload/precheck",
+            json={"sha256": sha256, "size": len(content), "filename": "logo"},
+        )
+        data = response.json()
+        assert data["exists"] is True
+        assert data["filename"] == "logo.png"
+        session_ids.append(data["session_id"])
+
+        # 新しいセッションで画像を取得・処理できる
+        assert client.get(data["image_url"]).content == content
+        assert data["session_id"] != session_ids[0]
+    finally:
+        for session_id in session_ids:
+            delete_session_files(session_id)
+
+
+def test_upload_precheck_validates_hash() -> None:
+    """不正な形式のハッシュが拒否されることをテスト"""
+    from transpalentor.presentation.app import app
+
+    client = TestClient(app)
+
+    response = client.post(
+        "/api/upload/precheck",
+        json={"sha256": "../../etc/passwd", "size": 10, "filename": "a.png"},
+    )
+
+    assert response.status_code == 422
+
+
+def test_upload_rejects_large_content_length_before_reading() -> None:
+    """Content-Lengthが上限を超える場合にボディを読まずに拒否されることをテスト"""
+    from transpalentor.application.validation import MAX_FILE_SIZE
+    from transpalentor.presentation.app import app
+
+    client = TestClient(app)
+
+    response = client.post(
+        "/api/upload",
+        content=b"x" * 16,
+        headers={
+            "Content-Type": "multipart/form-data; boundary=xyz",
+            "Content-Length": str(MAX_FILE_SIZE * 2),
+        },
+    )
+
+    assert response.status_code == 413
+    assert response.json()["error_code"] == "FILE_TOO_LARGE"
+
+
+def test_upload_rejects_large_chunked_body() -> None:
+    """Content-Lengthのない (chunked) ボディも受信しながら上限で拒否されることをテスト"""
+    from transpalentor.application.validation import MAX_FILE_SIZE
+    from transpalentor.presentation.app import app
+
+    client = TestClient(app)
+
+    def body():
+        yield b'--xyz\r\nContent-Disposition: form-data; name="file"; filename="a.png"\r\n\r\n'
+        for _ in range(MAX_FILE_SIZE // (1024 * 1024) + 2):
+            yield b"\0" * (1024 * 1024)
+
+    response = client.post(
+        "/api/upload",
+        content=body(),
+        headers={"Content-Type": "multipart/form-data; boundary=xyz"},
+    )
+
+    assert response.status_code == 413
+
+
+async def iterate_chunks(content: bytes, chunk_size: int = 64):
+    """内容を chunk_size ごとに返す非同期イテレーター"""
+    for start in range(0, len(content), chunk_size):
+        yield content[start : start + chunk_size]
+
+
+@pytest.mark.asyncio
+async def test_stream_upload_rejects_incrementally(tmp_path, monkeypatch) -> None:
+    """ストリーミング中にサイズ・形式が検証され、一時ファイルが残らないことをテスト"""
+    from transpalentor.application import validation
+    from transpalentor.presentation.exceptions import FileTooLargeError, UnsupportedFormatError
+
+    dest_path = tmp_path / "upload.part"
+
+    # 形式は先頭のシグネチャで判定される
+    chunks = iterate_chunks(b"GIF89a" + b"\0" * 1000)
+    with pytest.raises(UnsupportedFormatError):
+        await validation.stream_upload_to_file(chunks, dest_path, "a.gif")
+    assert not dest_path.exists()
+
+    # サイズは受信しながらチェックされる
+    monkeypatch.setattr(validation, "MAX_FILE_SIZE", 100)
+    chunks = iterate_chunks(create_test_image("PNG").getvalue())
+    with pytest.raises(FileTooLargeError):
+        await validation.stream_upload_to_file(chunks, dest_path, "a.png")
+    assert not dest_path.exists()
+
+
+@pytest.mark.asyncio
+async def test_stream_upload_writes_file_and_hash(tmp_path) -> None:
+    """ストリーミングで書き出した内容・サイズ・ハッシュが正しいことをテスト"""
+    import hashlib
+
+    from transpalentor.application.validation import stream_upload_to_file
+
+    content = create_test_image("JPEG").getvalue()
+    dest_path = tmp_path / "upload.part"
+
+    img_format, size, content_hash = await stream_upload_to_file(
+        iterate_chunks(content), dest_path, "a.jpg"
+    )
+
+    assert img_format == "JPEG"
+    assert size == len(content)
+    assert content_hash == hashlib.sha256(content).hexdigest()
+    assert dest_path.read_bytes() == content
+
+
+@pytest.mark.asyncio
+async def test_upload_rejects_invalid_format_before_receiving_body() -> None:
+    """形式が不正なファイルは、ボディの残りを受信する前に拒否されることをテスト"""
+    import json
+
+    from transpalentor.presentation.app import app
+
+    chunks = [b'--xyz\r\nContent-Disposition: form-data; name="file"; filename="a.gif"\r\n\r\n']
+    chunks += [b"GIF89a" + b"\0" * (64 * 1024 - 6)] * 64
+    chunks += [b"\r\n--xyz--\r\n"]
+    received = 0
+    messages = []
+
+    async def receive():
+        nonlocal received
+        received += 1
+        more_body = received < len(chunks)
+        return {"type": "http.request", "body": chunks[received - 1], "more_body": more_body}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/api/upload",
+        "raw_path": b"/api/upload",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"content-type", b"multipart/form-data; boundary=xyz")],
+        "client": ("testclient", 50000),
+        "server": ("testserver", 80),
+    }
+    await app(scope, receive, send)
+
+    assert messages[0]["status"] == 422
+    assert json.loads(messages[1]["body"])["error_code"] == "UNSUPPORTED_FORMAT"
+    assert received < 4
+
+
+def test_upload_requires_multipart_file_field() -> None:
+    """file フィールドがない・multipart ではないリクエストが拒否されることをテスト"""
+    from transpalentor.presentation.app import app
+
+    client = TestClient(app)
+
+    response = client.post("/api/upload", data={"other": "value"}, files={"x": ("a.png", b"1")})
+    assert response.status_code == 400
+    assert response.json()["error_code"] == "INVALID_PAYLOAD"
+
+    response = client.post("/api/upload", json={"file": "a.png"})
+    assert response.status_code == 400
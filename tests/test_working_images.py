@@ -0,0 +1,235 @@
+"""
+編集中画像のロック・遅延保存のテスト
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from transpalentor.domain.transparency import erase_at_coordinates
+
+
+def create_image_file(tmp_path, size: tuple = (50, 50)):
+    """テスト用の画像ファイルを作成"""
+    session_dir = tmp_path / "session"
+    session_dir.mkdir()
+    file_path = session_dir / "image.png"
+    Image.new("RGBA", size, color=(255, 0, 0, 255)).save(file_path, format="PNG")
+    return file_path
+
+
+def eraser(x: int, y: int):
+    """指定座標を消す変更関数を作成"""
+    return lambda image: erase_at_coordinates(image, strokes=[[x, y]], brush_size=2)
+
+
+def test_concurrent_edits_are_serialized(tmp_path) -> None:
+    """同じセッションへの並行した変更が失われないことをテスト"""
+    from transpalentor.infrastructure.working_images import WorkingImageManager
+
+    file_path = create_image_file(tmp_path)
+    manager = WorkingImageManager(flush_delay=60)
+    points = [(x, y) for x in range(5, 45, 10) for y in range(5, 45, 10)]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda p: manager.apply(file_path, eraser(*p)), points))
+
+    manager.flush(file_path)
+
+    with Image.open(file_path) as saved:
+        for x, y in points:
+            assert saved.getpixel((x, y))[3] == 0
+
+
+def test_edits_are_coalesced_into_one_write(tmp_path) -> None:
+    """連続した変更がまとめて1回だけ保存されることをテスト"""
+    from transpalentor.infrastructure.working_images import WorkingImageManager
+
+    file_path = create_image_file(tmp_path)
+    manager = WorkingImageManager(flush_delay=0.05)
+
+    for x in range(5, 45, 10):
+        manager.apply(file_path, eraser(x, 10))
+
+    # 保存前はディスク上の画像は変わらない
+    assert manager.has_pending_changes(file_path)
+    with Image.open(file_path) as saved:
+        assert saved.getpixel((5, 10))[3] == 255
+
+    deadline = time.time() + 5
+    while manager.has_pending_changes(file_path) and time.time() < deadline:
+        time.sleep(0.01)
+
+    assert manager.stats()["flushes"] == 1
+    assert manager.stats()["coalesced_edits"] == 3
+    with Image.open(file_path) as saved:
+        assert saved.getpixel((35, 10))[3] == 0
+
+
+def test_external_write_invalidates_working_image(tmp_path) -> None:
+    """他から置き換えられたファイルはメモリ上の画像を使わず読み直すことをテスト"""
+    from transpalentor.infrastructure.file_storage import atomic_write_bytes, encode_png
+    from transpalentor.infrastructure.working_images import WorkingImageManager
+
+    file_path = create_image_file(tmp_path)
+    manager = WorkingImageManager(flush_delay=60)
+
+    manager.apply(file_path, eraser(5, 5))
+    manager.flush(file_path)
+
+    # 別ワーカーによる書き込みを模擬
+    atomic_write_bytes(file_path, encode_png(Image.new("RGBA", (50, 50), (0, 0, 255, 255))))
+
+    image = manager.apply(file_path, eraser(40, 40))
+    assert image.getpixel((5, 5)) == (0, 0, 255, 255)
+    assert image.getpixel((40, 40))[3] == 0
+
+
+def test_write_discards_pending_edits(tmp_path) -> None:
+    """置き換え書き込みが未保存の変更を破棄することをテスト"""
+    from transpalentor.infrastructure.file_storage import encode_png
+    from transpalentor.infrastructure.working_images import WorkingImageManager
+
+    file_path = create_image_file(tmp_path)
+    manager = WorkingImageManager(flush_delay=60)
+
+    manager.apply(file_path, eraser(5, 5))
+    replacement = encode_png(Image.new("RGBA", (50, 50), (0, 255, 0, 255)))
+    manager.write(file_path, replacement)
+    manager.flush_all()
+
+    assert not manager.has_pending_changes(file_path)
+    assert file_path.read_bytes() == replacement
+
+
+def test_file_lock_held_until_flush(tmp_path) -> None:
+    """未保存の変更がある間は他プロセスがセッションのロックを取得できないことをテスト"""
+    import subprocess
+    import sys
+
+    from transpalentor.infrastructure.working_images import LOCK_FILENAME, WorkingImageManager
+
+    file_path = create_image_file(tmp_path)
+    manager = WorkingImageManager(flush_delay=60)
+    lock_path = file_path.parent / LOCK_FILENAME
+
+    script = (
+        "import fcntl, os, sys\n"
+        "fd = os.open(sys.argv[1], os.O_RDWR | os.O_CREAT)\n"
+        "try:\n"
+        "    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)\n"
+        "except BlockingIOError:\n"
+        "    sys.exit(1)\n"
+    )
+
+    def other_worker_can_lock() -> bool:
+        result = subprocess.run([sys.executable, "-c", script, str(lock_path)])
+        return result.returncode == 0
+
+    manager.apply(file_path, eraser(5, 5))
+    assert not other_worker_can_lock()
+
+    manager.flush(file_path)
+    assert other_worker_can_lock()
+
+
+def test_deferred_write_reuses_encoded_content(tmp_path) -> None:
+    """遅延した置き換え書き込みとエンコード済みの内容がそのまま保存されることをテスト"""
+    from transpalentor.infrastructure.file_storage import encode_png
+    from transpalentor.infrastructure.working_images import WorkingImageManager
+
+    file_path = create_image_file(tmp_path)
+    manager = WorkingImageManager(flush_delay=60)
+    written = []
+    manager.add_write_listener(lambda path, data: written.append(data))
+
+    replacement = encode_png(Image.new("RGBA", (50, 50), (0, 255, 0, 255)))
+    manager.write(file_path, replacement, defer=True)
+
+    # 保存前はディスクに書き込まれず、エンコード済みの内容がそのまま返る
+    assert manager.has_pending_changes(file_path)
+    assert written == []
+    assert manager.encoded(file_path) == replacement
+
+    # 遅延中の内容に対する変更はデコードして適用される
+    image = manager.apply(file_path, eraser(5, 5))
+    assert image.getpixel((40, 40)) == (0, 255, 0, 255)
+    encoded = manager.encoded(file_path)
+
+    manager.flush(file_path)
+    assert file_path.read_bytes() == encoded
+    assert written == [encoded]
+    assert manager.encoded(file_path) == encoded
+
+
+def test_read_waits_for_other_worker_flush(tmp_path) -> None:
+    """別のワーカーに未保存の変更がある間は、読み取りがその保存を待つことをテスト"""
+    import threading
+
+    from transpalentor.infrastructure.working_images import WorkingImageManager
+
+    file_path = create_image_file(tmp_path)
+    # 別々のマネージャーは別々のファイルディスクリプタで flock するため別ワーカーとして振る舞う
+    writer = WorkingImageManager(flush_delay=60)
+    reader = WorkingImageManager(flush_delay=60)
+    writer.apply(file_path, eraser(5, 5))
+
+    results = {}
+    threads = [
+        threading.Thread(
+            target=lambda: results.update(
+                pixel=reader.read(file_path, lambda image: image.getpixel((5, 5)))
+            )
+        ),
+        threading.Thread(target=lambda: results.update(encoded=reader.encoded(file_path))),
+    ]
+    for thread in threads:
+        thread.start()
+
+    time.sleep(0.2)
+    assert results == {}
+
+    writer.flush(file_path)
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert results["pixel"][3] == 0
+    assert results["encoded"] == file_path.read_bytes()
+
+
+def test_discard_session_keeps_lock_while_in_use(tmp_path) -> None:
+    """セッションの破棄中に使用中のロックがレジストリから削除されないことをテスト"""
+    import threading
+
+    from transpalentor.infrastructure.working_images import WorkingImageManager
+
+    file_path = create_image_file(tmp_path)
+    session_dir = file_path.parent
+    manager = WorkingImageManager(flush_delay=60)
+
+    reading = threading.Event()
+    release = threading.Event()
+
+    def slow_reader(image):
+        reading.set()
+        release.wait(timeout=5)
+        return image.size
+
+    thread = threading.Thread(target=manager.read, args=(file_path, slow_reader))
+    thread.start()
+    assert reading.wait(timeout=5)
+
+    discard = threading.Thread(target=manager.discard_session, args=(session_dir,))
+    discard.start()
+    time.sleep(0.1)
+
+    # 使用中の間はレジストリに残り、後から来た要求も同じロックで直列化される
+    lock = manager._session_locks[session_dir]
+    assert lock.users == 2
+    release.set()
+    thread.join(timeout=5)
+    discard.join(timeout=5)
+
+    assert lock.users == 0
+    assert session_dir not in manager._session_locks
@@ -0,0 +1,84 @@
+"""
+消しゴムのマスクの受け取り形式
+投げ縄や広い範囲の消しゴムは座標の列ではなくマスク画像として受け取る
+
+- PNG: 1ビットまたは8ビット (グレースケール) のPNG。寸法はPNGから取得する
+- raw: 寸法 (width, height) を別に指定した画素の並び
+    - 8ビット: 1画素1バイト (0 で変更なし、255 で完全に透明)
+    - 1ビット: 各行を上位ビットから詰め、行末をバイト境界まで埋めたもの
+"""
+
+import io
+from typing import Optional
+
+from PIL import Image
+
+from ..presentation.exceptions import InvalidPayloadError
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# マスクの画素数の上限
+MAX_MASK_PIXELS = 50_000_000
+
+# リクエストボディの上限 (bytes)
+MAX_MASK_PAYLOAD_SIZE = 16 * 1024 * 1024
+
+
+def _check_size(width: int, height: int) -> None:
+    """マスクの寸法が範囲内であることを確認"""
+    if width <= 0 or height <= 0:
+        raise InvalidPayloadError(f"Invalid mask size: {width}x{height}")
+    if width * height > MAX_MASK_PIXELS:
+        raise InvalidPayloadError(f"Mask is too large (max {MAX_MASK_PIXELS} pixels)")
+
+
+def decode_mask_payload(
+    payload: bytes,
+    width: Optional[int] = None,
+    height: Optional[int] = None,
+    bits: int = 8,
+) -> Image.Image:
+    """
+    マスクのリクエストボディを画像に変換
+
+    Args:
+        payload: リクエストボディ (PNG または raw)
+        width: raw の場合の幅
+        height: raw の場合の高さ
+        bits: raw の場合の1画素のビット数 (1 または 8)
+
+    Returns:
+        マスク画像 (Lモード)
+
+    Raises:
+        InvalidPayloadError: 形式が不正、または寸法が範囲外の場合
+    """
+    if payload.startswith(PNG_SIGNATURE):
+        try:
+            with Image.open(io.BytesIO(payload)) as mask:
+                # デコード前に寸法を確認し、展開後に巨大になるPNGを拒否する
+                _check_size(mask.width, mask.height)
+                mask.load()
+                return mask if mask.mode == "L" else mask.convert("L")
+        except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+            raise InvalidPayloadError(f"Invalid mask PNG: {e}") from e
+
+    if width is None or height is None:
+        raise InvalidPayloadError("Raw mask requires width and height")
+    _check_size(width, height)
+
+    if bits == 8:
+        expected = width * height
+        mode = "L"
+    elif bits == 1:
+        expected = (width + 7) // 8 * height
+        mode = "1"
+    else:
+        raise InvalidPayloadError(f"Unsupported mask bit depth: {bits}")
+
+    if len(payload) != expected:
+        raise InvalidPayloadError(
+            f"Raw mask size mismatch: expected {expected} bytes, got {len(payload)}"
+        )
+    raw_mask = Image.frombytes(mode, (width, height), payload)
+    return raw_mask if mode == "L" else raw_mask.convert("L")
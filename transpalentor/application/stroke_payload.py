@@ -0,0 +1,157 @@
+"""
+消しゴムのストロークのバイナリ形式
+JSONの [[x, y], ...] の代わりに座標を詰めたバイト列で受け取り、解析と範囲チェックを
+座標ごとのPythonのループではなく配列単位で行う
+
+形式 (すべてリトルエンディアン):
+
+    ヘッダー: マジック b"STRK", フラグ (uint8), 予約 (uint8, 0), セグメント数 (uint16)
+    セグメントごとに:
+        ブラシサイズ (uint16), 点の数 (uint32)
+        座標 x0, y0, x1, y1, ... (FLAG_INT32 なら int32、そうでなければ int16)
+
+FLAG_DELTA の場合、各セグメントの最初の点は絶対座標、以降の点は直前の点からの差分とする
+"""
+
+import struct
+import sys
+from array import array
+from itertools import accumulate
+from typing import List, Tuple
+
+from ..presentation.exceptions import InvalidPayloadError
+
+STROKE_MAGIC = b"STRK"
+
+# 座標を int32 で格納する (指定しない場合は int16)
+FLAG_INT32 = 0x01
+# 2点目以降を直前の点からの差分で格納する
+FLAG_DELTA = 0x02
+
+# ブラシサイズの範囲 (JSON形式の EraseRequest と同じ)
+MIN_BRUSH_SIZE = 1
+MAX_BRUSH_SIZE = 100
+
+# 座標の上限
+MAX_STROKE_COORDINATE = 65535
+
+# 1リクエストの点の数の上限
+MAX_STROKE_POINTS = 100_000
+
+# リクエストボディの上限 (bytes)
+MAX_STROKE_PAYLOAD_SIZE = 1024 * 1024
+
+_HEADER = struct.Struct("<4sBBH")
+_SEGMENT = struct.Struct("<HI")
+
+StrokeSegment = Tuple[int, List[Tuple[int, int]]]
+
+
+def _decode_coordinates(data: bytes, typecode: str) -> array:
+    """リトルエンディアンの整数列を配列に変換"""
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def decode_stroke_payload(payload: bytes) -> List[StrokeSegment]:
+    """
+    バイナリ形式のストロークを解析し、ブラシサイズと座標を検証
+
+    Args:
+        payload: リクエストボディ
+
+    Returns:
+        セグメントのリスト [(ブラシサイズ, [(x, y), ...]), ...]
+
+    Raises:
+        InvalidPayloadError: 形式が不正、または値が範囲外の場合
+    """
+    if len(payload) < _HEADER.size:
+        raise InvalidPayloadError("Stroke payload is too short")
+    magic, flags, _, segment_count = _HEADER.unpack_from(payload)
+    if magic != STROKE_MAGIC:
+        raise InvalidPayloadError("Invalid stroke payload magic")
+    if flags & ~(FLAG_INT32 | FLAG_DELTA):
+        raise InvalidPayloadError(f"Unknown stroke payload flags: {flags:#x}")
+
+    typecode = "i" if flags & FLAG_INT32 else "h"
+    item_size = 4 if flags & FLAG_INT32 else 2
+
+    segments: List[StrokeSegment] = []
+    offset = _HEADER.size
+    total_points = 0
+    for _ in range(segment_count):
+        if offset + _SEGMENT.size > len(payload):
+            raise InvalidPayloadError("Truncated stroke segment header")
+        brush_size, point_count = _SEGMENT.unpack_from(payload, offset)
+        offset += _SEGMENT.size
+
+        if not MIN_BRUSH_SIZE <= brush_size <= MAX_BRUSH_SIZE:
+            raise InvalidPayloadError(f"Brush size out of range: {brush_size}")
+        total_points += point_count
+        if total_points > MAX_STROKE_POINTS:
+            raise InvalidPayloadError(f"Too many stroke points (max {MAX_STROKE_POINTS})")
+
+        end = offset + point_count * 2 * item_size
+        if end > len(payload):
+            raise InvalidPayloadError("Truncated stroke coordinates")
+        values = _decode_coordinates(payload[offset:end], typecode)
+        offset = end
+
+        xs = values[0::2]
+        ys = values[1::2]
+        if flags & FLAG_DELTA:
+            xs = array("q", accumulate(xs))
+            ys = array("q", accumulate(ys))
+
+        if point_count and (
+            min(xs) < 0
+            or min(ys) < 0
+            or max(xs) > MAX_STROKE_COORDINATE
+            or max(ys) > MAX_STROKE_COORDINATE
+        ):
+            raise InvalidPayloadError("Stroke coordinates out of range")
+
+        segments.append((brush_size, list(zip(xs, ys))))
+
+    if offset != len(payload):
+        raise InvalidPayloadError("Unexpected trailing bytes in stroke payload")
+    return segments
+
+
+def encode_stroke_payload(
+    segments: List[StrokeSegment], int32: bool = False, delta: bool = True
+) -> bytes:
+    """
+    ストロークをバイナリ形式にエンコード (クライアントの実装の参考とテスト用)
+
+    Args:
+        segments: セグメントのリスト [(ブラシサイズ, [(x, y), ...]), ...]
+        int32: 座標を int32 で格納するか
+        delta: 2点目以降を差分で格納するか
+
+    Returns:
+        バイナリ形式のストローク
+
+    Raises:
+        OverflowError: 座標 (差分) が int16 に収まらない場合
+    """
+    flags = (FLAG_INT32 if int32 else 0) | (FLAG_DELTA if delta else 0)
+    output = bytearray(_HEADER.pack(STROKE_MAGIC, flags, 0, len(segments)))
+    for brush_size, points in segments:
+        output += _SEGMENT.pack(brush_size, len(points))
+        values = array("i" if int32 else "h")
+        previous = (0, 0)
+        for x, y in points:
+            if delta:
+                values.extend((x - previous[0], y - previous[1]))
+                previous = (x, y)
+            else:
+                values.extend((x, y))
+        if sys.byteorder == "big":
+            values.byteswap()
+        output += values.tobytes()
+    return bytes(output)
@@ -1,13 +1,27 @@
 """
 画像ファイルのバリデーション
 """
+
+import asyncio
+import hashlib
 from pathlib import Path
-from typing import Tuple
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 
-from fastapi import UploadFile
+from fastapi import Request
 from PIL import Image
 
-from ..presentation.exceptions import FileTooLargeError, UnsupportedFormatError
+try:
+    from python_multipart.exceptions import MultipartParseError
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ModuleNotFoundError:  # python-multipart < 0.0.13
+    from multipart.exceptions import MultipartParseError  # type: ignore
+    from multipart.multipart import MultipartParser, parse_options_header  # type: ignore
+
+from ..presentation.exceptions import (
+    FileTooLargeError,
+    InvalidPayloadError,
+    UnsupportedFormatError,
+)
 
 # サポートされている画像形式
 SUPPORTED_FORMATS = {"PNG", "JPEG", "BMP"}
@@ -15,53 +29,272 @@ SUPPORTED_FORMATS = {"PNG", "JPEG", "BMP"}
 # 最大ファイルサイズ (10MB)
 MAX_FILE_SIZE = 10 * 1024 * 1024
 
+# アップロードを読み込む単位
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# multipartの境界やヘッダーとして許容するリクエストボディの余裕
+UPLOAD_BODY_OVERHEAD = 64 * 1024
+
+# 形式判定に必要な先頭バイト数
+FORMAT_SIGNATURE_SIZE = 8
 
-async def validate_image_file(file: UploadFile) -> Tuple[str, int]:
+# 先頭バイトのシグネチャと画像形式の対応
+FORMAT_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "PNG"),
+    (b"\xff\xd8\xff", "JPEG"),
+    (b"BM", "BMP"),
+)
+
+
+def sniff_image_format(header: bytes) -> Optional[str]:
     """
-    アップロードされた画像ファイルをバリデーション
+    ファイル先頭のシグネチャから画像形式を判定
 
     Args:
-        file: アップロードされたファイル
+        header: ファイルの先頭バイト列 (FORMAT_SIGNATURE_SIZE バイト以上)
 
     Returns:
-        タプル (format, size)
+        サポートされている形式名。判定できない場合None
+    """
+    for signature, format_name in FORMAT_SIGNATURES:
+        if header.startswith(signature):
+            return format_name
+    return None
+
+
+class MultipartFileStream:
+    """
+    multipart/form-data のリクエストボディを受信しながらパースし、
+    指定したフィールドのファイルの内容を受信した順に返す
+
+    ボディ全体を一時ファイルへ溜めてから読む (UploadFile) のではなく、受信したチャンクを
+    そのまま返すため、呼び出し側は先頭の数KBを受信した時点でファイルを拒否できる。
+    対象のフィールドより後の部分は読まない。
+    """
+
+    def __init__(self, request: Request, field_name: str = "file") -> None:
+        """
+        Args:
+            request: リクエスト
+            field_name: ファイルのフィールド名
+
+        Raises:
+            InvalidPayloadError: multipart/form-data ではない場合
+        """
+        content_type, params = parse_options_header(request.headers.get("content-type", ""))
+        boundary = params.get(b"boundary")
+        if content_type != b"multipart/form-data" or not boundary:
+            raise InvalidPayloadError("multipart/form-data である必要があります")
+
+        self.field_name = field_name.encode("latin-1")
+        self.filename: Optional[str] = None
+        self._stream = request.stream()
+        self._pending: List[bytes] = []
+        self._headers: Dict[bytes, bytes] = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._in_file = False
+        self._file_found = False
+        self._file_done = False
+        self._parser = MultipartParser(
+            boundary,
+            {
+                "on_part_begin": self._on_part_begin,
+                "on_header_field": self._on_header_field,
+                "on_header_value": self._on_header_value,
+                "on_header_end": self._on_header_end,
+                "on_headers_finished": self._on_headers_finished,
+                "on_part_data": self._on_part_data,
+                "on_part_end": self._on_part_end,
+            },
+        )
+
+    # MultipartParser のコールバック (受信したチャンクのパース中に呼ばれる)
+    def _on_part_begin(self) -> None:
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        if self._file_found or options.get(b"name") != self.field_name:
+            return
+        self._in_file = True
+        self._file_found = True
+        filename = options.get(b"filename")
+        if filename is not None:
+            self.filename = filename.decode("utf-8", errors="replace")
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._in_file:
+            self._pending.append(bytes(data[start:end]))
+
+    def _on_part_end(self) -> None:
+        if self._in_file:
+            self._in_file = False
+            self._file_done = True
+
+    async def _feed(self) -> bool:
+        """ボディの次のチャンクを受信してパースし、ボディの終わりに達した場合Falseを返す"""
+        try:
+            chunk = await self._stream.__anext__()
+        except StopAsyncIteration:
+            return False
+        try:
+            self._parser.write(chunk)
+        except MultipartParseError as e:
+            raise InvalidPayloadError(f"multipart/form-data の形式が不正です: {e}") from e
+        return True
+
+    async def open(self) -> None:
+        """
+        対象のフィールドのヘッダーまで受信し、ファイル名を取得
+
+        Raises:
+            InvalidPayloadError: 対象のフィールドがない場合
+        """
+        while not self._file_found:
+            if not await self._feed():
+                raise InvalidPayloadError(
+                    f"{self.field_name.decode('latin-1')} フィールドがありません"
+                )
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        """
+        ファイルの内容を受信した順に返す (open の後に呼ぶ)
+
+        Raises:
+            InvalidPayloadError: ファイルの途中でボディが終わった場合
+        """
+        while True:
+            if self._pending:
+                data = b"".join(self._pending)
+                self._pending.clear()
+                yield data
+            elif self._file_done:
+                return
+            elif not await self._feed():
+                raise InvalidPayloadError("ファイルの途中でリクエストボディが終わりました")
+
+
+async def stream_upload_to_file(
+    chunks: AsyncIterator[bytes], dest_path: Path, filename: str = ""
+) -> Tuple[str, int, str]:
+    """
+    アップロードされた画像ファイルを受信しながら一時ファイルに書き出してバリデーション
+
+    ファイル全体をメモリに載せず、サイズは受信しながら、形式は先頭のシグネチャで判定するため、
+    不正なファイルは先頭の数KBを受信した時点で拒否される (残りのボディは受信しない)。
+    バリデーションに失敗した場合は一時ファイルを削除する。
+
+    Args:
+        chunks: ファイルの内容のチャンク (MultipartFileStream.chunks など)
+        dest_path: 書き出し先の一時ファイルのパス
+        filename: エラーメッセージ用のファイル名
+
+    Returns:
+        タプル (format, size, sha256)
 
     Raises:
         FileTooLargeError: ファイルサイズが制限を超える場合
         UnsupportedFormatError: サポートされていない形式の場合
     """
-    # ファイルサイズを取得
-    content = await file.read()
-    file_size = len(content)
+    digest = hashlib.sha256()
+    file_size = 0
+    header = b""
+    img_format: Optional[str] = None
+
+    try:
+        with dest_path.open("wb") as out:
+            async for chunk in chunks:
+                # ファイルサイズを受信しながらチェック
+                file_size += len(chunk)
+                if file_size > MAX_FILE_SIZE:
+                    raise FileTooLargeError(
+                        size=file_size, max_size=MAX_FILE_SIZE, filename=filename
+                    )
+
+                # 先頭のシグネチャで形式を判定
+                if img_format is None:
+                    header += chunk[: FORMAT_SIGNATURE_SIZE - len(header)]
+                    if len(header) >= FORMAT_SIGNATURE_SIZE:
+                        img_format = _require_format(header, filename)
+
+                digest.update(chunk)
+                await asyncio.to_thread(out.write, chunk)
+
+        if img_format is None:
+            img_format = _require_format(header, filename)
+
+        # Pillowでヘッダーを解析し、画像として開けることを確認
+        await asyncio.to_thread(_verify_image_header, dest_path, img_format, filename)
+    except BaseException:
+        dest_path.unlink(missing_ok=True)
+        raise
+
+    return img_format, file_size, digest.hexdigest()
+
+
+def validate_image_path(file_path: Path, filename: str = "") -> Tuple[str, int, str]:
+    """
+    ディスク上の画像ファイルをチャンク単位で読みながらバリデーション
+    (分割アップロードの完了時など、既に書き込まれたファイルの検証に使う)
 
-    # ファイルサイズをチェック
+    Args:
+        file_path: 検証するファイルのパス
+        filename: エラーメッセージ用のファイル名
+
+    Returns:
+        タプル (format, size, sha256)
+
+    Raises:
+        FileTooLargeError: ファイルサイズが制限を超える場合
+        UnsupportedFormatError: サポートされていない形式の場合
+    """
+    file_size = file_path.stat().st_size
     if file_size > MAX_FILE_SIZE:
-        raise FileTooLargeError(
-            size=file_size, max_size=MAX_FILE_SIZE, filename=file.filename or ""
-        )
+        raise FileTooLargeError(size=file_size, max_size=MAX_FILE_SIZE, filename=filename)
 
-    # ファイルを先頭に戻す
-    await file.seek(0)
+    digest = hashlib.sha256()
+    with file_path.open("rb") as f:
+        img_format = _require_format(f.read(FORMAT_SIGNATURE_SIZE), filename)
+        f.seek(0)
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+
+    _verify_image_header(file_path, img_format, filename)
+
+    return img_format, file_size, digest.hexdigest()
 
-    # Pillowで画像形式を検証
-    try:
-        img = Image.open(file.file)
-        img_format = img.format
 
-        if img_format not in SUPPORTED_FORMATS:
-            raise UnsupportedFormatError(format_name=img_format or "unknown")
+def _require_format(header: bytes, filename: str) -> str:
+    """先頭バイトから形式を判定し、サポート外の場合は例外を送出"""
+    img_format = sniff_image_format(header)
+    if img_format is None:
+        raise UnsupportedFormatError(format_name="unknown", filename=filename)
+    return img_format
 
-        # ファイルを再度先頭に戻す
-        await file.seek(0)
 
-        return img_format, file_size
-    except Exception as e:
+def _verify_image_header(file_path: Path, img_format: str, filename: str) -> None:
+    """Pillowでヘッダーのみを解析し、シグネチャと形式が一致することを確認"""
+    try:
+        with Image.open(file_path) as img:
+            actual_format = img.format
+    except Exception:
         # Pillowが画像を開けない場合
-        if isinstance(e, UnsupportedFormatError):
-            raise
-        raise UnsupportedFormatError(
-            format_name="corrupted or invalid", filename=file.filename or ""
-        )
+        raise UnsupportedFormatError(format_name="corrupted or invalid", filename=filename)
+
+    if actual_format != img_format or actual_format not in SUPPORTED_FORMATS:
+        raise UnsupportedFormatError(format_name=actual_format or "unknown", filename=filename)
 
 
 def get_file_extension(format_name: str) -> str:
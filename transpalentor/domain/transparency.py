@@ -1,12 +1,18 @@
 """
 透過処理機能のドメインロジック
 """
-from PIL import Image
 
+from functools import lru_cache
+from math import isqrt
+from typing import Any, Sequence
 
-def _calculate_color_distance(
-    r1: int, g1: int, b1: int, r2: int, g2: int, b2: int
-) -> float:
+from PIL import Image, ImageChops, ImageMath
+
+# 色の距離の最大値 (sqrt(3 * 255^2) ≒ 441.7 を切り上げたもの)
+MAX_COLOR_DISTANCE = 442
+
+
+def _calculate_color_distance(r1: int, g1: int, b1: int, r2: int, g2: int, b2: int) -> float:
     """
     2つの色のユークリッド距離を計算
 
@@ -88,8 +94,202 @@ def make_transparent(
     return image
 
 
+def compute_transparent_alpha(
+    image: Image.Image,
+    rgb: tuple[int, int, int] | list[tuple[int, int, int]],
+    threshold: int = 0,
+) -> Image.Image:
+    """
+    make_transparent を適用した後のアルファチャンネルだけを計算する（プレビュー用）
+
+    判定は make_transparent と同じ（いずれかの色との距離が threshold 以下なら透明）だが、
+    ピクセルごとのループではなくチャンネル単位の演算で行う。
+
+    Args:
+        image: 処理対象の画像（PIL Image）
+        rgb: 透明にする色のRGB値（単一色 (R, G, B) または複数色のリスト）
+        threshold: 色の許容範囲（0-255）
+
+    Returns:
+        透過処理後のアルファチャンネル（L形式）
+    """
+    if image.mode != "RGBA":
+        image = image.convert("RGBA")
+
+    target_colors = [rgb] if isinstance(rgb[0], int) else list(rgb)
+    red, green, blue, alpha = (band.convert("I") for band in image.split())
+    limit = threshold * threshold
+
+    # 距離の2乗が許容範囲の2乗を超える色ごとの判定 (1/0) を掛け合わせ、
+    # どの色にも近くないピクセルだけ元のアルファを残す
+    def keep(args: dict, color: tuple[int, int, int]) -> Any:
+        target_r, target_g, target_b = color
+        return (
+            (args["r"] - target_r) * (args["r"] - target_r)
+            + (args["g"] - target_g) * (args["g"] - target_g)
+            + (args["b"] - target_b) * (args["b"] - target_b)
+        ) > limit
+
+    def evaluate(args: dict) -> Any:
+        result = args["a"]
+        for color in target_colors:
+            result = result * keep(args, color)
+        return result
+
+    result: Image.Image
+    if hasattr(ImageMath, "lambda_eval"):
+        result = ImageMath.lambda_eval(evaluate, r=red, g=green, b=blue, a=alpha)
+    else:
+        # Pillow 11 未満には lambda_eval がないため、同じ式を文字列にして評価する
+        # (式に埋め込むのは int に変換した値のみ)
+        expression = "a"
+        for target_r, target_g, target_b in target_colors:
+            terms = " + ".join(
+                f"({channel} - {int(value)}) * ({channel} - {int(value)})"
+                for channel, value in zip("rgb", (target_r, target_g, target_b))
+            )
+            expression += f" * (({terms}) > {int(limit)})"
+        result = getattr(ImageMath, "eval")(expression, r=red, g=green, b=blue, a=alpha)
+    return result.convert("L")
+
+
+def distance_histogram(
+    color_counts: list[tuple[int, tuple[int, int, int]]],
+    rgb: tuple[int, int, int] | list[tuple[int, int, int]],
+) -> list[int]:
+    """
+    各ピクセルと指定色との最小距離の分布を計算
+
+    histogram[t] は threshold = t で初めて透明になる（最小距離 d が t - 1 < d <= t の）
+    ピクセル数。判定は make_transparent と同じく距離の2乗で行うため、累積和が
+    その threshold で透明になるピクセル数と一致する。
+
+    Args:
+        color_counts: 色ごとのピクセル数 [(ピクセル数, (R, G, B)), ...]
+        rgb: 透明にする色のRGB値（単一色 (R, G, B) または複数色のリスト）
+
+    Returns:
+        長さ MAX_COLOR_DISTANCE + 1 のピクセル数のリスト
+    """
+    target_colors = [rgb] if isinstance(rgb[0], int) else list(rgb)
+    histogram = [0] * (MAX_COLOR_DISTANCE + 1)
+    for count, (r, g, b) in color_counts:
+        squared = min(
+            (r - target_r) ** 2 + (g - target_g) ** 2 + (b - target_b) ** 2
+            for target_r, target_g, target_b in target_colors
+        )
+        distance = isqrt(squared)
+        if distance * distance < squared:
+            distance += 1
+        histogram[distance] += count
+    return histogram
+
+
+def otsu_threshold(histogram: list[int]) -> int:
+    """
+    大津の方法で分布を2つに分ける閾値を計算
+
+    閾値以下と閾値より大きい2つのクラスのクラス間分散が最大になる閾値を選ぶ。
+
+    Args:
+        histogram: 値ごとのピクセル数
+
+    Returns:
+        閾値（分けられない場合は0）
+    """
+    total = sum(histogram)
+    weighted_total = sum(value * count for value, count in enumerate(histogram))
+
+    best_threshold = 0
+    best_variance = 0.0
+    lower_count = 0
+    lower_weighted = 0
+    for value, count in enumerate(histogram):
+        lower_count += count
+        lower_weighted += value * count
+        upper_count = total - lower_count
+        if lower_count == 0:
+            continue
+        if upper_count == 0:
+            break
+        lower_mean = lower_weighted / lower_count
+        upper_mean = (weighted_total - lower_weighted) / upper_count
+        variance = lower_count * upper_count * (lower_mean - upper_mean) ** 2
+        if variance > best_variance:
+            best_variance = variance
+            best_threshold = value
+    return best_threshold
+
+
+@lru_cache(maxsize=128)
+def _brush_stamp(radius: int) -> Image.Image:
+    """
+    円形ブラシの形のマスクを作成 (中心からの距離が半径以内の画素が255)
+
+    Args:
+        radius: ブラシの半径
+
+    Returns:
+        一辺 2 * radius + 1 のマスク（L形式）
+    """
+    size = 2 * radius + 1
+    stamp = Image.new("L", (size, size), 0)
+    for dy in range(-radius, radius + 1):
+        for dx in range(-radius, radius + 1):
+            if dx * dx + dy * dy <= radius * radius:
+                stamp.putpixel((dx + radius, dy + radius), 255)
+    return stamp
+
+
+def erase_strokes_in_place(
+    image: Image.Image, strokes: Sequence[Sequence[int]], brush_size: int = 10
+) -> tuple[int, int, int, int] | None:
+    """
+    指定した座標の周辺のピクセルをその場で透明にし、変更した範囲を返す
+
+    ストロークが触れる範囲だけを切り出し、ブラシの形のマスクを各座標に重ねてから
+    アルファチャンネルに1回で適用する。
+
+    Args:
+        image: 処理対象の画像（RGBA形式。直接変更される）
+        strokes: 消しゴムのストローク座標 [[x, y], [x, y], ...]
+        brush_size: ブラシのサイズ（直径、ピクセル単位）
+
+    Returns:
+        変更した範囲 (left, top, right, bottom)。画像に触れない場合None
+    """
+    radius = brush_size // 2
+    points = [stroke for stroke in strokes if len(stroke) == 2]  # 不正な座標はスキップ
+    if not points:
+        return None
+
+    # ストロークが触れる範囲 (画像の範囲内)
+    left = max(min(x for x, _ in points) - radius, 0)
+    top = max(min(y for _, y in points) - radius, 0)
+    right = min(max(x for x, _ in points) + radius + 1, image.width)
+    bottom = min(max(y for _, y in points) + radius + 1, image.height)
+    if left >= right or top >= bottom:
+        return None
+
+    # 範囲内にブラシの形を重ねたマスクを作成 (範囲外にはみ出した部分は切り捨てられる)
+    stamp = _brush_stamp(radius)
+    mask = Image.new("L", (right - left, bottom - top), 0)
+    for x, y in points:
+        mask.paste(255, (x - radius - left, y - radius - top), stamp)
+
+    # マスクの範囲のアルファを0にする (RGBは保持)
+    box = (left, top, right, bottom)
+    region = image.crop(box)
+    alpha = region.getchannel("A")
+    alpha.paste(0, mask=mask)
+    region.putalpha(alpha)
+    image.paste(region, box[:2])
+
+    return box
+
+
 def erase_at_coordinates(
-    image: Image.Image, strokes: list[list[int]], brush_size: int = 10
+    image: Image.Image, strokes: Sequence[Sequence[int]], brush_size: int = 10
 ) -> Image.Image:
     """
     指定した座標の周辺のピクセルを透明にする（消しゴムツール）
@@ -109,31 +309,53 @@ def erase_at_coordinates(
         # 既存のRGBA画像はコピーして使用
         image = image.copy()
 
-    # ピクセルデータにアクセス
-    pixels = image.load()
-    width, height = image.size
+    erase_strokes_in_place(image, strokes, brush_size)
 
-    # ブラシの半径を計算
-    radius = brush_size // 2
+    return image
+
+
+def erase_with_mask(
+    image: Image.Image, mask: Image.Image, offset: tuple[int, int] = (0, 0)
+) -> Image.Image:
+    """
+    マスク画像の範囲のピクセルを透明にする（投げ縄・広範囲の消しゴム）
+
+    マスクの値 (0-255) の割合だけアルファを下げる (255 で完全に透明、0 で変更なし)。
+    座標ごとに処理せず、アルファチャンネル全体を1回の合成で更新する。
+
+    Args:
+        image: 処理対象の画像（PIL Image）
+        mask: マスク画像（1 または L 形式。それ以外はL形式に変換）
+        offset: マスクの左上を置く画像上の座標 (x, y)。画像外にはみ出した部分は無視する
+
+    Returns:
+        透過処理された画像（RGBA形式）
+    """
+    # 画像をRGBA形式に変換
+    if image.mode != "RGBA":
+        image = image.convert("RGBA")
+    else:
+        # 既存のRGBA画像はコピーして使用
+        image = image.copy()
+
+    if mask.mode != "L":
+        mask = mask.convert("L")
+
+    # マスクと画像が重なる範囲
+    left, top = offset
+    box = (
+        max(left, 0),
+        max(top, 0),
+        min(left + mask.width, image.width),
+        min(top + mask.height, image.height),
+    )
+    if box[0] >= box[2] or box[1] >= box[3]:
+        return image
 
-    # 各ストローク座標について処理
-    for stroke in strokes:
-        if len(stroke) != 2:
-            continue  # 不正な座標はスキップ
-
-        center_x, center_y = stroke
-
-        # ブラシサイズの範囲内のピクセルを透明化（円形ブラシ）
-        for dy in range(-radius, radius + 1):
-            for dx in range(-radius, radius + 1):
-                # 円形の判定（距離が半径以内かチェック）
-                if dx * dx + dy * dy <= radius * radius:
-                    x = center_x + dx
-                    y = center_y + dy
-
-                    # 画像の範囲内かチェック
-                    if 0 <= x < width and 0 <= y < height:
-                        r, g, b, a = pixels[x, y]
-                        pixels[x, y] = (r, g, b, 0)  # 完全に透明化
+    mask_region = mask.crop((box[0] - left, box[1] - top, box[2] - left, box[3] - top))
+    alpha = image.getchannel("A")
+    erased = ImageChops.multiply(alpha.crop(box), ImageChops.invert(mask_region))
+    alpha.paste(erased, box[:2])
+    image.putalpha(alpha)
 
     return image
@@ -0,0 +1,187 @@
+"""
+アルファマスクの転送形式
+透過処理・消しゴム処理はアルファチャンネルしか変更しないため、ブラウザが既に持っている
+元画像に重ねられるよう、アルファチャンネルだけをエンコードする
+
+- png1: 1ビットのPNG (アルファが ALPHA_THRESHOLD 以上を不透明とみなす)
+- png8: 8ビットグレースケールのPNG (アルファをそのまま保持)
+- rle: ランレングス符号化したバイナリ
+
+rle の形式 (すべてリトルエンディアン):
+
+    ヘッダー: マジック b"ARLE", 幅 (uint32), 高さ (uint32)
+    続いてランの並び: アルファ値 (uint8), 長さ (uint32)
+
+ランは行をまたいで左上から右下へ続き、長さの合計は 幅 × 高さ になる
+
+消しゴム処理で変更された範囲だけを送るパッチの形式 (すべてリトルエンディアン):
+
+    ヘッダー: マジック b"APCH", シーケンス番号 (uint32), x, y, 幅, 高さ (uint32)
+    続いて範囲のアルファ値 (幅 × 高さ バイト、左上から行ごと)
+"""
+
+import io
+import re
+import struct
+from typing import Optional, Tuple
+
+from PIL import Image
+
+MASK_FORMAT_PNG1 = "png1"
+MASK_FORMAT_PNG8 = "png8"
+MASK_FORMAT_RLE = "rle"
+
+# png1 で不透明とみなすアルファの下限
+ALPHA_THRESHOLD = 128
+
+RLE_MAGIC = b"ARLE"
+_RLE_HEADER = struct.Struct("<4sII")
+_RLE_RUN = struct.Struct("<BI")
+
+PATCH_MAGIC = b"APCH"
+_PATCH_HEADER = struct.Struct("<4sIIIII")
+
+# 同じバイトの連続 (正規表現エンジンで走査し、Pythonのループを1バイトごとに回さない)
+_RUN_PATTERN = re.compile(rb"(.)\1*", re.DOTALL)
+
+
+def extract_alpha(image: Image.Image) -> Image.Image:
+    """
+    画像のアルファチャンネルを取得
+
+    Args:
+        image: 画像
+
+    Returns:
+        アルファチャンネル (Lモード)。アルファのない画像はすべて不透明
+    """
+    if image.mode == "RGBA":
+        return image.getchannel("A")
+    if "A" in image.getbands() or "transparency" in image.info:
+        return image.convert("RGBA").getchannel("A")
+    return Image.new("L", image.size, 255)
+
+
+def encode_rle(alpha: Image.Image) -> bytes:
+    """
+    アルファチャンネルをランレングス符号化
+
+    Args:
+        alpha: アルファチャンネル (Lモード)
+
+    Returns:
+        rle 形式のバイト列
+    """
+    data = alpha.tobytes()
+    width, height = alpha.size
+    output = bytearray(_RLE_HEADER.pack(RLE_MAGIC, width, height))
+    for match in _RUN_PATTERN.finditer(data):
+        output += _RLE_RUN.pack(data[match.start()], match.end() - match.start())
+    return bytes(output)
+
+
+def decode_rle(data: bytes) -> Image.Image:
+    """
+    rle 形式のバイト列をアルファチャンネルに復元
+
+    Args:
+        data: rle 形式のバイト列
+
+    Returns:
+        アルファチャンネル (Lモード)
+
+    Raises:
+        ValueError: 形式が不正な場合
+    """
+    if len(data) < _RLE_HEADER.size:
+        raise ValueError("RLE mask is too short")
+    magic, width, height = _RLE_HEADER.unpack_from(data)
+    if magic != RLE_MAGIC:
+        raise ValueError("Invalid RLE mask magic")
+    if (len(data) - _RLE_HEADER.size) % _RLE_RUN.size:
+        raise ValueError("Truncated RLE mask")
+
+    pixels = bytearray()
+    for value, length in _RLE_RUN.iter_unpack(data[_RLE_HEADER.size :]):
+        pixels += bytes((value,)) * length
+    if len(pixels) != width * height:
+        raise ValueError("RLE mask length does not match its size")
+    return Image.frombytes("L", (width, height), bytes(pixels))
+
+
+def encode_alpha_mask(alpha: Image.Image, mask_format: str) -> Tuple[bytes, str]:
+    """
+    アルファチャンネルを指定の形式でエンコード
+
+    Args:
+        alpha: アルファチャンネル (Lモード)
+        mask_format: MASK_FORMAT_PNG1・MASK_FORMAT_PNG8・MASK_FORMAT_RLE
+
+    Returns:
+        タプル (エンコードした内容, MIMEタイプ)
+
+    Raises:
+        ValueError: 形式が不正な場合
+    """
+    if mask_format == MASK_FORMAT_RLE:
+        return encode_rle(alpha), "application/octet-stream"
+
+    if mask_format == MASK_FORMAT_PNG1:
+        mask = alpha.point(lambda value: 255 if value >= ALPHA_THRESHOLD else 0).convert(
+            "1", dither=Image.Dither.NONE
+        )
+    elif mask_format == MASK_FORMAT_PNG8:
+        mask = alpha
+    else:
+        raise ValueError(f"Unknown mask format: {mask_format}")
+
+    buffer = io.BytesIO()
+    mask.save(buffer, format="PNG")
+    return buffer.getvalue(), "image/png"
+
+
+def encode_alpha_patch(
+    sequence: int, box: Optional[Tuple[int, int, int, int]], alpha: Optional[Image.Image]
+) -> bytes:
+    """
+    変更された範囲のアルファ値をパッチ形式にエンコード
+
+    Args:
+        sequence: 変更のシーケンス番号
+        box: 変更された範囲 (left, top, right, bottom)。変更がない場合None
+        alpha: 範囲のアルファチャンネル (Lモード)。変更がない場合None
+
+    Returns:
+        パッチ形式のバイト列 (変更がない場合は幅・高さが0)
+    """
+    if box is None or alpha is None:
+        return _PATCH_HEADER.pack(PATCH_MAGIC, sequence, 0, 0, 0, 0)
+    left, top, right, bottom = box
+    header = _PATCH_HEADER.pack(PATCH_MAGIC, sequence, left, top, right - left, bottom - top)
+    return header + alpha.tobytes()
+
+
+def decode_alpha_patch(data: bytes) -> Tuple[int, Tuple[int, int], Optional[Image.Image]]:
+    """
+    パッチ形式のバイト列を復元
+
+    Args:
+        data: パッチ形式のバイト列
+
+    Returns:
+        タプル (シーケンス番号, 範囲の左上 (x, y), 範囲のアルファチャンネル (変更がない場合None))
+
+    Raises:
+        ValueError: 形式が不正な場合
+    """
+    if len(data) < _PATCH_HEADER.size:
+        raise ValueError("Alpha patch is too short")
+    magic, sequence, left, top, width, height = _PATCH_HEADER.unpack_from(data)
+    if magic != PATCH_MAGIC:
+        raise ValueError("Invalid alpha patch magic")
+    pixels = data[_PATCH_HEADER.size :]
+    if len(pixels) != width * height:
+        raise ValueError("Alpha patch length does not match its size")
+    if width == 0 or height == 0:
+        return sequence, (left, top), None
+    return sequence, (left, top), Image.frombytes("L", (width, height), pixels)
@@ -1,15 +1,62 @@
 """
 ファイルストレージの基盤機能
 一時ファイルの保存・管理を担当
+
+アップロードされたファイルの実体はSHA-256をキーにしたブロブとして一度だけ保存し、
+セッションディレクトリにはブロブへのハードリンクとマニフェストを置く。
+ブロブの参照数はハードリンク数 (st_nlink) で管理する。
+参照数の確認と削除がリンクの作成と交差しないよう、ブロブのシャードごとのロックで直列化する。
+
+セッションディレクトリはUUIDの先頭から作るシャード (ab/cd/<uuid>) 配下に置く。
 """
+
+import asyncio
+import errno
+import fcntl
+import hashlib
+import io
+import json
+import os
 import re
+import shutil
+import time
 import uuid
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Optional
+from typing import Any, Dict, Iterator, Optional, Union
+
+from PIL import Image
+
+from .settings import get_setting
 
 # プロジェクトのルートディレクトリ
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
-TMP_DIR = BASE_DIR / "tmp" / "transpalentor"
+
+# 一時ファイルの保存先 (TRANSPALENTOR_TMP_DIR で変更できる)
+TMP_DIR = Path(get_setting("TMP_DIR") or BASE_DIR / "tmp" / "transpalentor")
+
+# コンテンツアドレス方式のブロブ保存先
+BLOB_DIR = TMP_DIR / "_blobs"
+
+# ブロブのシャードごとのロックファイル名 (リンクの作成と解放を直列化する)
+BLOB_LOCK_FILENAME = ".lock"
+
+# 参照のないブロブを回収するまでの猶予 (秒)。保存直後のリンク前のブロブを消さないため
+ORPHAN_BLOB_MIN_AGE_SECONDS = 60 * 60
+
+# 書き込み時にfsyncするか (電源断時の永続性が必要な場合のみ有効にする)
+FSYNC_WRITES = False
+
+# アップロード中のファイルを書き出す一時ディレクトリ (ブロブと同じファイルシステム上に置く)
+STAGING_DIR = TMP_DIR / "_staging"
+
+# セッション内のファイル名とブロブのハッシュの対応を記録するファイル
+MANIFEST_FILENAME = ".manifest.json"
+
+# セッションディレクトリのシャード階層 (UUIDの先頭2文字ずつ2階層: ab/cd/<uuid>)
+# 1ディレクトリの子の数を抑え、セッション数が増えても参照・列挙が遅くならないようにする
+SESSION_SHARD_DEPTH = 2
+SESSION_SHARD_WIDTH = 2
 
 
 def generate_session_id() -> str:
@@ -39,17 +86,66 @@ def validate_session_id(session_id: str) -> bool:
         return False
 
 
-def get_session_directory(session_id: str) -> Path:
+def _sharded_session_directory(session_id: str) -> Path:
+    """セッションIDの先頭から作るシャードディレクトリ配下のパス (例: ab/cd/abcd1234-...)"""
+    shards = [
+        session_id[i * SESSION_SHARD_WIDTH : (i + 1) * SESSION_SHARD_WIDTH]
+        for i in range(SESSION_SHARD_DEPTH)
+    ]
+    return TMP_DIR.joinpath(*shards, session_id)
+
+
+def _migrate_flat_session_directory(session_id: str, session_dir: Path) -> None:
+    """
+    旧形式 (TMP_DIR直下) のセッションディレクトリがあればシャード配下へ移動
+    同じファイルシステム内のrenameなのでハードリンクやマニフェストはそのまま使える
+    """
+    flat_dir = TMP_DIR / session_id
+    if not flat_dir.is_dir():
+        return
+    session_dir.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.rename(flat_dir, session_dir)
+    except OSError:
+        # 別のワーカーが先に移動した場合や移動先が既に存在する場合は、移動先を正とする
+        pass
+
+
+def get_session_directory(session_id: str, migrate: bool = True) -> Path:
     """
     セッションIDに対応するディレクトリパスを取得
+    旧形式のディレクトリが残っている場合は、アクセス時にシャード配下へ移動する
 
     Args:
         session_id: セッションID(UUID v4形式)
+        migrate: 旧形式のディレクトリを確認・移動するか
+            (セッションインデックスで存在を確認済みの場合はFalseにしてstatを省く)
 
     Returns:
         セッションディレクトリのPath
     """
-    return TMP_DIR / session_id
+    session_dir = _sharded_session_directory(session_id)
+    if migrate and not session_dir.exists() and validate_session_id(session_id):
+        _migrate_flat_session_directory(session_id, session_dir)
+    return session_dir
+
+
+def iter_session_directories() -> Iterator[Path]:
+    """
+    存在するセッションディレクトリを列挙 (シャード配下と旧形式の両方)
+
+    Yields:
+        セッションディレクトリのPath
+    """
+    if not TMP_DIR.exists():
+        return
+    shard_pattern = "/".join(["?" * SESSION_SHARD_WIDTH] * SESSION_SHARD_DEPTH + ["*"])
+    for path in TMP_DIR.glob(shard_pattern):
+        if path.is_dir() and validate_session_id(path.name):
+            yield path
+    for path in TMP_DIR.iterdir():
+        if path.is_dir() and validate_session_id(path.name):
+            yield path
 
 
 def sanitize_filename(filename: str) -> str:
@@ -127,11 +223,489 @@ def is_path_safe(file_path: Path, allowed_base: Optional[Path] = None) -> bool:
         return False
 
 
-async def save_uploaded_file(
-    session_id: str, filename: str, file_content: bytes
-) -> Path:
+def atomic_write_bytes(file_path: Path, data: bytes, fsync: Optional[bool] = None) -> None:
+    """
+    一時ファイルに書き込んでからリネームし、ファイルを原子的に置き換える
+    読み込み側が書きかけのファイルを見ることはない。
+    既存ファイルがブロブへのハードリンクの場合もリンクを切って置き換えるため、
+    ブロブ本体が書き換わることはない
+
+    Args:
+        file_path: 書き込み先のパス
+        data: 書き込む内容
+        fsync: リネーム前後にfsyncして永続化を保証するか (デフォルトはFSYNC_WRITES)
+    """
+    if fsync is None:
+        fsync = FSYNC_WRITES
+
+    tmp_path = file_path.with_name(f".{file_path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with tmp_path.open("wb") as f:
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+    if fsync:
+        # リネーム自体を永続化するためディレクトリもfsyncする
+        dir_fd = os.open(file_path.parent, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+def encode_png(image: Image.Image) -> bytes:
+    """
+    画像をPNG形式のバイト列にエンコード
+
+    Args:
+        image: エンコードする画像
+
+    Returns:
+        PNGのバイト列
+    """
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def read_image_metadata(source: Union[Path, bytes]) -> Dict[str, Any]:
+    """
+    画像のヘッダーだけを読んで形式と寸法を取得
+
+    Args:
+        source: 画像ファイルのパスまたは内容
+
+    Returns:
+        image_format・width・heightの辞書。画像として読めない場合は空の辞書
+    """
+    try:
+        with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as image:
+            return {"image_format": image.format, "width": image.width, "height": image.height}
+    except Exception:
+        return {}
+
+
+def load_preview_raster(file_path: Path, max_size: int) -> Image.Image:
+    """
+    長辺が max_size 以下になるよう縮小した画像を読み込む (プレビュー用)
+    JPEGはデコード時に縮小し、残りを整数分の1の縮小 (Image.reduce) で行う
+
+    Args:
+        file_path: 画像ファイルのパス
+        max_size: 長辺の上限 (ピクセル)
+
+    Returns:
+        縮小した画像 (RGBA形式)
+    """
+    with Image.open(file_path) as image:
+        factor = -(-max(image.size) // max_size)
+        if factor > 1:
+            image.draft(image.mode, (image.width // factor, image.height // factor))
+            factor = -(-max(image.size) // max_size)
+        raster = image.convert("RGBA")
+    return raster.reduce(factor) if factor > 1 else raster
+
+
+def compute_file_hash(file_path: Path) -> str:
+    """
+    ファイル内容のSHA-256を計算
+
+    Args:
+        file_path: 対象ファイルのパス
+
+    Returns:
+        16進数表記のハッシュ値
+    """
+    digest = hashlib.sha256()
+    with file_path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_blob_path(content_hash: str) -> Path:
+    """
+    ハッシュ値に対応するブロブのパスを取得
+
+    Args:
+        content_hash: SHA-256 (16進数表記)
+
+    Returns:
+        ブロブのPath
+
+    Raises:
+        ValueError: ハッシュ値の形式が不正な場合
+    """
+    if not re.fullmatch(r"[0-9a-f]{64}", content_hash):
+        raise ValueError(f"Invalid content hash: {content_hash}")
+    return BLOB_DIR / content_hash[:2] / content_hash
+
+
+@contextmanager
+def _blob_lock(content_hash: str) -> Iterator[None]:
+    """
+    ブロブへのリンクの作成と解放を、ワーカー間で直列化する排他ロック
+    (ブロブのシャードのディレクトリごとにロックする)
+
+    Args:
+        content_hash: ブロブのハッシュ値
+
+    Raises:
+        ValueError: ハッシュ値の形式が不正な場合
+    """
+    shard_dir = get_blob_path(content_hash).parent
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    with (shard_dir / BLOB_LOCK_FILENAME).open("a") as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def _move_file(source: Path, destination: Path) -> None:
+    """
+    ファイルを置き換えで移動
+    別のファイルシステムの場合は移動先のディレクトリにコピーしてfsyncしてから置き換える
+
+    Args:
+        source: 移動元のパス
+        destination: 移動先のパス
+    """
+    try:
+        os.replace(source, destination)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+    tmp_path = destination.with_name(f".{destination.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with source.open("rb") as src, tmp_path.open("wb") as dst:
+            shutil.copyfileobj(src, dst)
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.replace(tmp_path, destination)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    source.unlink(missing_ok=True)
+
+
+def store_blob(content: bytes, content_hash: Optional[str] = None) -> str:
+    """
+    ファイル内容をブロブとして保存 (既に存在する場合は書き込まない)
+
+    Args:
+        content: ファイルの内容
+        content_hash: 計算済みのSHA-256 (省略時は計算する)
+
+    Returns:
+        ブロブのハッシュ値
+    """
+    if content_hash is None:
+        content_hash = hashlib.sha256(content).hexdigest()
+
+    blob_path = get_blob_path(content_hash)
+    if not blob_path.exists():
+        blob_path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write_bytes(blob_path, content)
+
+    return content_hash
+
+
+def get_blob_refcount(content_hash: str) -> int:
+    """
+    ブロブを参照しているセッションファイルの数を取得
+
+    Args:
+        content_hash: ブロブのハッシュ値
+
+    Returns:
+        参照数 (ブロブが存在しない場合は0)
+    """
+    try:
+        return get_blob_path(content_hash).stat().st_nlink - 1
+    except FileNotFoundError:
+        return 0
+
+
+def link_blob(content_hash: str, file_path: Path) -> None:
+    """
+    ブロブをセッションディレクトリ内のファイルとしてリンク
+    ハードリンクを作成できないファイルシステムではコピーする
+
+    Args:
+        content_hash: ブロブのハッシュ値
+        file_path: リンク先のパス
+
+    Raises:
+        FileNotFoundError: ブロブが存在しない場合
+    """
+    with _blob_lock(content_hash):
+        _link_blob_locked(content_hash, file_path)
+
+
+def _link_blob_locked(content_hash: str, file_path: Path) -> None:
+    """ブロブをリンク (_blob_lock を保持して呼び出す)"""
+    blob_path = get_blob_path(content_hash)
+    tmp_path = file_path.with_name(f".{file_path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        os.link(blob_path, tmp_path)
+    except FileNotFoundError:
+        raise
+    except OSError:
+        shutil.copyfile(blob_path, tmp_path)
+    os.replace(tmp_path, file_path)
+
+
+def read_manifest(session_dir: Path) -> Dict[str, str]:
+    """
+    セッションのマニフェスト (ファイル名 -> ブロブのハッシュ値) を読み込む
+
+    Args:
+        session_dir: セッションディレクトリ
+
+    Returns:
+        ファイル名とハッシュ値の辞書
+    """
+    try:
+        manifest: Dict[str, str] = json.loads((session_dir / MANIFEST_FILENAME).read_text())
+    except (OSError, ValueError):
+        return {}
+    return manifest
+
+
+def _record_manifest_entry(session_dir: Path, filename: str, content_hash: str) -> None:
+    """マニフェストにファイルとブロブの対応を追記"""
+    manifest = read_manifest(session_dir)
+    manifest[filename] = content_hash
+    atomic_write_bytes(session_dir / MANIFEST_FILENAME, json.dumps(manifest).encode("utf-8"))
+
+
+def get_file_hash(session_id: str, filename: str) -> Optional[str]:
+    """
+    セッションファイルのブロブハッシュをマニフェストから取得
+
+    ファイルがその後上書きされていないか (ブロブと同一inodeか) も確認する
+
+    Args:
+        session_id: セッションID
+        filename: ファイル名
+
+    Returns:
+        ハッシュ値。記録がない・内容が変わっている場合はNone
+    """
+    session_dir = get_session_directory(session_id)
+    content_hash = read_manifest(session_dir).get(filename)
+    if content_hash is None:
+        return None
+
+    try:
+        if os.path.samefile(session_dir / filename, get_blob_path(content_hash)):
+            return content_hash
+    except (OSError, ValueError):
+        return None
+    return None
+
+
+def release_blob(content_hash: str) -> bool:
+    """
+    参照がなくなったブロブを削除
+
+    Args:
+        content_hash: ブロブのハッシュ値
+
+    Returns:
+        削除した場合True
+    """
+    blob_path = get_blob_path(content_hash)
+    with _blob_lock(content_hash):
+        try:
+            if blob_path.stat().st_nlink > 1:
+                return False
+            blob_path.unlink()
+            return True
+        except FileNotFoundError:
+            return False
+
+
+def delete_session_files(session_id: str) -> bool:
+    """
+    セッションディレクトリを削除し、参照されなくなったブロブも解放する
+
+    Args:
+        session_id: セッションID
+
+    Returns:
+        セッションが存在して削除した場合True
+
+    Raises:
+        ValueError: セッションIDが無効な場合
+    """
+    if not validate_session_id(session_id):
+        raise ValueError(f"Invalid session_id format: {session_id}")
+
+    session_dir = get_session_directory(session_id)
+    if not session_dir.exists():
+        return False
+
+    content_hashes = set(read_manifest(session_dir).values())
+    shutil.rmtree(session_dir, ignore_errors=True)
+
+    for content_hash in content_hashes:
+        try:
+            release_blob(content_hash)
+        except ValueError:
+            continue
+
+    return True
+
+
+def collect_orphan_blobs(min_age: float = ORPHAN_BLOB_MIN_AGE_SECONDS) -> int:
+    """
+    どのセッションからも参照されていないブロブを削除
+    マニフェストを経由せずに削除されたセッションの後始末に使う (定期実行される)
+
+    保存直後でまだリンクされていないブロブを消さないよう、作成・リンク数の変更から
+    min_age 秒以上経過したものだけを対象にする
+
+    Args:
+        min_age: 削除の対象にする最終変更からの経過時間 (秒)
+
+    Returns:
+        削除したブロブの数
+    """
+    removed = 0
+    if not BLOB_DIR.exists():
+        return removed
+
+    cutoff = time.time() - min_age
+    for blob_path in BLOB_DIR.glob("*/*"):
+        if blob_path.name.startswith("."):
+            continue
+        try:
+            stat = blob_path.stat()
+            # リンクの作成・削除で ctime が更新される
+            if stat.st_nlink > 1 or max(stat.st_mtime, stat.st_ctime) > cutoff:
+                continue
+            if release_blob(blob_path.name):
+                removed += 1
+        except (OSError, ValueError):
+            continue
+
+    return removed
+
+
+def link_blob_to_session(session_id: str, filename: str, content_hash: str) -> Path:
+    """
+    保存済みのブロブをセッションのファイルとしてリンク
+    ファイル内容の転送なしでセッションを作成する場合に使う
+
+    Args:
+        session_id: セッションID
+        filename: ファイル名(サニタイズ済み)
+        content_hash: ブロブのハッシュ値
+
+    Returns:
+        リンクされたファイルのパス
+
+    Raises:
+        ValueError: セッションIDが無効な場合
+        FileNotFoundError: ブロブが存在しない場合
+        RuntimeError: パスが安全でない場合
+    """
+    session_dir = ensure_session_directory(session_id)
+    file_path = session_dir / filename
+
+    if not is_path_safe(file_path):
+        raise RuntimeError(f"Unsafe file path detected: {file_path}")
+
+    link_blob(content_hash, file_path)
+    _record_manifest_entry(session_dir, filename, content_hash)
+    return file_path
+
+
+def create_staging_path() -> Path:
+    """
+    アップロードを書き出す一時ファイルのパスを生成
+
+    Returns:
+        一時ファイルのPath (ファイルはまだ作成されない)
+    """
+    STAGING_DIR.mkdir(parents=True, exist_ok=True)
+    return STAGING_DIR / f"{uuid.uuid4().hex}.part"
+
+
+def staging_bytes() -> int:
+    """
+    書き出し中・取り込み前のアップロードの一時ファイルの合計サイズを取得
+
+    Returns:
+        合計サイズ (bytes)
+    """
+    if not STAGING_DIR.exists():
+        return 0
+    total = 0
+    for path in STAGING_DIR.iterdir():
+        try:
+            total += path.stat().st_size
+        except OSError:
+            continue
+    return total
+
+
+def save_staged_file(session_id: str, filename: str, staged_path: Path, content_hash: str) -> Path:
+    """
+    一時ファイルに書き出し済みのアップロードをブロブへ移動し、セッションにリンク
+    同じ内容のブロブが既にある場合は一時ファイルを破棄する
+
+    Args:
+        session_id: セッションID
+        filename: ファイル名(サニタイズ済み)
+        staged_path: 一時ファイルのパス
+        content_hash: 一時ファイルの内容のSHA-256
+
+    Returns:
+        保存されたファイルのパス
+
+    Raises:
+        ValueError: セッションIDが無効な場合
+        RuntimeError: ファイル保存に失敗した場合
+    """
+    session_dir = ensure_session_directory(session_id)
+    file_path = session_dir / filename
+
+    if not is_path_safe(file_path):
+        staged_path.unlink(missing_ok=True)
+        raise RuntimeError(f"Unsafe file path detected: {file_path}")
+
+    try:
+        blob_path = get_blob_path(content_hash)
+        # ブロブの配置からリンクまでの間に別のリクエストに解放されないようにする
+        with _blob_lock(content_hash):
+            if not blob_path.exists():
+                _move_file(staged_path, blob_path)
+            _link_blob_locked(content_hash, file_path)
+
+        _record_manifest_entry(session_dir, filename, content_hash)
+        return file_path
+    except Exception as e:
+        raise RuntimeError(f"Failed to save file: {e}")
+    finally:
+        # 既に同じブロブがあった場合の一時ファイルを破棄
+        staged_path.unlink(missing_ok=True)
+
+
+async def save_uploaded_file(session_id: str, filename: str, file_content: bytes) -> Path:
     """
     アップロードされたファイルを保存
+    内容はブロブとして一度だけ保存し、セッションディレクトリにはリンクを作成する
 
     Args:
         session_id: セッションID
@@ -155,9 +729,19 @@ async def save_uploaded_file(
     if not is_path_safe(file_path):
         raise RuntimeError(f"Unsafe file path detected: {file_path}")
 
-    # ファイルを保存
+    # ブロブとして保存してセッションにリンク (ディスクI/Oはスレッドプールで行う)
     try:
-        file_path.write_bytes(file_content)
+        await asyncio.to_thread(_store_and_link, session_dir, filename, file_content)
         return file_path
     except Exception as e:
         raise RuntimeError(f"Failed to save file: {e}")
+
+
+def _store_and_link(session_dir: Path, filename: str, file_content: bytes) -> None:
+    """ファイル内容をブロブとして保存し、セッションにリンクしてマニフェストに記録"""
+    file_path = session_dir / filename
+    content_hash = hashlib.sha256(file_content).hexdigest()
+    # 保存からリンクまでの間に別のリクエストにブロブを解放されないようにする
+    with _blob_lock(content_hash):
+        _link_blob_locked(store_blob(file_content, content_hash), file_path)
+    _record_manifest_entry(session_dir, filename, content_hash)
@@ -0,0 +1,426 @@
+"""
+アップロード時の画像の事前計算
+アップロードされた元画像をバックグラウンドで1回だけデコードし、透過処理やUIの補助で
+使う以下のデータを元画像のSHA-256をキーにメモリに保持する
+
+- 寸法と形式
+- 作業用ラスター (デコード済みのRGBA画像。透過処理などでファイルを読み直さずに使う)
+- 縮小画像のピラミッド (長辺 PYRAMID_SIZES 以下、Image.reduce で作成) とサムネイル
+- 色のヒストグラム (チャンネルごと、および色の種類が少ない場合は不透明な画素の色ごとの画素数)
+- 背景色の候補 (画像の外周で多い色)
+
+計算は最大 MAX_CONCURRENT_ANALYSES 件を並行して行い、保持するラスターの合計が
+MEMORY_LIMIT を超えると最も古い結果から削除する。保持したラスターとピラミッドは
+共有されるため、利用側は変更しない
+
+縮小画像を配信する際のPNGは、内容のSHA-256と段をキーに別のLRU (LEVEL_CACHE_LIMIT) で
+保持する。画像が変更されるとハッシュが変わるため、古い内容の縮小画像は参照されなくなる
+"""
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, cast
+
+from PIL import Image
+
+from .file_storage import encode_png
+
+# ピラミッドの各段の長辺の上限 (ピクセル)
+PYRAMID_SIZES = (256, 512, 1024, 2048)
+
+# サムネイルの長辺の上限 (ピクセル、PYRAMID_SIZES のいずれか)
+THUMBNAIL_SIZE = 256
+
+# 色ごとの画素数を数える色の種類の上限 (超える場合はチャンネルごとのヒストグラムのみ)
+MAX_HISTOGRAM_COLORS = 65536
+
+# 背景色の候補の数
+BORDER_COLOR_CANDIDATES = 3
+
+# 同時に計算する画像の数
+MAX_CONCURRENT_ANALYSES = 2
+
+# 保持する計算結果の合計サイズの上限 (bytes、ラスターとピラミッドの画素数から見積もる)
+MEMORY_LIMIT = 512 * 1024 * 1024
+
+# 配信用にエンコードした縮小画像の合計サイズの上限 (bytes)
+LEVEL_CACHE_LIMIT = 64 * 1024 * 1024
+
+
+def _build_pyramid(raster: Image.Image) -> Dict[int, Image.Image]:
+    """
+    長辺が PYRAMID_SIZES 以下の縮小画像を作成 (元画像より小さい段のみ)
+    大きい段から順に作成し、小さい段は1つ上の段から縮小する
+    """
+    pyramid: Dict[int, Image.Image] = {}
+    source = raster
+    for size in sorted(PYRAMID_SIZES, reverse=True):
+        if max(raster.size) <= size:
+            continue
+        factor = -(-max(source.size) // size)
+        if factor > 1:
+            source = source.reduce(factor)
+        pyramid[size] = source
+    return pyramid
+
+
+def _border_colors(raster: Image.Image) -> List[List[int]]:
+    """画像の外周 (上下の行と左右の列) で画素数の多い色を取得 (不透明な画素のみ)"""
+    width, height = raster.size
+    edges = [
+        raster.crop((0, 0, width, 1)),
+        raster.crop((0, height - 1, width, height)),
+        raster.crop((0, 0, 1, height)),
+        raster.crop((width - 1, 0, width, height)),
+    ]
+    counts: Dict[tuple, int] = {}
+    for edge in edges:
+        for count, color in edge.getcolors(edge.width * edge.height) or []:
+            r, g, b, a = cast(Tuple[int, int, int, int], color)
+            if a:
+                counts[(r, g, b)] = counts.get((r, g, b), 0) + count
+    ranked = sorted(counts.items(), key=lambda item: item[1], reverse=True)
+    return [list(color) for color, _ in ranked[:BORDER_COLOR_CANDIDATES]]
+
+
+def count_visible_colors(
+    raster: Image.Image, max_colors: Optional[int] = None
+) -> Optional[List[Tuple[int, Tuple[int, int, int]]]]:
+    """
+    完全に透明ではない画素を色 (RGB) ごとに数える
+
+    Args:
+        raster: 画像 (RGBA形式)
+        max_colors: 色の種類の上限 (省略時は上限なし)
+
+    Returns:
+        [(画素数, (R, G, B)), ...]。色の種類が上限を超える場合None
+    """
+    if max_colors is None:
+        max_colors = raster.width * raster.height
+    rgba_colors = raster.getcolors(max_colors)
+    if rgba_colors is None:
+        return None
+    counts: Dict[Tuple[int, int, int], int] = {}
+    for count, color in rgba_colors:
+        r, g, b, a = cast(Tuple[int, int, int, int], color)
+        if a:
+            counts[(r, g, b)] = counts.get((r, g, b), 0) + count
+    return [(count, color) for color, count in counts.items()]
+
+
+def analyze_image(file_path: Path, content_hash: str) -> Dict[str, Any]:
+    """
+    画像をデコードし、事前計算のデータを作成
+
+    Args:
+        file_path: 画像ファイルのパス
+        content_hash: 画像の内容のSHA-256
+
+    Returns:
+        計算結果の辞書 (content_hash・image_format・width・height・raster・pyramid・
+        thumbnail (PNG)・histogram・colors・border_colors・nbytes)
+    """
+    with Image.open(file_path) as image:
+        image_format = image.format
+        image.load()
+        raster = image if image.mode == "RGBA" else image.convert("RGBA")
+
+    pyramid = _build_pyramid(raster)
+    rgb = raster.convert("RGB")
+
+    return {
+        "content_hash": content_hash,
+        "image_format": image_format,
+        "width": raster.width,
+        "height": raster.height,
+        "raster": raster,
+        "pyramid": pyramid,
+        "thumbnail": encode_png(pyramid.get(THUMBNAIL_SIZE, raster)),
+        "histogram": rgb.histogram(),
+        "colors": count_visible_colors(raster, MAX_HISTOGRAM_COLORS),
+        "border_colors": _border_colors(raster),
+        "nbytes": sum(level.width * level.height * 4 for level in [raster, *pyramid.values()]),
+    }
+
+
+def pyramid_level_for(size: int) -> Optional[int]:
+    """
+    要求された長辺に対応するピラミッドの段を取得
+
+    Args:
+        size: 長辺の上限 (ピクセル)
+
+    Returns:
+        size 以上で最も小さい段。すべての段より大きい場合None (縮小しない)
+    """
+    for level in sorted(PYRAMID_SIZES):
+        if level >= size:
+            return level
+    return None
+
+
+def reduce_to_fit(image: Image.Image, max_size: int) -> Image.Image:
+    """
+    長辺が max_size 以下になるよう整数分の1に縮小 (Image.reduce)
+
+    Args:
+        image: 画像
+        max_size: 長辺の上限 (ピクセル)
+
+    Returns:
+        縮小画像 (縮小が不要な場合は image そのもの)
+    """
+    factor = -(-max(image.size) // max_size)
+    return image.reduce(factor) if factor > 1 else image
+
+
+def select_level(analysis: Dict[str, Any], max_size: int) -> Image.Image:
+    """
+    長辺が max_size 以下の縮小画像を取得
+    ピラミッドのうち max_size 以上で最も小さい段 (ない場合はラスター) から縮小する
+
+    Args:
+        analysis: analyze_image の計算結果
+        max_size: 長辺の上限 (ピクセル)
+
+    Returns:
+        縮小画像 (RGBA形式。共有されるため変更しない)
+    """
+    source = analysis["raster"]
+    for size, level in sorted(analysis["pyramid"].items()):
+        if size >= max_size:
+            source = level
+            break
+    return reduce_to_fit(source, max_size)
+
+
+def sample_pixels(
+    raster: Image.Image, points: List[Tuple[int, int]], size: int = 1
+) -> List[Optional[List[int]]]:
+    """
+    指定座標の画素値、または座標を中心とする size × size の範囲の平均を取得
+    範囲は画像の内側に切り詰める。平均は Image.resize (BOX) で計算するため、
+    アルファで重み付けされる (完全に透明な画素の色は含まれない)
+
+    Args:
+        raster: RGBA形式の画像
+        points: 座標のリスト [(x, y), ...]
+        size: 平均をとる範囲の一辺 (奇数。1 の場合はその画素の値)
+
+    Returns:
+        座標ごとの [R, G, B, A]。座標が画像の外の場合None
+    """
+    width, height = raster.size
+    radius = size // 2
+    samples: List[Optional[List[int]]] = []
+    for x, y in points:
+        if not (0 <= x < width and 0 <= y < height):
+            samples.append(None)
+            continue
+        if radius == 0:
+            samples.append(list(cast(Tuple[int, ...], raster.getpixel((x, y)))))
+            continue
+        # 画像全体に resize(box=...) を使うと遅いため、先に範囲を切り出す
+        region = raster.crop(
+            (
+                max(x - radius, 0),
+                max(y - radius, 0),
+                min(x + radius + 1, width),
+                min(y + radius + 1, height),
+            )
+        )
+        pixel = region.resize((1, 1), Image.Resampling.BOX).getpixel((0, 0))
+        samples.append(list(cast(Tuple[int, ...], pixel)))
+    return samples
+
+
+class ImageAnalysisStore:
+    """
+    事前計算をスレッドプールで実行し、結果をLRUで保持する
+
+    同じ内容の画像の計算は1回だけ行い、計算中の画像を要求された場合は完了を待つ。
+    """
+
+    def __init__(
+        self,
+        max_workers: int = MAX_CONCURRENT_ANALYSES,
+        memory_limit: int = MEMORY_LIMIT,
+        level_cache_limit: int = LEVEL_CACHE_LIMIT,
+    ) -> None:
+        self.memory_limit = memory_limit
+        self.level_cache_limit = level_cache_limit
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="image-analysis"
+        )
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._pending: "Dict[str, Future[Optional[Dict[str, Any]]]]" = {}
+        self._memory_bytes = 0
+        self._levels: "OrderedDict[Tuple[str, int], bytes]" = OrderedDict()
+        self._level_bytes = 0
+        self.analyses = 0
+        self.failures = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.level_hits = 0
+        self.level_misses = 0
+
+    def submit(self, content_hash: str, file_path: Path) -> None:
+        """
+        画像の事前計算を予約 (計算済み・計算中の場合は何もしない)
+
+        Args:
+            content_hash: 画像の内容のSHA-256
+            file_path: 画像ファイルのパス
+        """
+        with self._lock:
+            if content_hash in self._entries or content_hash in self._pending:
+                return
+            self._pending[content_hash] = self._executor.submit(self._run, content_hash, file_path)
+
+    def _run(self, content_hash: str, file_path: Path) -> Optional[Dict[str, Any]]:
+        """事前計算を実行して結果を保持 (スレッドプールで実行)"""
+        try:
+            analysis = analyze_image(file_path, content_hash)
+        except Exception:
+            # 計算できない場合は利用側が従来どおりファイルから処理する
+            with self._lock:
+                self.failures += 1
+                self._pending.pop(content_hash, None)
+            return None
+
+        with self._lock:
+            self.analyses += 1
+            self._pending.pop(content_hash, None)
+            self._remember(content_hash, analysis)
+        return analysis
+
+    def _remember(self, content_hash: str, analysis: Dict[str, Any]) -> None:
+        """結果を保持し、上限を超えた分を古い順に削除 (ロック取得済みで呼ぶ)"""
+        if analysis["nbytes"] > self.memory_limit:
+            return
+        self._entries[content_hash] = analysis
+        self._memory_bytes += analysis["nbytes"]
+        while self._memory_bytes > self.memory_limit:
+            _, evicted = self._entries.popitem(last=False)
+            self._memory_bytes -= evicted["nbytes"]
+            self.evictions += 1
+
+    def get(self, content_hash: Optional[str], wait: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        事前計算の結果を取得
+
+        Args:
+            content_hash: 画像の内容のSHA-256
+            wait: 計算中の場合に完了を待つか
+
+        Returns:
+            計算結果。計算していない (または計算中で wait が False の) 場合None
+        """
+        if content_hash is None:
+            return None
+        with self._lock:
+            analysis = self._entries.get(content_hash)
+            if analysis is not None:
+                self._entries.move_to_end(content_hash)
+                self.hits += 1
+                return analysis
+            future = self._pending.get(content_hash) if wait else None
+            if future is None:
+                self.misses += 1
+                return None
+
+        analysis = future.result()
+        with self._lock:
+            if analysis is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return analysis
+
+    def get_level(self, content_hash: str, size: int) -> Optional[bytes]:
+        """
+        配信用にエンコードした縮小画像を取得
+
+        Args:
+            content_hash: 画像の内容のSHA-256
+            size: ピラミッドの段 (長辺の上限)
+
+        Returns:
+            PNGのバイト列。保持していない場合None
+        """
+        with self._lock:
+            data = self._levels.get((content_hash, size))
+            if data is None:
+                self.level_misses += 1
+                return None
+            self._levels.move_to_end((content_hash, size))
+            self.level_hits += 1
+            return data
+
+    def put_level(self, content_hash: str, size: int, data: bytes) -> None:
+        """
+        配信用にエンコードした縮小画像を保持し、上限を超えた分を古い順に削除
+
+        Args:
+            content_hash: 画像の内容のSHA-256
+            size: ピラミッドの段 (長辺の上限)
+            data: PNGのバイト列
+        """
+        if len(data) > self.level_cache_limit:
+            return
+        with self._lock:
+            previous = self._levels.pop((content_hash, size), None)
+            if previous is not None:
+                self._level_bytes -= len(previous)
+            self._levels[(content_hash, size)] = data
+            self._level_bytes += len(data)
+            while self._level_bytes > self.level_cache_limit:
+                _, evicted = self._levels.popitem(last=False)
+                self._level_bytes -= len(evicted)
+
+    def clear(self) -> None:
+        """保持している結果と統計を削除 (計算中のものは完了後に保持される)"""
+        with self._lock:
+            self._entries.clear()
+            self._memory_bytes = 0
+            self._levels.clear()
+            self._level_bytes = 0
+            self.level_hits = 0
+            self.level_misses = 0
+            self.analyses = 0
+            self.failures = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        事前計算の統計情報を取得
+
+        Returns:
+            計算数・ヒット数・保持数・使用量などの辞書
+        """
+        with self._lock:
+            return {
+                "analyses": self.analyses,
+                "failures": self.failures,
+                "pending": len(self._pending),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "memory_bytes": self._memory_bytes,
+                "memory_limit": self.memory_limit,
+                "level_hits": self.level_hits,
+                "level_misses": self.level_misses,
+                "level_entries": len(self._levels),
+                "level_bytes": self._level_bytes,
+            }
+
+
+image_analysis = ImageAnalysisStore()
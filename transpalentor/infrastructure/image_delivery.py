@@ -0,0 +1,303 @@
+"""
+画像配信のオフロード・署名付きURL・キャッシュ検証
+画像の本体をPython (ASGI) を通さずフロントのプロキシに送らせるためのヘッダーと、
+プロキシ側でも検証できる期限付きの署名、内容のハッシュによるETagとバージョン付きURLを扱う
+
+- オフロード: X-Accel-Redirect (nginx) または X-Sendfile (Apache, lighttpd) ヘッダーで
+  ファイルの場所だけを返し、プロキシに sendfile で送信させる
+- 署名付きURL: nginx の secure_link モジュールと同じ形式
+  (md5 = base64url(MD5("{expires}{uri} {secret}")) をパディングなしで、
+  クエリ ?md5=...&expires=... に付ける)。有効期限は一定の単位に切り捨て、
+  同じ時間帯に発行したURLを同じにしてブラウザのキャッシュを効かせる
+
+設定は環境変数で行う (delivery_from_settings):
+TRANSPALENTOR_OFFLOAD_MODE (x-accel-redirect / x-sendfile)、TRANSPALENTOR_SIGNED_URLS、
+TRANSPALENTOR_SIGNED_URL_TTL (秒)、TRANSPALENTOR_URL_SIGNING_SECRET
+(未設定の場合は SIGNING_SECRET_PATH のファイル)
+
+nginxの設定例 (secret は SIGNING_SECRET_PATH のファイルの内容)。
+署名はプロキシでも検証して不正なリクエストを先に落とすが、各リクエストは引き続き
+Python が検証・解決し、オフロードされるのはバイト列の送信だけ
+(セッションディレクトリの振り分けは X-Accel-Redirect の値にすでに含まれる):
+
+    location ~ ^/api/images/[^/]+/[^/]+$ {
+        secure_link $arg_md5,$arg_expires;
+        secure_link_md5 "$secure_link_expires$uri <secret>";
+        if ($secure_link = "") { return 403; }
+        if ($secure_link = "0") { return 410; }
+        proxy_pass http://app;
+    }
+    location /_protected/ {
+        internal;
+        alias /path/to/tmp/transpalentor/;
+    }
+"""
+
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Mapping, Optional
+
+from .file_storage import TMP_DIR
+from .settings import get_bool_setting, get_int_setting, get_setting
+
+# オフロードの方式
+OFFLOAD_X_ACCEL_REDIRECT = "x-accel-redirect"
+OFFLOAD_X_SENDFILE = "x-sendfile"
+
+# X-Accel-Redirect で指定する内部ロケーションの接頭辞 (TMP_DIR に対応させる)
+ACCEL_REDIRECT_PREFIX = "/_protected/"
+
+# 署名付きURLの有効期間 (秒)
+SIGNED_URL_TTL_SECONDS = 60 * 60
+
+# 署名付きURLの有効期限を切り捨てる単位 (秒)。有効期間の半分を上限とするため、
+# 発行したURLは有効期間の半分以上は必ず有効
+SIGNED_URL_EXPIRY_BUCKET_SECONDS = 15 * 60
+
+# 署名の秘密鍵の保存先 (全ワーカーとプロキシで共有する)
+SIGNING_SECRET_PATH = TMP_DIR / "_index" / "url_signing_secret"
+
+# バージョン付きURL (?v=) に使う内容のハッシュの長さ
+CONTENT_VERSION_LENGTH = 16
+
+# バージョンが内容と一致するURLのキャッシュ指定 (内容が変わるとURLも変わる)
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+# バージョンのないURLのキャッシュ指定 (毎回ETagで再検証する)
+REVALIDATE_CACHE_CONTROL = "private, no-cache"
+
+
+def content_version(content_hash: str) -> str:
+    """
+    内容のハッシュからURLのバージョンを作成
+
+    Args:
+        content_hash: 内容のSHA-256
+
+    Returns:
+        バージョン文字列
+    """
+    return content_hash[:CONTENT_VERSION_LENGTH]
+
+
+def make_etag(content_hash: str) -> str:
+    """
+    内容のハッシュから強いETagを作成
+
+    Args:
+        content_hash: 内容のSHA-256
+
+    Returns:
+        ETagヘッダーの値
+    """
+    return f'"{content_hash}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    If-None-MatchヘッダーがETagに一致するか (弱い比較)
+
+    Args:
+        if_none_match: If-None-Matchヘッダーの値
+        etag: 現在のETag
+
+    Returns:
+        一致する場合True
+    """
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def sign_path(path: str, expires: int, secret: str) -> str:
+    """
+    nginx secure_link_md5 "$secure_link_expires$uri <secret>" と同じ署名を計算
+
+    Args:
+        path: URLのパス (クエリを含まない)
+        expires: 有効期限 (UNIX時間)
+        secret: 秘密鍵
+
+    Returns:
+        base64url (パディングなし) 形式の署名
+    """
+    digest = hashlib.md5(f"{expires}{path} {secret}".encode("utf-8")).digest()
+    return base64.urlsafe_b64encode(digest).decode("ascii").rstrip("=")
+
+
+def _load_or_create_secret(secret_path: Path) -> str:
+    """秘密鍵を読み込む (存在しない場合は作成する。同時に作成された場合は先勝ち)"""
+    try:
+        return secret_path.read_text(encoding="utf-8").strip()
+    except FileNotFoundError:
+        pass
+
+    secret_path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        fd = os.open(secret_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        return secret_path.read_text(encoding="utf-8").strip()
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        secret = secrets.token_urlsafe(32)
+        f.write(secret)
+    return secret
+
+
+class ImageDelivery:
+    """画像配信のオフロードと署名付きURLの設定"""
+
+    def __init__(
+        self,
+        offload_mode: Optional[str] = None,
+        signed_urls: bool = False,
+        url_ttl: int = SIGNED_URL_TTL_SECONDS,
+        url_bucket: int = SIGNED_URL_EXPIRY_BUCKET_SECONDS,
+        secret: Optional[str] = None,
+        secret_path: Path = SIGNING_SECRET_PATH,
+        base_dir: Path = TMP_DIR,
+        accel_prefix: str = ACCEL_REDIRECT_PREFIX,
+    ) -> None:
+        if url_ttl <= 0:
+            raise ValueError(f"Signed URL TTL must be positive: {url_ttl}")
+        self.offload_mode: Optional[str] = None
+        self.signed_urls = signed_urls
+        self.url_ttl = url_ttl
+        self.url_bucket = max(1, min(url_bucket, url_ttl // 2))
+        self.secret_path = secret_path
+        self.base_dir = base_dir
+        self.accel_prefix = accel_prefix
+        self._secret = secret
+        self._secret_lock = threading.Lock()
+        self.configure(offload_mode=offload_mode, signed_urls=signed_urls)
+
+    def configure(
+        self, offload_mode: Optional[str] = None, signed_urls: Optional[bool] = None
+    ) -> None:
+        """
+        オフロードの方式と署名付きURLの有無を設定
+
+        Args:
+            offload_mode: OFFLOAD_X_ACCEL_REDIRECT・OFFLOAD_X_SENDFILE・None (オフロードしない)
+            signed_urls: 署名付きURLを発行・検証するか (Noneの場合は変更しない)
+
+        Raises:
+            ValueError: オフロードの方式が不正な場合
+        """
+        if offload_mode not in (None, OFFLOAD_X_ACCEL_REDIRECT, OFFLOAD_X_SENDFILE):
+            raise ValueError(f"Unknown offload mode: {offload_mode}")
+        self.offload_mode = offload_mode
+        if signed_urls is not None:
+            self.signed_urls = signed_urls
+
+    @property
+    def secret(self) -> str:
+        """署名の秘密鍵"""
+        if self._secret is None:
+            with self._secret_lock:
+                if self._secret is None:
+                    self._secret = _load_or_create_secret(self.secret_path)
+        return self._secret
+
+    def sign_url(self, path: str, now: Optional[float] = None) -> str:
+        """
+        パスに署名を付けたURLを作成 (署名付きURLが無効な場合はパスをそのまま返す)
+        有効期限は url_bucket 単位に切り捨てるため、同じ時間帯には同じURLになる
+
+        Args:
+            path: URLのパス
+            now: 現在時刻 (UNIX時間、省略時は現在時刻)
+
+        Returns:
+            URL
+        """
+        if not self.signed_urls:
+            return path
+        if now is None:
+            now = time.time()
+        expires = (int(now) + self.url_ttl) // self.url_bucket * self.url_bucket
+        return f"{path}?md5={sign_path(path, expires, self.secret)}&expires={expires}"
+
+    def verify(
+        self,
+        path: str,
+        signature: Optional[str],
+        expires: Optional[int],
+        now: Optional[float] = None,
+    ) -> bool:
+        """
+        署名付きURLを検証 (署名付きURLが無効な場合は常にTrue)
+
+        Args:
+            path: URLのパス
+            signature: クエリの md5
+            expires: クエリの expires
+            now: 現在時刻 (UNIX時間、省略時は現在時刻)
+
+        Returns:
+            署名が正しく期限内の場合True
+        """
+        if not self.signed_urls:
+            return True
+        if signature is None or expires is None:
+            return False
+        if now is None:
+            now = time.time()
+        if expires < now:
+            return False
+        return hmac.compare_digest(sign_path(path, expires, self.secret), signature)
+
+    def offload_headers(self, file_path: Path) -> Optional[Dict[str, str]]:
+        """
+        プロキシにファイルを送らせるためのヘッダーを作成
+
+        Args:
+            file_path: 送信するファイルのパス
+
+        Returns:
+            ヘッダーの辞書。オフロードが無効な場合None
+        """
+        if self.offload_mode == OFFLOAD_X_SENDFILE:
+            return {"X-Sendfile": str(file_path.resolve())}
+        if self.offload_mode == OFFLOAD_X_ACCEL_REDIRECT:
+            relative = file_path.resolve().relative_to(self.base_dir.resolve()).as_posix()
+            return {"X-Accel-Redirect": f"{self.accel_prefix}{relative}"}
+        return None
+
+
+def delivery_from_settings(environ: Optional[Mapping[str, str]] = None) -> ImageDelivery:
+    """
+    環境変数の設定から画像配信の設定を作成
+
+    Args:
+        environ: 参照する環境変数 (省略時は os.environ)
+
+    Returns:
+        画像配信の設定 (未設定の項目はオフロード・署名付きURLともに無効)
+
+    Raises:
+        ValueError: 設定が不正な場合
+    """
+    return ImageDelivery(
+        offload_mode=get_setting("OFFLOAD_MODE", environ=environ),
+        signed_urls=get_bool_setting("SIGNED_URLS", False, environ=environ),
+        url_ttl=get_int_setting("SIGNED_URL_TTL", SIGNED_URL_TTL_SECONDS, environ=environ),
+        secret=get_setting("URL_SIGNING_SECRET", environ=environ),
+    )
+
+
+# アプリケーション全体で共有する設定 (環境変数で設定する)
+image_delivery = delivery_from_settings()
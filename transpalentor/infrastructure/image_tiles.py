@@ -0,0 +1,324 @@
+"""
+大きな画像のタイル配信
+画像を TILE_SIZE 四方のタイルに分割し、表示されている範囲のタイルだけを取得できるようにする
+
+- 段 (level) 0 が原寸、段が1つ上がるごとに縦横 1/2 に縮小する
+- 最も上の段は画像全体が1枚のタイルに収まる段
+- タイル (level, x, y) は、その段の座標で (x * TILE_SIZE, y * TILE_SIZE) を左上とする範囲
+
+タイルは作業中画像から要求時に作成し、エンコード済みのPNGとETagをLRUで保持する。
+画像が変更されたときは、変更された範囲 (原寸の座標) に重なるタイルだけを全ての段で破棄する。
+保持しているタイルがどの保存済みの内容 (セッションインデックスの content_hash) に
+対応するかも記録し、別のワーカーが保存した変更を検出した場合はその画像のタイルを全て破棄する
+"""
+
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from .result_cache import compute_content_hash
+from .working_images import working_images
+
+# タイルの一辺 (ピクセル)
+TILE_SIZE = 256
+
+# 保持するタイルの合計サイズの上限 (bytes)
+TILE_CACHE_LIMIT = 64 * 1024 * 1024
+
+Box = Tuple[int, int, int, int]
+TileKey = Tuple[Path, int, int, int]
+
+# 保持するタイル (PNGのバイト列, ETag)
+Tile = Tuple[bytes, str]
+
+
+def max_tile_level(width: int, height: int) -> int:
+    """
+    画像全体が1枚のタイルに収まる段を取得
+
+    Args:
+        width: 画像の幅
+        height: 画像の高さ
+
+    Returns:
+        最も上の段
+    """
+    level = 0
+    while max(width, height) > TILE_SIZE << level:
+        level += 1
+    return level
+
+
+def tile_count(width: int, height: int, level: int) -> Tuple[int, int]:
+    """
+    段の横・縦のタイル数を取得
+
+    Args:
+        width: 画像の幅
+        height: 画像の高さ
+        level: 段
+
+    Returns:
+        タプル (横のタイル数, 縦のタイル数)
+    """
+    span = TILE_SIZE << level
+    return -(-width // span), -(-height // span)
+
+
+def tile_box(width: int, height: int, level: int, x: int, y: int) -> Optional[Box]:
+    """
+    タイルが覆う原寸の範囲を取得
+
+    Args:
+        width: 画像の幅
+        height: 画像の高さ
+        level: 段
+        x: タイルの列
+        y: タイルの行
+
+    Returns:
+        範囲 (left, top, right, bottom)。段・列・行が範囲外の場合None
+    """
+    if not 0 <= level <= max_tile_level(width, height):
+        return None
+    columns, rows = tile_count(width, height, level)
+    if not (0 <= x < columns and 0 <= y < rows):
+        return None
+    span = TILE_SIZE << level
+    return (x * span, y * span, min((x + 1) * span, width), min((y + 1) * span, height))
+
+
+def render_tile(region: Image.Image, level: int) -> Image.Image:
+    """
+    タイルが覆う原寸の範囲をその段の大きさに縮小
+
+    Args:
+        region: tile_box の範囲を切り出した画像
+        level: 段
+
+    Returns:
+        タイルの画像 (一辺 TILE_SIZE 以下)
+    """
+    return region.reduce(1 << level) if level else region
+
+
+def _overlaps(level: int, x: int, y: int, box: Optional[Box]) -> bool:
+    """タイルが原寸の範囲 box に重なるか (box がNoneの場合は常に重なる)"""
+    if box is None:
+        return True
+    span = TILE_SIZE << level
+    return not (
+        (x + 1) * span <= box[0]
+        or x * span >= box[2]
+        or (y + 1) * span <= box[1]
+        or y * span >= box[3]
+    )
+
+
+class TileCache:
+    """
+    エンコード済みのタイルを (画像, 段, 列, 行) ごとにLRUで保持する
+
+    作成中のタイルにはバージョンを持たせ、破棄のたびに重なるものだけ上げる。作成を始めた
+    時点と終えた時点のバージョンが異なるタイルは、作成中に画像が変更された可能性があるため
+    保持しない。バージョンは作成中のタイルの分だけ持つ。
+    """
+
+    def __init__(self, limit: int = TILE_CACHE_LIMIT) -> None:
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._tiles: "OrderedDict[TileKey, Tile]" = OrderedDict()
+        self._bytes = 0
+        # 作成中のタイルの [作成中の数, バージョン]
+        self._renders: Dict[TileKey, List[int]] = {}
+        # 画像ごとの保持しているタイルの数と、対応する保存済みの内容のハッシュ
+        self._counts: Dict[Path, int] = {}
+        self._sources: Dict[Path, str] = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(
+        self, file_path: Path, level: int, x: int, y: int, content_hash: Optional[str] = None
+    ) -> Optional[Tile]:
+        """
+        タイルを取得
+
+        Args:
+            file_path: 画像ファイルのパス
+            level: 段
+            x: タイルの列
+            y: タイルの行
+            content_hash: インデックスに記録された保存済みの内容のハッシュ。
+                保持しているタイルの内容と異なる場合は、その画像のタイルを全て破棄する
+
+        Returns:
+            タプル (PNGのバイト列, ETag)。保持していない場合None
+        """
+        key = (file_path, level, x, y)
+        with self._lock:
+            if content_hash and self._sources.get(file_path, content_hash) != content_hash:
+                # 別のワーカーが保存した変更
+                self._invalidate_locked(file_path, None)
+            if content_hash and self._counts.get(file_path):
+                self._sources[file_path] = content_hash
+            tile = self._tiles.get(key)
+            if tile is None:
+                self.misses += 1
+                return None
+            self._tiles.move_to_end(key)
+            self.hits += 1
+            return tile
+
+    def begin(self, file_path: Path, level: int, x: int, y: int) -> int:
+        """
+        タイルの作成を始める (作成前に呼び、返されたバージョンを end に渡す)
+
+        Args:
+            file_path: 画像ファイルのパス
+            level: 段
+            x: タイルの列
+            y: タイルの行
+
+        Returns:
+            バージョン
+        """
+        with self._lock:
+            render = self._renders.setdefault((file_path, level, x, y), [0, 0])
+            render[0] += 1
+            return render[1]
+
+    def end(
+        self,
+        file_path: Path,
+        level: int,
+        x: int,
+        y: int,
+        version: int,
+        tile: Optional[Tile] = None,
+        content_hash: Optional[str] = None,
+    ) -> None:
+        """
+        タイルの作成を終え、作成中に破棄されていなければ保持して上限を超えた分を古い順に削除
+
+        Args:
+            file_path: 画像ファイルのパス
+            level: 段
+            x: タイルの列
+            y: タイルの行
+            version: begin が返したバージョン
+            tile: 作成したタイル (PNGのバイト列, ETag)。作成できなかった場合None
+            content_hash: タイルを作成した保存済みの内容のハッシュ
+                (未保存の変更を含む作業中画像から作成した場合None)
+        """
+        key = (file_path, level, x, y)
+        with self._lock:
+            render = self._renders[key]
+            render[0] -= 1
+            current = render[1]
+            if render[0] == 0:
+                del self._renders[key]
+
+            if tile is None or current != version or len(tile[0]) > self.limit:
+                return
+            source = self._sources.get(file_path)
+            if content_hash and source is not None and source != content_hash:
+                return
+
+            previous = self._tiles.pop(key, None)
+            if previous is not None:
+                self._remove_locked(key, previous)
+            self._tiles[key] = tile
+            self._bytes += len(tile[0])
+            self._counts[file_path] = self._counts.get(file_path, 0) + 1
+            if content_hash and source is None:
+                self._sources[file_path] = content_hash
+            while self._bytes > self.limit:
+                evicted_key, evicted = self._tiles.popitem(last=False)
+                self._remove_locked(evicted_key, evicted)
+
+    def _remove_locked(self, key: TileKey, tile: Tile) -> None:
+        """_tiles から取り除いたタイルの分だけ使用量と画像ごとの数を減らす (ロック取得済みで呼ぶ)"""
+        self._bytes -= len(tile[0])
+        file_path = key[0]
+        self._counts[file_path] -= 1
+        if self._counts[file_path] == 0:
+            del self._counts[file_path]
+            self._sources.pop(file_path, None)
+
+    def invalidate(self, file_path: Path, box: Optional[Box] = None) -> None:
+        """
+        画像の変更に合わせて、変更された範囲に重なるタイルを全ての段で破棄
+
+        Args:
+            file_path: 画像ファイルのパス
+            box: 変更された原寸の範囲 (left, top, right, bottom)。Noneの場合は全てのタイル
+        """
+        with self._lock:
+            self._invalidate_locked(file_path, box)
+
+    def _invalidate_locked(self, file_path: Path, box: Optional[Box]) -> None:
+        """変更された範囲に重なるタイルを破棄し、作成中のもののバージョンを上げる (ロック取得済みで呼ぶ)"""
+        self.invalidations += 1
+        for key, render in self._renders.items():
+            if key[0] == file_path and _overlaps(key[1], key[2], key[3], box):
+                render[1] += 1
+        if file_path not in self._counts:
+            return
+        for key in [key for key in self._tiles if key[0] == file_path]:
+            if _overlaps(key[1], key[2], key[3], box):
+                self._remove_locked(key, self._tiles.pop(key))
+
+    def record_write(self, file_path: Path, data: bytes) -> None:
+        """
+        このワーカーによる保存を記録 (作業中画像の保存通知用)
+        変更された範囲のタイルは変更時に破棄済みのため、残りのタイルは保存後の内容に対応する
+
+        Args:
+            file_path: 画像ファイルのパス
+            data: 書き込んだ内容
+        """
+        with self._lock:
+            if file_path not in self._counts:
+                return
+        content_hash = compute_content_hash(data)
+        with self._lock:
+            if file_path in self._counts:
+                self._sources[file_path] = content_hash
+
+    def clear(self) -> None:
+        """全てのタイルと統計を削除"""
+        with self._lock:
+            self._tiles.clear()
+            self._counts.clear()
+            self._sources.clear()
+            self._bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.invalidations = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        タイルのキャッシュの統計情報を取得
+
+        Returns:
+            ヒット数・ミス数・破棄の回数・保持数・使用量の辞書
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "entries": len(self._tiles),
+                "bytes": self._bytes,
+                "limit": self.limit,
+            }
+
+
+tile_cache = TileCache()
+
+# このワーカーの保存で、保持しているタイルが別のワーカーの変更とみなされないようにする
+working_images.add_write_listener(tile_cache.record_write)
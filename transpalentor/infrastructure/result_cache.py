@@ -0,0 +1,285 @@
+"""
+透過処理結果のキャッシュ
+元画像のSHA-256と正規化した処理パラメータをキーに、エンコード済みPNGを
+メモリとディスクの2段で保持する
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .file_storage import TMP_DIR
+
+# キャッシュの保存先
+CACHE_DIR = TMP_DIR / "_cache" / "results"
+
+# メモリ層・ディスク層の上限 (bytes)
+MEMORY_CACHE_LIMIT = 64 * 1024 * 1024
+DISK_CACHE_LIMIT = 512 * 1024 * 1024
+
+# 処理アルゴリズムを変更した場合はバージョンを上げて既存キャッシュを無効化する
+CACHE_KEY_VERSION = "v1"
+
+
+def compute_content_hash(content: bytes) -> str:
+    """
+    ファイル内容のSHA-256を計算
+
+    Args:
+        content: ファイルの内容
+
+    Returns:
+        16進数表記のハッシュ値
+    """
+    return hashlib.sha256(content).hexdigest()
+
+
+def make_cache_key(content_hash: str, colors: Iterable[Iterable[int]], threshold: int) -> str:
+    """
+    キャッシュキーを生成
+    色は順序・重複に依存しないよう正規化する
+
+    Args:
+        content_hash: 元画像のSHA-256
+        colors: 透過対象色のリスト [(R, G, B), ...]
+        threshold: 色の許容範囲
+
+    Returns:
+        キャッシュキー (16進数表記)
+    """
+    normalized_colors = sorted({tuple(int(v) for v in color) for color in colors})
+    color_part = ";".join(",".join(str(v) for v in color) for color in normalized_colors)
+    raw_key = f"{CACHE_KEY_VERSION}|{content_hash}|{color_part}|{int(threshold)}"
+    return hashlib.sha256(raw_key.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    メモリ + ディスクの2段LRUキャッシュ
+
+    メモリ層はOrderedDictでアクセス順を管理し、ディスク層はファイルの
+    mtimeを最終アクセス時刻として扱う。どちらもバイト数の上限を超えると
+    最も古いエントリから削除する。
+
+    ディスク層の使用量は最初の書き込み時に1回だけ走査し、以降は書き込み・削除に
+    合わせて更新するカウンターで管理する (stats は走査しない)。
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path,
+        memory_limit: int = MEMORY_CACHE_LIMIT,
+        disk_limit: int = DISK_CACHE_LIMIT,
+    ) -> None:
+        self.cache_dir = cache_dir
+        self.memory_limit = memory_limit
+        self.disk_limit = disk_limit
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes: Optional[int] = None
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _entry_path(self, key: str) -> Path:
+        """キーに対応するディスク上のパスを取得"""
+        return self.cache_dir / key[:2] / f"{key}.png"
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        キャッシュからエンコード済みPNGを取得
+
+        Args:
+            key: キャッシュキー
+
+        Returns:
+            キャッシュされたPNGバイト列。存在しない場合None
+        """
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return data
+
+        path = self._entry_path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.disk_hits += 1
+            self._remember(key, data)
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        """
+        エンコード済みPNGをキャッシュに保存
+
+        Args:
+            key: キャッシュキー
+            data: PNGバイト列
+        """
+        with self._lock:
+            self._remember(key, data)
+
+        path = self._entry_path(key)
+        if path.exists():
+            return
+
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # 一時ファイル名はスレッド・プロセスごとに一意にする
+            fd, tmp_name = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=path.parent)
+        except OSError:
+            # ディスク層への書き込み失敗はメモリ層のみで継続する
+            return
+
+        tmp_path = Path(tmp_name)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            # 既存のエントリは上書きしない (同じキーを同時に書き込んだ場合は先に書いた方を残し、
+            # 使用量を二重に数えない)
+            os.link(tmp_path, path)
+        except OSError:
+            return
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+        with self._lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes += len(data)
+        self._enforce_disk_limit()
+
+    def _remember(self, key: str, data: bytes) -> None:
+        """メモリ層にエントリを追加し、上限を超えた分を削除 (ロック取得済みで呼ぶ)"""
+        if len(data) > self.memory_limit:
+            return
+
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous)
+
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+
+        while self._memory_bytes > self.memory_limit:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self.evictions += 1
+
+    def _scan_disk(self) -> List[Tuple[float, int, Path]]:
+        """ディスク層のエントリを (mtime, size, path) のリストで取得"""
+        entries: List[Tuple[float, int, Path]] = []
+        if not self.cache_dir.exists():
+            return entries
+        for path in self.cache_dir.glob("*/*.png"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def disk_usage(self) -> int:
+        """ディスク層の使用量 (bytes) を取得"""
+        with self._lock:
+            if self._disk_bytes is not None:
+                return self._disk_bytes
+        usage = sum(size for _, size, _ in self._scan_disk())
+        with self._lock:
+            self._disk_bytes = usage
+        return usage
+
+    def _enforce_disk_limit(self) -> None:
+        """ディスク層が上限を超えている場合、最終アクセスが古い順に削除"""
+        if self.disk_usage() <= self.disk_limit:
+            return
+        self.shrink_disk(self.disk_limit)
+
+    def shrink_disk(self, target_bytes: int) -> int:
+        """
+        ディスク層を指定サイズ以下になるまで古い順に削除
+
+        Args:
+            target_bytes: 削除後の目標サイズ (bytes)
+
+        Returns:
+            解放したバイト数
+        """
+        # 複数ワーカーで共有されるため、削除時は実際の状態を走査し直す
+        entries = sorted(self._scan_disk())
+        usage = sum(size for _, size, _ in entries)
+        freed = 0
+
+        for _, size, path in entries:
+            if usage <= target_bytes:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            usage -= size
+            freed += size
+            with self._lock:
+                self.evictions += 1
+
+        with self._lock:
+            self._disk_bytes = usage
+        return freed
+
+    def clear(self) -> None:
+        """メモリ層・ディスク層の全エントリと統計を削除"""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            self.memory_hits = 0
+            self.disk_hits = 0
+            self.misses = 0
+            self.evictions = 0
+        for _, _, path in self._scan_disk():
+            try:
+                path.unlink()
+            except OSError:
+                continue
+        with self._lock:
+            self._disk_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        キャッシュの統計情報を取得 (ディスクは走査せず、カウンターの値を返す)
+
+        Returns:
+            ヒット数・ミス数・ヒット率・使用量などの辞書
+            (ディスク層の使用量は、このプロセスでまだ計測していない場合None)
+        """
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "memory_limit": self.memory_limit,
+                "disk_bytes": self._disk_bytes,
+                "disk_limit": self.disk_limit,
+            }
+
+
+# アプリケーション全体で共有するキャッシュ
+result_cache = ResultCache(CACHE_DIR)
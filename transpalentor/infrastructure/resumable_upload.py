@@ -0,0 +1,295 @@
+"""
+再開可能な分割アップロード
+作成 → オフセット付きのチャンク書き込み (並列可) → 完了 の順で1つのファイルを受け取る
+
+各アップロードは UPLOADS_DIR/<upload_id>/ に、事前確保したデータファイルと
+受信済み範囲を記録した状態ファイルを持つ。状態ファイルの更新はファイルロックで
+直列化するため、複数ワーカーに届いたチャンクも安全に記録できる。
+
+作成時にファイル全体のサイズを事前確保するため、未完了のアップロードは最大
+MAX_PENDING_UPLOADS 件に制限し (全ワーカーで共有するファイルロック下で数える)、
+確保したサイズは容量管理 (storage_budget) の使用量に含める。
+"""
+
+import asyncio
+import fcntl
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Iterator, List
+
+from .file_storage import TMP_DIR, create_staging_path, generate_session_id, validate_session_id
+
+# 分割アップロードの保存先
+UPLOADS_DIR = TMP_DIR / "_uploads"
+
+DATA_FILENAME = "data"
+STATE_FILENAME = "state.json"
+LOCK_FILENAME = "state.lock"
+
+# アップロードの作成を直列化するロックファイル (UPLOADS_DIR 直下)
+UPLOADS_LOCK_FILENAME = ".lock"
+
+# 同時に存在できる未完了のアップロードの最大数
+MAX_PENDING_UPLOADS = 32
+
+
+class UploadLimitError(Exception):
+    """未完了のアップロードが上限に達している場合の例外"""
+
+    pass
+
+
+def get_upload_directory(upload_id: str) -> Path:
+    """
+    アップロードIDに対応するディレクトリを取得
+
+    Args:
+        upload_id: アップロードID (UUID v4形式)
+
+    Returns:
+        アップロードディレクトリのPath
+
+    Raises:
+        FileNotFoundError: IDが不正、またはアップロードが存在しない場合
+    """
+    if not validate_session_id(upload_id):
+        raise FileNotFoundError(f"Upload not found: {upload_id}")
+
+    upload_dir = UPLOADS_DIR / upload_id
+    if not (upload_dir / STATE_FILENAME).exists():
+        raise FileNotFoundError(f"Upload not found: {upload_id}")
+
+    return upload_dir
+
+
+@contextmanager
+def _locked_state(upload_dir: Path) -> Iterator[Dict[str, Any]]:
+    """状態ファイルを排他ロック下で読み込み、ブロック終了時に書き戻す"""
+    with (upload_dir / LOCK_FILENAME).open("a") as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            state = json.loads((upload_dir / STATE_FILENAME).read_text())
+            yield state
+            tmp_path = upload_dir / f".{STATE_FILENAME}.tmp"
+            tmp_path.write_text(json.dumps(state))
+            os.replace(tmp_path, upload_dir / STATE_FILENAME)
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+@contextmanager
+def _locked_uploads() -> Iterator[None]:
+    """アップロードの作成をワーカー間で直列化する排他ロック"""
+    UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
+    with (UPLOADS_DIR / UPLOADS_LOCK_FILENAME).open("a") as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def _pending_upload_dirs() -> List[Path]:
+    """未完了のアップロードのディレクトリを取得"""
+    if not UPLOADS_DIR.exists():
+        return []
+    return [path for path in UPLOADS_DIR.iterdir() if path.is_dir()]
+
+
+def pending_upload_bytes() -> int:
+    """
+    未完了のアップロードが事前確保しているバイト数の合計を取得
+
+    Returns:
+        データファイルのサイズの合計 (bytes)
+    """
+    total = 0
+    for upload_dir in _pending_upload_dirs():
+        try:
+            total += (upload_dir / DATA_FILENAME).stat().st_size
+        except OSError:
+            continue
+    return total
+
+
+def _merge_range(ranges: List[List[int]], start: int, end: int) -> List[List[int]]:
+    """受信済み範囲のリストに [start, end) を追加して結合"""
+    merged: List[List[int]] = []
+    for range_start, range_end in sorted(ranges + [[start, end]]):
+        if merged and range_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], range_end)
+        else:
+            merged.append([range_start, range_end])
+    return merged
+
+
+def _summarize(upload_id: str, state: Dict[str, Any]) -> Dict[str, Any]:
+    """状態ファイルの内容をクライアント向けの状態に変換"""
+    ranges = state["ranges"]
+    received = sum(end - start for start, end in ranges)
+    # 先頭から連続して受信済みのバイト数 (tusのUpload-Offset相当)
+    offset = ranges[0][1] if ranges and ranges[0][0] == 0 else 0
+    return {
+        "upload_id": upload_id,
+        "filename": state["filename"],
+        "size": state["size"],
+        "offset": offset,
+        "received": received,
+        "ranges": ranges,
+        "complete": received == state["size"],
+    }
+
+
+def create_upload(filename: str, size: int) -> Dict[str, Any]:
+    """
+    分割アップロードを作成し、データファイルを指定サイズで事前確保
+
+    Args:
+        filename: 元のファイル名
+        size: ファイル全体のサイズ (bytes)
+
+    Returns:
+        アップロードの状態
+
+    Raises:
+        UploadLimitError: 未完了のアップロードが MAX_PENDING_UPLOADS 件ある場合
+    """
+    upload_id = generate_session_id()
+    upload_dir = UPLOADS_DIR / upload_id
+
+    with _locked_uploads():
+        pending = len(_pending_upload_dirs())
+        if pending >= MAX_PENDING_UPLOADS:
+            raise UploadLimitError(f"Too many pending uploads: {pending}")
+        upload_dir.mkdir(parents=True)
+
+    state = {"filename": filename, "size": size, "created_at": time.time(), "ranges": []}
+    try:
+        with (upload_dir / DATA_FILENAME).open("wb") as f:
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+            except (AttributeError, OSError):
+                f.truncate(size)
+        (upload_dir / STATE_FILENAME).write_text(json.dumps(state))
+    except BaseException:
+        # 作成途中のディレクトリを残すと上限の件数に数えられ続ける
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        raise
+
+    return _summarize(upload_id, state)
+
+
+def get_upload_status(upload_id: str) -> Dict[str, Any]:
+    """
+    分割アップロードの状態を取得
+
+    Args:
+        upload_id: アップロードID
+
+    Returns:
+        アップロードの状態
+
+    Raises:
+        FileNotFoundError: アップロードが存在しない場合
+    """
+    upload_dir = get_upload_directory(upload_id)
+    state = json.loads((upload_dir / STATE_FILENAME).read_text())
+    return _summarize(upload_id, state)
+
+
+async def write_chunk(upload_id: str, offset: int, chunks: AsyncIterator[bytes]) -> Dict[str, Any]:
+    """
+    チャンクをデータファイルの指定オフセットに書き込む
+
+    Args:
+        upload_id: アップロードID
+        offset: 書き込み開始位置
+        chunks: チャンクの内容 (受信しながら順に書き込む)
+
+    Returns:
+        書き込み後のアップロードの状態
+
+    Raises:
+        FileNotFoundError: アップロードが存在しない場合
+        ValueError: オフセットやサイズがファイルの範囲外の場合
+    """
+    status = await asyncio.to_thread(get_upload_status, upload_id)
+    upload_dir = UPLOADS_DIR / upload_id
+    size = status["size"]
+
+    if offset < 0 or offset > size:
+        raise ValueError(f"Offset {offset} is out of range for upload of {size} bytes")
+
+    position = offset
+    fd = os.open(upload_dir / DATA_FILENAME, os.O_WRONLY)
+    try:
+        async for chunk in chunks:
+            if position + len(chunk) > size:
+                raise ValueError(f"Chunk exceeds declared upload size of {size} bytes")
+            await asyncio.to_thread(os.pwrite, fd, chunk, position)
+            position += len(chunk)
+    finally:
+        os.close(fd)
+
+    # 書き込みが完了した範囲のみを受信済みとして記録 (ロック待ちでループを止めない)
+    return await asyncio.to_thread(_record_range, upload_dir, upload_id, offset, position)
+
+
+def _record_range(upload_dir: Path, upload_id: str, start: int, end: int) -> Dict[str, Any]:
+    """受信済み範囲を状態ファイルに記録し、記録後の状態を返す"""
+    with _locked_state(upload_dir) as state:
+        if end > start:
+            state["ranges"] = _merge_range(state["ranges"], start, end)
+        return _summarize(upload_id, state)
+
+
+def finalize_upload(upload_id: str) -> tuple[Path, str]:
+    """
+    全範囲を受信したアップロードのデータファイルを一時ファイルとして取り出す
+
+    Args:
+        upload_id: アップロードID
+
+    Returns:
+        タプル (一時ファイルのパス, 元のファイル名)
+
+    Raises:
+        FileNotFoundError: アップロードが存在しない場合
+        ValueError: 未受信の範囲が残っている場合
+    """
+    upload_dir = get_upload_directory(upload_id)
+
+    with _locked_state(upload_dir) as state:
+        status = _summarize(upload_id, state)
+        if not status["complete"]:
+            raise ValueError(
+                f"Upload is incomplete: {status['received']} of {status['size']} bytes received"
+            )
+        staged_path = create_staging_path()
+        os.replace(upload_dir / DATA_FILENAME, staged_path)
+
+    shutil.rmtree(upload_dir, ignore_errors=True)
+    return staged_path, state["filename"]
+
+
+def delete_upload(upload_id: str) -> bool:
+    """
+    分割アップロードを破棄
+
+    Args:
+        upload_id: アップロードID
+
+    Returns:
+        存在して削除した場合True
+    """
+    try:
+        upload_dir = get_upload_directory(upload_id)
+    except FileNotFoundError:
+        return False
+
+    shutil.rmtree(upload_dir, ignore_errors=True)
+    return True
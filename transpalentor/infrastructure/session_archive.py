@@ -0,0 +1,341 @@
+"""
+セッションの階層化
+- 利用中のセッション: 書き込んだファイルの内容をメモリ (hot_files) にも保持し、
+  画像の取得にディスクを読まずに応答する
+- 利用されていないセッション: ARCHIVE_AFTER_MINUTES 分以上アクセスのないセッションを
+  設定されたバックエンド (S3互換のオブジェクトストレージなど) へ退避してローカルの
+  ファイルを削除し、次のアクセス時に復元する
+
+退避先のバックエンドは環境変数で設定する (backend_from_settings)。
+未設定の場合は退避を行わない。
+
+- TRANSPALENTOR_ARCHIVE_BACKEND: "local" (ローカルディスク) または "s3" (S3互換)
+- TRANSPALENTOR_ARCHIVE_DIR: "local" の場合の退避先ディレクトリ
+- TRANSPALENTOR_ARCHIVE_S3_BUCKET / _S3_PREFIX / _S3_ENDPOINT_URL:
+  "s3" の場合のバケット・キーの接頭辞・エンドポイント (S3互換ストレージの場合)
+"""
+
+import fcntl
+import json
+import time
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, Mapping, Optional
+
+from .file_storage import (
+    TMP_DIR,
+    atomic_write_bytes,
+    delete_session_files,
+    ensure_session_directory,
+    get_session_directory,
+    link_blob_to_session,
+    read_manifest,
+    store_blob,
+)
+from .logging_config import get_logger
+from .result_cache import compute_content_hash
+from .session_index import SessionIndex, session_index
+from .settings import get_setting
+from .storage_backends import LocalDiskBackend, MemoryBackend, S3Backend, StorageBackend
+from .working_images import working_images
+
+# 書き込んだファイルの内容をメモリに保持する上限 (bytes)
+HOT_FILES_LIMIT = 64 * 1024 * 1024
+
+# この時間 (分) 以上アクセスのないセッションを退避する
+ARCHIVE_AFTER_MINUTES = 30
+
+# 退避の実行間隔 (分)
+ARCHIVE_INTERVAL_MINUTES = 10
+
+# 1回の実行で退避するセッション数の上限
+ARCHIVE_BATCH_SIZE = 100
+
+# 退避したセッションのメタデータ (マニフェストと成果物の記録) のキー名
+ARCHIVE_METADATA_NAME = ".metadata.json"
+
+# 退避・復元・削除をワーカー間で直列化するロックファイルの置き場所と数
+# (セッションIDで振り分ける。セッションディレクトリは復元・削除で作成・削除されるため外に置く)
+ARCHIVE_LOCK_DIR = TMP_DIR / "_index" / "archive_locks"
+ARCHIVE_LOCK_STRIPES = 64
+
+logger = get_logger(__name__)
+
+# 書き込んだファイルの内容をSHA-256をキーに保持するメモリ層
+# キーが内容のハッシュのため、どのワーカーが書き込んだかに関わらず
+# セッションインデックスのハッシュと一致すれば最新の内容である
+hot_files = MemoryBackend(HOT_FILES_LIMIT)
+
+
+def backend_from_settings(environ: Optional[Mapping[str, str]] = None) -> Optional[StorageBackend]:
+    """
+    環境変数の設定から退避先のバックエンドを作成
+
+    Args:
+        environ: 参照する環境変数 (省略時は os.environ)
+
+    Returns:
+        退避先のバックエンド。退避先が設定されていない場合None
+
+    Raises:
+        ValueError: 設定が不正または不足している場合
+    """
+    kind = get_setting("ARCHIVE_BACKEND", environ=environ)
+    if kind is None:
+        return None
+
+    if kind == "local":
+        archive_dir = get_setting("ARCHIVE_DIR", environ=environ)
+        if archive_dir is None:
+            raise ValueError("TRANSPALENTOR_ARCHIVE_DIR is required for the local archive")
+        return LocalDiskBackend(Path(archive_dir))
+
+    if kind == "s3":
+        bucket = get_setting("ARCHIVE_S3_BUCKET", environ=environ)
+        if bucket is None:
+            raise ValueError("TRANSPALENTOR_ARCHIVE_S3_BUCKET is required for the S3 archive")
+        options: Dict[str, Any] = {}
+        endpoint_url = get_setting("ARCHIVE_S3_ENDPOINT_URL", environ=environ)
+        if endpoint_url is not None:
+            options["endpoint_url"] = endpoint_url
+        prefix = get_setting("ARCHIVE_S3_PREFIX", environ=environ) or ""
+        return S3Backend(bucket, prefix=prefix, **options)
+
+    raise ValueError(f"Unknown archive backend: {kind}")
+
+
+@contextmanager
+def archive_lock(session_id: str) -> Iterator[None]:
+    """
+    セッションの退避・復元・削除をワーカー間で直列化する排他ロック
+    (ファイルごとに開くため、同じプロセスの別のスレッドとも排他になる)
+
+    Args:
+        session_id: セッションID
+    """
+    ARCHIVE_LOCK_DIR.mkdir(parents=True, exist_ok=True)
+    stripe = zlib.crc32(session_id.encode("utf-8")) % ARCHIVE_LOCK_STRIPES
+    with (ARCHIVE_LOCK_DIR / f"{stripe:02d}.lock").open("a") as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def _keep_hot(file_path: Path, data: bytes) -> None:
+    """作業中画像の保存時に内容をメモリ層に保持"""
+    hot_files.put(compute_content_hash(data), data)
+
+
+class SessionArchive:
+    """アクセスのないセッションのバックエンドへの退避と復元"""
+
+    def __init__(
+        self,
+        index: SessionIndex,
+        backend: Optional[StorageBackend] = None,
+        archive_after_minutes: float = ARCHIVE_AFTER_MINUTES,
+    ) -> None:
+        self.index = index
+        self.backend = backend
+        self.archive_after_minutes = archive_after_minutes
+        self.archived = 0
+        self.restored = 0
+
+    @property
+    def enabled(self) -> bool:
+        """退避先が設定されているか"""
+        return self.backend is not None
+
+    def configure(self, backend: Optional[StorageBackend]) -> None:
+        """
+        退避先のバックエンドを設定
+
+        Args:
+            backend: 退避先 (Noneの場合は退避を行わない)
+        """
+        self.backend = backend
+
+    def _backend(self) -> StorageBackend:
+        if self.backend is None:
+            raise RuntimeError("Session archive backend is not configured")
+        return self.backend
+
+    def archive_session(self, session_id: str) -> bool:
+        """
+        セッションのファイルをバックエンドへ退避し、ローカルのファイルを削除
+        退避の間はセッションのロックを保持し、退避後の変更が失われないようにする
+        (他のワーカーの復元・削除とは archive_lock で排他にする)
+
+        Args:
+            session_id: セッションID
+
+        Returns:
+            退避した場合True。ローカルにセッションがない場合False
+
+        Raises:
+            RuntimeError: 退避先が設定されていない場合
+        """
+        backend = self._backend()
+        session_dir = get_session_directory(session_id)
+        if not session_dir.is_dir():
+            return False
+
+        with archive_lock(session_id):
+
+            # 未保存の消しゴム処理を先に書き込み、削除まで他の変更を止める
+            with working_images.lock_session(session_dir):
+                if not session_dir.is_dir():
+                    return False
+
+                for file_path in sorted(session_dir.iterdir()):
+                    if file_path.is_file() and not file_path.name.startswith("."):
+                        backend.put(f"{session_id}/{file_path.name}", file_path.read_bytes())
+
+                # メタデータを最後に書き込み、これがあれば退避が完了しているとみなす
+                metadata = {
+                    "manifest": read_manifest(session_dir),
+                    "artifacts": self.index.list_artifacts(session_id),
+                }
+                backend.put(
+                    f"{session_id}/{ARCHIVE_METADATA_NAME}", json.dumps(metadata).encode("utf-8")
+                )
+
+                self.index.set_archived(session_id, True)
+                delete_session_files(session_id)
+
+        working_images.discard_session(session_dir)
+        self.archived += 1
+        return True
+
+    def restore_session(self, session_id: str) -> bool:
+        """
+        退避済みのセッションをローカルへ復元
+        他のワーカーの退避・復元・削除とは archive_lock で排他にする
+
+        Args:
+            session_id: セッションID
+
+        Returns:
+            復元した (または既にローカルにある) 場合True。退避されていない場合False
+        """
+        if self.backend is None or not self.index.is_archived(session_id):
+            return False
+
+        with archive_lock(session_id):
+            if not self.index.is_archived(session_id):
+                # 他のワーカーが復元した (または削除した)
+                return get_session_directory(session_id).is_dir()
+
+            backend = self.backend
+            raw_metadata = backend.get(f"{session_id}/{ARCHIVE_METADATA_NAME}")
+            if raw_metadata is None:
+                return False
+            metadata = json.loads(raw_metadata)
+            manifest: Dict[str, str] = metadata.get("manifest", {})
+
+            keys = backend.list_keys(f"{session_id}/")
+            for key in keys:
+                name = key.split("/", 1)[1]
+                if name == ARCHIVE_METADATA_NAME:
+                    continue
+                data = backend.get(key)
+                if data is None:
+                    continue
+                content_hash = manifest.get(name)
+                if content_hash is not None:
+                    # 元画像はブロブとして保存し直し、重複排除を保つ
+                    store_blob(data, content_hash)
+                    link_blob_to_session(session_id, name, content_hash)
+                else:
+                    atomic_write_bytes(ensure_session_directory(session_id) / name, data)
+
+            for artifact in metadata.get("artifacts", []):
+                self.index.record_artifact(
+                    session_id,
+                    artifact["name"],
+                    artifact["kind"],
+                    artifact["size"],
+                    content_hash=artifact.get("content_hash"),
+                    image_format=artifact.get("format"),
+                    width=artifact.get("width"),
+                    height=artifact.get("height"),
+                )
+            self.index.set_archived(session_id, False)
+
+            for key in keys:
+                backend.delete(key)
+
+        self.restored += 1
+        return True
+
+    def discard(self, session_id: str) -> bool:
+        """
+        退避済みのセッションのファイルを削除
+
+        Args:
+            session_id: セッションID
+
+        Returns:
+            削除したファイルがあった場合True
+        """
+        if self.backend is None:
+            return False
+        keys = self.backend.list_keys(f"{session_id}/")
+        for key in keys:
+            self.backend.delete(key)
+        return bool(keys)
+
+    def archive_idle_sessions(self, now: Optional[float] = None) -> int:
+        """
+        アクセスのないセッションを古い順に退避
+
+        Args:
+            now: 現在時刻 (UNIX時間、省略時は現在時刻)
+
+        Returns:
+            退避したセッション数
+        """
+        if self.backend is None:
+            return 0
+        if now is None:
+            now = time.time()
+
+        cutoff = now - self.archive_after_minutes * 60
+        archived = 0
+        for session_id in self.index.idle_sessions(cutoff, ARCHIVE_BATCH_SIZE):
+            try:
+                if self.archive_session(session_id):
+                    archived += 1
+                else:
+                    # ローカルにファイルのないセッションは次回以降の対象から外す
+                    self.index.set_archived(session_id, True)
+            except Exception as e:
+                logger.warning(f"Failed to archive session {session_id}: {e}")
+
+        if archived:
+            logger.info(f"Archived {archived} idle sessions")
+        return archived
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        統計情報を取得
+
+        Returns:
+            退避先の有無・退避数・復元数の辞書
+        """
+        return {
+            "enabled": self.enabled,
+            "backend": type(self.backend).__name__ if self.backend is not None else None,
+            "archived": self.archived,
+            "restored": self.restored,
+        }
+
+
+# アプリケーション全体で共有する退避管理 (退避先は環境変数で設定する)
+session_archive = SessionArchive(session_index, backend_from_settings())
+
+# 作業中画像の保存内容もメモリ層に保持する
+working_images.add_write_listener(_keep_hot)
@@ -0,0 +1,210 @@
+"""
+セッションのクリーンアップ
+最終アクセスから SESSION_TTL_HOURS 時間以上経過したセッションを定期的に削除する
+
+削除対象はセッションインデックスの最終アクセス順のインデックスから取り出すため、
+セッション数が増えてもディレクトリの走査やstatは発生しない。
+"""
+
+import time
+from typing import Optional
+
+from apscheduler.schedulers.background import BackgroundScheduler  # type: ignore[import-untyped]
+
+from . import resumable_upload
+from .file_storage import (
+    TMP_DIR,
+    collect_orphan_blobs,
+    delete_session_files,
+    get_session_directory,
+    iter_session_directories,
+)
+from .logging_config import get_logger
+from .session_archive import ARCHIVE_INTERVAL_MINUTES, archive_lock, session_archive
+from .session_index import SessionIndex, session_index
+from .working_images import working_images
+
+# セッションの保持期間 (時間)
+SESSION_TTL_HOURS = 24
+
+# クリーンアップの実行間隔 (分)
+CLEANUP_INTERVAL_MINUTES = 60
+
+# 1回の問い合わせで取り出す期限切れセッション数
+SWEEP_BATCH_SIZE = 500
+
+# インデックス導入前のセッションを登録済みかを示すファイル
+BACKFILL_MARKER = TMP_DIR / "_index" / "backfilled"
+
+logger = get_logger(__name__)
+
+
+def delete_session(session_id: str, index: Optional[SessionIndex] = None) -> bool:
+    """
+    セッションのファイル・作業中画像・退避済みのファイル・インデックスをまとめて削除
+
+    Args:
+        session_id: セッションID
+        index: セッションインデックス (デフォルトは共有インデックス)
+
+    Returns:
+        セッションディレクトリまたは退避済みのファイルが存在して削除した場合True
+
+    Raises:
+        ValueError: セッションIDが無効な場合
+    """
+    if index is None:
+        index = session_index
+
+    # 他のワーカーの退避・復元と交差しないよう、削除の間はロックを保持する
+    with archive_lock(session_id):
+        working_images.discard_session(get_session_directory(session_id))
+        deleted = delete_session_files(session_id)
+        archived = session_archive.discard(session_id)
+        index.remove(session_id)
+    return deleted or archived
+
+
+def sweep_expired_sessions(
+    now: Optional[float] = None,
+    ttl_hours: float = SESSION_TTL_HOURS,
+    index: Optional[SessionIndex] = None,
+) -> int:
+    """
+    期限切れのセッションと放置された分割アップロードを削除
+
+    Args:
+        now: 現在時刻 (UNIX時間、省略時は現在時刻)
+        ttl_hours: セッションの保持期間 (時間)
+        index: セッションインデックス (デフォルトは共有インデックス)
+
+    Returns:
+        削除したセッション数
+    """
+    if now is None:
+        now = time.time()
+    if index is None:
+        index = session_index
+
+    cutoff = now - ttl_hours * 3600
+    removed = 0
+
+    while True:
+        expired = index.expired_sessions(cutoff, SWEEP_BATCH_SIZE)
+        if not expired:
+            break
+        for session_id in expired:
+            try:
+                delete_session(session_id, index)
+            except Exception as e:
+                # 1件の失敗で全体を止めず、インデックスからは外して次回以降に持ち越さない
+                logger.warning(f"Failed to delete session {session_id}: {e}")
+                index.remove(session_id)
+            removed += 1
+
+    _sweep_stale_uploads(cutoff)
+
+    if removed:
+        logger.info(f"Removed {removed} expired sessions")
+    return removed
+
+
+def _sweep_stale_uploads(cutoff: float) -> None:
+    """完了されないまま期限を過ぎた分割アップロードを削除"""
+    if not resumable_upload.UPLOADS_DIR.exists():
+        return
+    for upload_dir in resumable_upload.UPLOADS_DIR.iterdir():
+        try:
+            if upload_dir.stat().st_mtime < cutoff:
+                resumable_upload.delete_upload(upload_dir.name)
+        except OSError:
+            continue
+
+
+def sweep_orphan_blobs() -> int:
+    """
+    どのセッションからも参照されなくなったブロブを削除
+
+    Returns:
+        削除したブロブの数
+    """
+    removed = collect_orphan_blobs()
+    if removed:
+        logger.info(f"Removed {removed} orphan blobs")
+    return removed
+
+
+def backfill_session_index(index: Optional[SessionIndex] = None) -> int:
+    """
+    インデックス導入前から存在するセッションを一度だけ登録
+
+    Args:
+        index: セッションインデックス (デフォルトは共有インデックス)
+
+    Returns:
+        登録したセッション数
+    """
+    if index is None:
+        index = session_index
+    if BACKFILL_MARKER.exists() or not TMP_DIR.exists():
+        return 0
+
+    count = index.backfill(list(iter_session_directories()))
+    BACKFILL_MARKER.parent.mkdir(parents=True, exist_ok=True)
+    BACKFILL_MARKER.touch()
+    return count
+
+
+class CleanupScheduler:
+    """
+    APSchedulerで期限切れセッションと参照のないブロブの削除
+    (と、設定時はセッションの退避) を定期実行する
+    """
+
+    def __init__(self, interval_minutes: float = CLEANUP_INTERVAL_MINUTES) -> None:
+        self.interval_minutes = interval_minutes
+        self._scheduler: Optional[BackgroundScheduler] = None
+
+    def start(self) -> None:
+        """スケジューラーを起動"""
+        if self._scheduler is not None:
+            return
+        backfill_session_index()
+        self._scheduler = BackgroundScheduler(daemon=True)
+        self._scheduler.add_job(
+            sweep_expired_sessions,
+            "interval",
+            minutes=self.interval_minutes,
+            id="sweep_expired_sessions",
+            max_instances=1,
+            coalesce=True,
+        )
+        self._scheduler.add_job(
+            sweep_orphan_blobs,
+            "interval",
+            minutes=self.interval_minutes,
+            id="sweep_orphan_blobs",
+            max_instances=1,
+            coalesce=True,
+        )
+        if session_archive.enabled:
+            self._scheduler.add_job(
+                session_archive.archive_idle_sessions,
+                "interval",
+                minutes=ARCHIVE_INTERVAL_MINUTES,
+                id="archive_idle_sessions",
+                max_instances=1,
+                coalesce=True,
+            )
+        self._scheduler.start()
+
+    def shutdown(self) -> None:
+        """スケジューラーを停止"""
+        if self._scheduler is None:
+            return
+        self._scheduler.shutdown(wait=False)
+        self._scheduler = None
+
+
+# アプリケーション全体で共有するスケジューラー
+cleanup_scheduler = CleanupScheduler()
@@ -0,0 +1,474 @@
+"""
+セッションのインデックス
+セッションごとの作成時刻・最終アクセス時刻と、セッション内のファイル (成果物) の
+サイズ・ハッシュ・形式・寸法を書き込み時にSQLite (WALモード) へ記録する。
+ハンドラーはファイルの存在やメタデータをファイルシステムを調べずにインデックスから
+取得し、期限切れセッションや容量超過時の削除対象もインデックスから取り出す
+
+WALモードのSQLiteは複数のワーカープロセスから同時に読み書きできるため、
+ディレクトリを走査・statせずに全ワーカーで同じ情報を共有できる。
+"""
+
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .file_storage import TMP_DIR, validate_session_id
+
+# インデックスの保存先
+INDEX_PATH = TMP_DIR / "_index" / "sessions.db"
+
+# 最終アクセス時刻を更新する最小間隔 (秒)
+# リクエストごとの書き込みを避けるため、間隔内の再アクセスは記録しない
+TOUCH_INTERVAL = 60.0
+
+# 最終記録時刻をメモリに保持するセッション数の上限
+TOUCH_CACHE_SIZE = 100_000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL,
+    archived INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_last_access ON sessions (last_access);
+CREATE TABLE IF NOT EXISTS artifacts (
+    session_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    content_hash TEXT,
+    format TEXT,
+    width INTEGER,
+    height INTEGER,
+    PRIMARY KEY (session_id, name)
+);
+CREATE TABLE IF NOT EXISTS totals (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    bytes INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO totals (id, bytes) VALUES (0, 0);
+"""
+
+# 成果物のメタデータ列
+_ARTIFACT_METADATA_COLUMNS = {
+    "content_hash": "TEXT",
+    "format": "TEXT",
+    "width": "INTEGER",
+    "height": "INTEGER",
+}
+
+# 後から追加した列 (既存のインデックスにはALTER TABLEで追加する)
+_ADDED_COLUMNS = {
+    "artifacts": _ARTIFACT_METADATA_COLUMNS,
+    "sessions": {"archived": "INTEGER NOT NULL DEFAULT 0"},
+}
+
+_ARTIFACT_FIELDS = ("name", "kind", "size", "updated_at") + tuple(_ARTIFACT_METADATA_COLUMNS)
+
+# 元画像を表す成果物の種類 (それ以外は元画像から再生成できる派生物として扱う)
+ORIGINAL_KIND = "original"
+
+
+class SessionIndex:
+    """SQLiteによるセッションのインデックス"""
+
+    def __init__(self, db_path: Path, touch_interval: float = TOUCH_INTERVAL) -> None:
+        self.db_path = db_path
+        self.touch_interval = touch_interval
+        self._local = threading.local()
+        self._touched: Dict[str, float] = {}
+        self._touched_lock = threading.Lock()
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        """スレッドごとの接続を取得 (初回はスキーマを作成)"""
+        connection: Optional[sqlite3.Connection] = getattr(self._local, "connection", None)
+        if connection is not None:
+            return connection
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+
+        with self._init_lock:
+            if not self._initialized:
+                connection.executescript(_SCHEMA)
+                self._migrate(connection)
+                self._initialized = True
+
+        self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def _migrate(connection: sqlite3.Connection) -> None:
+        """既存のインデックスに不足している列を追加"""
+        for table, added_columns in _ADDED_COLUMNS.items():
+            columns = {row[1] for row in connection.execute(f"PRAGMA table_info({table})")}
+            for column, column_type in added_columns.items():
+                if column in columns:
+                    continue
+                try:
+                    connection.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+                except sqlite3.OperationalError:
+                    # 別のワーカーが先に追加した
+                    pass
+
+    def touch(self, session_id: str, now: Optional[float] = None, force: bool = False) -> None:
+        """
+        セッションの最終アクセス時刻を更新 (未登録の場合は登録)
+
+        Args:
+            session_id: セッションID
+            now: 現在時刻 (UNIX時間、省略時は現在時刻)
+            force: TOUCH_INTERVAL内の再アクセスでも記録するか
+        """
+        if now is None:
+            now = time.time()
+
+        with self._touched_lock:
+            last = self._touched.get(session_id)
+            if not force and last is not None and now - last < self.touch_interval:
+                return
+            if len(self._touched) >= TOUCH_CACHE_SIZE:
+                self._touched.clear()
+            self._touched[session_id] = now
+
+        self._connection().execute(
+            "INSERT INTO sessions (session_id, created_at, last_access) VALUES (?, ?, ?) "
+            "ON CONFLICT (session_id) "
+            "DO UPDATE SET last_access = MAX(last_access, excluded.last_access)",
+            (session_id, now, now),
+        )
+
+    def remove(self, session_id: str) -> None:
+        """
+        セッションとその成果物をインデックスから削除
+
+        Args:
+            session_id: セッションID
+        """
+        with self._touched_lock:
+            self._touched.pop(session_id, None)
+
+        with self._transaction() as connection:
+            (removed_bytes,) = connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM artifacts WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            connection.execute("DELETE FROM artifacts WHERE session_id = ?", (session_id,))
+            connection.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            connection.execute("UPDATE totals SET bytes = bytes - ? WHERE id = 0", (removed_bytes,))
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """書き込みトランザクション (他プロセスの書き込みと直列化される)"""
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def record_artifact(
+        self,
+        session_id: str,
+        name: str,
+        kind: str,
+        size: int,
+        now: Optional[float] = None,
+        content_hash: Optional[str] = None,
+        image_format: Optional[str] = None,
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+    ) -> None:
+        """
+        セッション内のファイルのサイズとメタデータを記録し、合計使用量を差分で更新
+        既に記録されている場合は種類を変えずにサイズとメタデータを更新する
+
+        Args:
+            session_id: セッションID
+            name: ファイル名
+            kind: 成果物の種類 ("original", "processed" など)
+            size: ファイルサイズ (bytes)
+            now: 現在時刻 (UNIX時間、省略時は現在時刻)
+            content_hash: 内容のSHA-256
+            image_format: 画像形式 ("PNG" など)
+            width: 画像の幅
+            height: 画像の高さ
+        """
+        if now is None:
+            now = time.time()
+
+        with self._transaction() as connection:
+            row = connection.execute(
+                "SELECT size FROM artifacts WHERE session_id = ? AND name = ?",
+                (session_id, name),
+            ).fetchone()
+            delta = size - (row[0] if row else 0)
+            connection.execute(
+                "INSERT INTO artifacts "
+                "(session_id, name, kind, size, updated_at, content_hash, format, width, height) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (session_id, name) "
+                "DO UPDATE SET size = excluded.size, updated_at = excluded.updated_at, "
+                "content_hash = excluded.content_hash, format = excluded.format, "
+                "width = excluded.width, height = excluded.height",
+                (session_id, name, kind, size, now, content_hash, image_format, width, height),
+            )
+            connection.execute(
+                "INSERT OR IGNORE INTO sessions (session_id, created_at, last_access) "
+                "VALUES (?, ?, ?)",
+                (session_id, now, now),
+            )
+            connection.execute("UPDATE totals SET bytes = bytes + ? WHERE id = 0", (delta,))
+
+    def remove_artifact(self, session_id: str, name: str) -> None:
+        """
+        セッション内のファイルの記録を削除
+
+        Args:
+            session_id: セッションID
+            name: ファイル名
+        """
+        with self._transaction() as connection:
+            row = connection.execute(
+                "SELECT size FROM artifacts WHERE session_id = ? AND name = ?",
+                (session_id, name),
+            ).fetchone()
+            if row is None:
+                return
+            connection.execute(
+                "DELETE FROM artifacts WHERE session_id = ? AND name = ?", (session_id, name)
+            )
+            connection.execute("UPDATE totals SET bytes = bytes - ? WHERE id = 0", (row[0],))
+
+    def get_artifact(self, session_id: str, name: str) -> Optional[Dict[str, Any]]:
+        """
+        セッション内のファイルの記録を取得
+
+        Args:
+            session_id: セッションID
+            name: ファイル名
+
+        Returns:
+            name・kind・size・updated_at・content_hash・format・width・heightの辞書。
+            未登録の場合None
+        """
+        row = (
+            self._connection()
+            .execute(
+                f"SELECT {', '.join(_ARTIFACT_FIELDS)} FROM artifacts "
+                "WHERE session_id = ? AND name = ?",
+                (session_id, name),
+            )
+            .fetchone()
+        )
+        return dict(zip(_ARTIFACT_FIELDS, row)) if row else None
+
+    def list_artifacts(self, session_id: str) -> List[Dict[str, Any]]:
+        """
+        セッション内のファイルの記録を名前順に取得
+
+        Args:
+            session_id: セッションID
+
+        Returns:
+            get_artifactと同じ形式の辞書のリスト
+        """
+        rows = self._connection().execute(
+            f"SELECT {', '.join(_ARTIFACT_FIELDS)} FROM artifacts "
+            "WHERE session_id = ? ORDER BY name",
+            (session_id,),
+        )
+        return [dict(zip(_ARTIFACT_FIELDS, row)) for row in rows]
+
+    def total_bytes(self) -> int:
+        """全セッションの成果物の合計サイズ (bytes) を取得"""
+        row = self._connection().execute("SELECT bytes FROM totals WHERE id = 0").fetchone()
+        return int(row[0])
+
+    def session_bytes(self, session_id: str) -> int:
+        """
+        セッションの成果物の合計サイズを取得
+
+        Args:
+            session_id: セッションID
+
+        Returns:
+            合計サイズ (bytes)
+        """
+        row = (
+            self._connection()
+            .execute(
+                "SELECT COALESCE(SUM(size), 0) FROM artifacts WHERE session_id = ?", (session_id,)
+            )
+            .fetchone()
+        )
+        return int(row[0])
+
+    def lru_derived_artifacts(self, cutoff: float, limit: int) -> List[Tuple[str, str, int]]:
+        """
+        最終アクセスが指定時刻より古いセッションの派生成果物 (元画像以外) を、
+        セッションの最終アクセスが古い順に取得
+
+        Args:
+            cutoff: この時刻より前にアクセスされたセッションを対象とする (UNIX時間)
+            limit: 取得する最大件数
+
+        Returns:
+            (セッションID, ファイル名, サイズ) のリスト
+        """
+        rows = self._connection().execute(
+            "SELECT a.session_id, a.name, a.size FROM artifacts AS a "
+            "LEFT JOIN sessions AS s ON s.session_id = a.session_id "
+            "WHERE a.kind != ? AND COALESCE(s.last_access, 0) < ? "
+            "ORDER BY COALESCE(s.last_access, 0), a.updated_at LIMIT ?",
+            (ORIGINAL_KIND, cutoff, limit),
+        )
+        return [(row[0], row[1], row[2]) for row in rows]
+
+    def set_archived(self, session_id: str, archived: bool) -> None:
+        """
+        セッションを退避済み (ローカルにファイルがない状態) として記録、または解除
+        退避時は成果物の記録も削除し、ローカルの使用量から除く
+
+        Args:
+            session_id: セッションID
+            archived: 退避済みにする場合True
+        """
+        with self._transaction() as connection:
+            if archived:
+                (removed_bytes,) = connection.execute(
+                    "SELECT COALESCE(SUM(size), 0) FROM artifacts WHERE session_id = ?",
+                    (session_id,),
+                ).fetchone()
+                connection.execute("DELETE FROM artifacts WHERE session_id = ?", (session_id,))
+                connection.execute(
+                    "UPDATE totals SET bytes = bytes - ? WHERE id = 0", (removed_bytes,)
+                )
+            connection.execute(
+                "UPDATE sessions SET archived = ? WHERE session_id = ?",
+                (1 if archived else 0, session_id),
+            )
+
+    def is_archived(self, session_id: str) -> bool:
+        """
+        セッションが退避済みか
+
+        Args:
+            session_id: セッションID
+
+        Returns:
+            退避済みの場合True
+        """
+        row = (
+            self._connection()
+            .execute("SELECT archived FROM sessions WHERE session_id = ?", (session_id,))
+            .fetchone()
+        )
+        return bool(row and row[0])
+
+    def idle_sessions(self, cutoff: float, limit: int) -> List[str]:
+        """
+        最終アクセスが指定時刻より古い、退避されていないセッションを古い順に取得
+
+        Args:
+            cutoff: この時刻より前にアクセスされたセッションを対象とする (UNIX時間)
+            limit: 取得する最大件数
+
+        Returns:
+            セッションIDのリスト
+        """
+        rows = self._connection().execute(
+            "SELECT session_id FROM sessions WHERE last_access < ? AND archived = 0 "
+            "ORDER BY last_access LIMIT ?",
+            (cutoff, limit),
+        )
+        return [row[0] for row in rows]
+
+    def get_last_access(self, session_id: str) -> Optional[float]:
+        """
+        セッションの最終アクセス時刻を取得
+
+        Args:
+            session_id: セッションID
+
+        Returns:
+            最終アクセス時刻 (UNIX時間)。未登録の場合None
+        """
+        row = (
+            self._connection()
+            .execute("SELECT last_access FROM sessions WHERE session_id = ?", (session_id,))
+            .fetchone()
+        )
+        return row[0] if row else None
+
+    def expired_sessions(self, cutoff: float, limit: int) -> List[str]:
+        """
+        最終アクセスが指定時刻より古いセッションを古い順に取得
+
+        Args:
+            cutoff: この時刻より前にアクセスされたセッションを対象とする (UNIX時間)
+            limit: 取得する最大件数
+
+        Returns:
+            セッションIDのリスト
+        """
+        rows = self._connection().execute(
+            "SELECT session_id FROM sessions WHERE last_access < ? " "ORDER BY last_access LIMIT ?",
+            (cutoff, limit),
+        )
+        return [row[0] for row in rows]
+
+    def count(self) -> int:
+        """登録されているセッション数を取得"""
+        row = self._connection().execute("SELECT COUNT(*) FROM sessions").fetchone()
+        return int(row[0])
+
+    def backfill(self, session_dirs: List[Path]) -> int:
+        """
+        インデックス導入前から存在するセッションディレクトリを登録
+        最終アクセス時刻にはディレクトリの更新時刻を使う
+
+        Args:
+            session_dirs: セッションディレクトリのリスト
+
+        Returns:
+            登録したセッション数
+        """
+        rows = []
+        for session_dir in session_dirs:
+            if not validate_session_id(session_dir.name):
+                continue
+            try:
+                mtime = session_dir.stat().st_mtime
+            except OSError:
+                continue
+            rows.append((session_dir.name, mtime, mtime))
+
+        connection = self._connection()
+        connection.execute("BEGIN")
+        try:
+            connection.executemany(
+                "INSERT OR IGNORE INTO sessions (session_id, created_at, last_access) "
+                "VALUES (?, ?, ?)",
+                rows,
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return len(rows)
+
+
+# アプリケーション全体で共有するインデックス
+session_index = SessionIndex(INDEX_PATH)
@@ -0,0 +1,80 @@
+"""
+環境変数による設定
+設定は ENV_PREFIX で始まる環境変数から読み込む (例: TRANSPALENTOR_ARCHIVE_BACKEND)
+"""
+
+import os
+from typing import Mapping, Optional
+
+# 設定に使う環境変数の接頭辞
+ENV_PREFIX = "TRANSPALENTOR_"
+
+_TRUE_VALUES = {"1", "true", "yes", "on"}
+_FALSE_VALUES = {"0", "false", "no", "off"}
+
+
+def get_setting(
+    name: str, default: Optional[str] = None, environ: Optional[Mapping[str, str]] = None
+) -> Optional[str]:
+    """
+    設定値を取得
+
+    Args:
+        name: 設定名 (接頭辞を除いた環境変数名)
+        default: 未設定または空の場合の値
+        environ: 参照する環境変数 (省略時は os.environ)
+
+    Returns:
+        設定値
+    """
+    value = (os.environ if environ is None else environ).get(ENV_PREFIX + name, "").strip()
+    return value or default
+
+
+def get_bool_setting(name: str, default: bool, environ: Optional[Mapping[str, str]] = None) -> bool:
+    """
+    真偽値の設定値を取得
+
+    Args:
+        name: 設定名 (接頭辞を除いた環境変数名)
+        default: 未設定の場合の値
+        environ: 参照する環境変数 (省略時は os.environ)
+
+    Returns:
+        設定値
+
+    Raises:
+        ValueError: 真偽値として解釈できない場合
+    """
+    value = get_setting(name, environ=environ)
+    if value is None:
+        return default
+    if value.lower() in _TRUE_VALUES:
+        return True
+    if value.lower() in _FALSE_VALUES:
+        return False
+    raise ValueError(f"Invalid boolean for {ENV_PREFIX}{name}: {value}")
+
+
+def get_int_setting(name: str, default: int, environ: Optional[Mapping[str, str]] = None) -> int:
+    """
+    整数の設定値を取得
+
+    Args:
+        name: 設定名 (接頭辞を除いた環境変数名)
+        default: 未設定の場合の値
+        environ: 参照する環境変数 (省略時は os.environ)
+
+    Returns:
+        設定値
+
+    Raises:
+        ValueError: 整数として解釈できない場合
+    """
+    value = get_setting(name, environ=environ)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError as e:
+        raise ValueError(f"Invalid integer for {ENV_PREFIX}{name}: {value}") from e
@@ -0,0 +1,311 @@
+"""
+ストレージバックエンド
+キーとバイト列の対応を保存する共通インターフェースと、その実装
+
+- LocalDiskBackend: ローカルディスク (一時ファイルからのリネームで原子的に書き込む)
+- MemoryBackend: メモリ上のLRU。上限を超えたエントリは下位のバックエンドへ退避 (spill) する
+- S3Backend: S3互換のオブジェクトストレージ (boto3がインストールされている場合のみ)
+
+キーは "/" 区切りの相対パス形式 (例: "<session_id>/image.png") とする。
+"""
+
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from .file_storage import atomic_write_bytes
+
+
+def _validate_key(key: str) -> None:
+    """キーが相対パスとして安全であることを確認"""
+    parts = key.split("/")
+    if not key or key.startswith("/") or any(part in ("", ".", "..") for part in parts):
+        raise ValueError(f"Invalid storage key: {key}")
+
+
+class StorageBackend(ABC):
+    """ストレージバックエンドのインターフェース"""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        キーに対応する内容を取得
+
+        Args:
+            key: キー
+
+        Returns:
+            内容。存在しない場合None
+        """
+
+    @abstractmethod
+    def put(self, key: str, data: bytes) -> None:
+        """
+        キーに内容を保存 (既に存在する場合は置き換える)
+
+        Args:
+            key: キー
+            data: 内容
+        """
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """
+        キーを削除 (存在しない場合は何もしない)
+
+        Args:
+            key: キー
+        """
+
+    @abstractmethod
+    def list_keys(self, prefix: str = "") -> List[str]:
+        """
+        前方一致するキーを列挙
+
+        Args:
+            prefix: キーの接頭辞
+
+        Returns:
+            キーのリスト (昇順)
+        """
+
+    def exists(self, key: str) -> bool:
+        """
+        キーが存在するか
+
+        Args:
+            key: キー
+
+        Returns:
+            存在する場合True
+        """
+        return self.get(key) is not None
+
+
+class LocalDiskBackend(StorageBackend):
+    """ローカルディスク上のディレクトリに保存するバックエンド"""
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+
+    def _path(self, key: str) -> Path:
+        _validate_key(key)
+        return self.root / key
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            return self._path(key).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write_bytes(path, data)
+
+    def delete(self, key: str) -> None:
+        self._path(key).unlink(missing_ok=True)
+
+    def list_keys(self, prefix: str = "") -> List[str]:
+        if not self.root.exists():
+            return []
+        keys = (
+            path.relative_to(self.root).as_posix()
+            for path in self.root.rglob("*")
+            # 書き込み途中の一時ファイル (.<name>.<uuid>.tmp) は除く
+            if path.is_file() and not (path.name.startswith(".") and path.name.endswith(".tmp"))
+        )
+        return sorted(key for key in keys if key.startswith(prefix))
+
+    def exists(self, key: str) -> bool:
+        return self._path(key).is_file()
+
+
+class MemoryBackend(StorageBackend):
+    """
+    メモリ上に保持するバックエンド
+
+    バイト数の上限を超えると最も古いエントリから削除し、spill が指定されていれば
+    そこへ書き出す。メモリにないキーは spill から読み込み、メモリへ戻す。
+    """
+
+    def __init__(self, limit_bytes: int, spill: Optional[StorageBackend] = None) -> None:
+        self.limit_bytes = limit_bytes
+        self.spill = spill
+        self._lock = threading.Lock()
+        # キー → (内容, spill側に同じ内容があるか)
+        self._entries: "OrderedDict[str, Tuple[bytes, bool]]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.spilled = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        _validate_key(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        if self.spill is None:
+            return None
+        data = self.spill.get(key)
+        if data is not None:
+            self._store(key, data, persisted=True)
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        _validate_key(key)
+        self._store(key, data, persisted=False)
+
+    def _store(self, key: str, data: bytes, persisted: bool) -> None:
+        """
+        メモリに保存し、上限を超えた分を退避
+        取り除いたエントリの退避はロック下で行い、どちらの層にもない瞬間を作らない
+        """
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous[0])
+
+            if len(data) > self.limit_bytes:
+                # 上限より大きい内容はメモリに置かず直接退避する
+                if self.spill is not None and not persisted:
+                    self.spill.put(key, data)
+                    self.spilled += 1
+                return
+
+            self._entries[key] = (data, persisted)
+            self._bytes += len(data)
+            while self._bytes > self.limit_bytes:
+                old_key, (old_data, old_persisted) = self._entries.popitem(last=False)
+                self._bytes -= len(old_data)
+                if self.spill is not None and not old_persisted:
+                    self.spill.put(old_key, old_data)
+                    self.spilled += 1
+
+    def _drop(self, key: str) -> None:
+        """メモリからのみ削除"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= len(entry[0])
+
+    def delete(self, key: str) -> None:
+        _validate_key(key)
+        self._drop(key)
+        if self.spill is not None:
+            self.spill.delete(key)
+
+    def list_keys(self, prefix: str = "") -> List[str]:
+        with self._lock:
+            keys = {key for key in self._entries if key.startswith(prefix)}
+        if self.spill is not None:
+            keys.update(self.spill.list_keys(prefix))
+        return sorted(keys)
+
+    def exists(self, key: str) -> bool:
+        _validate_key(key)
+        with self._lock:
+            if key in self._entries:
+                return True
+        return self.spill is not None and self.spill.exists(key)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        統計情報を取得
+
+        Returns:
+            ヒット数・ミス数・退避数・保持数・使用量の辞書
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "spilled": self.spilled,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "limit_bytes": self.limit_bytes,
+            }
+
+
+# 存在しないオブジェクトを表すS3のエラーコード
+_S3_MISSING_CODES = {"NoSuchKey", "404", "NotFound"}
+
+
+def _is_missing_object(error: Exception) -> bool:
+    """S3クライアントの例外がオブジェクトの不在を表すか"""
+    response = getattr(error, "response", None) or {}
+    return str(response.get("Error", {}).get("Code")) in _S3_MISSING_CODES
+
+
+class S3Backend(StorageBackend):
+    """
+    S3互換のオブジェクトストレージに保存するバックエンド
+
+    client を省略した場合は boto3 でクライアントを作成する。boto3 は必須の依存関係では
+    ないため、使用する場合のみインストールする。テストでは同じメソッドを持つ
+    ローカルの代替クライアントを渡す。
+    """
+
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str = "",
+        client: Optional[Any] = None,
+        **client_options: Any,
+    ) -> None:
+        if client is None:
+            try:
+                import boto3  # type: ignore
+            except ImportError as e:
+                raise RuntimeError("boto3 is required to use S3Backend") from e
+            client = boto3.client("s3", **client_options)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+
+    def _object_key(self, key: str) -> str:
+        _validate_key(key)
+        return self.prefix + key
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))
+        except Exception as e:
+            if _is_missing_object(e):
+                return None
+            raise
+        data: bytes = response["Body"].read()
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        self.client.put_object(Bucket=self.bucket, Key=self._object_key(key), Body=data)
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+
+    def list_keys(self, prefix: str = "") -> List[str]:
+        keys: List[str] = []
+        options: Dict[str, Any] = {"Bucket": self.bucket, "Prefix": self.prefix + prefix}
+        while True:
+            response = self.client.list_objects_v2(**options)
+            keys.extend(item["Key"][len(self.prefix) :] for item in response.get("Contents", []))
+            if not response.get("IsTruncated"):
+                break
+            options["ContinuationToken"] = response["NextContinuationToken"]
+        return sorted(keys)
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+        except Exception as e:
+            if _is_missing_object(e):
+                return False
+            raise
+        return True
@@ -0,0 +1,276 @@
+"""
+一時ディレクトリの容量管理
+セッションごと・成果物ごとの使用量をセッションインデックスに差分で記録し、
+使用量が上限の HIGH_WATERMARK を超えたら LOW_WATERMARK まで削除する
+
+削除の順序:
+1. 処理結果キャッシュのディスク層 (いつでも再生成できる)
+2. 一定時間アクセスのないセッションの派生成果物 (処理済み画像など)。
+   セッションの最終アクセスが古い順 (未保存の変更がある作業中画像は削除しない)
+3. 一定時間アクセスのないセッション全体。最終アクセスが古い順
+   (退避先が設定されている場合は削除せずに退避する)
+
+使用量はセッション内のファイルの論理サイズの合計で、重複排除されたブロブも
+セッションごとに数えるため、実際のディスク使用量より大きめの値になる。
+未完了の分割アップロードが事前確保しているサイズと、取り込み前のアップロードの
+一時ファイルも使用量に含める (削除の対象にはしない)。
+"""
+
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from . import resumable_upload
+from .file_storage import get_session_directory, read_image_metadata, staging_bytes
+from .logging_config import get_logger
+from .result_cache import ResultCache, compute_content_hash, result_cache
+from .session_index import SessionIndex, session_index
+from .working_images import WorkingImageManager, working_images
+
+# 一時ディレクトリの容量上限 (bytes)
+STORAGE_BUDGET_BYTES = 2 * 1024 * 1024 * 1024
+
+# 削除を開始する使用率と、削除後の目標使用率
+HIGH_WATERMARK = 0.9
+LOW_WATERMARK = 0.75
+
+# この時間 (秒) 以上アクセスのないセッションを、派生成果物・セッション全体の削除の対象にする
+IDLE_SESSION_SECONDS = 15 * 60
+
+# 1回の問い合わせで取り出す削除候補の数
+EVICTION_BATCH_SIZE = 200
+
+# 派生成果物の種類
+PROCESSED_KIND = "processed"
+
+logger = get_logger(__name__)
+
+
+class StorageBudget:
+    """一時ディレクトリの使用量の記録と上限超過時の削除"""
+
+    def __init__(
+        self,
+        index: SessionIndex,
+        cache: ResultCache,
+        images: WorkingImageManager,
+        budget_bytes: int = STORAGE_BUDGET_BYTES,
+        high_watermark: float = HIGH_WATERMARK,
+        low_watermark: float = LOW_WATERMARK,
+        idle_seconds: float = IDLE_SESSION_SECONDS,
+    ) -> None:
+        self.index = index
+        self.cache = cache
+        self.images = images
+        self.budget_bytes = budget_bytes
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.idle_seconds = idle_seconds
+        self._enforce_lock = threading.Lock()
+        self.evicted_artifacts = 0
+        self.evicted_sessions = 0
+        self.evicted_bytes = 0
+
+    def record(
+        self,
+        session_id: str,
+        name: str,
+        kind: str,
+        size: int,
+        content_hash: Optional[str] = None,
+        image_format: Optional[str] = None,
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+    ) -> None:
+        """
+        セッション内のファイルの書き込みをメタデータとともに記録し、
+        必要なら削除をバックグラウンドで開始
+
+        Args:
+            session_id: セッションID
+            name: ファイル名
+            kind: 成果物の種類 ("original", "processed" など)
+            size: ファイルサイズ (bytes)
+            content_hash: 内容のSHA-256
+            image_format: 画像形式
+            width: 画像の幅
+            height: 画像の高さ
+        """
+        self.index.record_artifact(
+            session_id,
+            name,
+            kind,
+            size,
+            content_hash=content_hash,
+            image_format=image_format,
+            width=width,
+            height=height,
+        )
+        if self.usage() > self.budget_bytes * self.high_watermark:
+            self._start_enforce()
+
+    def record_path(self, file_path: Path, data: bytes) -> None:
+        """
+        セッションディレクトリ内のファイルの書き込みを記録
+        (作業中画像の保存通知用。既に記録済みの場合は種類を変えない)
+
+        Args:
+            file_path: ファイルのパス
+            data: 書き込んだ内容
+        """
+        self.record(
+            file_path.parent.name,
+            file_path.name,
+            PROCESSED_KIND,
+            len(data),
+            content_hash=compute_content_hash(data),
+            **read_image_metadata(data),
+        )
+
+    def usage(self) -> int:
+        """現在の使用量 (bytes) を取得"""
+        return (
+            self.index.total_bytes()
+            + self.cache.disk_usage()
+            + resumable_upload.pending_upload_bytes()
+            + staging_bytes()
+        )
+
+    def _start_enforce(self) -> None:
+        """削除処理を別スレッドで開始 (実行中の場合は何もしない)"""
+        if self._enforce_lock.locked():
+            return
+        threading.Thread(target=self.enforce, daemon=True).start()
+
+    def enforce(self, now: Optional[float] = None) -> int:
+        """
+        使用量が上限のHIGH_WATERMARKを超えている場合、LOW_WATERMARKまで削除
+
+        Args:
+            now: 現在時刻 (UNIX時間、省略時は現在時刻)
+
+        Returns:
+            解放したバイト数
+        """
+        if not self._enforce_lock.acquire(blocking=False):
+            return 0
+        try:
+            return self._enforce(time.time() if now is None else now)
+        finally:
+            self._enforce_lock.release()
+
+    def _enforce(self, now: float) -> int:
+        usage = self.usage()
+        if usage <= self.budget_bytes * self.high_watermark:
+            return 0
+
+        target = int(self.budget_bytes * self.low_watermark)
+        freed = 0
+
+        # 1. 処理結果キャッシュのディスク層
+        cache_usage = self.cache.disk_usage()
+        if cache_usage > 0:
+            freed += self.cache.shrink_disk(max(0, cache_usage - (usage - target)))
+
+        # 2. アクセスのないセッションの派生成果物をセッションの最終アクセスが古い順に
+        cutoff = now - self.idle_seconds
+        while usage - freed > target:
+            candidates = self.index.lru_derived_artifacts(cutoff, EVICTION_BATCH_SIZE)
+            evicted = 0
+            for session_id, name, size in candidates:
+                if usage - freed <= target:
+                    break
+                if self._evict_artifact(session_id, name):
+                    freed += size
+                    evicted += 1
+            # 残りが未保存の変更のあるものだけの場合は同じ候補が返り続ける
+            if not evicted:
+                break
+
+        # 3. アクセスのないセッション全体を最終アクセスが古い順に
+        while usage - freed > target:
+            idle = self.index.idle_sessions(cutoff, EVICTION_BATCH_SIZE)
+            if not idle:
+                break
+            for session_id in idle:
+                if usage - freed <= target:
+                    break
+                freed += self._evict_session(session_id)
+
+        self.evicted_bytes += freed
+        if freed:
+            logger.info(f"Storage budget exceeded: freed {freed} bytes")
+        return freed
+
+    def _evict_artifact(self, session_id: str, name: str) -> bool:
+        """派生成果物を削除 (未保存の変更がある場合は削除せずFalseを返す)"""
+        try:
+            if not self.images.discard(get_session_directory(session_id) / name, keep_pending=True):
+                return False
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to evict {session_id}/{name}: {e}")
+        self.index.remove_artifact(session_id, name)
+        self.evicted_artifacts += 1
+        return True
+
+    def _evict_session(self, session_id: str) -> int:
+        """
+        セッション全体をローカルから削除し、解放したバイト数を返す
+        退避先が設定されている場合は削除せずに退避する
+        """
+        from .session_archive import session_archive
+        from .session_cleanup import delete_session
+
+        size = self.index.session_bytes(session_id)
+        try:
+            if session_archive.enabled and session_archive.index is self.index:
+                try:
+                    if not session_archive.archive_session(session_id):
+                        self.index.set_archived(session_id, True)
+                except Exception as e:
+                    # 退避できない場合は削除して容量を確保する
+                    logger.warning(f"Failed to archive session {session_id}: {e}")
+                    delete_session(session_id, self.index)
+            else:
+                delete_session(session_id, self.index)
+        except Exception as e:
+            logger.warning(f"Failed to evict session {session_id}: {e}")
+            self.index.remove(session_id)
+        self.evicted_sessions += 1
+        return size
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        容量管理の統計情報を取得
+
+        Returns:
+            使用量・上限・削除数などの辞書
+        """
+        sessions_bytes = self.index.total_bytes()
+        cache_bytes = self.cache.disk_usage()
+        uploads_bytes = resumable_upload.pending_upload_bytes()
+        staged_bytes = staging_bytes()
+        usage = sessions_bytes + cache_bytes + uploads_bytes + staged_bytes
+        return {
+            "usage_bytes": usage,
+            "sessions_bytes": sessions_bytes,
+            "cache_bytes": cache_bytes,
+            "uploads_bytes": uploads_bytes,
+            "staging_bytes": staged_bytes,
+            "budget_bytes": self.budget_bytes,
+            "usage_ratio": usage / self.budget_bytes,
+            "high_watermark": self.high_watermark,
+            "low_watermark": self.low_watermark,
+            "sessions": self.index.count(),
+            "evicted_artifacts": self.evicted_artifacts,
+            "evicted_sessions": self.evicted_sessions,
+            "evicted_bytes": self.evicted_bytes,
+        }
+
+
+# アプリケーション全体で共有する容量管理
+storage_budget = StorageBudget(session_index, result_cache, working_images)
+
+# 消しゴム処理の遅延保存も使用量に反映する
+working_images.add_write_listener(storage_budget.record_path)
@@ -0,0 +1,515 @@
+"""
+編集中画像の管理
+セッション単位のロックで画像の変更を直列化し、作業中の画像をメモリに保持したまま
+ディスクへの書き込みを遅延・集約する (write-behind)
+
+- 同一プロセス内の変更は threading.Lock で、ワーカープロセス間の変更はセッション
+  ディレクトリのロックファイルへの flock で直列化する
+- 未保存の変更があるプロセスは、保存が終わるまで flock を保持し続ける。そのため別の
+  ワーカーが同じセッションを変更しようとすると、保存済みの最新状態を読み込むまで待つ
+- 保存は最後の変更から FLUSH_DELAY 秒後、または読み込み要求時に行う
+- 読み取りは flock の共有ロック下で行い、別のワーカーに未保存の変更がある場合は
+  その保存を待ってからディスクの内容を読む
+- エンコード済みの内容 (透過処理の結果や応答に含めるためにエンコードしたもの) は
+  保持しておき、保存時に再エンコードしない
+"""
+
+import fcntl
+import io
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+from PIL import Image
+
+from .file_storage import atomic_write_bytes, encode_png
+
+# 最後の変更からディスクへ保存するまでの待ち時間 (秒)
+FLUSH_DELAY = 0.2
+
+# メモリに保持する作業中画像の最大数 (未保存のものは上限を超えても保持する)
+MAX_WORKING_IMAGES = 32
+
+# セッションディレクトリ内のロックファイル名
+LOCK_FILENAME = ".lock"
+
+StatKey = Tuple[int, int, int]
+
+T = TypeVar("T")
+
+
+def _stat_key(file_path: Path) -> Optional[StatKey]:
+    """ファイルが他から置き換えられたかを判定するための (inode, mtime, size) を取得"""
+    try:
+        stat = file_path.stat()
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+class _SessionLock:
+    """セッション単位のプロセス内ロックとプロセス間ファイルロック"""
+
+    def __init__(self, session_dir: Path) -> None:
+        self.session_dir = session_dir
+        self.mutex = threading.Lock()
+        self._lock_fd: Optional[int] = None
+        # このロックを使用中のスレッド数と、セッション削除で不要になったか
+        # (_registry_lock 取得済みで読み書きする)
+        self.users = 0
+        self.discarded = False
+
+    @property
+    def file_locked(self) -> bool:
+        """プロセス間ロックを保持しているか"""
+        return self._lock_fd is not None
+
+    def acquire_file_lock(self) -> None:
+        """プロセス間ロックを取得 (mutex取得済みで呼ぶ)"""
+        if self._lock_fd is not None:
+            return
+        fd = os.open(self.session_dir / LOCK_FILENAME, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._lock_fd = fd
+
+    def release_file_lock(self) -> None:
+        """プロセス間ロックを解放 (mutex取得済みで呼ぶ)"""
+        if self._lock_fd is None:
+            return
+        try:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+        finally:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    @contextmanager
+    def shared_file_lock(self) -> Iterator[None]:
+        """
+        読み取り用のプロセス間共有ロックを保持する (mutex取得済みで呼ぶ)
+        このプロセスが排他ロックを保持している場合はそのまま読み取れるため何もしない
+        """
+        if self._lock_fd is not None:
+            yield
+            return
+        fd = os.open(self.session_dir / LOCK_FILENAME, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            yield
+        finally:
+            # クローズでロックも解放される
+            os.close(fd)
+
+
+class _WorkingImage:
+    """メモリ上の作業中画像 (image と encoded の少なくとも一方を持つ)"""
+
+    def __init__(
+        self,
+        image: Optional[Image.Image],
+        stat_key: Optional[StatKey],
+        encoded: Optional[bytes] = None,
+    ) -> None:
+        self.image = image
+        self.stat_key = stat_key
+        self.encoded = encoded
+        self.dirty = False
+        self.timer: Optional[threading.Timer] = None
+
+    def decoded(self) -> Image.Image:
+        """画像を取得 (エンコード済みの内容しかない場合はデコードする)"""
+        if self.image is None:
+            with Image.open(io.BytesIO(self.encoded or b"")) as image:
+                image.load()
+                self.image = image if image.mode == "RGBA" else image.convert("RGBA")
+        return self.image
+
+    def encode(self) -> bytes:
+        """エンコード済みの内容を取得 (ない場合はエンコードして保持する)"""
+        if self.encoded is None:
+            self.encoded = encode_png(self.decoded())
+        return self.encoded
+
+
+class WorkingImageManager:
+    """
+    作業中画像のロック・メモリ保持・遅延保存を管理する
+
+    メソッドはすべて同期的にブロックするため、ハンドラーからは
+    asyncio.to_thread 経由で呼び出す。
+    """
+
+    def __init__(
+        self, flush_delay: float = FLUSH_DELAY, max_entries: int = MAX_WORKING_IMAGES
+    ) -> None:
+        self.flush_delay = flush_delay
+        self.max_entries = max_entries
+        self._registry_lock = threading.Lock()
+        self._session_locks: Dict[Path, _SessionLock] = {}
+        self._entries: "OrderedDict[Path, _WorkingImage]" = OrderedDict()
+        self._write_listeners: List[Callable[[Path, bytes], None]] = []
+        self.flushes = 0
+        self.coalesced_edits = 0
+
+    def add_write_listener(self, listener: Callable[[Path, bytes], None]) -> None:
+        """
+        ファイルをディスクへ書き込んだ後に呼ばれる関数を登録
+
+        Args:
+            listener: (ファイルのパス, 書き込んだ内容) を受け取る関数
+        """
+        self._write_listeners.append(listener)
+
+    def _notify_write(self, file_path: Path, data: bytes) -> None:
+        """書き込みを登録済みの関数に通知"""
+        for listener in self._write_listeners:
+            listener(file_path, data)
+
+    @contextmanager
+    def _session_lock(self, file_path: Path) -> Iterator[_SessionLock]:
+        """
+        ファイルが属するセッションのロック (なければ作成) の mutex を保持する
+        使用中のロックはセッションが破棄されてもレジストリから削除しない
+        """
+        session_dir = file_path.parent
+        with self._registry_lock:
+            lock = self._session_locks.get(session_dir)
+            if lock is None:
+                lock = _SessionLock(session_dir)
+                self._session_locks[session_dir] = lock
+            lock.users += 1
+        try:
+            with lock.mutex:
+                yield lock
+        finally:
+            with self._registry_lock:
+                lock.users -= 1
+                if (
+                    lock.users == 0
+                    and lock.discarded
+                    and not lock.file_locked
+                    and self._session_locks.get(session_dir) is lock
+                ):
+                    del self._session_locks[session_dir]
+
+    def _load(self, file_path: Path) -> _WorkingImage:
+        """メモリ上の画像が最新ならそれを、そうでなければディスクから読み込む (ロック取得済みで呼ぶ)"""
+        with self._registry_lock:
+            entry = self._entries.get(file_path)
+            if entry is not None:
+                self._entries.move_to_end(file_path)
+
+        if entry is not None and (entry.dirty or entry.stat_key == _stat_key(file_path)):
+            return entry
+
+        with Image.open(file_path) as image:
+            image.load()
+            loaded = image if image.mode == "RGBA" else image.convert("RGBA")
+
+        entry = _WorkingImage(loaded, _stat_key(file_path))
+        with self._registry_lock:
+            self._entries[file_path] = entry
+            self._evict_clean_entries()
+        return entry
+
+    def _evict_clean_entries(self) -> None:
+        """上限を超えた分の保存済みエントリを古い順に削除 (_registry_lock取得済みで呼ぶ)"""
+        excess = len(self._entries) - self.max_entries
+        for path in list(self._entries):
+            if excess <= 0:
+                break
+            if not self._entries[path].dirty:
+                del self._entries[path]
+                excess -= 1
+
+    def apply(
+        self,
+        file_path: Path,
+        operation: Callable[[Image.Image], Image.Image],
+        schedule_flush: bool = True,
+    ) -> Image.Image:
+        """
+        セッションのロックを取得して作業中画像に変更を適用し、遅延保存を予約
+
+        Args:
+            file_path: 画像ファイルのパス
+            operation: 画像を受け取り変更後の画像を返す関数 (受け取った画像を直接変更してもよい)
+            schedule_flush: Falseの場合は遅延保存を予約しない
+                (呼び出し側が操作の区切りで flush する場合に使う)
+
+        Returns:
+            変更後の画像
+
+        Raises:
+            FileNotFoundError: 画像ファイルが存在しない場合
+        """
+        with self._session_lock(file_path) as session_lock:
+            session_lock.acquire_file_lock()
+            try:
+                entry = self._load(file_path)
+            except BaseException:
+                if not self._has_dirty_entries(session_lock.session_dir):
+                    session_lock.release_file_lock()
+                raise
+
+            if entry.dirty:
+                self.coalesced_edits += 1
+            entry.image = operation(entry.decoded())
+            entry.encoded = None
+            entry.dirty = True
+            if schedule_flush:
+                self._schedule_flush(file_path, entry)
+
+            return entry.image
+
+    def _schedule_flush(self, file_path: Path, entry: _WorkingImage) -> None:
+        """遅延保存を予約 (予約済みの場合は何もしない。ロック取得済みで呼ぶ)"""
+        if entry.timer is None:
+            entry.timer = threading.Timer(self.flush_delay, self.flush, args=(file_path,))
+            entry.timer.daemon = True
+            entry.timer.start()
+
+    def read(self, file_path: Path, reader: Callable[[Image.Image], T]) -> T:
+        """
+        セッションのロックを取得して作業中画像の現在の内容を読み取る (未保存の変更を含む。保存はしない)
+        変更はその場で画像を書き換える場合があるため、画像はロック下の reader の中でのみ参照する
+        別のワーカーに未保存の変更がある場合は、共有ロックでその保存を待ってから読み込む
+
+        Args:
+            file_path: 画像ファイルのパス
+            reader: 画像 (RGBAモード) を受け取り、必要な値を取り出す関数
+
+        Returns:
+            reader の戻り値
+
+        Raises:
+            FileNotFoundError: 画像ファイルが存在しない場合
+        """
+        with self._session_lock(file_path) as session_lock:
+            with session_lock.shared_file_lock():
+                return reader(self._load(file_path).decoded())
+
+    def encoded(self, file_path: Path) -> bytes:
+        """
+        作業中画像のエンコード済みの内容を取得
+        エンコードした内容は保持し、遅延保存でそのまま書き込む
+
+        Args:
+            file_path: 画像ファイルのパス
+
+        Returns:
+            PNG形式の内容
+
+        Raises:
+            FileNotFoundError: 画像ファイルが存在しない場合
+        """
+        with self._session_lock(file_path) as session_lock:
+            with self._registry_lock:
+                entry = self._entries.get(file_path)
+            if entry is not None and entry.dirty:
+                return entry.encode()
+            # 保存済みの場合はディスクの内容が最新 (別のワーカーの保存を待って読む)
+            with session_lock.shared_file_lock():
+                return file_path.read_bytes()
+
+    def _has_dirty_entries(self, session_dir: Path) -> bool:
+        """セッション内に未保存のエントリがあるか"""
+        with self._registry_lock:
+            return any(
+                entry.dirty for path, entry in self._entries.items() if path.parent == session_dir
+            )
+
+    def _flush_locked(
+        self, session_lock: _SessionLock, file_path: Path, keep_file_lock: bool = False
+    ) -> None:
+        """未保存の変更をディスクに書き込み、不要になったファイルロックを解放 (mutex取得済みで呼ぶ)"""
+        with self._registry_lock:
+            entry = self._entries.get(file_path)
+
+        if entry is not None:
+            if entry.timer is not None:
+                entry.timer.cancel()
+                entry.timer = None
+            if entry.dirty:
+                data = entry.encode()
+                atomic_write_bytes(file_path, data)
+                entry.stat_key = _stat_key(file_path)
+                entry.dirty = False
+                self.flushes += 1
+                self._notify_write(file_path, data)
+
+        if not keep_file_lock and not self._has_dirty_entries(session_lock.session_dir):
+            session_lock.release_file_lock()
+
+    def flush(self, file_path: Path) -> None:
+        """
+        作業中画像の未保存の変更をディスクへ書き込む
+
+        Args:
+            file_path: 画像ファイルのパス
+        """
+        with self._session_lock(file_path) as session_lock:
+            self._flush_locked(session_lock, file_path)
+
+    def has_pending_changes(self, file_path: Path) -> bool:
+        """
+        このプロセスに未保存の変更が残っているか
+
+        Args:
+            file_path: 画像ファイルのパス
+
+        Returns:
+            未保存の変更がある場合True
+        """
+        with self._registry_lock:
+            entry = self._entries.get(file_path)
+            return entry is not None and entry.dirty
+
+    def flush_all(self) -> None:
+        """全ての未保存の変更をディスクへ書き込む (シャットダウン時など)"""
+        with self._registry_lock:
+            dirty_paths = [path for path, entry in self._entries.items() if entry.dirty]
+        for file_path in dirty_paths:
+            self.flush(file_path)
+
+    def flush_session(self, session_dir: Path) -> None:
+        """
+        セッション内の未保存の変更をディスクへ書き込む
+
+        Args:
+            session_dir: セッションディレクトリ
+        """
+        with self._registry_lock:
+            dirty_paths = [
+                path
+                for path, entry in self._entries.items()
+                if entry.dirty and path.parent == session_dir
+            ]
+        for file_path in dirty_paths:
+            self.flush(file_path)
+
+    @contextmanager
+    def lock_session(self, session_dir: Path) -> Iterator[None]:
+        """
+        セッションのロックを取得して未保存の変更をディスクへ書き込み、ブロックの間ロックを保持する
+        (退避などでセッションのファイルをまとめて扱う間、他のスレッド・ワーカーの変更を止める)
+
+        Args:
+            session_dir: セッションディレクトリ
+        """
+        with self._session_lock(session_dir / LOCK_FILENAME) as session_lock:
+            session_lock.acquire_file_lock()
+            try:
+                with self._registry_lock:
+                    dirty_paths = [
+                        path
+                        for path, entry in self._entries.items()
+                        if entry.dirty and path.parent == session_dir
+                    ]
+                for file_path in dirty_paths:
+                    self._flush_locked(session_lock, file_path, keep_file_lock=True)
+                yield
+            finally:
+                if not self._has_dirty_entries(session_dir):
+                    session_lock.release_file_lock()
+
+    def write(self, file_path: Path, data: bytes, defer: bool = False) -> None:
+        """
+        セッションのロックを取得してファイルを置き換え、作業中画像を破棄
+        (透過処理の結果で画像を丸ごと置き換える場合などに使う)
+
+        Args:
+            file_path: 画像ファイルのパス
+            data: 書き込む内容
+            defer: Trueの場合は内容を作業中画像としてメモリに保持し、
+                消しゴム処理と同じく遅延して保存する
+        """
+        with self._session_lock(file_path) as session_lock:
+            session_lock.acquire_file_lock()
+            try:
+                with self._registry_lock:
+                    entry = self._entries.pop(file_path, None)
+                if entry is not None and entry.timer is not None:
+                    entry.timer.cancel()
+                if defer:
+                    entry = _WorkingImage(None, None, encoded=data)
+                    entry.dirty = True
+                    with self._registry_lock:
+                        self._entries[file_path] = entry
+                        self._evict_clean_entries()
+                    self._schedule_flush(file_path, entry)
+                    return
+                atomic_write_bytes(file_path, data)
+                # 保存時と同じく、ロック下で通知してインデックスの内容のハッシュを更新する
+                self._notify_write(file_path, data)
+            finally:
+                if not self._has_dirty_entries(session_lock.session_dir):
+                    session_lock.release_file_lock()
+
+    def discard(self, file_path: Path, keep_pending: bool = False) -> bool:
+        """
+        セッションのロックを取得してファイルを削除し、作業中画像も破棄
+
+        Args:
+            file_path: 画像ファイルのパス
+            keep_pending: Trueの場合、未保存の変更があれば何もしない
+
+        Returns:
+            削除した場合True
+        """
+        with self._session_lock(file_path) as session_lock:
+            if keep_pending and self.has_pending_changes(file_path):
+                return False
+            session_lock.acquire_file_lock()
+            try:
+                with self._registry_lock:
+                    entry = self._entries.pop(file_path, None)
+                if entry is not None and entry.timer is not None:
+                    entry.timer.cancel()
+                file_path.unlink(missing_ok=True)
+            finally:
+                if not self._has_dirty_entries(session_lock.session_dir):
+                    session_lock.release_file_lock()
+        return True
+
+    def discard_session(self, session_dir: Path) -> None:
+        """
+        セッションの作業中画像を保存せずに破棄 (セッション削除時に使う)
+
+        Args:
+            session_dir: セッションディレクトリ
+        """
+        with self._session_lock(session_dir / LOCK_FILENAME) as session_lock:
+            with self._registry_lock:
+                for path in [p for p in self._entries if p.parent == session_dir]:
+                    entry = self._entries.pop(path)
+                    if entry.timer is not None:
+                        entry.timer.cancel()
+                # 使用中の他のスレッドがあるため、ここでは削除せず最後の使用者が削除する
+                session_lock.discarded = True
+            session_lock.release_file_lock()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        統計情報を取得
+
+        Returns:
+            保持数・未保存数・保存回数・集約された変更回数の辞書
+        """
+        with self._registry_lock:
+            return {
+                "entries": len(self._entries),
+                "dirty_entries": sum(1 for entry in self._entries.values() if entry.dirty),
+                "flushes": self.flushes,
+                "coalesced_edits": self.coalesced_edits,
+            }
+
+
+# アプリケーション全体で共有するマネージャー
+working_images = WorkingImageManager()
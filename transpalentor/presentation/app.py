@@ -1,29 +1,137 @@
 """
 FastAPIアプリケーションのメインエントリーポイント
 """
-from pathlib import Path
-from typing import Any, Dict
 
-from fastapi import FastAPI, UploadFile, File
+import asyncio
+import io
+import json
+import os
+import uuid
+from contextlib import asynccontextmanager
+from itertools import accumulate
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Dict, Literal, Optional, Tuple
+
+from fastapi import (
+    FastAPI,
+    Header,
+    Query,
+    Request,
+    Response,
+    WebSocket,
+    WebSocketDisconnect,
+)
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse
 from fastapi.staticfiles import StaticFiles
+from PIL import Image
+from pydantic import ValidationError
 
 from .error_handlers import register_exception_handlers
-from .models import UploadResponse, ProcessRequest, ProcessResponse, EraseRequest, EraseResponse
-from .exceptions import SessionNotFoundError
-from ..application.validation import validate_image_file, get_file_extension
+from .middleware import UploadSizeLimitMiddleware
+from .models import (
+    UploadResponse,
+    UploadPrecheckRequest,
+    UploadPrecheckResponse,
+    ResumableUploadCreateRequest,
+    ResumableUploadStatus,
+    PreviewRequest,
+    ProcessRequest,
+    ProcessResponse,
+    ThresholdHistogramRequest,
+    ThresholdHistogramResponse,
+    EraseRequest,
+    EraseResponse,
+    CleanupResponse,
+    ImageAnalysisResponse,
+    PixelSampleRequest,
+    PixelSampleResponse,
+    SessionFileInfo,
+    SessionInfoResponse,
+    TileInfoResponse,
+)
+from .exceptions import (
+    FileTooLargeError,
+    ImageProcessingError,
+    InvalidPayloadError,
+    InvalidSignatureError,
+    SessionNotFoundError,
+    TileNotFoundError,
+    TooManyUploadsError,
+    UploadConflictError,
+    UploadNotFoundError,
+)
+from ..application.mask_payload import MAX_MASK_PAYLOAD_SIZE, decode_mask_payload
+from ..application.stroke_payload import MAX_STROKE_PAYLOAD_SIZE, decode_stroke_payload
+from ..application.validation import (
+    FORMAT_SIGNATURE_SIZE,
+    MAX_FILE_SIZE,
+    UPLOAD_BODY_OVERHEAD,
+    MultipartFileStream,
+    get_file_extension,
+    sniff_image_format,
+    stream_upload_to_file,
+    validate_image_path,
+)
 from ..infrastructure.file_storage import (
+    TMP_DIR,
+    compute_file_hash,
+    create_staging_path,
+    delete_session_files,
+    encode_png,
     generate_session_id,
+    get_blob_path,
+    get_file_hash,
+    is_path_safe,
+    link_blob_to_session,
+    load_preview_raster,
+    read_image_metadata,
     sanitize_filename,
-    save_uploaded_file,
+    save_staged_file,
     validate_session_id,
     get_session_directory,
 )
+from ..infrastructure import resumable_upload
+from ..infrastructure.alpha_mask import (
+    MASK_FORMAT_PNG1,
+    encode_alpha_mask,
+    encode_alpha_patch,
+    extract_alpha,
+)
+from ..infrastructure.image_analysis import (
+    count_visible_colors,
+    image_analysis,
+    pyramid_level_for,
+    reduce_to_fit,
+    sample_pixels,
+    select_level,
+)
+from ..infrastructure.image_delivery import (
+    IMMUTABLE_CACHE_CONTROL,
+    REVALIDATE_CACHE_CONTROL,
+    content_version,
+    etag_matches,
+    image_delivery,
+    make_etag,
+)
+from ..infrastructure.image_tiles import (
+    TILE_SIZE,
+    Box,
+    max_tile_level,
+    render_tile,
+    tile_box,
+    tile_cache,
+)
+from ..infrastructure.result_cache import compute_content_hash, make_cache_key, result_cache
+from ..infrastructure.session_archive import hot_files, session_archive
+from ..infrastructure.session_cleanup import cleanup_scheduler, delete_session
+from ..infrastructure.session_index import ORIGINAL_KIND, session_index
+from ..infrastructure.storage_budget import storage_budget
+from ..infrastructure.working_images import working_images
 
 
 def _convert_rgb_to_domain_format(
-    rgb: list[int] | list[list[int]]
+    rgb: list[int] | list[list[int]],
 ) -> tuple[int, int, int] | list[tuple[int, int, int]]:
     """
     APIリクエストのRGB形式をドメインロジックの形式に変換
@@ -45,16 +153,315 @@ def _convert_rgb_to_domain_format(
         # 複数色の場合
         return [tuple(color) for color in rgb]
 
+
+def _build_upload_filename(original_filename: str, img_format: str) -> str:
+    """
+    アップロードされたファイル名をサニタイズし、画像形式に合った拡張子を付ける
+
+    Args:
+        original_filename: クライアントから送られたファイル名
+        img_format: 画像形式名
+
+    Returns:
+        保存用のファイル名
+    """
+    safe_filename = sanitize_filename(original_filename)
+
+    # 拡張子を適切なものに設定
+    extension = get_file_extension(img_format)
+    if not safe_filename.endswith(extension):
+        safe_filename = safe_filename.rsplit(".", 1)[0] + extension
+
+    return safe_filename
+
+
+def _image_url(
+    session_id: str, filename: str, content_hash: Optional[str] = None, **query: Any
+) -> str:
+    """
+    画像のURLを作成 (署名付きURLが有効な場合は署名を付ける)
+
+    Args:
+        session_id: セッションID
+        filename: ファイル名
+        content_hash: 内容のSHA-256 (指定した場合はバージョンとして付け、キャッシュさせる)
+        **query: 追加するクエリパラメータ
+
+    Returns:
+        画像のURL
+    """
+    if content_hash:
+        query["v"] = content_version(content_hash)
+    url = image_delivery.sign_url(f"/api/images/{session_id}/{filename}")
+    if query:
+        separator = "&" if "?" in url else "?"
+        url += separator + "&".join(f"{key}={value}" for key, value in query.items())
+    return url
+
+
+def _inline_image_response(
+    session_id: str, filename: str, data: bytes, content_hash: str
+) -> Response:
+    """
+    処理済み画像をPNGのまま返す応答を作成
+    JSONで返す情報 (セッションID・ファイル名・URL) はヘッダーに含める
+
+    Args:
+        session_id: セッションID
+        filename: ファイル名
+        data: PNG形式の内容
+        content_hash: 内容のSHA-256
+
+    Returns:
+        画像の応答
+    """
+    return Response(
+        content=data,
+        media_type="image/png",
+        headers={
+            "ETag": make_etag(content_hash),
+            "Cache-Control": "no-store",
+            "X-Session-Id": session_id,
+            "X-Filename": filename,
+            "X-Processed-Url": _image_url(session_id, filename, content_hash),
+        },
+    )
+
+
+def _render_pyramid_level(file_path: Path, content_hash: str, size: int) -> bytes:
+    """
+    画像を長辺 size 以下に縮小したPNGを取得 (スレッドプールで実行)
+    エンコード済みのものがあればそれを、なければ事前計算のピラミッド
+    (ない場合は作業中画像) から縮小してエンコードし、保持する
+
+    Args:
+        file_path: 画像ファイルのパス
+        content_hash: 画像の内容のSHA-256
+        size: ピラミッドの段 (長辺の上限)
+
+    Returns:
+        縮小画像のPNGのバイト列
+    """
+    data = image_analysis.get_level(content_hash, size)
+    if data is not None:
+        return data
+
+    analysis = image_analysis.get(content_hash, wait=True)
+    if analysis is not None:
+        level = select_level(analysis, size)
+    else:
+        level = working_images.read(file_path, lambda image: reduce_to_fit(image, size))
+
+    data = encode_png(level)
+    image_analysis.put_level(content_hash, size, data)
+    return data
+
+
+def _render_image_tile(
+    file_path: Path, content_hash: Optional[str], level: int, x: int, y: int
+) -> Optional[Tuple[bytes, str]]:
+    """
+    画像のタイルのPNGとETagを取得 (スレッドプールで実行)
+    保持しているものがあればそれを、なければ作業中画像 (未保存の変更を含む) から作成して保持する
+
+    Args:
+        file_path: 画像ファイルのパス
+        content_hash: インデックスに記録された保存済みの内容のハッシュ
+            (別のワーカーが保存した変更の検出に使う)
+        level: 段
+        x: タイルの列
+        y: タイルの行
+
+    Returns:
+        タプル (タイルのPNGのバイト列, ETag)。段・列・行が範囲外の場合None
+    """
+    tile = tile_cache.get(file_path, level, x, y, content_hash)
+    if tile is not None:
+        return tile
+
+    # 範囲の切り出しだけをロック下で行い、縮小とエンコードはロックの外で行う。
+    # 保存とインデックスの更新はロック下で行われるため、ロック下で取得したハッシュは
+    # 切り出した内容と一致する (未保存の変更がある場合はNone)
+    def crop(image: Image.Image) -> Optional[Tuple[Image.Image, Optional[str]]]:
+        box = tile_box(image.width, image.height, level, x, y)
+        if box is None:
+            return None
+        saved_hash = None
+        if not working_images.has_pending_changes(file_path):
+            artifact = session_index.get_artifact(file_path.parent.name, file_path.name)
+            saved_hash = artifact["content_hash"] if artifact is not None else None
+        return image.crop(box), saved_hash
+
+    version = tile_cache.begin(file_path, level, x, y)
+    saved_hash: Optional[str] = None
+    try:
+        cropped = working_images.read(file_path, crop)
+        if cropped is not None:
+            region, saved_hash = cropped
+            data = encode_png(render_tile(region, level))
+            tile = (data, make_etag(compute_content_hash(data)))
+    finally:
+        tile_cache.end(file_path, level, x, y, version, tile, saved_hash)
+    return tile
+
+
+def _union_box(boxes: list[Optional[Box]]) -> Optional[Box]:
+    """範囲 (left, top, right, bottom) をすべて含む範囲を取得 (Noneは無視する)"""
+    present = [box for box in boxes if box is not None]
+    if not present:
+        return None
+    return (
+        min(box[0] for box in present),
+        min(box[1] for box in present),
+        max(box[2] for box in present),
+        max(box[3] for box in present),
+    )
+
+
+def _strokes_box(brush_size: int, points: list) -> Optional[Box]:
+    """ストロークのブラシが触れうる範囲を取得 (画像の範囲には切り詰めない)"""
+    points = [point for point in points if len(point) == 2]
+    if not points:
+        return None
+    radius = brush_size // 2
+    return (
+        min(x for x, _ in points) - radius,
+        min(y for _, y in points) - radius,
+        max(x for x, _ in points) + radius + 1,
+        max(y for _, y in points) + radius + 1,
+    )
+
+
+async def _resolve_session_file(
+    session_id: str, filename: str
+) -> Tuple[Path, Optional[Dict[str, Any]]]:
+    """
+    セッション内のファイルのパスを取得し、存在を確認
+    セッションインデックスに記録があればファイルシステムを調べず、
+    記録がない場合 (インデックス導入前のファイルなど) のみディスクを確認する。
+    退避済みのセッションはここで復元する
+
+    Args:
+        session_id: セッションID
+        filename: ファイル名
+
+    Returns:
+        タプル (ファイルのパス, インデックスの記録 (ない場合None))
+
+    Raises:
+        SessionNotFoundError: セッションまたはファイルが見つからない場合
+            (ファイル名がセッションディレクトリの外を指す場合を含む)
+    """
+    if not validate_session_id(session_id):
+        raise SessionNotFoundError(session_id=session_id)
+
+    # クエリやボディで受け取ったファイル名でセッションの外を指せないようにする
+    session_dir = get_session_directory(session_id, migrate=False)
+    if Path(filename).name != filename or not is_path_safe(session_dir / filename, session_dir):
+        raise SessionNotFoundError(session_id=session_id)
+
+    artifact = await asyncio.to_thread(session_index.get_artifact, session_id, filename)
+    if artifact is not None:
+        return session_dir / filename, artifact
+
+    # 保存を遅延している作業中画像はまだディスクにない
+    file_path = get_session_directory(session_id) / filename
+    if file_path.exists() or working_images.has_pending_changes(file_path):
+        return file_path, None
+
+    if await asyncio.to_thread(session_archive.restore_session, session_id):
+        artifact = await asyncio.to_thread(session_index.get_artifact, session_id, filename)
+        if artifact is not None or file_path.exists():
+            return file_path, artifact
+
+    raise SessionNotFoundError(session_id=session_id)
+
+
+async def _resolve_saved_file(
+    session_id: str, filename: str
+) -> Tuple[Path, Optional[Dict[str, Any]]]:
+    """
+    セッション内のファイルのパスを取得し、このプロセスに未保存の消しゴム処理があれば先に保存
+    (保存時にインデックスの記録が更新されるため、読み直した記録を返す)。
+    ディスク上のファイルや内容のハッシュで処理する前に使う
+
+    Args:
+        session_id: セッションID
+        filename: ファイル名
+
+    Returns:
+        タプル (ファイルのパス, インデックスの記録 (ない場合None))
+
+    Raises:
+        SessionNotFoundError: セッションまたはファイルが見つからない場合
+            (マニフェストなどの内部ファイルを含む)
+    """
+    # マニフェストなどの内部ファイルは公開しない
+    if filename.startswith("."):
+        raise SessionNotFoundError(session_id=session_id)
+
+    file_path, artifact = await _resolve_session_file(session_id, filename)
+    if working_images.has_pending_changes(file_path):
+        await asyncio.to_thread(working_images.flush, file_path)
+        artifact = await asyncio.to_thread(session_index.get_artifact, session_id, filename)
+    return file_path, artifact
+
+
+async def _record_original(session_id: str, filename: str, size: int, content_hash: str) -> None:
+    """アップロードされた元画像のメタデータをセッションインデックスに記録"""
+    file_path = get_session_directory(session_id, migrate=False) / filename
+    metadata = await asyncio.to_thread(read_image_metadata, file_path)
+    await asyncio.to_thread(
+        storage_budget.record,
+        session_id,
+        filename,
+        ORIGINAL_KIND,
+        size,
+        content_hash=content_hash,
+        **metadata,
+    )
+    # 透過処理やプレビューで使うデータをバックグラウンドで事前計算する
+    image_analysis.submit(content_hash, file_path)
+
+
+# 消しゴムのWebSocketで、この時間 (秒) 操作がなければ変更をディスクへ保存する
+LIVE_ERASE_IDLE_SECONDS = 1.0
+
+# WebSocketで、セッションまたはファイルが見つからない場合のクローズコード
+WEBSOCKET_NOT_FOUND_CODE = 4404
+
+# 透過処理のライブプレビューの長辺 (ピクセル) の既定値と範囲
+PREVIEW_DEFAULT_SIZE = 512
+PREVIEW_MIN_SIZE = 64
+PREVIEW_MAX_SIZE = 2048
+
 # プロジェクトのルートディレクトリを取得
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
 STATIC_DIR = BASE_DIR / "static"
-TMP_DIR = BASE_DIR / "tmp" / "transpalentor"
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """
+    アプリケーションの起動・終了時の処理
+
+    起動時に期限切れセッションのクリーンアップを開始し、
+    終了時には未保存の消しゴム処理をディスクへ書き込む
+    """
+    cleanup_scheduler.start()
+    try:
+        yield
+    finally:
+        cleanup_scheduler.shutdown()
+        await asyncio.to_thread(working_images.flush_all)
+
 
 # FastAPIアプリケーションの作成
 app = FastAPI(
     title="Transpalentor",
     description="画像の色指定による透過処理アプリケーション",
     version="0.1.0",
+    lifespan=lifespan,
 )
 
 # グローバル例外ハンドラーの登録
@@ -67,6 +474,32 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # 画像・マスクを直接返す応答のメタデータをブラウザから読めるようにする
+    expose_headers=[
+        "ETag",
+        "X-Session-Id",
+        "X-Filename",
+        "X-Processed-Url",
+        "X-Image-Width",
+        "X-Image-Height",
+    ],
+)
+
+# アップロードのボディサイズ制限 (上限を超えるリクエストは読み込む前に拒否)
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    max_body_size=MAX_FILE_SIZE + UPLOAD_BODY_OVERHEAD,
+    paths=("/api/upload",),
+)
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    max_body_size=MAX_STROKE_PAYLOAD_SIZE,
+    paths=("/api/erase/binary",),
+)
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    max_body_size=MAX_MASK_PAYLOAD_SIZE,
+    paths=("/api/erase/mask",),
 )
 
 # 静的ファイルのマウント
@@ -84,13 +517,53 @@ async def health_check() -> Dict[str, str]:
     return {"status": "healthy"}
 
 
-@app.post("/api/upload", response_model=UploadResponse)
-async def upload_image(file: UploadFile = File(...)) -> UploadResponse:
+@app.get("/api/metrics")
+async def get_metrics() -> Dict[str, Any]:
     """
-    画像ファイルをアップロード
+    キャッシュなどの運用メトリクスを取得
+
+    Returns:
+        サブシステムごとのメトリクスを示す辞書
+    """
+    return {
+        "result_cache": result_cache.stats(),
+        "working_images": working_images.stats(),
+        "storage": await asyncio.to_thread(storage_budget.stats),
+        "hot_files": hot_files.stats(),
+        "archive": session_archive.stats(),
+        "image_analysis": image_analysis.stats(),
+        "tiles": tile_cache.stats(),
+    }
+
+
+# multipart/form-data の file フィールド (ボディは自前でパースするため、スキーマのみ定義する)
+UPLOAD_REQUEST_BODY = {
+    "required": True,
+    "content": {
+        "multipart/form-data": {
+            "schema": {
+                "type": "object",
+                "required": ["file"],
+                "properties": {"file": {"type": "string", "format": "binary"}},
+            }
+        }
+    },
+}
+
+
+@app.post(
+    "/api/upload",
+    response_model=UploadResponse,
+    openapi_extra={"requestBody": UPLOAD_REQUEST_BODY},
+)
+async def upload_image(request: Request) -> UploadResponse:
+    """
+    画像ファイルをアップロード (multipart/form-data の file フィールド)
+    ボディを受信しながらパースしてステージングファイルへ直接書き出すため、
+    不正なファイルは全体を受信する前に拒否される
 
     Args:
-        file: アップロードされた画像ファイル
+        request: リクエスト
 
     Returns:
         アップロード結果
@@ -98,28 +571,30 @@ async def upload_image(file: UploadFile = File(...)) -> UploadResponse:
     Raises:
         FileTooLargeError: ファイルサイズが10MBを超える場合
         UnsupportedFormatError: サポートされていない形式の場合
+        InvalidPayloadError: multipart/form-data の形式が不正、または file フィールドがない場合
     """
-    # 画像ファイルのバリデーション
-    img_format, file_size = await validate_image_file(file)
+    upload = MultipartFileStream(request)
+    await upload.open()
+
+    # 受信しながらステージングファイルへ書き出してバリデーション
+    staged_path = create_staging_path()
+    img_format, file_size, content_hash = await stream_upload_to_file(
+        upload.chunks(), staged_path, upload.filename or ""
+    )
 
     # セッションIDを生成
     session_id = generate_session_id()
 
     # ファイル名をサニタイズ
-    original_filename = file.filename or "image"
-    safe_filename = sanitize_filename(original_filename)
+    safe_filename = _build_upload_filename(upload.filename or "image", img_format)
 
-    # 拡張子を適切なものに設定
-    extension = get_file_extension(img_format)
-    if not safe_filename.endswith(extension):
-        safe_filename = safe_filename.rsplit(".", 1)[0] + extension
-
-    # ファイルを読み込んで保存
-    file_content = await file.read()
-    file_path = await save_uploaded_file(session_id, safe_filename, file_content)
+    # 一時ファイルをブロブへ移動してセッションにリンク
+    await asyncio.to_thread(save_staged_file, session_id, safe_filename, staged_path, content_hash)
+    await asyncio.to_thread(session_index.touch, session_id, force=True)
+    await _record_original(session_id, safe_filename, file_size, content_hash)
 
     # 画像URLを生成
-    image_url = f"/api/images/{session_id}/{safe_filename}"
+    image_url = _image_url(session_id, safe_filename, content_hash)
 
     return UploadResponse(
         session_id=session_id,
@@ -129,34 +604,262 @@ async def upload_image(file: UploadFile = File(...)) -> UploadResponse:
     )
 
 
+def _sniff_blob_format(content_hash: str, size: int) -> Optional[str]:
+    """
+    ブロブが指定サイズで存在する場合、その画像形式を取得
+    ブロブはバリデーション済みのアップロードからのみ作られるため、
+    サイズと先頭のシグネチャの確認だけで再パースは不要
+
+    Args:
+        content_hash: ファイル内容のSHA-256
+        size: ファイルサイズ (bytes)
+
+    Returns:
+        画像形式。ブロブがない・サイズが異なる・形式が不明の場合None
+    """
+    try:
+        with get_blob_path(content_hash).open("rb") as f:
+            if os.fstat(f.fileno()).st_size != size:
+                return None
+            return sniff_image_format(f.read(FORMAT_SIGNATURE_SIZE))
+    except OSError:
+        return None
+
+
+@app.post("/api/upload/precheck", response_model=UploadPrecheckResponse)
+async def precheck_upload(request: UploadPrecheckRequest) -> UploadPrecheckResponse:
+    """
+    ファイル本体を送る前に、同じ内容のファイルがサーバーにあるか確認
+    存在する場合はアップロードなしでセッションを作成する
+
+    Args:
+        request: ファイルのSHA-256・サイズ・ファイル名
+
+    Returns:
+        確認結果。存在する場合は作成したセッションの情報を含む
+    """
+    if request.size > MAX_FILE_SIZE:
+        return UploadPrecheckResponse(exists=False)
+
+    img_format = await asyncio.to_thread(_sniff_blob_format, request.sha256, request.size)
+    if img_format is None:
+        return UploadPrecheckResponse(exists=False)
+
+    session_id = generate_session_id()
+    safe_filename = _build_upload_filename(request.filename or "image", img_format)
+
+    try:
+        await asyncio.to_thread(link_blob_to_session, session_id, safe_filename, request.sha256)
+    except FileNotFoundError:
+        # 確認直後にブロブが解放された場合は通常のアップロードに任せる
+        await asyncio.to_thread(delete_session_files, session_id)
+        return UploadPrecheckResponse(exists=False)
+
+    await asyncio.to_thread(session_index.touch, session_id, force=True)
+    await _record_original(session_id, safe_filename, request.size, request.sha256)
+
+    return UploadPrecheckResponse(
+        exists=True,
+        session_id=session_id,
+        image_url=_image_url(session_id, safe_filename, request.sha256),
+        filename=safe_filename,
+        size=request.size,
+    )
+
+
+def _to_upload_status(status: Dict[str, Any]) -> ResumableUploadStatus:
+    """分割アップロードの状態をレスポンスモデルに変換"""
+    return ResumableUploadStatus(
+        upload_id=status["upload_id"],
+        upload_url=f"/api/uploads/{status['upload_id']}",
+        size=status["size"],
+        offset=status["offset"],
+        received=status["received"],
+        ranges=status["ranges"],
+        complete=status["complete"],
+    )
+
+
+@app.post("/api/uploads", response_model=ResumableUploadStatus, status_code=201)
+async def create_resumable_upload(request: ResumableUploadCreateRequest) -> ResumableUploadStatus:
+    """
+    再開可能な分割アップロードを作成
+
+    Args:
+        request: ファイル名とファイル全体のサイズ
+
+    Returns:
+        作成したアップロードの状態
+
+    Raises:
+        FileTooLargeError: ファイルサイズが10MBを超える場合
+        TooManyUploadsError: 未完了のアップロードが上限に達している場合
+    """
+    if request.size > MAX_FILE_SIZE:
+        raise FileTooLargeError(
+            size=request.size, max_size=MAX_FILE_SIZE, filename=request.filename
+        )
+
+    try:
+        status = await asyncio.to_thread(
+            resumable_upload.create_upload, request.filename, request.size
+        )
+    except resumable_upload.UploadLimitError:
+        raise TooManyUploadsError(limit=resumable_upload.MAX_PENDING_UPLOADS)
+    return _to_upload_status(status)
+
+
+@app.api_route(
+    "/api/uploads/{upload_id}", methods=["GET", "HEAD"], response_model=ResumableUploadStatus
+)
+async def get_resumable_upload(upload_id: str, response: Response) -> ResumableUploadStatus:
+    """
+    分割アップロードの受信状況を取得 (中断後の再開位置の確認に使う)
+
+    Args:
+        upload_id: アップロードID
+
+    Returns:
+        アップロードの状態 (Upload-Offsetヘッダーにも連続受信済みのバイト数を設定)
+
+    Raises:
+        UploadNotFoundError: アップロードが見つからない場合
+    """
+    try:
+        status = await asyncio.to_thread(resumable_upload.get_upload_status, upload_id)
+    except FileNotFoundError:
+        raise UploadNotFoundError(upload_id=upload_id)
+
+    response.headers["Upload-Offset"] = str(status["offset"])
+    response.headers["Upload-Length"] = str(status["size"])
+    return _to_upload_status(status)
+
+
+@app.patch("/api/uploads/{upload_id}", response_model=ResumableUploadStatus)
+async def patch_resumable_upload(
+    upload_id: str,
+    request: Request,
+    response: Response,
+    upload_offset: int = Header(..., alias="Upload-Offset"),
+) -> ResumableUploadStatus:
+    """
+    チャンクを指定オフセットに書き込む
+    異なるオフセットのチャンクは並列に送信できる
+
+    Args:
+        upload_id: アップロードID
+        request: チャンクの内容をボディに持つリクエスト
+        upload_offset: チャンクの書き込み開始位置
+
+    Returns:
+        書き込み後のアップロードの状態
+
+    Raises:
+        UploadNotFoundError: アップロードが見つからない場合
+        UploadConflictError: オフセットやチャンクサイズが範囲外の場合
+    """
+    try:
+        status = await resumable_upload.write_chunk(upload_id, upload_offset, request.stream())
+    except FileNotFoundError:
+        raise UploadNotFoundError(upload_id=upload_id)
+    except ValueError as e:
+        raise UploadConflictError(upload_id=upload_id, message=str(e))
+
+    response.headers["Upload-Offset"] = str(status["offset"])
+    return _to_upload_status(status)
+
+
+@app.post("/api/uploads/{upload_id}/finalize", response_model=UploadResponse)
+async def finalize_resumable_upload(upload_id: str) -> UploadResponse:
+    """
+    全チャンクを受信したアップロードをバリデーションし、セッションを作成
+
+    Args:
+        upload_id: アップロードID
+
+    Returns:
+        アップロード結果 (/api/upload と同じ形式)
+
+    Raises:
+        UploadNotFoundError: アップロードが見つからない場合
+        UploadConflictError: 未受信の範囲が残っている場合
+        FileTooLargeError: ファイルサイズが10MBを超える場合
+        UnsupportedFormatError: サポートされていない形式の場合
+    """
+    try:
+        staged_path, original_filename = await asyncio.to_thread(
+            resumable_upload.finalize_upload, upload_id
+        )
+    except FileNotFoundError:
+        raise UploadNotFoundError(upload_id=upload_id)
+    except ValueError as e:
+        raise UploadConflictError(upload_id=upload_id, message=str(e))
+
+    try:
+        img_format, file_size, content_hash = await asyncio.to_thread(
+            validate_image_path, staged_path, original_filename
+        )
+    except BaseException:
+        staged_path.unlink(missing_ok=True)
+        raise
+
+    session_id = generate_session_id()
+    safe_filename = _build_upload_filename(original_filename or "image", img_format)
+    await asyncio.to_thread(save_staged_file, session_id, safe_filename, staged_path, content_hash)
+    await asyncio.to_thread(session_index.touch, session_id, force=True)
+    await _record_original(session_id, safe_filename, file_size, content_hash)
+
+    return UploadResponse(
+        session_id=session_id,
+        image_url=_image_url(session_id, safe_filename, content_hash),
+        filename=safe_filename,
+        size=file_size,
+    )
+
+
 @app.get("/api/images/{session_id}/{filename}")
-async def get_image(session_id: str, filename: str) -> FileResponse:
+async def get_image(
+    session_id: str,
+    filename: str,
+    md5: Optional[str] = None,
+    expires: Optional[int] = None,
+    v: Optional[str] = None,
+    size: Optional[int] = Query(None, ge=1),
+    if_none_match: Optional[str] = Header(None),
+) -> Response:
     """
     セッションIDとファイル名から画像を取得
+    内容のハッシュをETagとして返し、If-None-Matchが一致する場合は304を返す。
+    URLのバージョン (v) が現在の内容と一致する場合は変更されないものとしてキャッシュさせる。
+    size を指定した場合は、長辺がその値以上で最も小さいピラミッドの段 (PYRAMID_SIZES) に
+    縮小したPNGを返す (元画像の方が小さい場合は元画像)
 
     Args:
         session_id: セッションID
         filename: ファイル名
+        md5: 署名付きURLの署名
+        expires: 署名付きURLの有効期限 (UNIX時間)
+        v: URLのバージョン (内容のハッシュの先頭)
+        size: 表示する長辺の大きさ (ピクセル)
+        if_none_match: If-None-Matchヘッダー
 
     Returns:
-        画像ファイル
+        画像ファイル (オフロードが有効な場合はプロキシ向けのヘッダーのみ、
+        キャッシュが有効な場合は本体のない304)
 
     Raises:
         SessionNotFoundError: セッションが見つからない場合
+        InvalidSignatureError: 署名付きURLが有効で、署名が不正または期限切れの場合
     """
-    # セッションIDのバリデーション
-    if not validate_session_id(session_id):
-        raise SessionNotFoundError(session_id=session_id)
-
-    # セッションディレクトリを取得
-    session_dir = get_session_directory(session_id)
+    path = f"/api/images/{session_id}/{filename}"
+    if not image_delivery.verify(path, md5, expires):
+        raise InvalidSignatureError(path=path)
 
-    # ファイルパスを構築
-    file_path = session_dir / filename
+    # インデックス (未登録の場合はディスク) でファイルの存在を確認し、
+    # このプロセスに未保存の消しゴム処理があれば先に保存
+    file_path, artifact = await _resolve_saved_file(session_id, filename)
 
-    # ファイルが存在するか確認
-    if not file_path.exists():
-        raise SessionNotFoundError(session_id=session_id)
+    await asyncio.to_thread(session_index.touch, session_id)
 
     # MIMEタイプを推測
     import mimetypes
@@ -165,60 +868,378 @@ async def get_image(session_id: str, filename: str) -> FileResponse:
     if mime_type is None:
         mime_type = "application/octet-stream"
 
-    return FileResponse(str(file_path), media_type=mime_type)
+    # 内容のハッシュがわかる場合はETagとキャッシュの指定を付ける
+    # (わからない場合はFileResponseが更新日時とサイズからETagを作る)
+    content_hash: Optional[str] = artifact["content_hash"] if artifact is not None else None
+
+    # 縮小画像は元画像より小さくなる場合だけ返す
+    # (内容のハッシュをキーに保持するため、画像が変更されると別の縮小画像になる)
+    level = pyramid_level_for(size) if size is not None else None
+    if level is not None and artifact is not None and artifact.get("width"):
+        if max(artifact["width"], artifact["height"]) <= level:
+            level = None
+    if level is not None and not content_hash:
+        content_hash = await asyncio.to_thread(compute_file_hash, file_path)
+
+    headers: Dict[str, str] = {}
+    if content_hash:
+        etag = make_etag(f"{content_hash}-{level}" if level is not None else content_hash)
+        headers["ETag"] = etag
+        if v is not None and v == content_version(content_hash):
+            headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        else:
+            headers["Cache-Control"] = REVALIDATE_CACHE_CONTROL
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+
+    if level is not None and content_hash:
+        data = await asyncio.to_thread(_render_pyramid_level, file_path, content_hash, level)
+        return Response(content=data, media_type="image/png", headers=headers)
+
+    # プロキシがファイルを送る場合はヘッダーだけを返す
+    offload_headers = image_delivery.offload_headers(file_path)
+    if offload_headers is not None:
+        return Response(media_type=mime_type, headers={**headers, **offload_headers})
+
+    # 最近書き込まれた内容がメモリ層にあればディスクを読まずに返す
+    if content_hash:
+        hot_data = hot_files.get(content_hash)
+        if hot_data is not None:
+            return Response(content=hot_data, media_type=mime_type, headers=headers)
+
+    return FileResponse(str(file_path), media_type=mime_type, headers=headers)
+
+
+@app.get("/api/images/{session_id}/{filename}/alpha")
+async def get_alpha_mask(
+    session_id: str,
+    filename: str,
+    mask_format: Literal["png1", "png8", "rle"] = Query(MASK_FORMAT_PNG1, alias="format"),
+    md5: Optional[str] = None,
+    expires: Optional[int] = None,
+    if_none_match: Optional[str] = Header(None),
+) -> Response:
+    """
+    画像のアルファチャンネルだけを取得
+    RGBは元画像から変わらないため、クライアントは手元の元画像にこのマスクを重ねて表示する。
+    未保存の消しゴム処理はメモリ上の作業中画像から直接エンコードする
 
+    Args:
+        session_id: セッションID
+        filename: ファイル名
+        mask_format: png1 (1ビットPNG)・png8 (8ビットPNG)・rle (ランレングス符号化)
+        md5: 画像のURLの署名
+        expires: 画像のURLの有効期限 (UNIX時間)
+        if_none_match: If-None-Matchヘッダー
 
-@app.post("/api/process", response_model=ProcessResponse)
-async def process_transparency(request: ProcessRequest) -> ProcessResponse:
+    Returns:
+        アルファマスク (画像の寸法は X-Image-Width・X-Image-Height ヘッダー)
+
+    Raises:
+        SessionNotFoundError: セッションが見つからない場合
+        InvalidSignatureError: 署名付きURLが有効で、署名が不正または期限切れの場合
     """
-    画像の透過処理を実行
+    # 署名は画像のURLのものをそのまま使う
+    path = f"/api/images/{session_id}/{filename}"
+    if not image_delivery.verify(path, md5, expires):
+        raise InvalidSignatureError(path=path)
+
+    if filename.startswith("."):
+        raise SessionNotFoundError(session_id=session_id)
+
+    file_path, artifact = await _resolve_session_file(session_id, filename)
+    await asyncio.to_thread(session_index.touch, session_id)
+
+    # 保存済みの内容のハッシュがわかる場合は、デコードせずにETagで再検証できる
+    headers: Dict[str, str] = {"Cache-Control": REVALIDATE_CACHE_CONTROL}
+    if (
+        artifact is not None
+        and artifact["content_hash"]
+        and not working_images.has_pending_changes(file_path)
+    ):
+        etag = make_etag(f"{artifact['content_hash']}-{mask_format}")
+        headers["ETag"] = etag
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+
+    # アルファチャンネルの取り出しだけをロック下で行い、エンコードはロックの外で行う
+    alpha = await asyncio.to_thread(working_images.read, file_path, extract_alpha)
+    data, media_type = await asyncio.to_thread(encode_alpha_mask, alpha, mask_format)
+    headers["X-Image-Width"] = str(alpha.width)
+    headers["X-Image-Height"] = str(alpha.height)
+    return Response(content=data, media_type=media_type, headers=headers)
+
+
+@app.get("/api/images/{session_id}/{filename}/analysis", response_model=ImageAnalysisResponse)
+async def get_image_analysis(session_id: str, filename: str) -> ImageAnalysisResponse:
+    """
+    画像の寸法・色の種類の数・背景色の候補を取得
+    アップロード時に事前計算した結果を返す (ない場合はここで計算する)
 
     Args:
-        request: 透過処理リクエスト（セッションID、ファイル名、RGB値）
+        session_id: セッションID
+        filename: ファイル名
 
     Returns:
-        処理済み画像のURL
+        画像の解析結果
 
     Raises:
         SessionNotFoundError: セッションまたはファイルが見つからない場合
+        ImageProcessingError: 画像を解析できない場合
     """
-    from PIL import Image
-    from ..domain.transparency import make_transparent
+    file_path, artifact = await _resolve_saved_file(session_id, filename)
+    await asyncio.to_thread(session_index.touch, session_id)
 
-    # セッションIDのバリデーション
-    if not validate_session_id(request.session_id):
-        raise SessionNotFoundError(session_id=request.session_id)
+    content_hash: Optional[str] = artifact["content_hash"] if artifact is not None else None
+    if not content_hash:
+        content_hash = await asyncio.to_thread(compute_file_hash, file_path)
 
-    # セッションディレクトリを取得
-    session_dir = get_session_directory(request.session_id)
+    image_analysis.submit(content_hash, file_path)
+    analysis = await asyncio.to_thread(image_analysis.get, content_hash, True)
+    if analysis is None:
+        raise ImageProcessingError(f"Failed to analyze image: {filename}")
+
+    colors = analysis["colors"]
+    return ImageAnalysisResponse(
+        session_id=session_id,
+        filename=filename,
+        width=analysis["width"],
+        height=analysis["height"],
+        color_count=len(colors) if colors is not None else None,
+        border_colors=analysis["border_colors"],
+    )
 
-    # 元画像のパスを構築
-    original_path = session_dir / request.filename
 
-    # ファイルが存在するか確認
-    if not original_path.exists():
+@app.post("/api/sample", response_model=PixelSampleResponse)
+async def sample_image_pixels(request: PixelSampleRequest) -> PixelSampleResponse:
+    """
+    指定座標の画素値 (または周囲 size × size の平均) をまとめて取得 (スポイトツール用)
+    変更のない画像はアップロード時に事前計算したラスターから、未保存の変更がある画像は
+    メモリ上の作業中画像から読み取るため、ファイルをデコードし直さない
+
+    Args:
+        request: セッションID、ファイル名、座標、平均をとる範囲の一辺
+
+    Returns:
+        座標ごとの画素値
+
+    Raises:
+        SessionNotFoundError: セッションまたはファイルが見つからない場合
+    """
+    if request.filename.startswith("."):
         raise SessionNotFoundError(session_id=request.session_id)
 
-    # 画像を読み込み
-    image = Image.open(original_path)
+    file_path, artifact = await _resolve_session_file(request.session_id, request.filename)
+    await asyncio.to_thread(session_index.touch, request.session_id)
 
-    # 透過処理を実行
-    rgb_data = _convert_rgb_to_domain_format(request.rgb)
-    processed_image = make_transparent(
-        image, rgb=rgb_data, threshold=request.threshold
+    points = [(x, y) for x, y in request.points]
+
+    def sample(raster: Image.Image) -> Tuple[Tuple[int, int], list[Optional[list[int]]]]:
+        return raster.size, sample_pixels(raster, points, request.size)
+
+    analysis = None
+    if not working_images.has_pending_changes(file_path):
+        content_hash = artifact["content_hash"] if artifact is not None else None
+        if content_hash is None:
+            content_hash = await asyncio.to_thread(
+                get_file_hash, request.session_id, request.filename
+            )
+        if content_hash is not None:
+            analysis = image_analysis.get(content_hash)
+
+    if analysis is not None:
+        (width, height), samples = await asyncio.to_thread(sample, analysis["raster"])
+    else:
+        (width, height), samples = await asyncio.to_thread(working_images.read, file_path, sample)
+
+    return PixelSampleResponse(
+        session_id=request.session_id,
+        filename=request.filename,
+        width=width,
+        height=height,
+        samples=samples,
+    )
+
+
+@app.get("/api/images/{session_id}/{filename}/tiles", response_model=TileInfoResponse)
+async def get_tile_info(
+    session_id: str,
+    filename: str,
+    md5: Optional[str] = None,
+    expires: Optional[int] = None,
+) -> TileInfoResponse:
+    """
+    画像のタイルの構成 (寸法・タイルの一辺・段の数) を取得
+    署名付きURLが有効な場合は、画像のURLの署名 (md5・expires) をそのまま付ける
+
+    Args:
+        session_id: セッションID
+        filename: ファイル名
+        md5: 画像のURLの署名
+        expires: 画像のURLの有効期限 (UNIX時間)
+
+    Returns:
+        タイルの構成
+
+    Raises:
+        SessionNotFoundError: セッションまたはファイルが見つからない場合
+        InvalidSignatureError: 署名付きURLが有効で、署名が不正または期限切れの場合
+    """
+    path = f"/api/images/{session_id}/{filename}"
+    if not image_delivery.verify(path, md5, expires):
+        raise InvalidSignatureError(path=path)
+    if filename.startswith("."):
+        raise SessionNotFoundError(session_id=session_id)
+
+    file_path, _ = await _resolve_session_file(session_id, filename)
+    await asyncio.to_thread(session_index.touch, session_id)
+
+    width, height = await asyncio.to_thread(
+        working_images.read, file_path, lambda image: image.size
     )
+    return TileInfoResponse(
+        session_id=session_id,
+        filename=filename,
+        width=width,
+        height=height,
+        tile_size=TILE_SIZE,
+        max_level=max_tile_level(width, height),
+    )
+
+
+@app.get("/api/images/{session_id}/{filename}/tiles/{level}/{x}/{y}")
+async def get_image_tile(
+    session_id: str,
+    filename: str,
+    level: int,
+    x: int,
+    y: int,
+    md5: Optional[str] = None,
+    expires: Optional[int] = None,
+    if_none_match: Optional[str] = Header(None),
+) -> Response:
+    """
+    画像のタイルを取得 (段 level の列 x・行 y。PNG)
+    タイルは未保存の消しゴム処理を含む作業中画像から作成し、変更された範囲のタイルだけを
+    作成し直す。内容のハッシュをETagとして返し、変わっていないタイルは304で再検証できる
+
+    Args:
+        session_id: セッションID
+        filename: ファイル名
+        level: 段 (0 が原寸)
+        x: タイルの列
+        y: タイルの行
+        md5: 画像のURLの署名
+        expires: 画像のURLの有効期限 (UNIX時間)
+        if_none_match: If-None-Matchヘッダー
+
+    Returns:
+        タイルの画像 (キャッシュが有効な場合は本体のない304)
+
+    Raises:
+        SessionNotFoundError: セッションまたはファイルが見つからない場合
+        TileNotFoundError: 段・列・行が範囲外の場合
+        InvalidSignatureError: 署名付きURLが有効で、署名が不正または期限切れの場合
+    """
+    path = f"/api/images/{session_id}/{filename}"
+    if not image_delivery.verify(path, md5, expires):
+        raise InvalidSignatureError(path=path)
+    if filename.startswith("."):
+        raise SessionNotFoundError(session_id=session_id)
+
+    file_path, artifact = await _resolve_session_file(session_id, filename)
+    await asyncio.to_thread(session_index.touch, session_id)
+
+    content_hash = artifact["content_hash"] if artifact is not None else None
+    tile = await asyncio.to_thread(_render_image_tile, file_path, content_hash, level, x, y)
+    if tile is None:
+        raise TileNotFoundError(level=level, x=x, y=y)
+
+    data, etag = tile
+    headers = {"ETag": etag, "Cache-Control": REVALIDATE_CACHE_CONTROL}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=data, media_type="image/png", headers=headers)
+
+
+@app.post("/api/process", response_model=ProcessResponse)
+async def process_transparency(request: ProcessRequest) -> ProcessResponse | Response:
+    """
+    画像の透過処理を実行
+
+    Args:
+        request: 透過処理リクエスト（セッションID、ファイル名、RGB値）
+
+    Returns:
+        処理済み画像のURL (inline の場合は処理済み画像そのもの)
+
+    Raises:
+        SessionNotFoundError: セッションまたはファイルが見つからない場合
+    """
+    from ..domain.transparency import make_transparent
+
+    # インデックス (未登録の場合はディスク) で元画像の存在を確認し、
+    # 未保存の消しゴム処理があれば先に保存して、保存後の内容のハッシュをキャッシュキーに使う
+    original_path, artifact = await _resolve_saved_file(request.session_id, request.filename)
+    session_dir = original_path.parent
+
+    await asyncio.to_thread(session_index.touch, request.session_id)
 
     # 処理済み画像のファイル名を生成
     name_without_ext = original_path.stem
     ext = original_path.suffix
     processed_filename = f"{name_without_ext}_processed{ext}"
-
-    # 処理済み画像を保存
     processed_path = session_dir / processed_filename
-    processed_image.save(str(processed_path), format="PNG")
 
-    # 処理済み画像のURLを生成
-    processed_url = f"/api/images/{request.session_id}/{processed_filename}"
+    # 元画像のハッシュとパラメータからキャッシュキーを生成
+    # アップロード時に記録したハッシュがあれば元画像を読み込まずに済む
+    original_content: bytes | None = None
+    content_hash = artifact["content_hash"] if artifact else None
+    if content_hash is None:
+        content_hash = await asyncio.to_thread(get_file_hash, request.session_id, request.filename)
+    if content_hash is None:
+        original_content = await asyncio.to_thread(original_path.read_bytes)
+        content_hash = compute_content_hash(original_content)
+
+    rgb_data = _convert_rgb_to_domain_format(request.rgb)
+    colors = [rgb_data] if isinstance(rgb_data, tuple) else rgb_data
+    cache_key = make_cache_key(content_hash, colors, request.threshold)
+
+    # キャッシュにあればデコード・再計算せずにそのまま保存
+    png_data = await asyncio.to_thread(result_cache.get, cache_key)
+    if png_data is None:
+        # アップロード時にデコード済みのラスターがあれば使い (計算中なら完了を待つ)、
+        # なければ画像を読み込む
+        analysis = await asyncio.to_thread(image_analysis.get, content_hash, True)
+        if analysis is not None:
+            image = analysis["raster"]
+        else:
+            if original_content is None:
+                original_content = await asyncio.to_thread(original_path.read_bytes)
+            image = Image.open(io.BytesIO(original_content))
+
+        # 透過処理を実行 (CPU負荷が高いためスレッドプールで実行)
+        processed_image = await asyncio.to_thread(
+            make_transparent, image, rgb=rgb_data, threshold=request.threshold
+        )
+
+        png_data = await asyncio.to_thread(encode_png, processed_image)
+        await asyncio.to_thread(result_cache.put, cache_key, png_data)
+
+    # 処理済み画像を保存 (一時ファイルからのリネームで書きかけを見せない)
+    # 消しゴム処理の未保存の変更があれば、セッションのロック下で破棄して置き換える
+    # 画像を応答に含める場合はクライアントがすぐに読み込まないため、保存を遅延する
+    await asyncio.to_thread(working_images.write, processed_path, png_data, request.inline)
+    tile_cache.invalidate(processed_path)
+    processed_hash = compute_content_hash(png_data)
+
+    if request.inline:
+        return _inline_image_response(
+            request.session_id, processed_filename, png_data, processed_hash
+        )
+
+    # 処理済み画像のURLを生成 (内容のハッシュをバージョンとして付け、キャッシュさせる)
+    processed_url = _image_url(request.session_id, processed_filename, processed_hash)
 
     return ProcessResponse(
         session_id=request.session_id,
@@ -227,8 +1248,114 @@ async def process_transparency(request: ProcessRequest) -> ProcessResponse:
     )
 
 
+@app.post("/api/process/histogram", response_model=ThresholdHistogramResponse)
+async def get_threshold_histogram(
+    request: ThresholdHistogramRequest,
+) -> ThresholdHistogramResponse:
+    """
+    指定色に対して、閾値ごとに透過処理で透明になるピクセル数を取得
+    画像を処理せずに閾値を選べるよう、全ての閾値の結果と大津の方法による候補を返す。
+    アップロード時に数えた色ごとのピクセル数を使うため、画像を読み直さない
+
+    Args:
+        request: セッションID、ファイル名、RGB値
+
+    Returns:
+        閾値ごとの透明になるピクセル数と閾値の候補
+
+    Raises:
+        SessionNotFoundError: セッションまたはファイルが見つからない場合
+        ImageProcessingError: 画像を解析できない場合
+    """
+    from ..domain.transparency import distance_histogram, otsu_threshold
+
+    # 未保存の消しゴム処理があれば先に保存し、保存後の内容で数える
+    file_path, artifact = await _resolve_saved_file(request.session_id, request.filename)
+    await asyncio.to_thread(session_index.touch, request.session_id)
+
+    content_hash: Optional[str] = artifact["content_hash"] if artifact is not None else None
+    if content_hash is None:
+        content_hash = await asyncio.to_thread(get_file_hash, request.session_id, request.filename)
+    if content_hash is None:
+        content_hash = await asyncio.to_thread(compute_file_hash, file_path)
+
+    image_analysis.submit(content_hash, file_path)
+    analysis = await asyncio.to_thread(image_analysis.get, content_hash, True)
+    if analysis is None:
+        raise ImageProcessingError(f"Failed to analyze image: {request.filename}")
+
+    # 色の種類が多く事前に数えていない場合は、ここで全ての色を数える
+    color_counts = analysis["colors"]
+    if color_counts is None:
+        color_counts = await asyncio.to_thread(count_visible_colors, analysis["raster"])
+
+    rgb_data = _convert_rgb_to_domain_format(request.rgb)
+    histogram = await asyncio.to_thread(distance_histogram, color_counts, rgb_data)
+    cleared_pixels = list(accumulate(histogram))
+
+    return ThresholdHistogramResponse(
+        session_id=request.session_id,
+        filename=request.filename,
+        total_pixels=cleared_pixels[-1],
+        cleared_pixels=cleared_pixels,
+        # 透過処理の threshold は 0-255
+        suggested_threshold=min(otsu_threshold(histogram), 255),
+    )
+
+
+async def _apply_erase(
+    session_id: str,
+    filename: str,
+    operation: Callable[[Image.Image], Image.Image],
+    inline: bool,
+    changed_box: Optional[Box] = None,
+) -> EraseResponse | Response:
+    """
+    作業中画像に消しゴム系の変更を適用し、応答を作成
+
+    Args:
+        session_id: セッションID
+        filename: ファイル名
+        operation: 画像を受け取り変更後の画像を返す関数
+        inline: 処理済み画像そのものを返すか
+        changed_box: 変更されうる範囲 (タイルの破棄に使う。Noneの場合は画像全体)
+
+    Returns:
+        処理済み画像のURL (inline の場合は処理済み画像そのもの)
+
+    Raises:
+        SessionNotFoundError: セッションまたはファイルが見つからない場合
+    """
+    # インデックス (未登録の場合はディスク) で画像の存在を確認
+    image_path, _ = await _resolve_session_file(session_id, filename)
+
+    await asyncio.to_thread(session_index.touch, session_id)
+
+    # セッションのロックを取得し、メモリ上の作業中画像に変更を適用
+    # (連続した消しゴム操作は直列化され、ディスクへの保存はまとめて遅延実行される)
+    await asyncio.to_thread(working_images.apply, image_path, operation)
+    tile_cache.invalidate(image_path, changed_box)
+
+    # 画像を応答に含める場合は、エンコードした内容を遅延保存でもそのまま使う
+    if inline:
+        data = await asyncio.to_thread(working_images.encoded, image_path)
+        return _inline_image_response(session_id, filename, data, compute_content_hash(data))
+
+    # 処理済み画像のURLを生成
+    # 保存は遅延されて内容のハッシュはまだないため、操作ごとに異なるリビジョンを付ける。
+    # このURLは内容と一致しないため、取得時はETagで再検証される
+    revision = uuid.uuid4().hex[:16]
+    processed_url = _image_url(session_id, filename, v=revision)
+
+    return EraseResponse(
+        session_id=session_id,
+        processed_url=processed_url,
+        filename=filename,
+    )
+
+
 @app.post("/api/erase", response_model=EraseResponse)
-async def erase_transparency(request: EraseRequest) -> EraseResponse:
+async def erase_transparency(request: EraseRequest) -> EraseResponse | Response:
     """
     消しゴムツールで指定座標を透過処理
 
@@ -236,51 +1363,405 @@ async def erase_transparency(request: EraseRequest) -> EraseResponse:
         request: 消しゴムツールリクエスト（セッションID、ファイル名、座標、ブラシサイズ）
 
     Returns:
-        処理済み画像のURL
+        処理済み画像のURL (inline の場合は処理済み画像そのもの)
 
     Raises:
         SessionNotFoundError: セッションまたはファイルが見つからない場合
     """
-    from PIL import Image
     from ..domain.transparency import erase_at_coordinates
 
-    # セッションIDのバリデーション
-    if not validate_session_id(request.session_id):
-        raise SessionNotFoundError(session_id=request.session_id)
+    def erase(image: Image.Image) -> Image.Image:
+        return erase_at_coordinates(image, strokes=request.strokes, brush_size=request.brush_size)
 
-    # セッションディレクトリを取得
-    session_dir = get_session_directory(request.session_id)
+    return await _apply_erase(
+        request.session_id,
+        request.filename,
+        erase,
+        request.inline,
+        # ストロークがない場合は何も変わらない
+        _strokes_box(request.brush_size, request.strokes) or (0, 0, 0, 0),
+    )
 
-    # 画像のパスを構築
-    image_path = session_dir / request.filename
 
-    # ファイルが存在するか確認
-    if not image_path.exists():
-        raise SessionNotFoundError(session_id=request.session_id)
+@app.post("/api/erase/binary", response_model=EraseResponse)
+async def erase_transparency_binary(
+    request: Request, session_id: str, filename: str, inline: bool = False
+) -> EraseResponse | Response:
+    """
+    バイナリ形式 (application/octet-stream) のストロークで消しゴム処理
+    ブラシサイズの異なる複数のセグメントを1リクエストで送れる。形式は stroke_payload を参照
+
+    Args:
+        request: リクエスト (ボディがバイナリ形式のストローク)
+        session_id: セッションID
+        filename: 処理対象のファイル名
+        inline: 処理済み画像そのものを返すか
+
+    Returns:
+        処理済み画像のURL (inline の場合は処理済み画像そのもの)
+
+    Raises:
+        InvalidPayloadError: ストロークの形式が不正な場合
+        SessionNotFoundError: セッションまたはファイルが見つからない場合
+    """
+    from ..domain.transparency import erase_at_coordinates
+
+    segments = decode_stroke_payload(await request.body())
+
+    def erase(image: Image.Image) -> Image.Image:
+        for brush_size, points in segments:
+            image = erase_at_coordinates(image, strokes=points, brush_size=brush_size)
+        return image
+
+    # ストロークがない場合は何も変わらない
+    changed_box = _union_box([_strokes_box(brush_size, points) for brush_size, points in segments])
+    return await _apply_erase(session_id, filename, erase, inline, changed_box or (0, 0, 0, 0))
+
+
+@app.post("/api/erase/mask", response_model=EraseResponse)
+async def erase_transparency_with_mask(
+    request: Request,
+    session_id: str,
+    filename: str,
+    x: int = 0,
+    y: int = 0,
+    width: Optional[int] = None,
+    height: Optional[int] = None,
+    bits: int = 8,
+    inline: bool = False,
+) -> EraseResponse | Response:
+    """
+    マスク画像で消しゴム処理 (投げ縄・広範囲の消しゴム)
+    ボディは1ビット・8ビットのPNG、または width・height・bits を指定した raw の画素。
+    マスクは画像全体でも、(x, y) を左上とする一部の範囲だけでもよい
+
+    Args:
+        request: リクエスト (ボディがマスク)
+        session_id: セッションID
+        filename: 処理対象のファイル名
+        x: マスクの左上のX座標
+        y: マスクの左上のY座標
+        width: raw の場合のマスクの幅
+        height: raw の場合のマスクの高さ
+        bits: raw の場合の1画素のビット数 (1 または 8)
+        inline: 処理済み画像そのものを返すか
+
+    Returns:
+        処理済み画像のURL (inline の場合は処理済み画像そのもの)
+
+    Raises:
+        InvalidPayloadError: マスクの形式が不正な場合
+        SessionNotFoundError: セッションまたはファイルが見つからない場合
+    """
+    from ..domain.transparency import erase_with_mask
+
+    payload = await request.body()
+    mask = await asyncio.to_thread(decode_mask_payload, payload, width, height, bits)
+
+    def erase(image: Image.Image) -> Image.Image:
+        return erase_with_mask(image, mask, offset=(x, y))
+
+    changed_box = (x, y, x + mask.width, y + mask.height)
+    return await _apply_erase(session_id, filename, erase, inline, changed_box)
+
+
+@app.websocket("/api/erase/live/{session_id}/{filename}")
+async def live_erase(websocket: WebSocket, session_id: str, filename: str) -> None:
+    """
+    消しゴムのストロークを逐次受け取り、変更された範囲のアルファ値を返すWebSocket
+
+    - バイナリメッセージ: stroke_payload 形式のストローク。メモリ上の作業中画像に適用し、
+      変更された範囲をアルファパッチ形式 (alpha_mask.encode_alpha_patch) で返す
+    - テキストメッセージ {"action": "flush"}: 変更をディスクへ保存し、
+      {"type": "flushed", "sequence": ..., "processed_url": ...} を返す
+    - 不正なストロークには {"type": "error", "error_code": "INVALID_PAYLOAD", ...} を返す
+
+    画像全体のエンコードと保存は、LIVE_ERASE_IDLE_SECONDS 秒操作がないとき・flush要求時・
+    切断時にまとめて行う。セッションまたはファイルが見つからない場合は接続を拒否する
+
+    Args:
+        websocket: WebSocket接続
+        session_id: セッションID
+        filename: 処理対象のファイル名
+    """
+    from ..domain.transparency import erase_strokes_in_place
+
+    try:
+        image_path, _ = await _resolve_session_file(session_id, filename)
+    except SessionNotFoundError:
+        await websocket.close(code=WEBSOCKET_NOT_FOUND_CODE)
+        return
+
+    await websocket.accept()
+    await asyncio.to_thread(session_index.touch, session_id)
+    sequence = 0
+
+    async def flush() -> None:
+        if working_images.has_pending_changes(image_path):
+            # 切断時は接続のタスクがキャンセルされるため、保存自体はキャンセルさせない
+            await asyncio.shield(asyncio.to_thread(working_images.flush, image_path))
+            await asyncio.to_thread(session_index.touch, session_id)
+
+    try:
+        while True:
+            try:
+                message = await asyncio.wait_for(websocket.receive(), LIVE_ERASE_IDLE_SECONDS)
+            except asyncio.TimeoutError:
+                await flush()
+                continue
+
+            if message["type"] == "websocket.disconnect":
+                break
+
+            if message.get("text") is not None:
+                try:
+                    command = json.loads(message["text"])
+                except ValueError:
+                    command = None
+                if not isinstance(command, dict) or command.get("action") != "flush":
+                    await websocket.send_json(
+                        {
+                            "type": "error",
+                            "error_code": "INVALID_PAYLOAD",
+                            "detail": "Unknown message",
+                        }
+                    )
+                else:
+                    await flush()
+                    artifact = await asyncio.to_thread(
+                        session_index.get_artifact, session_id, filename
+                    )
+                    await websocket.send_json(
+                        {
+                            "type": "flushed",
+                            "sequence": sequence,
+                            "processed_url": _image_url(
+                                session_id,
+                                filename,
+                                artifact["content_hash"] if artifact is not None else None,
+                            ),
+                        }
+                    )
+                continue
+
+            try:
+                segments = decode_stroke_payload(message.get("bytes") or b"")
+            except InvalidPayloadError as e:
+                await websocket.send_json(
+                    {"type": "error", "error_code": "INVALID_PAYLOAD", "detail": str(e)}
+                )
+                continue
+
+            sequence += 1
+            patch: Dict[str, Any] = {}
+
+            # その場で消し、変更された範囲のアルファ値だけを取り出す (保存は後でまとめて行う)
+            def erase(image: Image.Image) -> Image.Image:
+                box = _union_box(
+                    [
+                        erase_strokes_in_place(image, points, brush_size)
+                        for brush_size, points in segments
+                    ]
+                )
+                if box is not None:
+                    patch["box"] = box
+                    patch["alpha"] = image.crop(box).getchannel("A")
+                return image
+
+            try:
+                await asyncio.to_thread(
+                    working_images.apply, image_path, erase, schedule_flush=False
+                )
+            except FileNotFoundError:
+                # セッションが削除された
+                await websocket.close(code=WEBSOCKET_NOT_FOUND_CODE)
+                return
+
+            if patch:
+                tile_cache.invalidate(image_path, patch["box"])
+            await websocket.send_bytes(
+                encode_alpha_patch(sequence, patch.get("box"), patch.get("alpha"))
+            )
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await flush()
+
+
+@app.websocket("/api/process/live/{session_id}/{filename}")
+async def live_preview(
+    websocket: WebSocket,
+    session_id: str,
+    filename: str,
+    size: int = Query(PREVIEW_DEFAULT_SIZE, ge=PREVIEW_MIN_SIZE, le=PREVIEW_MAX_SIZE),
+) -> None:
+    """
+    透過処理のパラメータを逐次受け取り、縮小画像で計算したアルファのプレビューを返すWebSocket
 
-    # 画像を読み込み
-    image = Image.open(image_path)
+    接続時に元画像を長辺 size 以下に縮小して保持し、
+    {"type": "ready", "width": ..., "height": ..., "preview_width": ..., "preview_height": ...}
+    を返す。以降は
 
-    # 消しゴム処理を実行
-    processed_image = erase_at_coordinates(
-        image, strokes=request.strokes, brush_size=request.brush_size
+    - テキストメッセージ: PreviewRequest 形式のパラメータ ({"rgb": ..., "threshold": ...})。
+      縮小画像全体のアルファをアルファパッチ形式 (alpha_mask.encode_alpha_patch) で返す
+    - 不正なパラメータには {"type": "error", "error_code": "INVALID_PAYLOAD", ...} を返す
+
+    計算中に届いたパラメータは最新のものだけを残し、古いパラメータのプレビューは計算しない。
+    セッションまたはファイルが見つからない場合は接続を拒否する
+
+    Args:
+        websocket: WebSocket接続
+        session_id: セッションID
+        filename: 処理対象 (元画像) のファイル名
+        size: プレビューの長辺の上限 (ピクセル)
+    """
+    from ..domain.transparency import compute_transparent_alpha
+
+    try:
+        # 未保存の消しゴム処理があれば先に保存し、保存後の内容をプレビューする
+        image_path, artifact = await _resolve_saved_file(session_id, filename)
+        # アップロード時に作成したピラミッドがあれば、ファイルをデコードし直さない
+        analysis = await asyncio.to_thread(
+            image_analysis.get, artifact["content_hash"] if artifact is not None else None, True
+        )
+        if analysis is not None:
+            raster = await asyncio.to_thread(select_level, analysis, size)
+            metadata: Dict[str, Any] = analysis
+        else:
+            raster = await asyncio.to_thread(load_preview_raster, image_path, size)
+            if artifact is not None:
+                metadata = artifact
+            else:
+                metadata = await asyncio.to_thread(read_image_metadata, image_path)
+    except (SessionNotFoundError, FileNotFoundError):
+        await websocket.close(code=WEBSOCKET_NOT_FOUND_CODE)
+        return
+
+    await websocket.accept()
+    await asyncio.to_thread(session_index.touch, session_id)
+    await websocket.send_json(
+        {
+            "type": "ready",
+            "width": metadata.get("width"),
+            "height": metadata.get("height"),
+            "preview_width": raster.width,
+            "preview_height": raster.height,
+        }
     )
 
-    # 処理済み画像を同じファイルに上書き保存
-    processed_image.save(str(image_path), format="PNG")
+    # 未計算の最新のパラメータ (新しいパラメータが届くと上書きされる)
+    pending: Dict[str, Any] = {}
+    updated = asyncio.Event()
+
+    async def render() -> None:
+        while True:
+            await updated.wait()
+            updated.clear()
+            sequence, request = pending.pop("latest")
+            alpha = await asyncio.to_thread(
+                compute_transparent_alpha,
+                raster,
+                _convert_rgb_to_domain_format(request.rgb),
+                request.threshold,
+            )
+            await websocket.send_bytes(
+                encode_alpha_patch(sequence, (0, 0, raster.width, raster.height), alpha)
+            )
+
+    renderer = asyncio.create_task(render())
+    received = 0
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if renderer.done():
+                # 送信に失敗した (切断された) 場合
+                break
+
+            try:
+                request = PreviewRequest.model_validate_json(message.get("text") or "")
+            except ValidationError as e:
+                await websocket.send_json(
+                    {"type": "error", "error_code": "INVALID_PAYLOAD", "detail": str(e)}
+                )
+                continue
+
+            received += 1
+            sequence = request.sequence if request.sequence is not None else received
+            pending["latest"] = (sequence, request)
+            updated.set()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        renderer.cancel()
+
+
+@app.get("/api/sessions/{session_id}", response_model=SessionInfoResponse)
+async def get_session_info(session_id: str) -> SessionInfoResponse:
+    """
+    セッション内のファイルのメタデータをセッションインデックスから取得
 
-    # 処理済み画像のURLを生成（キャッシュ回避のためタイムスタンプを追加）
-    import time
-    timestamp = int(time.time() * 1000)
-    processed_url = f"/api/images/{request.session_id}/{request.filename}?t={timestamp}"
+    Args:
+        session_id: セッションID
 
-    return EraseResponse(
-        session_id=request.session_id,
-        processed_url=processed_url,
-        filename=request.filename,
+    Returns:
+        ファイルごとの種類・サイズ・ハッシュ・形式・寸法
+
+    Raises:
+        SessionNotFoundError: セッションが見つからない場合
+    """
+    if not validate_session_id(session_id):
+        raise SessionNotFoundError(session_id=session_id)
+
+    artifacts = await asyncio.to_thread(session_index.list_artifacts, session_id)
+    if not artifacts and await asyncio.to_thread(session_archive.restore_session, session_id):
+        artifacts = await asyncio.to_thread(session_index.list_artifacts, session_id)
+    if not artifacts:
+        raise SessionNotFoundError(session_id=session_id)
+
+    return SessionInfoResponse(
+        session_id=session_id,
+        files=[
+            SessionFileInfo(
+                filename=artifact["name"],
+                kind=artifact["kind"],
+                size=artifact["size"],
+                content_hash=artifact["content_hash"],
+                format=artifact["format"],
+                width=artifact["width"],
+                height=artifact["height"],
+                url=_image_url(session_id, artifact["name"], artifact["content_hash"]),
+            )
+            for artifact in artifacts
+        ],
     )
 
 
+@app.delete("/api/cleanup/{session_id}", response_model=CleanupResponse)
+async def cleanup_session(session_id: str) -> CleanupResponse:
+    """
+    セッションの一時ファイルを削除
+
+    Args:
+        session_id: セッションID
+
+    Returns:
+        削除結果
+
+    Raises:
+        SessionNotFoundError: セッションが見つからない場合
+    """
+    if not validate_session_id(session_id):
+        raise SessionNotFoundError(session_id=session_id)
+
+    deleted = await asyncio.to_thread(delete_session, session_id)
+    if not deleted:
+        raise SessionNotFoundError(session_id=session_id)
+
+    return CleanupResponse(session_id=session_id, status="deleted")
+
+
 @app.get("/")
 async def root() -> FileResponse:
     """
@@ -2,6 +2,7 @@
 エラーハンドラー
 FastAPIのグローバル例外ハンドラー
 """
+
 from typing import Any, Dict, List, Union
 
 from fastapi import Request, status
@@ -12,9 +13,15 @@ from .exceptions import (
     ColorNotSpecifiedError,
     FileTooLargeError,
     ImageProcessingError,
+    InvalidPayloadError,
+    InvalidSignatureError,
     SessionNotFoundError,
+    TileNotFoundError,
+    TooManyUploadsError,
     TranspalentorException,
     UnsupportedFormatError,
+    UploadConflictError,
+    UploadNotFoundError,
 )
 
 
@@ -36,9 +43,7 @@ def format_validation_error(error: ValidationError) -> Dict[str, Any]:
     return {"detail": "Validation error", "errors": errors, "fields": {}}
 
 
-async def session_not_found_handler(
-    request: Request, exc: SessionNotFoundError
-) -> JSONResponse:
+async def session_not_found_handler(request: Request, exc: SessionNotFoundError) -> JSONResponse:
     """
     SessionNotFoundErrorのハンドラー
 
@@ -81,9 +86,7 @@ async def file_too_large_handler(request: Request, exc: FileTooLargeError) -> JS
     )
 
 
-async def unsupported_format_handler(
-    request: Request, exc: UnsupportedFormatError
-) -> JSONResponse:
+async def unsupported_format_handler(request: Request, exc: UnsupportedFormatError) -> JSONResponse:
     """
     UnsupportedFormatErrorのハンドラー
 
@@ -105,6 +108,132 @@ async def unsupported_format_handler(
     )
 
 
+async def upload_not_found_handler(request: Request, exc: UploadNotFoundError) -> JSONResponse:
+    """
+    UploadNotFoundErrorのハンドラー
+
+    Args:
+        request: リクエスト
+        exc: 例外
+
+    Returns:
+        404エラーレスポンス
+    """
+    return JSONResponse(
+        status_code=status.HTTP_404_NOT_FOUND,
+        content={
+            "detail": "Upload not found",
+            "error_code": "UPLOAD_NOT_FOUND",
+            "upload_id": exc.upload_id,
+        },
+    )
+
+
+async def upload_conflict_handler(request: Request, exc: UploadConflictError) -> JSONResponse:
+    """
+    UploadConflictErrorのハンドラー
+
+    Args:
+        request: リクエスト
+        exc: 例外
+
+    Returns:
+        409エラーレスポンス
+    """
+    return JSONResponse(
+        status_code=status.HTTP_409_CONFLICT,
+        content={
+            "detail": str(exc),
+            "error_code": "UPLOAD_CONFLICT",
+            "upload_id": exc.upload_id,
+        },
+    )
+
+
+async def too_many_uploads_handler(request: Request, exc: TooManyUploadsError) -> JSONResponse:
+    """
+    TooManyUploadsErrorのハンドラー
+
+    Args:
+        request: リクエスト
+        exc: 例外
+
+    Returns:
+        429エラーレスポンス
+    """
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={
+            "detail": str(exc),
+            "error_code": "TOO_MANY_UPLOADS",
+            "limit": exc.limit,
+        },
+    )
+
+
+async def invalid_signature_handler(request: Request, exc: InvalidSignatureError) -> JSONResponse:
+    """
+    InvalidSignatureErrorのハンドラー
+
+    Args:
+        request: リクエスト
+        exc: 例外
+
+    Returns:
+        403エラーレスポンス
+    """
+    return JSONResponse(
+        status_code=status.HTTP_403_FORBIDDEN,
+        content={
+            "detail": "Invalid or expired signature",
+            "error_code": "INVALID_SIGNATURE",
+        },
+    )
+
+
+async def invalid_payload_handler(request: Request, exc: InvalidPayloadError) -> JSONResponse:
+    """
+    InvalidPayloadErrorのハンドラー
+
+    Args:
+        request: リクエスト
+        exc: 例外
+
+    Returns:
+        400エラーレスポンス
+    """
+    return JSONResponse(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        content={
+            "detail": str(exc),
+            "error_code": "INVALID_PAYLOAD",
+        },
+    )
+
+
+async def tile_not_found_handler(request: Request, exc: TileNotFoundError) -> JSONResponse:
+    """
+    TileNotFoundErrorのハンドラー
+
+    Args:
+        request: リクエスト
+        exc: 例外
+
+    Returns:
+        404エラーレスポンス
+    """
+    return JSONResponse(
+        status_code=status.HTTP_404_NOT_FOUND,
+        content={
+            "detail": "Tile not found",
+            "error_code": "TILE_NOT_FOUND",
+            "level": exc.level,
+            "x": exc.x,
+            "y": exc.y,
+        },
+    )
+
+
 async def color_not_specified_handler(
     request: Request, exc: ColorNotSpecifiedError
 ) -> JSONResponse:
@@ -179,6 +308,12 @@ def register_exception_handlers(app: Any) -> None:
     app.add_exception_handler(SessionNotFoundError, session_not_found_handler)
     app.add_exception_handler(FileTooLargeError, file_too_large_handler)
     app.add_exception_handler(UnsupportedFormatError, unsupported_format_handler)
+    app.add_exception_handler(UploadNotFoundError, upload_not_found_handler)
+    app.add_exception_handler(UploadConflictError, upload_conflict_handler)
+    app.add_exception_handler(TooManyUploadsError, too_many_uploads_handler)
+    app.add_exception_handler(InvalidSignatureError, invalid_signature_handler)
+    app.add_exception_handler(InvalidPayloadError, invalid_payload_handler)
+    app.add_exception_handler(TileNotFoundError, tile_not_found_handler)
     app.add_exception_handler(ColorNotSpecifiedError, color_not_specified_handler)
     app.add_exception_handler(ImageProcessingError, image_processing_error_handler)
     app.add_exception_handler(Exception, generic_exception_handler)
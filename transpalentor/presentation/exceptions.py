@@ -44,6 +44,30 @@ class UnsupportedFormatError(FileValidationError):
         super().__init__(message, filename)
 
 
+class UploadNotFoundError(TranspalentorException):
+    """分割アップロードが見つからない場合の例外"""
+
+    def __init__(self, upload_id: str):
+        self.upload_id = upload_id
+        super().__init__(f"Upload not found: {upload_id}")
+
+
+class TooManyUploadsError(TranspalentorException):
+    """未完了の分割アップロードが上限に達している場合の例外"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        super().__init__(f"Too many pending uploads (limit: {limit})")
+
+
+class UploadConflictError(TranspalentorException):
+    """分割アップロードのオフセットや完了状態が不正な場合の例外"""
+
+    def __init__(self, upload_id: str, message: str):
+        self.upload_id = upload_id
+        super().__init__(message)
+
+
 class ImageProcessingError(TranspalentorException):
     """画像処理エラー"""
 
@@ -55,3 +79,28 @@ class ColorNotSpecifiedError(TranspalentorException):
 
     def __init__(self):
         super().__init__("Target color not specified for transparency processing")
+
+
+class InvalidSignatureError(TranspalentorException):
+    """署名付きURLの署名が不正、または期限切れの場合の例外"""
+
+    def __init__(self, path: str):
+        self.path = path
+        super().__init__(f"Invalid or expired signature: {path}")
+
+
+class InvalidPayloadError(TranspalentorException):
+    """リクエストボディ (バイナリ形式・multipart) が不正な場合の例外"""
+
+    def __init__(self, message: str):
+        super().__init__(message)
+
+
+class TileNotFoundError(TranspalentorException):
+    """画像のタイルの段・列・行が範囲外の場合の例外"""
+
+    def __init__(self, level: int, x: int, y: int):
+        self.level = level
+        self.x = x
+        self.y = y
+        super().__init__(f"Tile not found: {level}/{x}/{y}")
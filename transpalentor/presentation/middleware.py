@@ -0,0 +1,84 @@
+"""
+ASGIミドルウェア
+"""
+
+from typing import Tuple
+
+from fastapi import Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .error_handlers import file_too_large_handler
+from .exceptions import FileTooLargeError
+
+
+class _BodyTooLarge(Exception):
+    """リクエストボディが上限を超えたことを示す内部例外"""
+
+    pass
+
+
+class UploadSizeLimitMiddleware:
+    """
+    アップロードのリクエストボディサイズを制限するミドルウェア
+
+    Content-Lengthが上限を超える場合はボディを読む前に413を返す。
+    Content-Lengthがない (chunked) 場合も受信しながらバイト数を数え、
+    上限を超えた時点で読み込みを打ち切って413を返す。
+    """
+
+    def __init__(self, app: ASGIApp, max_body_size: int, paths: Tuple[str, ...]) -> None:
+        self.app = app
+        self.max_body_size = max_body_size
+        self.paths = paths
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            scope["type"] != "http"
+            or scope["method"] not in ("POST", "PUT", "PATCH")
+            or scope["path"] not in self.paths
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None:
+            try:
+                declared_size = int(content_length)
+            except ValueError:
+                declared_size = 0
+            if declared_size > self.max_body_size:
+                await self._reject(scope, receive, send, declared_size)
+                return
+
+        received = 0
+        exceeded = False
+
+        async def limited_receive() -> Message:
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_size:
+                    exceeded = True
+                    raise _BodyTooLarge()
+            return message
+
+        async def guarded_send(message: Message) -> None:
+            # 上限超過後にアプリケーションが返すエラーレスポンスは破棄する
+            if not exceeded:
+                await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except _BodyTooLarge:
+            pass
+
+        if exceeded:
+            await self._reject(scope, receive, send, received)
+
+    async def _reject(self, scope: Scope, receive: Receive, send: Send, size: int) -> None:
+        """413レスポンスを返す"""
+        response = await file_too_large_handler(
+            Request(scope), FileTooLargeError(size=size, max_size=self.max_body_size)
+        )
+        await response(scope, receive, send)
@@ -1,6 +1,7 @@
 """
 APIリクエスト/レスポンスのPydanticモデル
 """
+
 from typing import Optional, Annotated
 
 from pydantic import BaseModel, Field, field_validator
@@ -23,6 +24,45 @@ class UploadResponse(BaseModel):
     size: int = Field(..., description="ファイルサイズ (bytes)")
 
 
+class UploadPrecheckRequest(BaseModel):
+    """アップロード事前確認リクエスト"""
+
+    sha256: str = Field(
+        ..., pattern=r"^[0-9a-f]{64}$", description="ファイル内容のSHA-256 (16進数小文字)"
+    )
+    size: int = Field(..., ge=1, description="ファイルサイズ (bytes)")
+    filename: str = Field(..., description="ファイル名")
+
+
+class UploadPrecheckResponse(BaseModel):
+    """アップロード事前確認レスポンス"""
+
+    exists: bool = Field(..., description="サーバーに同じファイルが存在するか")
+    session_id: Optional[str] = Field(default=None, description="作成されたセッションID")
+    image_url: Optional[str] = Field(default=None, description="画像のURL")
+    filename: Optional[str] = Field(default=None, description="ファイル名")
+    size: Optional[int] = Field(default=None, description="ファイルサイズ (bytes)")
+
+
+class ResumableUploadCreateRequest(BaseModel):
+    """分割アップロード作成リクエスト"""
+
+    filename: str = Field(..., description="ファイル名")
+    size: int = Field(..., ge=1, description="ファイル全体のサイズ (bytes)")
+
+
+class ResumableUploadStatus(BaseModel):
+    """分割アップロードの状態"""
+
+    upload_id: str = Field(..., description="アップロードID (UUID v4)")
+    upload_url: str = Field(..., description="チャンクを送信するURL")
+    size: int = Field(..., description="ファイル全体のサイズ (bytes)")
+    offset: int = Field(..., description="先頭から連続して受信済みのバイト数")
+    received: int = Field(..., description="受信済みの合計バイト数")
+    ranges: list[list[int]] = Field(..., description="受信済みの範囲 [[start, end), ...]")
+    complete: bool = Field(..., description="全範囲を受信済みか")
+
+
 class ProcessRequest(BaseModel):
     """透過処理リクエスト"""
 
@@ -33,6 +73,10 @@ class ProcessRequest(BaseModel):
         description="透過対象色 [R, G, B] または [[R, G, B], [R, G, B], ...]（最大3色）",
     )
     threshold: int = Field(default=30, ge=0, le=255, description="色の許容範囲 (0-255)")
+    inline: bool = Field(
+        default=False,
+        description="処理済み画像をJSONではなくPNGのまま応答に含めるか (ディスクへの保存は遅延する)",
+    )
 
     @field_validator("rgb")
     @classmethod
@@ -65,6 +109,100 @@ class ProcessRequest(BaseModel):
         return v
 
 
+class PreviewRequest(BaseModel):
+    """透過処理のライブプレビューのパラメータ"""
+
+    rgb: list[int] | list[list[int]] = Field(
+        ...,
+        description="透過対象色 [R, G, B] または [[R, G, B], [R, G, B], ...]（最大3色）",
+    )
+    threshold: int = Field(default=30, ge=0, le=255, description="色の許容範囲 (0-255)")
+    sequence: Optional[int] = Field(
+        default=None,
+        ge=0,
+        le=0xFFFFFFFF,
+        description="プレビューのシーケンス番号 (省略時はサーバーで採番)",
+    )
+
+    @field_validator("rgb")
+    @classmethod
+    def validate_rgb(cls, v: list[int] | list[list[int]]) -> list[int] | list[list[int]]:
+        """RGB値のバリデーション (ProcessRequest と同じ)"""
+        return ProcessRequest.validate_rgb(v)
+
+
+class ThresholdHistogramRequest(BaseModel):
+    """閾値ごとの透過されるピクセル数のリクエスト"""
+
+    session_id: str = Field(..., description="セッションID")
+    filename: str = Field(..., description="処理対象のファイル名")
+    rgb: list[int] | list[list[int]] = Field(
+        ...,
+        description="透過対象色 [R, G, B] または [[R, G, B], [R, G, B], ...]（最大3色）",
+    )
+
+    @field_validator("rgb")
+    @classmethod
+    def validate_rgb(cls, v: list[int] | list[list[int]]) -> list[int] | list[list[int]]:
+        """RGB値のバリデーション (ProcessRequest と同じ)"""
+        return ProcessRequest.validate_rgb(v)
+
+
+class ThresholdHistogramResponse(BaseModel):
+    """閾値ごとの透過されるピクセル数のレスポンス"""
+
+    session_id: str = Field(..., description="セッションID")
+    filename: str = Field(..., description="ファイル名")
+    total_pixels: int = Field(..., description="完全に透明ではないピクセル数")
+    cleared_pixels: list[int] = Field(
+        ...,
+        description="threshold = t で透明になるピクセル数 (t = 0〜442 の累積)",
+    )
+    suggested_threshold: int = Field(..., description="大津の方法による閾値の候補 (0-255)")
+
+
+class PixelSampleRequest(BaseModel):
+    """画素値の取得リクエスト"""
+
+    session_id: str = Field(..., description="セッションID")
+    filename: str = Field(..., description="対象のファイル名")
+    points: list[list[int]] = Field(
+        ..., min_length=1, max_length=1024, description="座標 [[x, y], [x, y], ...]（最大1024点）"
+    )
+    size: int = Field(
+        default=1, ge=1, le=31, description="平均をとる範囲の一辺 (奇数。1 の場合はその画素の値)"
+    )
+
+    @field_validator("points")
+    @classmethod
+    def validate_points(cls, v: list[list[int]]) -> list[list[int]]:
+        """座標のバリデーション"""
+        for coord in v:
+            if len(coord) != 2:
+                raise ValueError(f"座標は[x, y]の形式である必要があります: {coord}")
+        return v
+
+    @field_validator("size")
+    @classmethod
+    def validate_size(cls, v: int) -> int:
+        """範囲の一辺のバリデーション"""
+        if v % 2 == 0:
+            raise ValueError(f"範囲の一辺は奇数である必要があります: {v}")
+        return v
+
+
+class PixelSampleResponse(BaseModel):
+    """画素値の取得レスポンス"""
+
+    session_id: str = Field(..., description="セッションID")
+    filename: str = Field(..., description="ファイル名")
+    width: int = Field(..., description="画像の幅")
+    height: int = Field(..., description="画像の高さ")
+    samples: list[Optional[list[int]]] = Field(
+        ..., description="座標ごとの [R, G, B, A] (座標が画像の外の場合null)"
+    )
+
+
 class ProcessResponse(BaseModel):
     """透過処理レスポンス"""
 
@@ -80,6 +218,9 @@ class EraseRequest(BaseModel):
     filename: str = Field(..., description="処理対象のファイル名")
     strokes: list[list[int]] = Field(..., description="ストローク座標 [[x, y], [x, y], ...]")
     brush_size: int = Field(default=10, ge=1, le=100, description="ブラシサイズ (1-100)")
+    inline: bool = Field(
+        default=False, description="処理済み画像をJSONではなくPNGのまま応答に含めるか"
+    )
 
     @field_validator("strokes")
     @classmethod
@@ -101,8 +242,56 @@ class EraseResponse(BaseModel):
     filename: str = Field(..., description="ファイル名")
 
 
+class ImageAnalysisResponse(BaseModel):
+    """画像の解析結果レスポンス"""
+
+    session_id: str = Field(..., description="セッションID")
+    filename: str = Field(..., description="ファイル名")
+    width: int = Field(..., description="画像の幅")
+    height: int = Field(..., description="画像の高さ")
+    color_count: Optional[int] = Field(
+        default=None, description="完全に透明な画素を除く色の種類の数 (多すぎて数えない場合None)"
+    )
+    border_colors: list[list[int]] = Field(
+        ..., description="背景色の候補 (画像の外周で多い順の [R, G, B])"
+    )
+
+
+class TileInfoResponse(BaseModel):
+    """画像のタイルの構成レスポンス"""
+
+    session_id: str = Field(..., description="セッションID")
+    filename: str = Field(..., description="ファイル名")
+    width: int = Field(..., description="画像の幅")
+    height: int = Field(..., description="画像の高さ")
+    tile_size: int = Field(..., description="タイルの一辺 (ピクセル)")
+    max_level: int = Field(
+        ..., description="最も上の段 (0 が原寸、1つ上がるごとに縦横1/2。最上段はタイル1枚)"
+    )
+
+
 class CleanupResponse(BaseModel):
     """クリーンアップレスポンス"""
 
     session_id: str = Field(..., description="セッションID")
     status: str = Field(..., description="削除ステータス")
+
+
+class SessionFileInfo(BaseModel):
+    """セッション内のファイルのメタデータ"""
+
+    filename: str = Field(..., description="ファイル名")
+    kind: str = Field(..., description="種類 (original: 元画像, processed: 処理済み画像)")
+    size: int = Field(..., description="ファイルサイズ (bytes)")
+    content_hash: Optional[str] = Field(default=None, description="内容のSHA-256")
+    format: Optional[str] = Field(default=None, description="画像形式")
+    width: Optional[int] = Field(default=None, description="画像の幅")
+    height: Optional[int] = Field(default=None, description="画像の高さ")
+    url: str = Field(..., description="画像のURL")
+
+
+class SessionInfoResponse(BaseModel):
+    """セッション情報レスポンス"""
+
+    session_id: str = Field(..., description="セッションID")
+    files: list[SessionFileInfo] = Field(..., description="セッション内のファイル")